@@ -0,0 +1,553 @@
+"""
+合成音声のバッチ後処理 (正規化・無音トリム・リサンプリング・WAV / FLAC エンコード)
+
+SBV2 の出力 ([N, 1, T] または [N, T] のパディング済みバッチ + 各行の有効長) をまとめて処理する。
+C# ランタイムと同じ順序 (正規化 → 末尾トリム) で、サンプル単位の Python ループを使わない。
+
+対応する C# 実装:
+- TTSAudioUtility.NormalizeSamplesBurst → peak_scales (targetPeak 0.95、maxAbs <= 0 ならそのまま)
+- TTSPipeline.GetTrimmedLength          → trim_bounds の終端 (512 サンプルのブロック、閾値 0.002)
+
+処理フロー:
+1. 1 パスでブロック (512 サンプル) ごとのピークと二乗和を求める (Numba カーネル)
+2. 行ごとのスケールを決める
+   - peak: targetPeak / maxAbs (C# と同じ float32 演算)
+   - rms:  目標 dBFS に合わせ、ピークが --target-peak を超えないよう制限 (K 重み付けなしの RMS)
+3. スケール後のブロックピークで末尾 (と --trim-leading 時は先頭) の無音ブロックを判定
+   (正のスケールは単調なので、スケール済み配列を作らずに C# と同じ判定になる)
+4. トリム範囲の切り出し・スケール・ポリフェーズリサンプリングを 1 パスで行う
+   (44.1 kHz → 24 / 22.05 / 16 kHz。Kaiser 窓 sinc の FIR で、scipy.signal.resample_poly と同じ設計)
+5. int16 WAV / FLAC にストリーミングで書き出す (一定サンプル数ずつ int16 に変換するため、
+   全体の float コピーを持たない。FLAC は soundfile (libsndfile / libFLAC) が必要)
+
+C# のループを書き写した参照実装・AudioTests と同じ期待値・畳み込みの直接計算との一致と
+WAV / FLAC の読み戻しは tests/test_audio_postprocess.py で確認する。
+
+使用方法:
+    audios = postprocess_batch(output, lengths, target_rate=24000)
+    with open_writer("line.flac", 24000) as writer:
+        writer.write(audios[0])
+
+    uv run python audio_postprocess.py --benchmark --batch-size 32
+    uv run python audio_postprocess.py --input renders/*.wav --output-dir out \\
+        --rate 24000 --format flac
+"""
+
+import argparse
+import functools
+import importlib.util
+import io
+import math
+import tempfile
+import time
+import wave
+from pathlib import Path
+
+import numba
+import numpy as np
+
+SAMPLE_RATE = 44100
+TARGET_PEAK = 0.95
+TRIM_BLOCK_SIZE = 512
+TRIM_THRESHOLD = 0.002
+TARGET_RATES = (24000, 22050, 16000)
+NORMALIZE_MODES = ("peak", "rms", "none")
+FORMATS = ("wav", "flac")
+
+# float → int16 変換の単位 (ストリーミング書き出し時の一時バッファ)
+CONVERT_CHUNK = 1 << 16
+
+
+# ---------------------------------------------------------------------------
+# 正規化・トリム
+# ---------------------------------------------------------------------------
+
+
+def as_batch(batch: np.ndarray, lengths: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """[N, 1, T] / [N, T] / [T] を ([N, T], lengths[N]) にする (lengths 省略時は全長)。"""
+    batch = np.asarray(batch)
+    if batch.ndim == 3:
+        batch = batch[:, 0]
+    elif batch.ndim == 1:
+        batch = batch[None]
+    if lengths is None:
+        lengths = np.full(len(batch), batch.shape[1], dtype=np.int64)
+    return batch, np.asarray(lengths, dtype=np.int64)
+
+
+def to_padded(samples: list[np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+    """可変長の PCM のリストを (ゼロ埋め [N, T_max], lengths[N]) にする。"""
+    lengths = np.fromiter((len(s) for s in samples), dtype=np.int64, count=len(samples))
+    batch = np.zeros((len(samples), int(lengths.max(initial=0))), dtype=np.float32)
+    for i, s in enumerate(samples):
+        batch[i, : len(s)] = s
+    return batch, lengths
+
+
+@numba.njit(cache=True)
+def _block_stats(
+    batch: np.ndarray, lengths: np.ndarray, block_size: int, peaks: np.ndarray, sumsq: np.ndarray
+) -> None:
+    for i in range(batch.shape[0]):
+        total = 0.0
+        for b in range(peaks.shape[1]):
+            peak = np.float32(0.0)
+            for t in range(b * block_size, min((b + 1) * block_size, lengths[i])):
+                v = batch[i, t]
+                a = -v if v < 0 else v
+                if a > peak:
+                    peak = a
+                total += np.float64(v) * v
+            peaks[i, b] = peak
+        sumsq[i] = total
+
+
+def block_stats(
+    batch: np.ndarray, lengths: np.ndarray, block_size: int = TRIM_BLOCK_SIZE
+) -> tuple[np.ndarray, np.ndarray]:
+    """有効範囲内のブロックごとのピーク [N, ceil(T / block_size)] と行ごとの二乗和 [N]。"""
+    batch = np.ascontiguousarray(batch, dtype=np.float32)
+    num_blocks = -(-batch.shape[1] // block_size)
+    peaks = np.zeros((len(batch), num_blocks), dtype=np.float32)
+    sumsq = np.zeros(len(batch), dtype=np.float64)
+    _block_stats(batch, lengths, block_size, peaks, sumsq)
+    return peaks, sumsq
+
+
+def peak_scales(peaks: np.ndarray, target_peak: float = TARGET_PEAK) -> np.ndarray:
+    """NormalizeSamplesBurst のスケール (maxAbs <= 0 の行は 1)。"""
+    max_abs = peaks.max(axis=1, initial=np.float32(0))
+    with np.errstate(divide="ignore"):
+        scales = np.float32(target_peak) / max_abs
+    return np.where(max_abs > 0, scales, np.float32(1)).astype(np.float32)
+
+
+def rms_scales(
+    peaks: np.ndarray,
+    sumsq: np.ndarray,
+    lengths: np.ndarray,
+    target_dbfs: float = -20.0,
+    target_peak: float = TARGET_PEAK,
+) -> np.ndarray:
+    """RMS を target_dbfs に合わせるスケール (ピークが target_peak を超えない範囲)。"""
+    rms = np.sqrt(sumsq / np.maximum(lengths, 1))
+    max_abs = peaks.max(axis=1, initial=np.float32(0)).astype(np.float64)
+    with np.errstate(divide="ignore"):
+        scales = np.minimum(10 ** (target_dbfs / 20) / rms, target_peak / max_abs)
+    return np.where(max_abs > 0, scales, 1.0).astype(np.float32)
+
+
+def trim_bounds(
+    peaks: np.ndarray,
+    lengths: np.ndarray,
+    scales: np.ndarray | None = None,
+    leading: bool = False,
+    block_size: int = TRIM_BLOCK_SIZE,
+    threshold: float = TRIM_THRESHOLD,
+) -> tuple[np.ndarray, np.ndarray]:
+    """無音ブロックを除いた範囲 (starts[N], ends[N])。
+
+    終端は GetTrimmedLength と同じ (完全なブロックのみ判定、全ブロック無音なら 1 ブロック残す、
+    2 ブロック未満は全長)。leading=True なら先頭の無音ブロックも除く。
+    scales を渡すと、スケール後の振幅で判定する。
+    """
+    if scales is not None:
+        peaks = peaks * scales[:, None]
+    total_blocks = lengths // block_size
+    index = np.arange(peaks.shape[1])
+    active = (peaks > np.float32(threshold)) & (index < total_blocks[:, None])
+
+    last_active = np.maximum(np.where(active, index, -1).max(axis=1, initial=-1), 0)
+    ends = np.minimum((last_active + 1) * block_size, lengths)
+    ends = np.where(total_blocks <= 1, lengths, ends)
+
+    starts = np.zeros_like(lengths)
+    if leading:
+        first_active = np.where(active, index, peaks.shape[1]).min(axis=1, initial=peaks.shape[1])
+        starts = np.where(active.any(axis=1) & (total_blocks > 1), first_active * block_size, 0)
+    return starts.astype(np.int64), ends.astype(np.int64)
+
+
+def trimmed_lengths(
+    batch: np.ndarray,
+    lengths: np.ndarray | None = None,
+    block_size: int = TRIM_BLOCK_SIZE,
+    threshold: float = TRIM_THRESHOLD,
+) -> np.ndarray:
+    """行ごとの GetTrimmedLength (正規化なし)。"""
+    batch, lengths = as_batch(batch, lengths)
+    peaks, _ = block_stats(batch, lengths, block_size)
+    return trim_bounds(peaks, lengths, block_size=block_size, threshold=threshold)[1]
+
+
+# ---------------------------------------------------------------------------
+# ポリフェーズリサンプリング
+# ---------------------------------------------------------------------------
+
+
+@functools.lru_cache(maxsize=None)
+def design_resampler(
+    src_rate: int, dst_rate: int, half_width: int = 10, beta: float = 5.0
+) -> tuple[int, int, int, np.ndarray]:
+    """(up, down, half_len, taps[up, K]) を返す。taps[p, k] = h[p + k * up]。
+
+    h は Kaiser 窓の sinc ローパス (カットオフ 1 / max(up, down)、長さ 2 * half_width * max + 1)
+    で、DC ゲインを up に揃える (scipy.signal.resample_poly の既定と同じ)。
+    """
+    g = math.gcd(src_rate, dst_rate)
+    up, down = dst_rate // g, src_rate // g
+    max_rate = max(up, down)
+    half_len = half_width * max_rate
+    n = np.arange(2 * half_len + 1) - half_len
+    cutoff = 1.0 / max_rate
+    h = cutoff * np.sinc(cutoff * n) * np.kaiser(2 * half_len + 1, beta)
+    h *= up / h.sum()
+    num_taps = -(-len(h) // up)
+    padded = np.zeros(num_taps * up)
+    padded[: len(h)] = h
+    return up, down, half_len, padded.reshape(num_taps, up).T.astype(np.float32).copy()
+
+
+def resampled_lengths(lengths: np.ndarray, src_rate: int, dst_rate: int) -> np.ndarray:
+    up, down, _, _ = design_resampler(src_rate, dst_rate)
+    return -(-np.asarray(lengths, dtype=np.int64) * up // down)
+
+
+@numba.njit(parallel=True, cache=True)
+def _resample_rows(
+    batch: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    scales: np.ndarray,
+    taps: np.ndarray,
+    up: int,
+    down: int,
+    half_len: int,
+    out: np.ndarray,
+    out_lengths: np.ndarray,
+) -> None:
+    num_taps = taps.shape[1]
+    for i in numba.prange(batch.shape[0]):
+        start = starts[i]
+        n_in = ends[i] - start
+        for n in range(out_lengths[i]):
+            t = n * down + half_len
+            p = t % up
+            base = t // up
+            acc = 0.0
+            for k in range(num_taps):
+                j = base - k
+                if j < 0:
+                    break
+                if j < n_in:
+                    acc += taps[p, k] * batch[i, start + j]
+            out[i, n] = acc * scales[i]
+
+
+def resample_batch(
+    batch: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    scales: np.ndarray,
+    src_rate: int,
+    dst_rate: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """batch[i, starts[i]:ends[i]] * scales[i] をリサンプリングする → ([N, T'], lengths[N])。"""
+    up, down, half_len, taps = design_resampler(src_rate, dst_rate)
+    out_lengths = resampled_lengths(ends - starts, src_rate, dst_rate)
+    out = np.zeros((len(batch), int(out_lengths.max(initial=0))), dtype=np.float32)
+    _resample_rows(
+        np.ascontiguousarray(batch, dtype=np.float32), starts, ends,
+        np.asarray(scales, dtype=np.float32), taps, up, down, half_len, out, out_lengths,
+    )
+    return out, out_lengths
+
+
+def postprocess_batch(
+    batch: np.ndarray,
+    lengths: np.ndarray | None = None,
+    normalize: str = "peak",
+    target_peak: float = TARGET_PEAK,
+    target_dbfs: float = -20.0,
+    trim_leading: bool = False,
+    sample_rate: int = SAMPLE_RATE,
+    target_rate: int | None = None,
+) -> list[np.ndarray]:
+    """正規化 → 無音トリム → リサンプリングを行い、行ごとの float32 PCM を返す。"""
+    if normalize not in NORMALIZE_MODES:
+        raise ValueError(f"Unknown normalize mode: {normalize} (expected one of {NORMALIZE_MODES})")
+    batch, lengths = as_batch(batch, lengths)
+    peaks, sumsq = block_stats(batch, lengths)
+    if normalize == "peak":
+        scales = peak_scales(peaks, target_peak)
+    elif normalize == "rms":
+        scales = rms_scales(peaks, sumsq, lengths, target_dbfs, target_peak)
+    else:
+        scales = np.ones(len(batch), dtype=np.float32)
+    starts, ends = trim_bounds(peaks, lengths, scales, leading=trim_leading)
+
+    if target_rate is None or target_rate == sample_rate:
+        return [batch[i, starts[i] : ends[i]] * scales[i] for i in range(len(batch))]
+    out, out_lengths = resample_batch(batch, starts, ends, scales, sample_rate, target_rate)
+    return [out[i, : out_lengths[i]] for i in range(len(out))]
+
+
+# ---------------------------------------------------------------------------
+# ストリーミングエンコード
+# ---------------------------------------------------------------------------
+
+
+def to_int16(samples: np.ndarray, scale: float = 1.0) -> np.ndarray:
+    """float PCM → int16 (C# と同じ clip * 32767 の切り捨て)。"""
+    samples = np.asarray(samples, dtype=np.float32)
+    if scale != 1.0:
+        samples = samples * np.float32(scale)
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+
+
+def int16_chunks(samples: np.ndarray, scale: float = 1.0):
+    """float PCM を CONVERT_CHUNK サンプルずつ int16 にして返す (int16 ならそのまま)。"""
+    if samples.dtype == np.int16:
+        yield samples
+        return
+    for start in range(0, len(samples), CONVERT_CHUNK):
+        yield to_int16(samples[start : start + CONVERT_CHUNK], scale)
+
+
+class WavStreamWriter:
+    """16bit mono WAV をチャンクごとに書き出す (ヘッダは close 時に確定)。"""
+
+    def __init__(self, path, sample_rate: int = SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self._wave = wave.open(str(path), "wb")
+        self._wave.setnchannels(1)
+        self._wave.setsampwidth(2)
+        self._wave.setframerate(sample_rate)
+
+    def write(self, samples: np.ndarray, scale: float = 1.0) -> None:
+        """float PCM (または int16) を追記する。"""
+        for pcm in int16_chunks(np.asarray(samples), scale):
+            self._wave.writeframes(pcm.astype("<i2", copy=False).tobytes())
+
+    def close(self) -> None:
+        self._wave.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def flac_available() -> bool:
+    """FLAC の読み書きに必要な soundfile が import できるか。"""
+    return importlib.util.find_spec("soundfile") is not None
+
+
+def _soundfile():
+    """FLAC の読み書きに使う soundfile (libsndfile / libFLAC) を import する。"""
+    try:
+        import soundfile
+    except ImportError as e:
+        raise ImportError("FLAC requires the soundfile package (uv sync)") from e
+    return soundfile
+
+
+class FlacStreamWriter:
+    """16bit mono FLAC をチャンクごとに書き出す (エンコードは libFLAC)。
+
+    path にはバイナリのファイルオブジェクトも渡せる (その場合 close では閉じない)。
+    """
+
+    def __init__(self, path, sample_rate: int = SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self._file = _soundfile().SoundFile(
+            path if hasattr(path, "write") else str(path), "w",
+            samplerate=sample_rate, channels=1, format="FLAC", subtype="PCM_16",
+        )
+
+    def write(self, samples: np.ndarray, scale: float = 1.0) -> None:
+        """float PCM (または int16) を追記する。"""
+        for pcm in int16_chunks(np.asarray(samples), scale):
+            self._file.write(pcm)
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_writer(path, sample_rate: int = SAMPLE_RATE, fmt: str | None = None):
+    """拡張子 (または fmt) に応じた WavStreamWriter / FlacStreamWriter を返す。"""
+    fmt = fmt or Path(path).suffix.lstrip(".").lower()
+    if fmt == "wav":
+        return WavStreamWriter(path, sample_rate)
+    if fmt == "flac":
+        return FlacStreamWriter(path, sample_rate)
+    raise ValueError(f"Unknown audio format: {fmt} (expected one of {FORMATS})")
+
+
+def encode_flac(samples: np.ndarray, sample_rate: int = SAMPLE_RATE) -> bytes:
+    """float PCM (または int16) を FLAC のバイト列にする。"""
+    buffer = io.BytesIO()
+    with FlacStreamWriter(buffer, sample_rate) as writer:
+        writer.write(samples)
+    return buffer.getvalue()
+
+
+def write_audio(path, samples: np.ndarray, sample_rate: int = SAMPLE_RATE, fmt: str | None = None):
+    """float PCM を 16bit mono WAV / FLAC で保存する。"""
+    with open_writer(path, sample_rate, fmt) as writer:
+        writer.write(samples)
+
+
+# ---------------------------------------------------------------------------
+# 読み込み
+# ---------------------------------------------------------------------------
+
+
+def decode_flac(data: bytes | np.ndarray) -> tuple[np.ndarray, int]:
+    """16bit mono FLAC のバイト列 (または uint8 配列) を (int16 PCM, sample_rate) に復号する。"""
+    pcm, sample_rate = _soundfile().read(io.BytesIO(data), dtype="int16")
+    if pcm.ndim != 1:
+        raise ValueError("Expected mono FLAC")
+    return pcm, sample_rate
+
+
+def read_audio(path) -> tuple[np.ndarray, int]:
+    """16bit mono WAV / FLAC を (float32 PCM, sample_rate) で読み込む。"""
+    path = Path(path)
+    if path.suffix.lower() == ".flac":
+        pcm, sample_rate = decode_flac(path.read_bytes())
+    else:
+        with wave.open(str(path), "rb") as w:
+            if w.getnchannels() != 1 or w.getsampwidth() != 2:
+                raise ValueError(f"{path}: expected 16bit mono WAV")
+            sample_rate = w.getframerate()
+            pcm = np.frombuffer(w.readframes(w.getnframes()), dtype="<i2")
+    return pcm.astype(np.float32) / 32767, sample_rate
+
+
+# ---------------------------------------------------------------------------
+# 参照実装 (C# のループの書き写し) とベンチマーク
+# ---------------------------------------------------------------------------
+
+
+def _reference_normalize(samples: np.ndarray, target_peak: float = TARGET_PEAK) -> np.ndarray:
+    samples = samples.astype(np.float32).copy()
+    max_abs = np.float32(0)
+    for v in samples:
+        a = -v if v < 0 else v
+        if a > max_abs:
+            max_abs = a
+    if max_abs <= 0:
+        return samples
+    scale = np.float32(target_peak) / max_abs
+    for i in range(len(samples)):
+        samples[i] *= scale
+    return samples
+
+
+def _random_batch(rng: np.random.Generator, batch_size: int, max_len: int):
+    """末尾 (と一部は先頭) に無音がある可変長のバッチ。パディング部分はノイズで埋める。"""
+    lengths = rng.integers(max_len // 8, max_len, batch_size)
+    batch = rng.uniform(-1, 1, (batch_size, max_len)).astype(np.float32) * 0.3
+    for i, n in enumerate(lengths):
+        voiced = int(rng.integers(n // 4, n + 1))
+        batch[i, voiced:n] *= 1e-4
+        if i % 3 == 0:
+            batch[i, : int(rng.integers(0, n // 4 + 1))] = 0
+    batch[0, : lengths[0]] = 0  # 全無音の行
+    return batch, lengths
+
+
+def benchmark(batch_size: int, seconds: float, seed: int = 0) -> None:
+    """行ごとの処理 (C# の正規化ループの書き写し) とバッチ実装の処理時間を比較し、リサンプリング・エンコードの時間を測る。"""
+    rng = np.random.default_rng(seed)
+    batch, lengths = _random_batch(rng, batch_size, int(seconds * SAMPLE_RATE))
+    postprocess_batch(batch[:1], lengths[:1], target_rate=TARGET_RATES[0])  # JIT コンパイル
+
+    start = time.perf_counter()
+    for i, n in enumerate(lengths):
+        samples = _reference_normalize(batch[i, :n])
+        samples[: trimmed_lengths(samples)[0]]
+    loop_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    postprocess_batch(batch, lengths)
+    batch_ms = (time.perf_counter() - start) * 1000
+    print(f"Batch of {batch_size} x {seconds:.1f}s: normalize + trim "
+          f"per-row {loop_ms:.1f}ms, batched {batch_ms:.1f}ms (x{loop_ms / batch_ms:.1f})")
+
+    audio_seconds = lengths.sum() / SAMPLE_RATE
+    for rate in TARGET_RATES:
+        start = time.perf_counter()
+        postprocess_batch(batch, lengths, target_rate=rate)
+        batch_ms = (time.perf_counter() - start) * 1000
+        print(f"  + resample to {rate} Hz: {batch_ms:.1f}ms "
+              f"(x{audio_seconds * 1000 / batch_ms:.0f} realtime)")
+
+    audio = batch[1, : lengths[1]]
+    with tempfile.TemporaryDirectory() as tmp:
+        for fmt in FORMATS:
+            if fmt == "flac" and not flac_available():
+                continue
+            path = Path(tmp) / f"bench.{fmt}"
+            start = time.perf_counter()
+            write_audio(path, audio, fmt=fmt)
+            elapsed = (time.perf_counter() - start) * 1000
+            print(f"  encode {len(audio) / SAMPLE_RATE:.1f}s as {fmt}: {elapsed:.1f}ms, "
+                  f"{path.stat().st_size / 1024:.0f} KiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Batch post-processing of SBV2 outputs (normalize, trim, resample, encode)"
+    )
+    parser.add_argument("--benchmark", action="store_true", help="Compare with per-row loops")
+    parser.add_argument("--batch-size", type=int, default=16, help="Batch size for --benchmark")
+    parser.add_argument("--seconds", type=float, default=3.0, help="Clip length for --benchmark")
+    parser.add_argument("--input", type=str, nargs="+", default=None, help="16bit mono WAV/FLAC")
+    parser.add_argument("--output-dir", type=str, default=None, help="Output directory for --input")
+    parser.add_argument("--format", choices=FORMATS, default="wav", help="Output format")
+    parser.add_argument(
+        "--rate", type=int, default=None, help=f"Output sample rate (e.g. {TARGET_RATES})"
+    )
+    parser.add_argument("--normalize", choices=NORMALIZE_MODES, default="peak")
+    parser.add_argument("--target-peak", type=float, default=TARGET_PEAK)
+    parser.add_argument(
+        "--target-dbfs", type=float, default=-20.0, help="Target RMS for --normalize rms"
+    )
+    parser.add_argument("--trim-leading", action="store_true", help="Also trim leading silence")
+    args = parser.parse_args()
+
+    if not (args.benchmark or args.input):
+        parser.error("specify --benchmark and/or --input")
+    if args.benchmark:
+        benchmark(args.batch_size, args.seconds)
+    if args.input:
+        if not args.output_dir:
+            parser.error("--input requires --output-dir")
+        loaded = [read_audio(path) for path in args.input]
+        rates = {rate for _, rate in loaded}
+        if len(rates) != 1:
+            parser.error(f"inputs have different sample rates: {sorted(rates)}")
+        sample_rate = rates.pop()
+        batch, lengths = to_padded([samples for samples, _ in loaded])
+        outputs = postprocess_batch(
+            batch, lengths, args.normalize, args.target_peak, args.target_dbfs,
+            args.trim_leading, sample_rate, args.rate,
+        )
+        output_dir = Path(args.output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        for path, audio in zip(args.input, outputs):
+            write_audio(output_dir / f"{Path(path).stem}.{args.format}", audio,
+                        args.rate or sample_rate, args.format)
+        print(f"Wrote {len(outputs)} files to: {output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+"""
+複数の Style-Bert-VITS2 モデルを並列に Sentis 互換 ONNX へ変換するバッチドライバ
+
+処理フロー:
+1. マニフェスト (JSON) から変換ジョブ一覧を読み込む
+2. 各ジョブを spawn した子プロセスで実行 (同時実行数は --workers)
+   - 子プロセスごとに torch のスレッド数とアドレス空間の上限 (--memory-limit-gb) を設定
+   - download_model / find_local_model → build_model → export_onnx (または export_split_onnx)
+   - 変換結果を ONNX Runtime で検証
+3. モデルごとの所要時間・出力サイズ・検証結果をまとめて表示し、summary.json に保存
+
+1 ジョブ = 1 プロセスのため、メモリ上限超過やクラッシュは該当ジョブの失敗として記録され、
+他のジョブには影響しない。ステージキャッシュ (--stage-cache-dir) は全ジョブで共有する。
+
+マニフェスト形式:
+    [
+        {"repo": "ayousanz/tsukuyomi-chan-style-bert-vits2-model"},
+        {"name": "narrator", "model_dir": "models/narrator", "no_fp16": true},
+        {"name": "streaming", "repo": "<hf-repo-id>", "split": true}
+    ]
+    name を省略した場合は repo / model_dir の末尾を使う。
+    no_fp16 / no_dynamic / no_simplify / split / external_data / seq_len はジョブごとに上書きできる。
+
+使用方法:
+    uv run python batch_convert_sbv2.py --manifest voices.json \
+        --output-dir ../Assets/StreamingAssets/uStyleBertVITS2/Models \
+        --workers 4 --memory-limit-gb 12
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import queue
+import shutil
+import sys
+import time
+import traceback
+from pathlib import Path
+
+# ジョブごとに上書きできる変換オプションと既定値
+JOB_OPTIONS = {
+    "no_fp16": False,
+    "no_dynamic": False,
+    "no_simplify": False,
+    "split": False,
+    "external_data": False,
+    "seq_len": 128,
+}
+
+
+def load_manifest(manifest_path: Path, defaults: dict) -> list[dict]:
+    """マニフェストを読み込み、既定値を補ったジョブのリストを返す。"""
+    entries = json.loads(manifest_path.read_text(encoding="utf-8"))
+    jobs = []
+    names = set()
+    for entry in entries:
+        if ("repo" in entry) == ("model_dir" in entry):
+            raise ValueError(f"Manifest entry needs exactly one of repo/model_dir: {entry}")
+        unknown = set(entry) - set(JOB_OPTIONS) - {"name", "repo", "model_dir"}
+        if unknown:
+            raise ValueError(f"Unknown manifest keys {sorted(unknown)}: {entry}")
+
+        source = entry.get("repo") or entry["model_dir"]
+        name = entry.get("name") or Path(source).name
+        if name in names:
+            raise ValueError(f"Duplicate job name: {name}")
+        names.add(name)
+
+        job = {**defaults, **entry, "name": name}
+        if "model_dir" in job:
+            # 子プロセスの作業ディレクトリに依存しないよう絶対パスにする
+            job["model_dir"] = str((manifest_path.parent / job["model_dir"]).resolve())
+        jobs.append(job)
+    return jobs
+
+
+def _set_memory_limit(memory_limit_gb: float | None):
+    """子プロセスのアドレス空間の上限を設定する (POSIX のみ)。"""
+    if not memory_limit_gb:
+        return
+    try:
+        import resource
+    except ImportError:
+        print("Warning: memory limits are not supported on this platform")
+        return
+    limit = int(memory_limit_gb * 1024**3)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _validate(output_path: Path, split: bool):
+    """変換結果を ONNX Runtime でダミー推論して検証する (失敗時は例外)。"""
+    from streaming_synthesis import StreamingSynthesizer
+    from validate_onnx import make_tts_feeds, validate_tts
+
+    if not split:
+        validate_tts(str(output_path))
+        return
+    synth = StreamingSynthesizer(
+        str(output_path.with_name(f"{output_path.stem}_flow.onnx")),
+        str(output_path.with_name(f"{output_path.stem}_decoder.onnx")),
+    )
+    chunks = list(synth.stream(make_tts_feeds(10)))
+    samples = sum(chunk.shape[0] for chunk in chunks)
+    assert samples > 0, "Split model produced no audio"
+
+
+def convert_job(job: dict, options: dict) -> dict:
+    """1 モデル分の変換と検証を行い、結果を dict で返す (子プロセスで実行)。"""
+    import torch
+
+    from conversion_cache import ConversionCache
+    from convert_sbv2_for_sentis import (
+        build_model,
+        conversion_base_key,
+        download_model,
+        export_onnx,
+        export_split_onnx,
+        find_local_model,
+    )
+    from onnx_io import model_size_mb
+
+    torch.set_num_threads(options["threads_per_job"])
+    _set_memory_limit(options["memory_limit_gb"])
+
+    timings = {}
+    start = time.perf_counter()
+    if "repo" in job:
+        model_path, config_path, style_vec_path = download_model(
+            job["repo"], Path(options["cache_dir"])
+        )
+    else:
+        model_path, config_path, style_vec_path = find_local_model(Path(job["model_dir"]))
+    timings["fetch"] = time.perf_counter() - start
+
+    output_dir = Path(options["output_dir"]) / job["name"]
+    output_dir.mkdir(parents=True, exist_ok=True)
+    output_path = output_dir / "sbv2_model.onnx"
+    shutil.copy2(style_vec_path, output_dir / "style_vectors.npy")
+
+    start = time.perf_counter()
+    net_g, hps = build_model(config_path, model_path)
+    timings["build"] = time.perf_counter() - start
+
+    cache = None
+    base_key = None
+    if options["stage_cache_dir"]:
+        cache = ConversionCache(Path(options["stage_cache_dir"]))
+        base_key = conversion_base_key(model_path, config_path)
+
+    start = time.perf_counter()
+    if job["split"]:
+        output_paths = list(export_split_onnx(
+            net_g, hps, output_path,
+            no_fp16=job["no_fp16"], no_dynamic=job["no_dynamic"],
+            no_simplify=job["no_simplify"], seq_len=job["seq_len"],
+            external_data=job["external_data"], cache=cache, base_key=base_key,
+        ))
+    else:
+        export_onnx(
+            net_g, hps, output_path,
+            no_fp16=job["no_fp16"], no_dynamic=job["no_dynamic"],
+            no_simplify=job["no_simplify"], seq_len=job["seq_len"],
+            external_data=job["external_data"], cache=cache, base_key=base_key,
+        )
+        output_paths = [output_path]
+    timings["export"] = time.perf_counter() - start
+    del net_g
+
+    validation = "skipped"
+    if options["validate"]:
+        start = time.perf_counter()
+        try:
+            _validate(output_path, job["split"])
+            validation = "passed"
+        except Exception as e:
+            validation = f"failed: {type(e).__name__}: {e}"
+        timings["validate"] = time.perf_counter() - start
+
+    return {
+        "status": "ok",
+        "checkpoint": model_path.name,
+        "outputs": {str(p): round(model_size_mb(p), 1) for p in output_paths},
+        "validation": validation,
+        "timings": {k: round(v, 1) for k, v in timings.items()},
+    }
+
+
+def _job_main(job: dict, options: dict, results: mp.Queue):
+    """子プロセスのエントリポイント。ログはジョブごとのファイルに書き出す。"""
+    log_path = Path(options["output_dir"]) / f"{job['name']}.log"
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(log_path, "w", encoding="utf-8", buffering=1) as log:
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+        sys.stdout.reconfigure(line_buffering=True)
+        try:
+            result = convert_job(job, options)
+        except BaseException as e:
+            traceback.print_exc()
+            result = {"status": "failed", "error": f"{type(e).__name__}: {e}"}
+    results.put((job["name"], result))
+
+
+def run_jobs(jobs: list[dict], options: dict, workers: int) -> dict[str, dict]:
+    """ジョブを最大 workers 個の子プロセスで並列実行し、name → 結果 を返す。"""
+    ctx = mp.get_context("spawn")
+    results_queue = ctx.Queue()
+    pending = list(jobs)
+    running = {}  # name -> (process, start_time)
+    results = {}
+
+    while pending or running:
+        while pending and len(running) < workers:
+            job = pending.pop(0)
+            process = ctx.Process(
+                target=_job_main, args=(job, options, results_queue), name=job["name"]
+            )
+            process.start()
+            running[job["name"]] = (process, time.perf_counter())
+            print(f"[start] {job['name']}")
+
+        try:
+            name, result = results_queue.get(timeout=1.0)
+        except queue.Empty:
+            # 結果を返さずに終了したプロセス (OOM kill など) を検出
+            # (_job_main は例外を捕捉するため、正常終了したプロセスの結果はキューにある)
+            for name, (process, start) in list(running.items()):
+                if not process.is_alive() and process.exitcode != 0:
+                    process.join()
+                    results[name] = {
+                        "status": "crashed",
+                        "error": f"exit code {process.exitcode}",
+                        "seconds": round(time.perf_counter() - start, 1),
+                    }
+                    del running[name]
+                    print(f"[crashed] {name} (exit code {process.exitcode})")
+            continue
+
+        process, start = running.pop(name)
+        process.join()
+        result["seconds"] = round(time.perf_counter() - start, 1)
+        results[name] = result
+        print(f"[{result['status']}] {name} ({result['seconds']:.1f}s)")
+
+    return results
+
+
+def print_summary(jobs: list[dict], results: dict[str, dict]):
+    print("\n=== Summary ===")
+    print(f"{'name':<24} {'status':<8} {'time':>8} {'size MB':>9}  validation")
+    for job in jobs:
+        result = results[job["name"]]
+        size = sum(result.get("outputs", {}).values())
+        detail = result.get("validation") or result.get("error", "")
+        print(
+            f"{job['name']:<24} {result['status']:<8} {result['seconds']:>7.1f}s "
+            f"{size:>9.1f}  {detail}"
+        )
+    ok = sum(results[job["name"]]["status"] == "ok" for job in jobs)
+    print(f"\n{ok}/{len(jobs)} models converted")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert multiple Style-Bert-VITS2 models in parallel"
+    )
+    parser.add_argument("--manifest", type=str, required=True, help="Manifest JSON path")
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        default="../Assets/StreamingAssets/uStyleBertVITS2/Models",
+        help="Output root (one subdirectory per model)",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=2, help="Number of concurrent conversion jobs"
+    )
+    parser.add_argument(
+        "--threads-per-job",
+        type=int,
+        default=None,
+        help="torch threads per job (default: cpu_count / workers)",
+    )
+    parser.add_argument(
+        "--memory-limit-gb",
+        type=float,
+        default=None,
+        help="Address-space limit per job (POSIX only)",
+    )
+    parser.add_argument("--no-validate", action="store_true", help="Skip ORT validation")
+    parser.add_argument(
+        "--summary",
+        type=str,
+        default=None,
+        help="Summary JSON path (default: <output-dir>/summary.json)",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=".cache/sbv2",
+        help="Cache directory for downloaded files",
+    )
+    parser.add_argument(
+        "--stage-cache-dir",
+        type=str,
+        default=".cache/sbv2_stages",
+        help="Cache directory for intermediate conversion stages",
+    )
+    parser.add_argument(
+        "--no-stage-cache",
+        action="store_true",
+        help="Always re-run every conversion stage",
+    )
+    parser.add_argument(
+        "--stage-cache-max-gb",
+        type=float,
+        default=20.0,
+        help="Prune least recently used stage cache entries above this size (0 = no limit)",
+    )
+    # マニフェストで上書きされない場合の既定値
+    parser.add_argument("--no-fp16", action="store_true", help="Skip FP16 conversion")
+    parser.add_argument("--no-dynamic", action="store_true", help="Export with fixed sequence length")
+    parser.add_argument("--no-simplify", action="store_true", help="Skip onnxsim simplification")
+    parser.add_argument("--split", action="store_true", help="Export flow and decoder separately")
+    parser.add_argument("--external-data", action="store_true", help="Keep weights in .data files")
+    parser.add_argument("--seq-len", type=int, default=128, help="Sequence length for dummy input")
+    args = parser.parse_args()
+
+    defaults = {key: getattr(args, key) for key in JOB_OPTIONS}
+    jobs = load_manifest(Path(args.manifest), defaults)
+    workers = max(1, min(args.workers, len(jobs)))
+    output_dir = Path(args.output_dir).resolve()
+    options = {
+        "output_dir": str(output_dir),
+        "cache_dir": str(Path(args.cache_dir).resolve()),
+        "stage_cache_dir": (
+            None if args.no_stage_cache else str(Path(args.stage_cache_dir).resolve())
+        ),
+        "threads_per_job": args.threads_per_job or max(1, (os.cpu_count() or 1) // workers),
+        "memory_limit_gb": args.memory_limit_gb,
+        "validate": not args.no_validate,
+    }
+    print(
+        f"Converting {len(jobs)} models with {workers} workers "
+        f"({options['threads_per_job']} threads/job, logs in {output_dir})"
+    )
+
+    start = time.perf_counter()
+    results = run_jobs(jobs, options, workers)
+    elapsed = time.perf_counter() - start
+
+    print_summary(jobs, results)
+    print(f"Total time: {elapsed:.1f}s")
+
+    # 全ジョブの終了後にステージキャッシュを上限まで削除 (最終使用が古いエントリから)
+    if options["stage_cache_dir"] and args.stage_cache_max_gb > 0:
+        from conversion_cache import ConversionCache
+
+        cache = ConversionCache(Path(options["stage_cache_dir"]))
+        removed = cache.prune(int(args.stage_cache_max_gb * 1024**3))
+        if removed:
+            print(f"Pruned {removed} stage cache entries (limit {args.stage_cache_max_gb} GB)")
+
+    summary_path = Path(args.summary) if args.summary else output_dir / "summary.json"
+    summary = {
+        "total_seconds": round(elapsed, 1),
+        "workers": workers,
+        "models": {job["name"]: {**job, **results[job["name"]]} for job in jobs},
+    }
+    summary_path.write_text(json.dumps(summary, indent=2, ensure_ascii=False))
+    print(f"Summary written to: {summary_path}")
+
+    if any(
+        result["status"] != "ok" or result["validation"].startswith("failed")
+        for result in results.values()
+    ):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
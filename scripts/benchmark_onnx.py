@@ -0,0 +1,305 @@
+"""
+変換済み ONNX モデルの CPU ベンチマーク (ONNX Runtime)
+
+Unity の BertBenchmark.RunAllSizes に相当する計測を Python だけで行う。
+
+処理フロー:
+1. モデル (BERT / TTS、FP32・FP16・INT8 などのラベル付き) ×
+   系列長 × intra/inter-op スレッド数 × グラフ最適化レベル × 実行モード の組み合わせを列挙
+2. 組み合わせごとに新しい子プロセスでセッションを作成し、warmup 後に iterations 回推論
+   (子プロセスを分けることで、ピーク RSS を設定ごとに計測できる)
+3. p50/p95/p99 レイテンシ・セッション作成時間・ピーク RSS・実時間係数 (TTS のみ) を
+   JSON と CSV に保存
+4. --compare で以前のレポートと p50 を比較し、閾値を超えて遅くなった設定を報告
+
+使用方法:
+    uv run python benchmark_onnx.py \
+        --bert fp32=deberta.onnx int8=deberta_int8.onnx \
+        --tts fp32=sbv2_model.onnx fp16=sbv2_model_fp16.onnx \
+        --intra-threads 1 4 --output bench/report.json
+
+    # 以前のコミットのレポートと比較 (10% 以上の悪化で終了コード 1)
+    uv run python benchmark_onnx.py --tts fp32=sbv2_model.onnx \
+        --output bench/new.json --compare bench/base.json
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing as mp
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import onnxruntime as ort
+
+from quantize_onnx import deterministic_feeds
+from validate_onnx import cast_feeds, create_session, make_bert_feeds, make_tts_feeds
+
+SAMPLE_RATE = 44100
+
+OPT_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+EXECUTION_MODES = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+
+# 設定を識別するキー (レポート間の比較に使う)
+CONFIG_KEYS = ("kind", "variant", "length", "intra", "inter", "opt_level", "execution_mode")
+
+
+def _peak_rss_mb() -> float | None:
+    """プロセスのピーク RSS (MB)。取得できない環境では None。"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS は bytes
+    return round(peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def run_config(config: dict, warmup: int, iterations: int) -> dict:
+    """1 設定分のベンチマークを実行する (子プロセスで呼ばれる)。"""
+    start = time.perf_counter()
+    session = create_session(
+        config["path"],
+        intra_op_num_threads=config["intra"],
+        inter_op_num_threads=config["inter"],
+        graph_optimization_level=OPT_LEVELS[config["opt_level"]],
+        execution_mode=EXECUTION_MODES[config["execution_mode"]],
+    )
+    load_ms = (time.perf_counter() - start) * 1000
+
+    if config["kind"] == "bert":
+        feeds = make_bert_feeds(config["length"])
+    else:
+        # ノイズ 0 にして音声長 (と推論時間) を実行ごとに揃える (RTF の分母を p50 と対応させる)
+        feeds = deterministic_feeds(make_tts_feeds(config["length"]))
+    feeds = cast_feeds(session, feeds)
+
+    for _ in range(warmup):
+        output = session.run(None, feeds)[0]
+
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        output = session.run(None, feeds)[0]
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    result = {
+        "load_ms": round(load_ms, 2),
+        "mean_ms": round(float(np.mean(latencies)), 3),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "peak_rss_mb": _peak_rss_mb(),
+        "rtf": None,
+    }
+    if config["kind"] == "tts":
+        # 実時間係数 = 推論時間 / 生成音声の長さ (1 未満ならリアルタイムより速い)
+        audio_ms = output.shape[-1] / SAMPLE_RATE * 1000
+        result["audio_ms"] = round(audio_ms, 1)
+        result["rtf"] = round(float(p50) / audio_ms, 4) if audio_ms > 0 else None
+    return result
+
+
+def run_isolated(config: dict, warmup: int, iterations: int) -> dict:
+    """新しい子プロセスで run_config を実行する (失敗は error として記録)。"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn")) as pool:
+        try:
+            return pool.submit(run_config, config, warmup, iterations).result()
+        except Exception as e:
+            return {"error": f"{type(e).__name__}: {e}"}
+
+
+def parse_models(specs: list[str] | None) -> list[tuple[str, str]]:
+    """LABEL=PATH (または PATH のみ) を (label, path) に変換する。"""
+    models = []
+    for spec in specs or []:
+        label, sep, path = spec.partition("=")
+        if not sep:
+            label, path = Path(spec).stem, spec
+        models.append((label, path))
+    return models
+
+
+def build_configs(args) -> list[dict]:
+    configs = []
+    for kind, models, lengths in (
+        ("bert", parse_models(args.bert), args.bert_lengths),
+        ("tts", parse_models(args.tts), args.tts_lengths),
+    ):
+        for (variant, path), length, intra, inter, opt_level, mode in itertools.product(
+            models, lengths, args.intra_threads, args.inter_threads,
+            args.opt_levels, args.execution_modes,
+        ):
+            configs.append({
+                "kind": kind, "variant": variant, "path": path, "length": length,
+                "intra": intra, "inter": inter,
+                "opt_level": opt_level, "execution_mode": mode,
+            })
+    return configs
+
+
+def config_id(row: dict) -> tuple:
+    return tuple(row[key] for key in CONFIG_KEYS)
+
+
+def environment_info() -> dict:
+    """レポートに記録する実行環境 (コミット比較用)。"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "onnxruntime": ort.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def write_report(rows: list[dict], output_path: Path, args) -> None:
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    report = {
+        "environment": environment_info(),
+        "settings": {"warmup": args.warmup, "iterations": args.iterations},
+        "results": rows,
+    }
+    output_path.write_text(json.dumps(report, indent=2))
+
+    csv_path = output_path.with_suffix(".csv")
+    fields = list(dict.fromkeys(key for row in rows for key in row))
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"\nReport written to: {output_path} / {csv_path}")
+
+
+def compare_reports(rows: list[dict], baseline_path: Path, threshold: float) -> int:
+    """baseline と p50 を比較し、threshold (比率) を超えて悪化した設定数を返す。"""
+    baseline = json.loads(baseline_path.read_text())
+    base_rows = {config_id(row): row for row in baseline["results"] if "p50_ms" in row}
+    print(f"\n=== Compare with {baseline_path} ({baseline['environment'].get('commit')}) ===")
+
+    regressions = 0
+    for row in rows:
+        base = base_rows.get(config_id(row))
+        if base is None or "p50_ms" not in row:
+            continue
+        ratio = row["p50_ms"] / base["p50_ms"] - 1
+        mark = ""
+        if ratio > threshold:
+            mark = "  REGRESSION"
+            regressions += 1
+        print(
+            f"{_label(row):<56} {base['p50_ms']:>9.2f} -> {row['p50_ms']:>9.2f}ms "
+            f"({ratio:+.1%}){mark}"
+        )
+    return regressions
+
+
+def _label(row: dict) -> str:
+    return (
+        f"{row['kind']}/{row['variant']} len={row['length']} "
+        f"t={row['intra']}/{row['inter']} {row['opt_level']}/{row['execution_mode']}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU benchmark for exported ONNX models")
+    parser.add_argument(
+        "--bert", type=str, nargs="+", default=None, help="BERT models as LABEL=PATH"
+    )
+    parser.add_argument(
+        "--tts", type=str, nargs="+", default=None, help="SBV2 models as LABEL=PATH"
+    )
+    parser.add_argument(
+        "--bert-lengths", type=int, nargs="+", default=[8, 32, 64, 128, 256],
+        help="BERT token lengths",
+    )
+    parser.add_argument(
+        "--tts-lengths", type=int, nargs="+", default=[16, 64, 128, 256],
+        help="SBV2 phoneme lengths",
+    )
+    parser.add_argument(
+        "--intra-threads", type=int, nargs="+", default=[0],
+        help="intra_op_num_threads values (0 = ORT default)",
+    )
+    parser.add_argument(
+        "--inter-threads", type=int, nargs="+", default=[0],
+        help="inter_op_num_threads values (0 = ORT default)",
+    )
+    parser.add_argument(
+        "--opt-levels", type=str, nargs="+", default=["all"], choices=list(OPT_LEVELS),
+        help="Graph optimization levels",
+    )
+    parser.add_argument(
+        "--execution-modes", type=str, nargs="+", default=["sequential"],
+        choices=list(EXECUTION_MODES), help="Execution modes",
+    )
+    parser.add_argument("--warmup", type=int, default=3, help="Warmup runs per config")
+    parser.add_argument("--iterations", type=int, default=20, help="Timed runs per config")
+    parser.add_argument(
+        "--output", type=str, default="benchmark_report.json",
+        help="Report path (a .csv is written alongside)",
+    )
+    parser.add_argument("--compare", type=str, default=None, help="Baseline report JSON")
+    parser.add_argument(
+        "--regression-threshold", type=float, default=0.1,
+        help="Relative p50 slowdown reported as a regression (default: 0.1)",
+    )
+    args = parser.parse_args()
+
+    configs = build_configs(args)
+    if not configs:
+        parser.error("Specify at least one model with --bert or --tts")
+
+    print(f"Running {len(configs)} configurations ({args.warmup} warmup, {args.iterations} runs)")
+    rows = []
+    for i, config in enumerate(configs, 1):
+        result = run_isolated(config, args.warmup, args.iterations)
+        row = {key: config[key] for key in CONFIG_KEYS} | result
+        rows.append(row)
+        if "error" in result:
+            print(f"[{i}/{len(configs)}] {_label(row)}  ERROR {result['error']}")
+            continue
+        rtf = f" rtf={result['rtf']:.3f}" if result["rtf"] is not None else ""
+        rss = f" rss={result['peak_rss_mb']:.0f}MB" if result["peak_rss_mb"] else ""
+        print(
+            f"[{i}/{len(configs)}] {_label(row)}  p50={result['p50_ms']:.2f}ms "
+            f"p95={result['p95_ms']:.2f}ms p99={result['p99_ms']:.2f}ms{rtf}{rss}"
+        )
+
+    write_report(rows, Path(args.output), args)
+
+    if args.compare:
+        regressions = compare_reports(rows, Path(args.compare), args.regression_threshold)
+        if regressions:
+            raise SystemExit(f"{regressions} configuration(s) regressed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+"""
+プロセス間で共有する永続 BERT 特徴量キャッシュ
+
+C# の CachedBertRunner はプロセス内の LRUCache (64 件) のため再起動で消える。
+ここでは BERT 出力 [1024, token_len] を FP16 でディスク上のアリーナに保存し、
+複数のワーカープロセスから memory-map でコピーなしに読み出す。
+
+キー: sha256(モデルのハッシュ, normalize_text(テキスト))
+    (正規化は C# の TextNormalizer.Normalize と同じ。compute には正規化後のテキストを渡す)
+
+ディレクトリ構成:
+    <root>/arena.bin   特徴量 (容量 = --capacity-mb の固定長ファイル、FP16)
+    <root>/index.bin   ヘッダ + スロット表 (キー・オフセット・バイト数・token_len・最終アクセス時刻)
+    <root>/lock        書き込み用のロックファイル (fcntl.flock)
+
+- 追加時はアリーナの空き領域に first-fit で配置し、収まらなければ最終アクセスが古いものから削除する
+- 読み出しは共有ロック中にスロットを引いてコピーし、最終アクセス時刻は排他ロックで更新する。
+  copy=False のアリーナ上のビュー (読み取り専用) は、別プロセスの put で上書きされうるため
+  書き手がいないことが分かっている場合 (読み出し専用のベンチマークなど) だけに使う
+- POSIX 専用 (fcntl)
+
+使用方法:
+    store = BertFeatureStore(Path("bert_cache"), model_digest(Path("deberta_fp16.onnx")))
+    features = store.get_or_compute(text, lambda normalized: run_bert(normalized))
+
+    uv run python bert_cache.py --cache-dir bert_cache --stats
+    uv run python bert_cache.py --cache-dir bert_cache --benchmark --capacity-mb 64
+"""
+
+import argparse
+import fcntl
+import hashlib
+import mmap
+import time
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+from conversion_cache import file_sha256
+from onnx_io import external_data_path
+from text_tensors import EMBEDDING_DIM, normalize_text
+
+MAGIC = b"SBV2BERT"
+INDEX_VERSION = 1
+DEFAULT_CAPACITY_MB = 1024
+DEFAULT_SLOTS = 16384
+
+HEADER_DTYPE = np.dtype([
+    ("magic", "S8"), ("version", "<u4"), ("dim", "<u4"), ("capacity", "<i8"), ("slots", "<i8"),
+])
+SLOT_DTYPE = np.dtype([
+    ("key", "V32"),
+    ("offset", "<i8"),
+    ("nbytes", "<i8"),  # 0 = 空きスロット
+    ("token_len", "<i4"),
+    ("pad", "<i4"),
+    ("last_access", "<f8"),
+])
+
+
+def model_digest(model_path: Path) -> str:
+    """BERT モデル (と外部データ) の内容ハッシュ。"""
+    digest = file_sha256(model_path)
+    data_path = external_data_path(model_path)
+    if data_path.exists():
+        digest = hashlib.sha256((digest + file_sha256(data_path)).encode()).hexdigest()
+    return digest
+
+
+def cache_key(model_hash: str, text: str) -> bytes:
+    """正規化済みテキストとモデルのハッシュから 32 バイトのキーを求める。"""
+    return hashlib.sha256(f"{model_hash}\0{text}".encode()).digest()
+
+
+class BertFeatureStore:
+    """FP16 の BERT 特徴量を memory-map したアリーナに保存する LRU キャッシュ。"""
+
+    def __init__(
+        self,
+        root: Path,
+        model_hash: str,
+        capacity_bytes: int | None = None,
+        slots: int = DEFAULT_SLOTS,
+    ):
+        """capacity_bytes / slots は新規作成時のみ使う (既存のキャッシュはその設定で開く)。"""
+        self.root = root
+        self.model_hash = model_hash
+        self.hits = 0
+        self.misses = 0
+        root.mkdir(parents=True, exist_ok=True)
+        self._lock_file = open(root / "lock", "a+b")
+
+        index_path = root / "index.bin"
+        arena_path = root / "arena.bin"
+        with self._locked(fcntl.LOCK_EX):
+            if not index_path.exists():
+                header = np.zeros(1, dtype=HEADER_DTYPE)
+                capacity_bytes = capacity_bytes or DEFAULT_CAPACITY_MB << 20
+                header[0] = (MAGIC, INDEX_VERSION, EMBEDDING_DIM, capacity_bytes, slots)
+                with open(index_path, "wb") as f:
+                    f.write(header.tobytes())
+                    f.truncate(HEADER_DTYPE.itemsize + SLOT_DTYPE.itemsize * slots)
+                with open(arena_path, "wb") as f:
+                    f.truncate(capacity_bytes)
+            header = np.fromfile(index_path, dtype=HEADER_DTYPE, count=1)[0]
+            if header["magic"] != MAGIC or header["version"] != INDEX_VERSION:
+                raise ValueError(f"{index_path} is not a BERT cache index (version {INDEX_VERSION})")
+            if capacity_bytes is not None and header["capacity"] != capacity_bytes:
+                print(
+                    f"Note: existing cache capacity {header['capacity'] >> 20}MB is used "
+                    f"(requested {capacity_bytes >> 20}MB)"
+                )
+
+        self.capacity = int(header["capacity"])
+        self.index = np.memmap(
+            index_path, dtype=SLOT_DTYPE, mode="r+",
+            offset=HEADER_DTYPE.itemsize, shape=(int(header["slots"]),),
+        )
+        with open(arena_path, "r+b") as f:
+            self._arena = mmap.mmap(f.fileno(), self.capacity)
+
+    def close(self) -> None:
+        self.index.flush()
+        self._arena.close()
+        self._lock_file.close()
+
+    def __enter__(self) -> "BertFeatureStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    @contextmanager
+    def _locked(self, mode: int):
+        fcntl.flock(self._lock_file, mode)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _find(self, key: bytes) -> int | None:
+        found = np.flatnonzero((self.index["key"] == np.void(key)) & (self.index["nbytes"] > 0))
+        return int(found[0]) if len(found) else None
+
+    def _view(self, slot: int) -> np.ndarray:
+        entry = self.index[slot]
+        view = np.ndarray(
+            (EMBEDDING_DIM, int(entry["token_len"])), dtype=np.float16,
+            buffer=self._arena, offset=int(entry["offset"]),
+        )
+        view.flags.writeable = False
+        return view
+
+    def get(
+        self, text: str, token_len: int | None = None, copy: bool = True
+    ) -> np.ndarray | None:
+        """キャッシュされた [1024, token_len] (FP16) を返す。ない場合は None。
+
+        token_len を指定すると、長さが異なるエントリ (別の正規化前テキスト由来) はミス扱いにする。
+        copy=False はロック解放後も有効とは限らないアリーナ上のビューを返す (モジュールの説明を参照)。
+        """
+        key = cache_key(self.model_hash, normalize_text(text))
+        with self._locked(fcntl.LOCK_SH):
+            slot = self._find(key)
+            if slot is None or (
+                token_len is not None and self.index[slot]["token_len"] != token_len
+            ):
+                self.misses += 1
+                return None
+            view = self._view(slot)
+            if copy:
+                view = view.copy()
+        self._touch(slot, key)
+        self.hits += 1
+        return view
+
+    def _touch(self, slot: int, key: bytes) -> None:
+        """最終アクセス時刻を更新する (共有ロック中の読み手同士が同じスロットに書かないよう排他ロックで)。"""
+        with self._locked(fcntl.LOCK_EX):
+            # 共有ロックを外した間に削除・再利用されたスロットは更新しない
+            if self.index[slot]["nbytes"] > 0 and self.index[slot]["key"] == np.void(key):
+                self.index["last_access"][slot] = time.time()
+
+    def _allocate(self, nbytes: int) -> int:
+        """first-fit で空き領域を探し、なければ LRU のエントリを削除する (排他ロック中に呼ぶ)。"""
+        while True:
+            used = np.flatnonzero(self.index["nbytes"] > 0)
+            extents = sorted(
+                (int(self.index[i]["offset"]), int(self.index[i]["nbytes"])) for i in used
+            )
+            position = 0
+            for offset, size in extents:
+                if offset - position >= nbytes:
+                    return position
+                position = offset + size
+            if self.capacity - position >= nbytes:
+                return position
+            oldest = used[np.argmin(self.index["last_access"][used])]
+            self.index["nbytes"][oldest] = 0
+
+    def put(self, text: str, features: np.ndarray) -> bool:
+        """[1024, token_len] (先頭に batch=1 の軸があってもよい) を FP16 で保存する。
+
+        アリーナより大きい場合は保存せずに False を返す。
+        """
+        features = np.ascontiguousarray(
+            features.reshape(EMBEDDING_DIM, features.shape[-1]), dtype=np.float16
+        )
+        if features.nbytes > self.capacity:
+            return False
+        key = cache_key(self.model_hash, normalize_text(text))
+        with self._locked(fcntl.LOCK_EX):
+            slot = self._find(key)
+            if slot is None:
+                free = np.flatnonzero(self.index["nbytes"] == 0)
+                if len(free):
+                    slot = int(free[0])
+                else:
+                    slot = int(np.argmin(self.index["last_access"]))
+                    self.index["nbytes"][slot] = 0
+            else:
+                self.index["nbytes"][slot] = 0
+            offset = self._allocate(features.nbytes)
+            self._arena[offset : offset + features.nbytes] = features.tobytes()
+            # データを書いてからスロットを有効にする
+            self.index[slot] = (key, offset, features.nbytes, features.shape[1], 0, time.time())
+        return True
+
+    def get_or_compute(
+        self, text: str, compute: Callable[[str], np.ndarray], token_len: int | None = None
+    ) -> np.ndarray:
+        """キャッシュにあれば返し、なければ compute(正規化後のテキスト) の結果を保存して返す。"""
+        cached = self.get(text, token_len)
+        if cached is not None:
+            return cached
+        features = compute(normalize_text(text))
+        self.put(text, features)
+        return features.reshape(EMBEDDING_DIM, features.shape[-1]).astype(np.float16)
+
+    def stats(self) -> dict:
+        used = self.index["nbytes"] > 0
+        return {
+            "entries": int(used.sum()),
+            "used_mb": round(float(self.index["nbytes"][used].sum()) / 1024 / 1024, 2),
+            "capacity_mb": self.capacity >> 20,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def _benchmark_worker(root: str, model_hash: str, texts: list[str]) -> tuple[int, float]:
+    """別プロセスからの読み出し時間 (ミリ秒/件)。"""
+    with BertFeatureStore(Path(root), model_hash) as store:
+        start = time.perf_counter()
+        hits = sum(store.get(text) is not None for text in texts)
+        return hits, (time.perf_counter() - start) * 1000 / len(texts)
+
+
+def benchmark(root: Path, capacity_bytes: int | None, count: int, processes: int) -> None:
+    """ダミー特徴量の書き込み・読み出し (同一プロセス / 複数プロセス) を計測する。"""
+    rng = np.random.default_rng(0)
+    model_hash = "benchmark"
+    texts = [f"ダミーテキスト{i}" for i in range(count)]
+    features = [
+        rng.standard_normal((EMBEDDING_DIM, int(n))).astype(np.float32)
+        for n in rng.integers(8, 64, count)
+    ]
+    with BertFeatureStore(root, model_hash, capacity_bytes) as store:
+        start = time.perf_counter()
+        for text, feat in zip(texts, features):
+            store.put(text, feat)
+        put_ms = (time.perf_counter() - start) * 1000 / count
+
+        start = time.perf_counter()
+        hits = sum(store.get(text) is not None for text in texts)
+        get_ms = (time.perf_counter() - start) * 1000 / count
+        print(f"put: {put_ms:.3f}ms/entry, get: {get_ms:.3f}ms/entry ({hits}/{count} hits)")
+        print(f"Stats: {store.stats()}")
+
+    with ProcessPoolExecutor(processes) as pool:
+        results = list(pool.map(
+            _benchmark_worker, [str(root)] * processes, [model_hash] * processes,
+            [texts] * processes,
+        ))
+    for i, (worker_hits, worker_ms) in enumerate(results):
+        print(f"  worker {i}: get {worker_ms:.3f}ms/entry ({worker_hits}/{count} hits)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Persistent shared BERT feature cache")
+    parser.add_argument("--cache-dir", type=str, required=True, help="Cache directory")
+    parser.add_argument(
+        "--capacity-mb", type=int, default=None,
+        help=f"Arena size for a new cache (MB, default {DEFAULT_CAPACITY_MB})",
+    )
+    parser.add_argument("--stats", action="store_true", help="Print cache statistics")
+    parser.add_argument("--benchmark", action="store_true", help="Benchmark with dummy features")
+    parser.add_argument("--count", type=int, default=256, help="Entries for --benchmark")
+    parser.add_argument("--processes", type=int, default=4, help="Reader processes for --benchmark")
+    args = parser.parse_args()
+
+    root = Path(args.cache_dir)
+    capacity = args.capacity_mb << 20 if args.capacity_mb else None
+    if args.benchmark:
+        benchmark(root, capacity, args.count, args.processes)
+    if args.stats:
+        with BertFeatureStore(root, "") as store:
+            print(store.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+長さバケットごとの静的シェイプ ONNX とルーター
+
+--buckets 32 64 128 ... を指定した変換スクリプトは、バケット長ごとに
+固定長 (--no-dynamic 相当) のグラフ <stem>_len<N>.onnx を出力し、
+<stem>_buckets.json に一覧を書き出す。
+
+ルーターは入力長が収まる最小のバケットを選び、そのバケット長までだけパディングして実行する
+(短い発話が最大長分の計算を払わずに済む)。
+
+パディング規則:
+- bert: input_ids / token_type_ids / attention_mask を 0 で埋め、出力 [1, 1024, N] を元の長さに切り詰める
+  (attention_mask=0 のトークンは実トークンの出力に影響しない)
+- tts: x_tst / tones / language と bert 系入力を 0 で埋め、x_tst_lengths は元の長さのまま
+  (SynthesizerTrn は x_mask でパディングを無視し、出力音声長は実際の長さで決まる)
+
+使用方法:
+    uv run python convert_bert_for_sentis.py --output deberta.onnx --buckets 32 64 128 256 512
+    uv run python bucket_router.py --manifest deberta_buckets.json --lengths 5 40 200
+"""
+
+import argparse
+import json
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+import numpy as np
+import onnxruntime as ort
+
+from validate_onnx import cast_feeds, create_session, make_bert_feeds, make_tts_feeds
+
+# モデル種別ごとの「入力名 → 長さ方向の軸」
+LENGTH_AXES = {
+    "bert": {"input_ids": 1, "token_type_ids": 1, "attention_mask": 1},
+    "tts": {
+        "x_tst": 1, "tones": 1, "language": 1,
+        "bert": 2, "ja_bert": 2, "en_bert": 2,
+    },
+}
+
+
+def bucket_path(output_path: Path, length: int) -> Path:
+    """バケット長 length のモデルのパス (<stem>_len<N>.onnx)。"""
+    return output_path.with_name(f"{output_path.stem}_len{length}{output_path.suffix}")
+
+
+def manifest_path(output_path: Path) -> Path:
+    """バケット一覧のマニフェストのパス (<stem>_buckets.json)。"""
+    return output_path.with_name(f"{output_path.stem}_buckets.json")
+
+
+def write_bucket_manifest(output_path: Path, kind: str, lengths: list[int]) -> Path:
+    """バケットモデルの一覧をマニフェストに書き出す (パスはマニフェストからの相対)。"""
+    path = manifest_path(output_path)
+    manifest = {
+        "kind": kind,
+        "buckets": [
+            {"length": length, "path": bucket_path(output_path, length).name}
+            for length in sorted(lengths)
+        ],
+    }
+    path.write_text(json.dumps(manifest, indent=2))
+    print(f"Bucket manifest written to: {path}")
+    return path
+
+
+def feeds_length(kind: str, feeds: dict[str, np.ndarray]) -> int:
+    """feeds の系列長 (パディング前)。"""
+    name = "input_ids" if kind == "bert" else "x_tst"
+    return feeds[name].shape[LENGTH_AXES[kind][name]]
+
+
+def pad_feeds(kind: str, feeds: dict[str, np.ndarray], length: int) -> dict[str, np.ndarray]:
+    """長さ方向の入力を length まで 0 で埋めた feeds を返す。"""
+    result = dict(feeds)
+    for name, axis in LENGTH_AXES[kind].items():
+        if name not in result:
+            continue
+        value = result[name]
+        pad = length - value.shape[axis]
+        if pad < 0:
+            raise ValueError(f"{name} length {value.shape[axis]} exceeds bucket {length}")
+        if pad:
+            widths = [(0, 0)] * value.ndim
+            widths[axis] = (0, pad)
+            result[name] = np.pad(value, widths)
+    return result
+
+
+class BucketRouter:
+    """マニフェストのバケットモデルから入力長に合うものを選んで実行する。
+
+    セッションは初回使用時に作成してキャッシュする。
+    """
+
+    def __init__(
+        self,
+        manifest: Path,
+        session_factory: Callable[[str], ort.InferenceSession] = create_session,
+    ):
+        data = json.loads(manifest.read_text())
+        self.kind = data["kind"]
+        self.buckets = sorted(
+            (entry["length"], str(manifest.parent / entry["path"]))
+            for entry in data["buckets"]
+        )
+        self.session_factory = session_factory
+        self._sessions: dict[int, ort.InferenceSession] = {}
+
+    @property
+    def max_length(self) -> int:
+        return self.buckets[-1][0]
+
+    def select(self, length: int) -> int:
+        """length が収まる最小のバケット長を返す。"""
+        for bucket, _ in self.buckets:
+            if length <= bucket:
+                return bucket
+        raise ValueError(f"Input length {length} exceeds the largest bucket {self.max_length}")
+
+    def session(self, bucket: int) -> ort.InferenceSession:
+        if bucket not in self._sessions:
+            path = dict(self.buckets)[bucket]
+            self._sessions[bucket] = self.session_factory(path)
+        return self._sessions[bucket]
+
+    def run(self, feeds: dict[str, np.ndarray]) -> np.ndarray:
+        """バケットを選んでパディングして実行し、最初の出力を返す。
+
+        bert の出力はパディング分を切り詰めて [1, 1024, 元の長さ] で返す
+        (--fuse-alignment のモデルはグラフ内で展開済みの [1, 1024, phone_len])。
+        """
+        length = feeds_length(self.kind, feeds)
+        bucket = self.select(length)
+        session = self.session(bucket)
+        output = session.run(None, cast_feeds(session, pad_feeds(self.kind, feeds, bucket)))[0]
+        fused = any(inp.name == "phone_to_token" for inp in session.get_inputs())
+        if self.kind == "bert" and not fused:
+            output = output[:, :, :length]
+        return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run bucketed static-shape ONNX models")
+    parser.add_argument("--manifest", type=str, required=True, help="Bucket manifest JSON")
+    parser.add_argument(
+        "--lengths", type=int, nargs="+", default=[5, 20, 60], help="Dummy input lengths"
+    )
+    args = parser.parse_args()
+
+    router = BucketRouter(Path(args.manifest))
+    print(f"Buckets ({router.kind}): {[length for length, _ in router.buckets]}")
+    for length in args.lengths:
+        feeds = make_bert_feeds(length) if router.kind == "bert" else make_tts_feeds(length)
+        router.run(feeds)  # セッション作成 + warmup
+        start = time.perf_counter()
+        output = router.run(feeds)
+        elapsed = (time.perf_counter() - start) * 1000
+        print(
+            f"  length {length:>4} -> bucket {router.select(length):>4}: "
+            f"output {output.shape} ({elapsed:.1f}ms)"
+        )
+
+
+if __name__ == "__main__":
+    main()
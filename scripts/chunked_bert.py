@@ -0,0 +1,235 @@
+"""
+長文 BERT の分割推論 (重なり付きウィンドウ + スティッチング)
+
+DeBERTa は token_len を動的軸としてエクスポートしているが、最大位置数 (512) を超える入力の扱いがなく、
+attention のコストも長さの 2 乗で増える。ここでは長いトークン列を重なり付きのウィンドウに分け、
+全ウィンドウを 1 回のセッション呼び出しにまとめて推論し、[1024, token_len] に戻す。
+
+処理フロー:
+1. [CLS] / [SEP] を除いた本文トークンを、長さ --window (CLS/SEP 込み) のウィンドウに分割
+   (隣り合うウィンドウは 2 * --context トークン重なる。最後のウィンドウは末尾に揃えるため
+    全ウィンドウが同じ長さになり、パディングが不要)
+2. 各ウィンドウに [CLS] / [SEP] を付けて [num_windows, window] のバッチで推論
+   (convert_bert_for_sentis.py --dynamic-batch のモデル。batch=1 固定のモデルはウィンドウごとに推論。
+    token_len 軸が固定のモデル (--buckets / --no-dynamic) は対象外)
+3. 重なり部分はウィンドウ端からの距離で重み付け平均 (blend)、または端から遠い方のウィンドウを採用 (core)
+   (系列の先頭・末尾はウィンドウ端でも文脈が欠けないため重みを下げない)
+4. [CLS] は最初のウィンドウ、[SEP] は最後のウィンドウの出力を使う
+
+--compare は 1 回の推論 (全長) との相対誤差・トークンごとの最小コサイン類似度・レイテンシを比較する。
+
+使用方法:
+    chunked = ChunkedBert(create_session("deberta_fp32.onnx"), window=256, context=32)
+    features = chunked.run(token_ids)  # [1024, token_len]
+
+    uv run python chunked_bert.py --model deberta_fp32.onnx --compare --lengths 256 512 1024
+"""
+
+import argparse
+import time
+
+import numpy as np
+import onnxruntime as ort
+
+from quantize_onnx import relative_error
+from validate_onnx import cast_feeds, create_session
+
+MAX_POSITIONS = 512
+DEFAULT_WINDOW = 256
+DEFAULT_CONTEXT = 32
+# ku-nlp/deberta-v2-large-japanese-char-wwm の語彙数 (--compare のランダムトークン用)
+VOCAB_SIZE = 22012
+STITCH_MODES = ("blend", "core")
+
+
+def plan_windows(content_len: int, window: int, context: int) -> tuple[np.ndarray, int]:
+    """本文トークン数から各ウィンドウの開始位置と本文長 (window - 2) を求める。"""
+    length = min(window - 2, content_len)
+    stride = length - 2 * context
+    if content_len <= length:
+        return np.zeros(1, dtype=np.int64), length
+    count = 1 + -(-(content_len - length) // stride)
+    starts = np.minimum(np.arange(count, dtype=np.int64) * stride, content_len - length)
+    return starts, length
+
+
+def stitch_weights(
+    starts: np.ndarray, length: int, content_len: int, mode: str = "blend"
+) -> np.ndarray:
+    """ウィンドウごとの本文トークンの重み [num_windows, length] (位置ごとに和が 1)。"""
+    if mode not in STITCH_MODES:
+        raise ValueError(f"Unknown stitch mode: {mode} (expected one of {STITCH_MODES})")
+    offsets = np.arange(length, dtype=np.float64)
+    # ウィンドウ端からの距離 + 1 (系列端と接する側は文脈が欠けないため無限大)
+    left = np.where(starts[:, None] > 0, offsets + 1, np.inf)
+    right = np.where(starts[:, None] + length < content_len, length - offsets, np.inf)
+    distance = np.minimum(left, right)
+
+    weights = np.zeros((len(starts), content_len))
+    positions = starts[:, None] + offsets.astype(np.int64)
+    np.put_along_axis(weights, positions, np.minimum(distance, length), axis=1)
+    if mode == "core":
+        weights = (weights == weights.max(axis=0, keepdims=True)).astype(np.float64)
+    weights /= weights.sum(axis=0, keepdims=True)
+    return np.take_along_axis(weights, positions, axis=1)
+
+
+class ChunkedBert:
+    """重なり付きウィンドウで BERT を推論し、トークン単位の特徴量をつなぎ合わせる。"""
+
+    def __init__(
+        self,
+        session: ort.InferenceSession,
+        window: int = DEFAULT_WINDOW,
+        context: int = DEFAULT_CONTEXT,
+        mode: str = "blend",
+    ):
+        self.session = session
+        input_ids = next(inp for inp in session.get_inputs() if inp.name == "input_ids")
+        batch_dim, token_dim = input_ids.shape
+        if isinstance(token_dim, int):
+            raise ValueError("Chunked inference requires a model with a dynamic token_len axis")
+        if window <= 2 * context + 2:
+            raise ValueError(
+                f"window ({window}) must be larger than 2 * context + 2 ({2 * context + 2})"
+            )
+        # batch 軸が動的なら全ウィンドウを 1 回で推論する
+        self.batched = not isinstance(batch_dim, int)
+        self.window = window
+        self.context = context
+        self.mode = mode
+        self.fused_alignment = any(inp.name == "phone_to_token" for inp in session.get_inputs())
+
+    def _infer(self, input_ids: np.ndarray) -> np.ndarray:
+        """[batch, token_len] → [batch, dim, token_len]。"""
+        if len(input_ids) > 1 and not self.batched:
+            # batch=1 固定のモデルはウィンドウごとに推論する
+            return np.concatenate([self._infer(ids[None]) for ids in input_ids])
+        feeds = {
+            "input_ids": input_ids,
+            "token_type_ids": np.zeros_like(input_ids),
+            "attention_mask": np.ones_like(input_ids),
+        }
+        if self.fused_alignment:
+            # グラフ内展開は恒等写像にしてトークン単位の出力を得る
+            feeds["phone_to_token"] = np.arange(input_ids.shape[1], dtype=np.int64)
+        return self.session.run(None, cast_feeds(self.session, feeds))[0]
+
+    def run(self, token_ids: np.ndarray) -> np.ndarray:
+        """[CLS] + 本文 + [SEP] の token_ids [token_len] → 特徴量 [dim, token_len] (FP32)。"""
+        token_ids = np.asarray(token_ids)
+        if len(token_ids) <= self.window:
+            return self._infer(token_ids.reshape(1, -1))[0].astype(np.float32, copy=False)
+
+        content = token_ids[1:-1]
+        starts, length = plan_windows(len(content), self.window, self.context)
+        positions = starts[:, None] + np.arange(length)
+        batch = np.empty((len(starts), length + 2), dtype=token_ids.dtype)
+        batch[:, 0] = token_ids[0]
+        batch[:, 1:-1] = content[positions]
+        batch[:, -1] = token_ids[-1]
+        outputs = self._infer(batch).astype(np.float32, copy=False)
+
+        weights = stitch_weights(starts, length, len(content), self.mode).astype(np.float32)
+        features = np.zeros((outputs.shape[1], len(token_ids)), dtype=np.float32)
+        for i, start in enumerate(starts):
+            features[:, 1 + start : 1 + start + length] += outputs[i, :, 1:-1] * weights[i]
+        features[:, 0] = outputs[0, :, 0]
+        features[:, -1] = outputs[-1, :, -1]
+        return features
+
+
+def _token_cosine(reference: np.ndarray, output: np.ndarray) -> np.ndarray:
+    """トークンごとのコサイン類似度 [token_len]。"""
+    dot = (reference * output).sum(axis=0)
+    norms = np.linalg.norm(reference, axis=0) * np.linalg.norm(output, axis=0)
+    return dot / np.maximum(norms, 1e-12)
+
+
+def compare(
+    session: ort.InferenceSession,
+    lengths: list[int],
+    window: int,
+    context: int,
+    runs: int,
+    vocab_size: int = VOCAB_SIZE,
+    seed: int = 0,
+) -> None:
+    """1 回の推論との精度 (相対誤差・最小コサイン類似度) とレイテンシを比較する。"""
+    rng = np.random.default_rng(seed)
+    chunked = {mode: ChunkedBert(session, window, context, mode) for mode in STITCH_MODES}
+    blend = chunked["blend"]
+    print(f"window={blend.window}, context={context}, batched={blend.batched}\n")
+    header = f"{'tokens':>7} {'windows':>7} {'single ms':>10} {'chunked ms':>11}"
+    header += "".join(f" {mode + ' err':>11} {mode + ' cos':>9}" for mode in STITCH_MODES)
+    print(header)
+
+    def timed(fn, token_ids):
+        fn(token_ids)  # ウォームアップ
+        start = time.perf_counter()
+        for _ in range(runs):
+            result = fn(token_ids)
+        return result, (time.perf_counter() - start) * 1000 / runs
+
+    for length in lengths:
+        token_ids = np.concatenate([[1], rng.integers(5, vocab_size, size=length - 2), [2]])
+        starts, _ = plan_windows(length - 2, blend.window, context)
+        row = f"{length:>7} {len(starts):>7}"
+        try:
+            reference, single_ms = timed(
+                lambda ids: blend._infer(ids.reshape(1, -1))[0].astype(np.float32), token_ids
+            )
+            row += f" {single_ms:>10.1f}"
+        except Exception as e:  # noqa: BLE001 (位置数を超える長さなど)
+            reference = None
+            row += f" {'failed':>10}"
+            print(f"  single pass failed at {length} tokens: {type(e).__name__}")
+        features, chunked_ms = timed(blend.run, token_ids)
+        row += f" {chunked_ms:>11.1f}"
+        for mode in STITCH_MODES:
+            if reference is None:
+                row += f" {'-':>11} {'-':>9}"
+                continue
+            output = features if mode == "blend" else chunked[mode].run(token_ids)
+            error = relative_error(reference, output)
+            cosine = float(_token_cosine(reference, output).min())
+            row += f" {error:>11.2e} {cosine:>9.4f}"
+        if length > MAX_POSITIONS:
+            row += "  (> max positions)"
+        print(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Chunked BERT inference with overlapping windows and stitching"
+    )
+    parser.add_argument("--model", type=str, required=True, help="DeBERTa ONNX path")
+    parser.add_argument(
+        "--window", type=int, default=DEFAULT_WINDOW,
+        help="Tokens per window including [CLS]/[SEP]",
+    )
+    parser.add_argument(
+        "--context", type=int, default=DEFAULT_CONTEXT,
+        help="Overlap tokens on each side of a window boundary",
+    )
+    parser.add_argument("--compare", action="store_true", help="Compare with single-pass inference")
+    parser.add_argument(
+        "--lengths", type=int, nargs="+", default=[256, 512, 1024],
+        help="Token lengths for --compare",
+    )
+    parser.add_argument("--runs", type=int, default=5, help="Timed runs per length")
+    parser.add_argument(
+        "--vocab-size", type=int, default=VOCAB_SIZE, help="Random token id range for --compare"
+    )
+    parser.add_argument(
+        "--threads", type=int, default=0, help="ORT intra-op threads (0 = default)"
+    )
+    args = parser.parse_args()
+
+    session = create_session(args.model, args.threads)
+    if args.compare:
+        compare(session, args.lengths, args.window, args.context, args.runs, args.vocab_size)
+
+
+if __name__ == "__main__":
+    main()
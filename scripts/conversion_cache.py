@@ -0,0 +1,174 @@
+"""
+ONNX 変換ステージのコンテンツアドレス型キャッシュ
+
+変換は「エクスポート → onnxsim → int64→int32 → FP16」のステージ列で、
+各ステージの出力を入力とパラメータから求めたキーで保存する。
+
+キーの連鎖:
+    base   = hash(チェックポイント, config.json, SBV2 ソース, 変換スクリプト, ツールのバージョン)
+    export = hash(base, "export", opset / seq_len / dynamic ...)
+    simplify = hash(export, "simplify", {})
+    ...
+各ステージのキーは直前のステージのキーを含むため、あるフラグだけを変えた再実行では
+それより前のステージがヒットし、最後に有効なステージから再開できる。
+
+キャッシュディレクトリ構成:
+    <cache_dir>/<key>/model.onnx        ステージ出力
+    <cache_dir>/<key>/model.onnx.data   外部データ (--external-data 時)
+    <cache_dir>/<key>/stage.json        完了マーカー (ステージ名とパラメータ。mtime = 最終使用時刻)
+
+prune() は最終使用時刻が古いエントリから削除し、合計サイズを上限以下に保つ。
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from importlib import metadata
+from pathlib import Path
+
+import onnx
+
+from onnx_io import save_model
+
+# キャッシュ形式のバージョン (エントリの構成を変えたら上げる)
+CACHE_VERSION = 1
+
+_CHUNK_SIZE = 1 << 20
+
+# 出力に影響するため、バージョンをキーに含めるパッケージ
+KEY_PACKAGES = ("torch", "onnx", "onnxsim", "onnxconverter-common", "onnxruntime")
+
+
+def file_sha256(path: Path) -> str:
+    """ファイル内容の SHA-256。"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def tree_sha256(root: Path, pattern: str = "*.py") -> str:
+    """ディレクトリ以下の pattern に一致するファイルの相対パスと内容をまとめた SHA-256。
+
+    git のコミットではなく内容で判定するため、未コミットの変更も区別できる。
+    """
+    digest = hashlib.sha256()
+    for path in sorted(root.rglob(pattern)):
+        digest.update(path.relative_to(root).as_posix().encode())
+        digest.update(file_sha256(path).encode())
+    return digest.hexdigest()
+
+
+def tool_versions(packages: tuple[str, ...] = KEY_PACKAGES) -> dict[str, str | None]:
+    """変換に使うパッケージのバージョン (未インストールは None)。"""
+    versions = {}
+    for name in packages:
+        try:
+            versions[name] = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            versions[name] = None
+    return versions
+
+
+def _dir_size(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+def chain_key(parent: str, stage: str, params: dict | None = None) -> str:
+    """直前のキー・ステージ名・パラメータからステージのキーを求める。"""
+    payload = json.dumps(
+        {"version": CACHE_VERSION, "parent": parent, "stage": stage, "params": params or {}},
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ConversionCache:
+    """ステージ出力をキーごとのディレクトリに保存するキャッシュ。"""
+
+    MODEL_NAME = "model.onnx"
+    MARKER_NAME = "stage.json"
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def entry_dir(self, key: str) -> Path:
+        return self.root / key
+
+    def has(self, key: str) -> bool:
+        """完了マーカーがあるエントリのみ有効とする (中断された書き込みは無視)。"""
+        return (self.entry_dir(key) / self.MARKER_NAME).exists()
+
+    def load(self, key: str, external_data: bool = False) -> tuple[onnx.ModelProto, Path]:
+        """エントリを読み込み、(model, 外部参照の基準ディレクトリ) を返す。
+
+        external_data=True の場合は重みを外部参照のまま (グラフのみ) 読み込む。
+        """
+        entry_dir = self.entry_dir(key)
+        model_path = entry_dir / self.MODEL_NAME
+        model = onnx.load(str(model_path), load_external_data=not external_data)
+        # 最終使用時刻を更新 (prune の LRU 順)
+        os.utime(entry_dir / self.MARKER_NAME)
+        return model, entry_dir
+
+    def save(
+        self,
+        key: str,
+        stage: str,
+        model: onnx.ModelProto,
+        base_dir: Path | None = None,
+        external_data: bool = False,
+        params: dict | None = None,
+    ) -> Path:
+        """ステージ出力を保存し、エントリのディレクトリを返す。
+
+        一時ディレクトリに書いてからリネームするため、中断しても壊れたエントリは残らない。
+        external_data=True の場合、model の外部参照は保存先の .data を指すように書き換わる。
+        """
+        entry_dir = self.entry_dir(key)
+        temp_dir = self.root / f"{key}.tmp-{os.getpid()}"
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        temp_dir.mkdir(parents=True)
+
+        save_model(
+            model, temp_dir / self.MODEL_NAME,
+            base_dir=base_dir, external_data=external_data,
+        )
+        marker = {"stage": stage, "params": params or {}, "created": time.time()}
+        (temp_dir / self.MARKER_NAME).write_text(json.dumps(marker, indent=2))
+
+        try:
+            # 存在確認とリネームの間に他のプロセスが書く場合があるため、リネーム自体で判定する
+            os.replace(temp_dir, entry_dir)
+        except OSError:
+            # 並行実行で先に書かれた場合はそちらを使う (内容は同一)
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            if not self.has(key):
+                raise
+        return entry_dir
+
+    def prune(self, max_bytes: int) -> int:
+        """最終使用時刻が古いエントリから削除し、合計を max_bytes 以下にする (削除数を返す)。
+
+        書き込み中の一時ディレクトリとマーカーのないエントリは対象外。
+        """
+        if not self.root.exists():
+            return 0
+        entries = []
+        for entry_dir in self.root.iterdir():
+            marker = entry_dir / self.MARKER_NAME
+            if entry_dir.is_dir() and marker.exists():
+                entries.append((marker.stat().st_mtime, _dir_size(entry_dir), entry_dir))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, entry_dir in entries:
+            if total <= max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+            removed += 1
+        return removed
@@ -4,14 +4,41 @@ DeBERTa (ku-nlp/deberta-v2-large-japanese-char-wwm) ONNX変換スクリプト
 処理フロー:
 1. HuggingFace から DeBERTa モデルをロード
 2. 隠れ層 -3 を選択するラッパーモデルを作成
+   (-3 より後のエンコーダ層は削除し、FP32 で元のモデルと出力が一致することを確認。--no-truncate で無効)
 3. torch.onnx.export() で opset 15 エクスポート
 4. onnxsim 簡略化
+   (--fuse-transformer: ORT の contrib op へ Attention / LayerNorm / Gelu / バイアス加算を融合。ORT 専用)
 5. int64→int32 キャスト
+   (--mixed-precision: 誤差を持ち込むノードだけ FP32 に残す混合精度を、ORT で実行できる int32 化の前に探索)
 6. FP16変換
+   (--quantize int8 の場合は 5-6 の代わりに INT8 量子化 + 精度ゲート。ORT 専用)
 
 使用方法:
     uv run python convert_bert_for_sentis.py \
         --output deberta_fp16.onnx
+
+    # ORT 用 (int64 のまま) + オフライン最適化済みモデル (deberta_fp32.optimized.ort)
+    uv run python convert_bert_for_sentis.py \
+        --output deberta_fp32.onnx --no-fp16 --no-int32 --emit-ort ort
+
+    # ORT 用 + transformer 融合 (融合前後のレイテンシを deberta_fp32.fusion.json に記録)
+    uv run python convert_bert_for_sentis.py \
+        --output deberta_fp32.onnx --no-fp16 --no-int32 --fuse-transformer --fusion-benchmark
+
+    # 長さバケットごとの静的シェイプ (deberta_fp16_len32.onnx ... + deberta_fp16_buckets.json)
+    uv run python convert_bert_for_sentis.py \
+        --output deberta_fp16.onnx --buckets 32 64 128 256 512
+
+    # word2ph 展開をグラフ内で行う (入力 phone_to_token [phone_len] → 出力 [1, 1024, phone_len])
+    uv run python convert_bert_for_sentis.py --output deberta_fp16.onnx --fuse-alignment
+
+    # batch 軸も動的にする (長文を重なり付きウィンドウに分けて一括推論、chunked_bert.py)
+    uv run python convert_bert_for_sentis.py --output deberta_fp16.onnx --dynamic-batch
+
+    # INT8 (static キャリブレーション、ORT 用)
+    uv run python convert_bert_for_sentis.py \
+        --output deberta_int8.onnx --quantize int8 --quant-mode static \
+        --calibration-dir calibration/
 """
 
 import argparse
@@ -21,93 +48,252 @@ import numpy as np
 import onnx
 import torch
 import torch.nn as nn
-from onnxconverter_common import float16
 from onnxsim import simplify
-from transformers import AutoModel
+from transformers import AutoModel, AutoTokenizer
 
+from bucket_router import bucket_path, pad_feeds, write_bucket_manifest
 from convert_for_sentis import convert_int64_to_int32
+from mixed_precision import convert_to_fp16, search_mixed_precision
+from onnx_io import (
+    externalize,
+    load_external_tensors,
+    model_size_mb,
+    remove_model_files,
+    save_model,
+)
+from ort_optimize import (
+    OPTIMIZATION_LEVELS,
+    OPTIMIZED_FORMATS,
+    emit_optimized_model,
+    optimized_output_path,
+)
+from quantize_onnx import (
+    QUANTIZE_MODES,
+    load_calibration_sentences,
+    quantize_with_gate,
+    split_holdout,
+)
+from transformer_fusion import (
+    compare_latency,
+    convert_fused_to_fp16,
+    fuse_transformer,
+    write_fusion_report,
+)
+
+# --fusion-benchmark で計測するトークン長 (--no-dynamic / --buckets では seq_len のみ)
+FUSION_BENCHMARK_LENGTHS = [32, 128]
+
+
+# SBV2 が使う隠れ層 (bert_feature.py:61)
+HIDDEN_LAYER = -3
 
 
 class DeBERTaWrapper(nn.Module):
     """
     DeBERTaの隠れ層 -3 を選択し[batch, 1024, token_len]形式で出力するラッパー。
     Style-Bert-VITS2のBERT埋め込み仕様に準拠（bert_feature.py:61 と同じ層を使用）。
+    fuse_alignment=True の場合は phone_to_token [phone_len] で展開した
+    [batch, 1024, phone_len] を出力する (numpy 版は text_tensors.align_bert_to_phonemes)。
+    truncate() 後は隠れ層 -3 より後のエンコーダ層を持たず、最終層の出力をそのまま使う。
     """
 
-    def __init__(self, deberta_model):
+    def __init__(self, deberta_model, fuse_alignment: bool = False):
         super().__init__()
         self.model = deberta_model
+        self.fuse_alignment = fuse_alignment
+        self.truncated = False
 
-    def forward(self, input_ids, token_type_ids, attention_mask):
+    def truncate(self) -> int:
+        """隠れ層 -3 より後のエンコーダ層を削除し、削除した層数を返す。"""
+        layers = self.model.encoder.layer
+        # hidden_states[0] は埋め込み、hidden_states[i] は i 層目の出力
+        keep = len(layers) + 1 + HIDDEN_LAYER
+        dropped = len(layers) - keep
+        self.model.encoder.layer = nn.ModuleList(layers[:keep])
+        self.model.config.num_hidden_layers = keep
+        self.truncated = True
+        return dropped
+
+    def forward(self, input_ids, token_type_ids, attention_mask, phone_to_token=None):
         outputs = self.model(
             input_ids=input_ids,
             token_type_ids=token_type_ids,
             attention_mask=attention_mask,
-            output_hidden_states=True,
+            output_hidden_states=not self.truncated,
         )
-        hidden_states = outputs.hidden_states
-        # 隠れ層 -3 のみ (Python SBV2 bert_feature.py と同じ)
-        result = hidden_states[-3]
-        return result.transpose(1, 2)  # [batch, 1024, token_len]
+        if self.truncated:
+            result = outputs.last_hidden_state
+        else:
+            # 隠れ層 -3 のみ (Python SBV2 bert_feature.py と同じ)
+            result = outputs.hidden_states[HIDDEN_LAYER]
+        result = result.transpose(1, 2)  # [batch, 1024, token_len]
+        if self.fuse_alignment:
+            # word2ph 展開 (BertAligner 相当) をグラフ内の Gather で行う
+            result = result.index_select(2, phone_to_token)  # [batch, 1024, phone_len]
+        return result
 
 
-def main():
-    parser = argparse.ArgumentParser(
-        description="Convert DeBERTa to Sentis-compatible ONNX"
-    )
-    parser.add_argument(
-        "--model-name",
-        type=str,
-        default="ku-nlp/deberta-v2-large-japanese-char-wwm",
-        help="HuggingFace model name",
-    )
-    parser.add_argument(
-        "--output",
-        type=str,
-        default="deberta_fp16.onnx",
-        help="Output ONNX model path",
-    )
-    parser.add_argument(
-        "--no-fp16", action="store_true", help="Skip FP16 conversion"
-    )
-    parser.add_argument(
-        "--seq-len", type=int, default=128, help="Dummy sequence length for export"
-    )
-    parser.add_argument(
-        "--no-dynamic",
-        action="store_true",
-        help="Export with fixed sequence length (no dynamic axes)",
+def count_parameters(module: nn.Module) -> int:
+    return sum(p.numel() for p in module.parameters())
+
+
+def estimate_encoder_flops(wrapper: DeBERTaWrapper, seq_len: int) -> int:
+    """エンコーダの概算 FLOPs (Linear: 2 * 重み数 * T、attention: c2c/c2p/p2c + context の 4 行列積)。"""
+    hidden = wrapper.model.config.hidden_size
+    flops = 0
+    for layer in wrapper.model.encoder.layer:
+        linear = sum(m.weight.numel() for m in layer.modules() if isinstance(m, nn.Linear))
+        flops += 2 * linear * seq_len + 4 * 2 * seq_len * seq_len * hidden
+    return flops
+
+
+class TruncationMismatchError(RuntimeError):
+    """エンコーダ層を削除したモデルの出力が元のモデルと一致しない。"""
+
+
+def truncate_with_check(wrapper: DeBERTaWrapper, seq_len: int, seed: int = 0):
+    """wrapper を truncate() し、FP32 で元のモデルと出力が完全一致することを確認する。
+
+    Raises:
+        TruncationMismatchError: 出力が一致しない場合
+    """
+    generator = torch.Generator().manual_seed(seed)
+    inputs = (
+        torch.randint(5, 1000, (1, seq_len), generator=generator),
+        torch.zeros(1, seq_len, dtype=torch.long),
+        torch.ones(1, seq_len, dtype=torch.long),
+        torch.arange(seq_len),
     )
-    parser.add_argument(
-        "--no-int32",
-        action="store_true",
-        help="Skip int64→int32 conversion (for ONNX Runtime which supports int64 natively)",
+    params_before = count_parameters(wrapper)
+    flops_before = estimate_encoder_flops(wrapper, seq_len)
+    with torch.no_grad():
+        reference = wrapper(*inputs)
+        dropped = wrapper.truncate()
+        output = wrapper(*inputs)
+
+    params_after = count_parameters(wrapper)
+    flops_after = estimate_encoder_flops(wrapper, seq_len)
+    print(f"Truncated encoder: dropped {dropped} layer(s) after hidden_states[{HIDDEN_LAYER}]")
+    print(
+        f"  Parameters: {params_before / 1e6:.1f}M -> {params_after / 1e6:.1f}M "
+        f"({1 - params_after / params_before:.1%} fewer)"
     )
-    parser.add_argument(
-        "--no-simplify",
-        action="store_true",
-        help="Skip onnxsim simplification",
+    print(
+        f"  Encoder GFLOPs (seq_len={seq_len}): {flops_before / 1e9:.2f} -> "
+        f"{flops_after / 1e9:.2f} ({1 - flops_after / flops_before:.1%} fewer)"
     )
-    args = parser.parse_args()
+    if not torch.equal(reference, output):
+        diff = (reference - output).abs().max().item()
+        raise TruncationMismatchError(
+            f"Truncated encoder output differs from the full model ({diff})"
+        )
+    print("  FP32 output matches the full model bit-for-bit")
 
-    print(f"Loading model: {args.model_name}")
-    base_model = AutoModel.from_pretrained(args.model_name)
-    base_model.eval()
 
-    wrapper = DeBERTaWrapper(base_model)
-    wrapper.eval()
+def make_bert_calibration_feeds(
+    tokenizer, sentences: list[str]
+) -> list[dict[str, np.ndarray]]:
+    """サンプル文をトークナイズして DeBERTa の feeds を作成する。"""
+    feeds_list = []
+    for sentence in sentences:
+        encoded = tokenizer(sentence, return_tensors="np")
+        feeds_list.append(
+            {
+                "input_ids": encoded["input_ids"],
+                "token_type_ids": np.zeros_like(encoded["input_ids"]),
+                "attention_mask": encoded["attention_mask"],
+            }
+        )
+    return feeds_list
+
+
+def make_bert_random_feeds(
+    lengths: tuple[int, ...] = (8, 32, 128), seed: int = 0
+) -> list[dict[str, np.ndarray]]:
+    """精度ゲート用のランダムトークン feeds (サンプル文がない場合)。"""
+    rng = np.random.default_rng(seed)
+    return [
+        {
+            "input_ids": rng.integers(5, 1000, size=(1, token_len)).astype(np.int64),
+            "token_type_ids": np.zeros((1, token_len), dtype=np.int64),
+            "attention_mask": np.ones((1, token_len), dtype=np.int64),
+        }
+        for token_len in lengths
+    ]
+
+
+def fit_bert_feeds(
+    feeds_list: list[dict[str, np.ndarray]], seq_len: int
+) -> list[dict[str, np.ndarray]]:
+    """固定長グラフ用に feeds を seq_len に切り詰め / パディングする。"""
+    return [
+        pad_feeds("bert", {name: value[:, :seq_len] for name, value in feeds.items()}, seq_len)
+        for feeds in feeds_list
+    ]
+
+
+def add_identity_alignment(
+    feeds_list: list[dict[str, np.ndarray]],
+) -> list[dict[str, np.ndarray]]:
+    """--fuse-alignment のモデル用に恒等の phone_to_token (1 トークン = 1 音素) を追加する。"""
+    return [
+        feeds | {"phone_to_token": np.arange(feeds["input_ids"].shape[1], dtype=np.int64)}
+        for feeds in feeds_list
+    ]
+
+
+def fuse_for_ort(
+    model: onnx.ModelProto,
+    wrapper: DeBERTaWrapper,
+    output_path: Path,
+    lengths: list[int],
+    benchmark: bool = False,
+) -> onnx.ModelProto:
+    """ORT の transformer 融合を適用する (benchmark=True なら融合前後の FP32 レイテンシを計測)。"""
+    config = wrapper.model.config
+    nodes_before = len(model.graph.node)
+    unfused_path = output_path.with_suffix(".unfused.temp.onnx")
+    fused_path = output_path.with_suffix(".fused.temp.onnx")
+    if benchmark:
+        save_model(model, unfused_path)
 
+    model, stats = fuse_transformer(model, config.num_attention_heads, config.hidden_size)
+
+    if benchmark:
+        save_model(model, fused_path)
+        try:
+            rows = compare_latency(unfused_path, fused_path, lengths)
+        finally:
+            remove_model_files(unfused_path)
+            remove_model_files(fused_path)
+        write_fusion_report(
+            output_path.with_suffix(".fusion.json"),
+            stats, (nodes_before, len(model.graph.node)), rows,
+        )
+    return model
+
+
+def convert_bert(
+    wrapper: DeBERTaWrapper,
+    args: argparse.Namespace,
+    output_path: Path,
+    seq_len: int,
+    no_dynamic: bool,
+    calibration_feeds: list[dict[str, np.ndarray]],
+):
+    """DeBERTaWrapper をエクスポートし、後処理 (または INT8 量子化) をして output_path に保存する"""
     # ダミー入力
-    seq_len = args.seq_len
     dummy_input_ids = torch.ones(1, seq_len, dtype=torch.long)
     dummy_token_type_ids = torch.zeros(1, seq_len, dtype=torch.long)
     dummy_attention_mask = torch.ones(1, seq_len, dtype=torch.long)
+    inputs = (dummy_input_ids, dummy_token_type_ids, dummy_attention_mask)
+    input_names = ["input_ids", "token_type_ids", "attention_mask"]
 
     # ONNX エクスポート
     temp_path = "deberta_temp.onnx"
     dynamic_axes = (
-        None
-        if args.no_dynamic
+        {}
+        if no_dynamic
         else {
             "input_ids": {1: "token_len"},
             "token_type_ids": {1: "token_len"},
@@ -115,27 +301,101 @@ def main():
             "output": {2: "token_len"},
         }
     )
-    print(f"Exporting ONNX (opset 15, dynamic={not args.no_dynamic})...")
+    if wrapper.fuse_alignment:
+        # 音素長はトークン長と独立に動的 (--no-dynamic でも phone_len は可変)
+        dummy_phone_to_token = torch.arange(seq_len, dtype=torch.long).repeat_interleave(2)
+        inputs += (dummy_phone_to_token,)
+        input_names.append("phone_to_token")
+        dynamic_axes["phone_to_token"] = {0: "phone_len"}
+        dynamic_axes["output"] = {2: "phone_len"}
+    if args.dynamic_batch:
+        # 長文の分割ウィンドウを 1 回の推論でまとめて処理するための batch 軸 (chunked_bert.py)
+        for name in ("input_ids", "token_type_ids", "attention_mask", "output"):
+            dynamic_axes.setdefault(name, {})[0] = "batch_size"
+    print(
+        f"Exporting ONNX (opset 15, dynamic={not no_dynamic}, "
+        f"dynamic_batch={args.dynamic_batch}, fuse_alignment={wrapper.fuse_alignment})..."
+    )
     torch.onnx.export(
         wrapper,
-        (dummy_input_ids, dummy_token_type_ids, dummy_attention_mask),
+        inputs,
         temp_path,
         opset_version=15,
         dynamo=False,
-        input_names=["input_ids", "token_type_ids", "attention_mask"],
+        input_names=input_names,
         output_names=["output"],
-        dynamic_axes=dynamic_axes,
+        dynamic_axes=dynamic_axes or None,
     )
 
     # 後処理
     print("Loading exported ONNX...")
     model = onnx.load(temp_path)
 
-    if not args.no_simplify:
+    if args.no_simplify:
+        print("Skipping simplification")
+    elif args.external_data:
+        # onnxsim は入力と出力の両方のモデル全体をメモリに保持する
+        print("Skipping simplification (--external-data)")
+    else:
         print("Simplifying...")
         model, check = simplify(model)
-    else:
-        print("Skipping simplification")
+
+    if args.quantize:
+        if args.quant_mode == "static" and calibration_feeds:
+            # レンジ推定に使っていない文で精度ゲートを行う
+            calibration_feeds, gate_feeds = split_holdout(calibration_feeds)
+        else:
+            gate_feeds = calibration_feeds or make_bert_random_feeds()
+        if no_dynamic:
+            # 固定長グラフには seq_len に収まる feeds をパディングして渡す
+            calibration_feeds = fit_bert_feeds(calibration_feeds, seq_len)
+            gate_feeds = fit_bert_feeds(gate_feeds, seq_len)
+        if wrapper.fuse_alignment:
+            calibration_feeds = add_identity_alignment(calibration_feeds)
+            gate_feeds = add_identity_alignment(gate_feeds)
+        try:
+            quantize_with_gate(
+                model,
+                output_path,
+                args.quant_mode,
+                gate_feeds=gate_feeds,
+                max_error=args.max_error,
+                calibration_feeds=calibration_feeds,
+            )
+        except ValueError as e:
+            raise SystemExit(str(e))
+        finally:
+            Path(temp_path).unlink(missing_ok=True)
+        if args.emit_ort:
+            emit_ort_model(output_path, args.emit_ort, args.ort_opt_level)
+        return
+
+    if args.fuse_transformer:
+        print("Fusing transformer patterns for ONNX Runtime...")
+        lengths = [seq_len] if no_dynamic else FUSION_BENCHMARK_LENGTHS
+        model = fuse_for_ort(
+            model, wrapper, output_path, lengths, benchmark=args.fusion_benchmark
+        )
+
+    if not args.no_fp16 and args.mixed_precision:
+        # 探索は ORT で実行するため int64→int32 の前に行う
+        # (int32 化したグラフは Reshape の shape 入力などが ORT で不正になる)
+        print("Converting to mixed FP16/FP32...")
+        feeds_list = calibration_feeds or make_bert_random_feeds()
+        if no_dynamic:
+            feeds_list = fit_bert_feeds(feeds_list, seq_len)
+        if wrapper.fuse_alignment:
+            feeds_list = add_identity_alignment(feeds_list)
+        try:
+            model, _ = search_mixed_precision(model, feeds_list, args.mp_max_error)
+        except ValueError as e:
+            raise SystemExit(f"{e}; relax --mp-max-error or use --no-fp16")
+
+    if args.external_data:
+        # 以降は重みを外部ファイルに置いたまま、グラフのみを処理する
+        print("Externalizing weights...")
+        model = externalize(model, Path(temp_path))
+        load_external_tensors(model, Path(temp_path).parent, onnx.TensorProto.INT64)
 
     if not args.no_int32:
         print("Converting int64 → int32...")
@@ -143,15 +403,15 @@ def main():
     else:
         print("Skipping int64 → int32 conversion (ORT mode)")
 
-    if not args.no_fp16:
+    if not args.no_fp16 and args.fuse_transformer:
+        print("Converting to FP16 (contrib ops)...")
+        model = convert_fused_to_fp16(model)
+    elif not args.no_fp16 and not args.mixed_precision:
         print("Converting to FP16...")
         try:
-            model = float16.convert_float_to_float16(model, keep_io_types=True)
-        except ValueError:
-            # onnxsim may partially convert to fp16, retry with check disabled
-            model = float16.convert_float_to_float16(
-                model, keep_io_types=True, check_fp16_ready=False
-            )
+            model = convert_to_fp16(model)
+        except ValueError as e:
+            raise SystemExit(str(e))
 
     # 出力が FP16 の場合、FP32 にキャストするノードを追加 (ORT 互換)
     output_type = model.graph.output[0].type.tensor_type.elem_type
@@ -177,13 +437,202 @@ def main():
         # 出力の型を FP32 に更新
         old_output.type.tensor_type.elem_type = onnx.TensorProto.FLOAT
 
-    output_path = Path(args.output)
     print(f"Saving to: {output_path}")
-    onnx.save(model, str(output_path))
-    print(f"Done! Model size: {output_path.stat().st_size / 1024 / 1024:.1f} MB")
+    save_model(
+        model, output_path,
+        base_dir=Path(temp_path).parent, external_data=args.external_data,
+    )
+    print(f"Done! Model size: {model_size_mb(output_path):.1f} MB")
 
     # 一時ファイル削除
-    Path(temp_path).unlink(missing_ok=True)
+    remove_model_files(Path(temp_path))
+
+    if args.emit_ort:
+        emit_ort_model(output_path, args.emit_ort, args.ort_opt_level)
+
+
+def emit_ort_model(output_path: Path, fmt: str, level: str):
+    """変換結果から ORT 用のオフライン最適化済みモデルを出力する。"""
+    optimized_path = optimized_output_path(output_path, fmt)
+    emit_optimized_model(output_path, optimized_path, fmt=fmt, level=level)
+    print(f"Optimized model size: {optimized_path.stat().st_size / 1024 / 1024:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert DeBERTa to Sentis-compatible ONNX"
+    )
+    parser.add_argument(
+        "--model-name",
+        type=str,
+        default="ku-nlp/deberta-v2-large-japanese-char-wwm",
+        help="HuggingFace model name",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="deberta_fp16.onnx",
+        help="Output ONNX model path",
+    )
+    parser.add_argument(
+        "--no-fp16", action="store_true", help="Skip FP16 conversion"
+    )
+    parser.add_argument(
+        "--seq-len", type=int, default=128, help="Dummy sequence length for export"
+    )
+    parser.add_argument(
+        "--no-dynamic",
+        action="store_true",
+        help="Export with fixed sequence length (no dynamic axes)",
+    )
+    parser.add_argument(
+        "--buckets",
+        type=int,
+        nargs="+",
+        default=None,
+        help="Export one fixed-length graph per token length plus a bucket manifest",
+    )
+    parser.add_argument(
+        "--no-truncate",
+        action="store_true",
+        help="Keep the encoder layers after hidden_states[-3] in the exported graph",
+    )
+    parser.add_argument(
+        "--fuse-alignment",
+        action="store_true",
+        help="Add a phone_to_token input and expand the output to phone length in-graph",
+    )
+    parser.add_argument(
+        "--dynamic-batch",
+        action="store_true",
+        help="Make the batch axis dynamic (for batched overlapping windows, see chunked_bert.py)",
+    )
+    parser.add_argument(
+        "--no-int32",
+        action="store_true",
+        help="Skip int64→int32 conversion (for ONNX Runtime which supports int64 natively)",
+    )
+    parser.add_argument(
+        "--no-simplify",
+        action="store_true",
+        help="Skip onnxsim simplification",
+    )
+    parser.add_argument(
+        "--quantize",
+        type=str,
+        choices=["int8"],
+        default=None,
+        help="Quantize to INT8 for ONNX Runtime (skips int32/FP16 conversion)",
+    )
+    parser.add_argument(
+        "--quant-mode",
+        type=str,
+        choices=QUANTIZE_MODES,
+        default="dynamic",
+        help="INT8 quantization mode",
+    )
+    parser.add_argument(
+        "--calibration-dir",
+        type=str,
+        default=None,
+        help="Directory of *.txt sample sentences for calibration and the accuracy gate",
+    )
+    parser.add_argument(
+        "--max-error",
+        type=float,
+        default=0.05,
+        help="Max relative error of INT8 hidden states vs FP32 (accuracy gate)",
+    )
+    parser.add_argument(
+        "--mixed-precision",
+        action="store_true",
+        help="Keep FP16-unstable nodes in FP32 (searched with --calibration-dir or random tokens)",
+    )
+    parser.add_argument(
+        "--mp-max-error",
+        type=float,
+        default=0.01,
+        help="Max relative output error vs FP32 for --mixed-precision (default: 0.01)",
+    )
+    parser.add_argument(
+        "--external-data",
+        action="store_true",
+        help="Keep weights in an external .data file and stream the int32/FP16 stages "
+        "(skips onnxsim, which holds the whole model in memory)",
+    )
+    parser.add_argument(
+        "--fuse-transformer",
+        action="store_true",
+        help="Fuse attention/LayerNorm/Gelu/bias patterns into ORT contrib ops (requires --no-int32)",
+    )
+    parser.add_argument(
+        "--fusion-benchmark",
+        action="store_true",
+        help="Benchmark CPU latency before/after --fuse-transformer (<output>.fusion.json)",
+    )
+    parser.add_argument(
+        "--emit-ort",
+        type=str,
+        choices=OPTIMIZED_FORMATS,
+        default=None,
+        help="Also save an offline-optimized ONNX Runtime model (requires --no-int32 or --quantize)",
+    )
+    parser.add_argument(
+        "--ort-opt-level",
+        type=str,
+        choices=list(OPTIMIZATION_LEVELS),
+        default="extended",
+        help="Optimization level for --emit-ort ('all' is tied to the current CPU)",
+    )
+    args = parser.parse_args()
+    if args.emit_ort and not (args.no_int32 or args.quantize):
+        parser.error("--emit-ort targets ONNX Runtime; use it with --no-int32 or --quantize")
+    if args.fuse_transformer and (not args.no_int32 or args.quantize or args.external_data):
+        parser.error("--fuse-transformer requires --no-int32 and no --quantize / --external-data")
+    if args.mixed_precision and (
+        args.no_fp16 or args.external_data or args.quantize or args.fuse_transformer
+    ):
+        parser.error(
+            "--mixed-precision cannot be combined with --no-fp16, --external-data, "
+            "--quantize or --fuse-transformer"
+        )
+    if args.fusion_benchmark and not args.fuse_transformer:
+        parser.error("--fusion-benchmark requires --fuse-transformer")
+
+    print(f"Loading model: {args.model_name}")
+    base_model = AutoModel.from_pretrained(args.model_name)
+    base_model.eval()
+
+    wrapper = DeBERTaWrapper(base_model, fuse_alignment=args.fuse_alignment)
+    wrapper.eval()
+    if not args.no_truncate:
+        try:
+            truncate_with_check(wrapper, args.seq_len)
+        except TruncationMismatchError as e:
+            raise SystemExit(str(e))
+
+    calibration_feeds = []
+    if (args.quantize or args.mixed_precision) and args.calibration_dir:
+        tokenizer = AutoTokenizer.from_pretrained(args.model_name)
+        sentences = load_calibration_sentences(Path(args.calibration_dir))
+        calibration_feeds = make_bert_calibration_feeds(tokenizer, sentences)
+        print(f"Loaded {len(sentences)} calibration sentences")
+
+    output_path = Path(args.output)
+    if not args.buckets:
+        convert_bert(
+            wrapper, args, output_path, args.seq_len, args.no_dynamic, calibration_feeds
+        )
+        return
+
+    # バケット長ごとに静的シェイプのグラフを出力
+    for length in sorted(args.buckets):
+        print(f"\n=== Bucket: token_len={length} ===")
+        convert_bert(
+            wrapper, args, bucket_path(output_path, length), length, True,
+            calibration_feeds,
+        )
+    write_bucket_manifest(output_path, "bert", args.buckets)
 
 
 if __name__ == "__main__":
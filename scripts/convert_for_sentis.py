@@ -7,37 +7,183 @@ Style-Bert-VITS2 SynthesizerTrn ONNX変換スクリプト (Unity Sentis向け)
 3. onnxsim.simplify() でグラフ簡略化
 4. int64→int32 キャスト (Sentis互換)
 5. FP16変換 (keep_io_types=True)
+   (--quantize int8 の場合は 4-5 の代わりに INT8 量子化 + 精度ゲート。ORT 専用)
 
 使用方法:
     uv run python convert_for_sentis.py \
         --model-dir /path/to/sbv2_model/ \
         --output sbv2_model_fp16.onnx
+
+    # INT8 (static キャリブレーション、ORT 用)
+    uv run python convert_for_sentis.py \
+        --input sbv2_model_fp32.onnx --output sbv2_model_int8.onnx \
+        --quantize int8 --quant-mode static --calibration-dir calibration/
 """
 
 import argparse
+import json
+from dataclasses import asdict, dataclass, field
 from pathlib import Path
 
 import numpy as np
 import onnx
 from onnxconverter_common import float16
-from onnxsim import simplify
 
+from onnx_io import (
+    externalize,
+    load_external_tensors,
+    model_size_mb,
+    remove_model_files,
+    save_model,
+)
+from quantize_onnx import (
+    QUANTIZE_MODES,
+    deterministic_feeds,
+    load_calibration_feeds,
+    make_tts_gate_feeds,
+    quantize_with_gate,
+    split_holdout,
+)
+
+
+INT32_MIN = np.iinfo(np.int32).min
+INT32_MAX = np.iinfo(np.int32).max
+INT64_MIN = np.iinfo(np.int64).min
+INT64_MAX = np.iinfo(np.int64).max
+
+
+@dataclass
+class Int32ConversionReport:
+    """convert_int64_to_int32 の変換結果 (変換したテンソル名・ノード名)。"""
+
+    inputs: list[str] = field(default_factory=list)
+    outputs: list[str] = field(default_factory=list)
+    initializers: list[str] = field(default_factory=list)
+    sparse_initializers: list[str] = field(default_factory=list)
+    tensor_attributes: list[str] = field(default_factory=list)
+    casts: list[str] = field(default_factory=list)
+    value_infos: int = 0
+    subgraphs: int = 0
+    # INT64_MAX/MIN (Slice の終端などの番兵値) を INT32_MAX/MIN に丸めたテンソル
+    clamped: list[str] = field(default_factory=list)
+
+    @property
+    def tensor_count(self) -> int:
+        return (
+            len(self.initializers)
+            + len(self.sparse_initializers)
+            + len(self.tensor_attributes)
+            + len(self.casts)
+        )
 
-def _convert_tensor_int64_to_int32(tensor: onnx.TensorProto) -> None:
-    """TensorProto 内の int64 データを int32 に変換する (in-place)。"""
+    def summary(self) -> str:
+        return (
+            f"Converted {self.tensor_count} int64 tensors/nodes to int32 "
+            f"(initializers={len(self.initializers)}, "
+            f"sparse={len(self.sparse_initializers)}, "
+            f"tensor attrs={len(self.tensor_attributes)}, casts={len(self.casts)}, "
+            f"inputs={len(self.inputs)}, outputs={len(self.outputs)}, "
+            f"value_info={self.value_infos}, subgraphs={self.subgraphs}, "
+            f"clamped={len(self.clamped)})"
+        )
+
+
+def _convert_tensor_int64_to_int32(
+    tensor: onnx.TensorProto, name: str, report: Int32ConversionReport
+) -> None:
+    """TensorProto 内の int64 データを int32 に変換する (in-place)。
+
+    raw_data は np.frombuffer でコピーせずに読み、結果は常に raw_data に書き戻す。
+    INT64_MAX/MIN は番兵値として INT32_MAX/MIN に丸め、それ以外の範囲外の値は OverflowError。
+    """
     if tensor.data_type != onnx.TensorProto.INT64:
         return
+    if tensor.data_location == onnx.TensorProto.EXTERNAL:
+        raise ValueError(
+            f"int64 tensor '{name}' is stored externally; "
+            "load it with onnx_io.load_external_tensors first"
+        )
     if tensor.raw_data:
-        data = np.frombuffer(tensor.raw_data, dtype=np.int64).astype(np.int32)
-        tensor.raw_data = data.tobytes()
-    elif tensor.int64_data:
-        data = np.array(tensor.int64_data, dtype=np.int64).astype(np.int32)
-        del tensor.int64_data[:]
-        tensor.int32_data.extend(data.tolist())
+        data = np.frombuffer(tensor.raw_data, dtype="<i8")
+    else:
+        data = np.fromiter(tensor.int64_data, dtype="<i8", count=len(tensor.int64_data))
+
+    if data.size:
+        lo, hi = data.min(), data.max()
+        if lo < INT32_MIN or hi > INT32_MAX:
+            sentinel = (data == INT64_MAX) | (data == INT64_MIN)
+            in_range = (data >= INT32_MIN) & (data <= INT32_MAX)
+            if not np.all(sentinel | in_range):
+                bad = data[~(sentinel | in_range)]
+                raise OverflowError(
+                    f"int64 tensor '{name}' has values outside int32 range "
+                    f"(e.g. {int(bad[0])}); cannot convert safely"
+                )
+            data = np.clip(data, INT32_MIN, INT32_MAX)
+            report.clamped.append(name)
+
+    tensor.raw_data = data.astype("<i4").tobytes()
+    del tensor.int64_data[:]
     tensor.data_type = onnx.TensorProto.INT32
 
 
-def convert_int64_to_int32(model: onnx.ModelProto) -> onnx.ModelProto:
+def _convert_value_infos(value_infos, names: list[str] | None = None) -> int:
+    """ValueInfoProto の elem_type を INT64→INT32 に変更し、変更数を返す。"""
+    count = 0
+    for vi in value_infos:
+        if vi.type.tensor_type.elem_type == onnx.TensorProto.INT64:
+            vi.type.tensor_type.elem_type = onnx.TensorProto.INT32
+            count += 1
+            if names is not None:
+                names.append(vi.name)
+    return count
+
+
+def _convert_graph(graph: onnx.GraphProto, report: Int32ConversionReport) -> None:
+    """グラフ (およびサブグラフ) 内の int64 を 1 パスで int32 に変換する。"""
+    _convert_value_infos(graph.input, report.inputs)
+    _convert_value_infos(graph.output, report.outputs)
+    report.value_infos += _convert_value_infos(graph.value_info)
+
+    for initializer in graph.initializer:
+        if initializer.data_type == onnx.TensorProto.INT64:
+            _convert_tensor_int64_to_int32(initializer, initializer.name, report)
+            report.initializers.append(initializer.name)
+
+    # sparse initializer: values のみ変換 (indices は ONNX 仕様で int64 固定)
+    for sparse in graph.sparse_initializer:
+        if sparse.values.data_type == onnx.TensorProto.INT64:
+            _convert_tensor_int64_to_int32(sparse.values, sparse.values.name, report)
+            report.sparse_initializers.append(sparse.values.name)
+
+    for node in graph.node:
+        for attr in node.attribute:
+            if attr.type == onnx.AttributeProto.TENSOR:
+                # Constant / ConstantOfShape の value 属性など
+                if attr.t.data_type == onnx.TensorProto.INT64:
+                    _convert_tensor_int64_to_int32(attr.t, node.name or node.output[0], report)
+                    report.tensor_attributes.append(node.name or node.output[0])
+            elif attr.type == onnx.AttributeProto.GRAPH:
+                # If / Loop / Scan のサブグラフ
+                _convert_graph(attr.g, report)
+                report.subgraphs += 1
+            elif attr.type == onnx.AttributeProto.GRAPHS:
+                for subgraph in attr.graphs:
+                    _convert_graph(subgraph, report)
+                    report.subgraphs += 1
+            elif (
+                node.op_type == "Cast"
+                and attr.name == "to"
+                and attr.i == onnx.TensorProto.INT64
+            ):
+                # Cast ノードの to=INT64 を to=INT32 に変更
+                attr.i = onnx.TensorProto.INT32
+                report.casts.append(node.name or node.output[0])
+
+
+def convert_int64_to_int32(
+    model: onnx.ModelProto, report: Int32ConversionReport | None = None
+) -> onnx.ModelProto:
     """ONNX モデル内の全ての int64 テンソルを int32 に変換する。
 
     Unity Sentis は int64 をサポートしないため、全ての int64 を int32 に統一する。
@@ -45,53 +191,21 @@ def convert_int64_to_int32(model: onnx.ModelProto) -> onnx.ModelProto:
     Sentis は全て int32 で処理するため問題ない。
     ※ onnxruntime での検証には変換前のモデルを使うこと。
 
-    変換対象:
+    変換対象 (If/Loop/Scan のサブグラフも再帰的に処理):
     - グラフ入力/出力の型宣言
-    - 初期化テンソル (weights)
-    - Constant ノードの value 属性
+    - 初期化テンソル (weights) と sparse initializer の values
+    - テンソル属性 (Constant / ConstantOfShape の value)
     - Cast ノードの to=INT64 を to=INT32 に
     - 中間テンソルの value_info
-    """
-    count = 0
-
-    # グラフ入力
-    for input_tensor in model.graph.input:
-        if input_tensor.type.tensor_type.elem_type == onnx.TensorProto.INT64:
-            input_tensor.type.tensor_type.elem_type = onnx.TensorProto.INT32
-
-    # グラフ出力
-    for output_tensor in model.graph.output:
-        if output_tensor.type.tensor_type.elem_type == onnx.TensorProto.INT64:
-            output_tensor.type.tensor_type.elem_type = onnx.TensorProto.INT32
 
-    # 初期化テンソル (weights)
-    for initializer in model.graph.initializer:
-        if initializer.data_type == onnx.TensorProto.INT64:
-            _convert_tensor_int64_to_int32(initializer)
-            count += 1
-
-    # Constant ノードの value 属性
-    for node in model.graph.node:
-        if node.op_type == "Constant":
-            for attr in node.attribute:
-                if attr.name == "value" and attr.t.data_type == onnx.TensorProto.INT64:
-                    _convert_tensor_int64_to_int32(attr.t)
-                    count += 1
-
-    # Cast ノードの to=INT64 を to=INT32 に変更
-    for node in model.graph.node:
-        if node.op_type == "Cast":
-            for attr in node.attribute:
-                if attr.name == "to" and attr.i == onnx.TensorProto.INT64:
-                    attr.i = onnx.TensorProto.INT32
-                    count += 1
-
-    # 中間テンソルの value_info
-    for vi in model.graph.value_info:
-        if vi.type.tensor_type.elem_type == onnx.TensorProto.INT64:
-            vi.type.tensor_type.elem_type = onnx.TensorProto.INT32
-
-    print(f"  Converted {count} int64 tensors/nodes to int32")
+    report を渡すと変換内容が記録される。
+    """
+    if report is None:
+        report = Int32ConversionReport()
+    _convert_graph(model.graph, report)
+    print(f"  {report.summary()}")
+    if report.clamped:
+        print(f"  Clamped INT64 sentinels in {len(report.clamped)} tensors")
     return model
 
 
@@ -114,21 +228,104 @@ def main():
     parser.add_argument(
         "--no-simplify", action="store_true", help="Skip onnxsim simplification"
     )
+    parser.add_argument(
+        "--quantize",
+        type=str,
+        choices=["int8"],
+        default=None,
+        help="Quantize to INT8 for ONNX Runtime (skips int32/FP16 conversion)",
+    )
+    parser.add_argument(
+        "--quant-mode",
+        type=str,
+        choices=QUANTIZE_MODES,
+        default="dynamic",
+        help="INT8 quantization mode",
+    )
+    parser.add_argument(
+        "--calibration-dir",
+        type=str,
+        default=None,
+        help="Directory of *.npz preprocessed feeds for calibration and the accuracy gate",
+    )
+    parser.add_argument(
+        "--max-error",
+        type=float,
+        default=0.1,
+        help="Max relative error of INT8 waveforms vs FP32 (accuracy gate)",
+    )
+    parser.add_argument(
+        "--int32-report",
+        type=str,
+        default=None,
+        help="Write the int64→int32 conversion report as JSON",
+    )
+    parser.add_argument(
+        "--external-data",
+        action="store_true",
+        help="Keep weights in an external .data file and stream the int32/FP16 stages "
+        "(skips onnxsim, which holds the whole model in memory)",
+    )
     args = parser.parse_args()
 
     print(f"Loading ONNX model: {args.input}")
     model = onnx.load(args.input)
 
     # 1. 簡略化
-    if not args.no_simplify:
+    if args.external_data and not args.no_simplify:
+        # onnxsim は入力と出力の両方のモデル全体をメモリに保持する
+        print("Skipping onnxsim simplification (--external-data)")
+    elif not args.no_simplify:
+        from onnxsim import simplify
+
         print("Simplifying model with onnxsim...")
         model, check = simplify(model)
         if not check:
             print("Warning: onnxsim simplification check failed")
 
+    # INT8 量子化 (ORT 専用のため int32/FP16 変換は行わない)
+    if args.quantize:
+        calibration_feeds = (
+            load_calibration_feeds(Path(args.calibration_dir))
+            if args.calibration_dir
+            else []
+        )
+        if args.quant_mode == "static" and calibration_feeds:
+            # レンジ推定に使っていない入力で精度ゲートを行う
+            calibration_feeds, gate_feeds = split_holdout(calibration_feeds)
+        else:
+            gate_feeds = calibration_feeds or make_tts_gate_feeds()
+        # ノイズを 0 にして FP32 と INT8 の波形を決定的に比較する
+        gate_feeds = [deterministic_feeds(f) for f in gate_feeds]
+        try:
+            quantize_with_gate(
+                model,
+                Path(args.output),
+                args.quant_mode,
+                gate_feeds=gate_feeds,
+                max_error=args.max_error,
+                calibration_feeds=calibration_feeds,
+            )
+        except ValueError as e:
+            raise SystemExit(str(e))
+        return
+
+    # 以降は重みを外部ファイルに置いたまま、グラフのみを処理する
+    output_path = Path(args.output)
+    stage_path = output_path.with_suffix(".temp.onnx")
+    if args.external_data:
+        print("Externalizing weights...")
+        model = externalize(model, stage_path)
+        load_external_tensors(model, stage_path.parent, onnx.TensorProto.INT64)
+
     # 2. int64→int32 変換
     print("Converting int64 → int32...")
-    model = convert_int64_to_int32(model)
+    report = Int32ConversionReport()
+    model = convert_int64_to_int32(model, report)
+    if args.int32_report:
+        Path(args.int32_report).write_text(
+            json.dumps(asdict(report), indent=2, ensure_ascii=False), encoding="utf-8"
+        )
 
     # 3. FP16変換
     if not args.no_fp16:
@@ -136,10 +333,13 @@ def main():
         model = float16.convert_float_to_float16(model, keep_io_types=True)
 
     # 4. 保存
-    output_path = Path(args.output)
     print(f"Saving to: {output_path}")
-    onnx.save(model, str(output_path))
-    print(f"Done! Model size: {output_path.stat().st_size / 1024 / 1024:.1f} MB")
+    save_model(
+        model, output_path,
+        base_dir=stage_path.parent, external_data=args.external_data,
+    )
+    print(f"Done! Model size: {model_size_mb(output_path):.1f} MB")
+    remove_model_files(stage_path)
 
 
 if __name__ == "__main__":
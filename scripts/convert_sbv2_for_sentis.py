@@ -5,8 +5,10 @@ Style-Bert-VITS2 モデルを Sentis 互換 ONNX に変換するスクリプト
 1. HuggingFace からモデルをダウンロード (safetensors + config.json + style_vectors.npy)
 2. SBV2 の公式モデル定義を使って PyTorch モデルを復元
 3. torch.onnx.export() でエクスポート
+   (--combined-bert 指定時は DeBERTa も同じグラフに含める)
 4. onnxsim 簡略化
 5. int64→int32 キャスト (Sentis互換)
+   (--mixed-precision: 誤差を持ち込むノードだけ FP32 に残す混合精度を、ORT で実行できる int32 化の前に探索)
 6. FP16 変換
 
 使用方法:
@@ -14,6 +16,30 @@ Style-Bert-VITS2 モデルを Sentis 互換 ONNX に変換するスクリプト
         --repo ayousanz/tsukuyomi-chan-style-bert-vits2-model \
         --output ../Assets/StreamingAssets/uStyleBertVITS2/Models/sbv2_model.onnx
 
+    # ストリーミング用の分割エクスポート (sbv2_model_flow.onnx + sbv2_model_decoder.onnx)
+    uv run python convert_sbv2_for_sentis.py --repo <hf-repo-id> --split
+
+    # リテイク用の分割エクスポート (sbv2_model_encoder.onnx + sbv2_model_retake.onnx)
+    uv run python convert_sbv2_for_sentis.py --repo <hf-repo-id> --retake-split
+
+    # 長さバケットごとの静的シェイプ (sbv2_model_len32.onnx ... + sbv2_model_buckets.json)
+    uv run python convert_sbv2_for_sentis.py --repo <hf-repo-id> --buckets 32 64 128 256 512
+
+    # ORT 用のオフライン最適化済みモデルも出力 (sbv2_model.optimized.ort、Sentis では使わない)
+    uv run python convert_sbv2_for_sentis.py --repo <hf-repo-id> --emit-ort ort
+
+    # DeBERTa と SynthesizerTrn を 1 つのグラフに結合 (トークン + 音素 → 音声、batch=1)
+    uv run python convert_sbv2_for_sentis.py --repo <hf-repo-id> \
+        --combined-bert ku-nlp/deberta-v2-large-japanese-char-wwm \
+        --output sbv2_combined.onnx
+
+ステージキャッシュ:
+    各ステージ (エクスポート / onnxsim / int32 / FP16) の出力を --stage-cache-dir に保存し、
+    チェックポイント・config.json・SBV2 ソース・変換スクリプト・opset・seq_len・フラグが
+    同じステージはスキップする (例: --no-fp16 の付け外しだけなら FP16 変換と保存のみ再実行)。
+    --no-stage-cache で無効化。ツール (torch / onnx / onnxsim ...) のバージョンもキーに含め、
+    変換後に --stage-cache-max-gb (既定 20GB) を超えた分を最終使用が古いエントリから削除する。
+
 前提:
     - scripts/_sbv2_src/ に Style-Bert-VITS2 リポジトリが clone 済み
       git clone --depth 1 https://github.com/litagin02/Style-Bert-VITS2.git _sbv2_src
@@ -21,8 +47,11 @@ Style-Bert-VITS2 モデルを Sentis 互換 ONNX に変換するスクリプト
 
 import argparse
 import json
+import math
+import re
 import sys
 import time
+from collections.abc import Callable
 from pathlib import Path
 from typing import cast
 
@@ -30,10 +59,29 @@ import numpy as np
 import onnx
 import torch
 from huggingface_hub import hf_hub_download
-from onnxconverter_common import float16
 from onnxsim import simplify
+from transformers import AutoModel
 
+from bucket_router import bucket_path, write_bucket_manifest
+from conversion_cache import ConversionCache, chain_key, file_sha256, tool_versions, tree_sha256
+from convert_bert_for_sentis import (
+    DeBERTaWrapper,
+    TruncationMismatchError,
+    emit_ort_model,
+    truncate_with_check,
+)
 from convert_for_sentis import convert_int64_to_int32
+from mixed_precision import calibration_feeds_for, convert_to_fp16, search_mixed_precision
+from onnx_io import (
+    externalize,
+    load_external_tensors,
+    model_size_mb,
+    remove_model_files,
+    save_model,
+)
+from ort_optimize import OPTIMIZATION_LEVELS, OPTIMIZED_FORMATS
+from retake_cache import ENCODER_OUTPUT_NAMES
+from synthesis_server import AUDIO_LENGTHS_OUTPUT
 
 # SBV2 のモデル定義を import するために sys.path に追加
 SBV2_SRC = Path(__file__).parent / "_sbv2_src"
@@ -48,6 +96,21 @@ from style_bert_vits2.models.models import SynthesizerTrn
 from style_bert_vits2.nlp.symbols import SYMBOLS
 from safetensors.torch import load_file as load_safetensors
 
+# ステージ出力に影響する変換スクリプト (キャッシュキーに内容を含める)
+CACHE_KEY_SCRIPTS = (
+    "convert_sbv2_for_sentis.py",
+    "convert_bert_for_sentis.py",
+    "convert_for_sentis.py",
+    "mixed_precision.py",
+    "onnx_io.py",
+)
+
+
+def checkpoint_step(name: str) -> int:
+    """チェックポイント名からステップ数を取り出す (e.g., tsukuyomi-chan_e200_s5200.safetensors)"""
+    m = re.search(r"_s(\d+)", name)
+    return int(m.group(1)) if m else 0
+
 
 def download_model(repo_id: str, cache_dir: Path) -> tuple[Path, Path, Path]:
     """HuggingFace からモデルファイルをダウンロード"""
@@ -67,20 +130,30 @@ def download_model(repo_id: str, cache_dir: Path) -> tuple[Path, Path, Path]:
     if not safetensors_files:
         raise FileNotFoundError(f"No safetensors files found in {repo_id}")
 
-    # ステップ数でソート (e.g., tsukuyomi-chan_e200_s5200.safetensors)
-    import re
-
-    def extract_step(name: str) -> int:
-        m = re.search(r"_s(\d+)", name)
-        return int(m.group(1)) if m else 0
-
-    best_ckpt = max(safetensors_files, key=extract_step)
+    best_ckpt = max(safetensors_files, key=checkpoint_step)
     print(f"Selected checkpoint: {best_ckpt}")
 
     model_path = Path(hf_hub_download(repo_id, best_ckpt, cache_dir=cache_dir))
     return model_path, config_path, style_vec_path
 
 
+def find_local_model(model_dir: Path) -> tuple[Path, Path, Path]:
+    """ローカルのモデルディレクトリから (safetensors, config.json, style_vectors.npy) を探す"""
+    config_path = model_dir / "config.json"
+    style_vec_path = model_dir / "style_vectors.npy"
+    for path in (config_path, style_vec_path):
+        if not path.exists():
+            raise FileNotFoundError(f"{path.name} not found in {model_dir}")
+
+    safetensors_files = sorted(model_dir.glob("*.safetensors"))
+    if not safetensors_files:
+        raise FileNotFoundError(f"No safetensors files found in {model_dir}")
+
+    model_path = max(safetensors_files, key=lambda p: checkpoint_step(p.name))
+    print(f"Selected checkpoint: {model_path.name}")
+    return model_path, config_path, style_vec_path
+
+
 def build_model(
     config_path: Path, model_path: Path, device: str = "cpu"
 ) -> tuple[torch.nn.Module, HyperParameters]:
@@ -163,18 +236,30 @@ def build_model(
     return net_g, hps
 
 
-def export_onnx(
+def _export_synthesizer(
     net_g: torch.nn.Module,
     hps: HyperParameters,
-    output_path: Path,
-    no_fp16: bool = False,
+    temp_path: str,
     no_dynamic: bool = False,
-    no_simplify: bool = False,
     opset_version: int = 15,
     seq_len: int = 128,
+    output_name: str = "output",
+    with_lengths: bool = False,
 ):
-    """モデルを Sentis 互換 ONNX にエクスポート"""
+    """SynthesizerTrn.infer を torch.onnx.export する (後処理なし)
+
+    with_lengths=True の場合、行ごとの有効な音声サンプル数 (y_mask のフレーム数 × アップサンプル率) を
+    2 つ目の出力 audio_lengths [batch] として追加する (バッチ推論でパディング行の末尾を切るため)。
+    """
     device = "cpu"
+    hop_length = math.prod(hps.model.upsample_rates)
+    output_names = [output_name, AUDIO_LENGTHS_OUTPUT] if with_lengths else [output_name]
+
+    def outputs(o, y_mask):
+        if with_lengths:
+            return o, (y_mask.sum(dim=(1, 2)) * hop_length).long()
+        return o
+
     is_jp_extra = hps.version.endswith("JP-Extra")
     x_tst = torch.randint(0, 100, (1, seq_len), dtype=torch.long, device=device)
     x_tst_lengths = torch.tensor([seq_len], dtype=torch.long, device=device)
@@ -188,20 +273,18 @@ def export_onnx(
     noise_scale = torch.tensor(0.667)
     noise_scale_w = torch.tensor(0.8)
 
-    temp_path = str(output_path.with_suffix(".temp.onnx"))
-
     if is_jp_extra:
 
         def forward_jp_extra(
             x, x_lengths, sid, tone, language, bert, style_vec,
             length_scale=1.0, sdp_ratio=0.0, noise_scale=0.667, noise_scale_w=0.8,
         ):
-            o, _, _, _ = cast(SynthesizerTrnJPExtra, net_g).infer(
+            o, _, y_mask, _ = cast(SynthesizerTrnJPExtra, net_g).infer(
                 x, x_lengths, sid, tone, language, bert, style_vec,
                 length_scale=length_scale, sdp_ratio=sdp_ratio,
                 noise_scale=noise_scale, noise_scale_w=noise_scale_w,
             )
-            return o
+            return outputs(o, y_mask)
 
         net_g.forward = forward_jp_extra  # type: ignore
 
@@ -216,6 +299,7 @@ def export_onnx(
                 "language": {0: "batch_size", 1: "x_tst_max_length"},
                 "bert": {0: "batch_size", 2: "x_tst_max_length"},
                 "style_vec": {0: "batch_size"},
+                **({AUDIO_LENGTHS_OUTPUT: {0: "batch_size"}} if with_lengths else {}),
             }
         )
         print(f"Exporting ONNX (JP-Extra, dynamic={not no_dynamic})...")
@@ -235,7 +319,7 @@ def export_onnx(
                 "bert", "style_vec",
                 "length_scale", "sdp_ratio", "noise_scale", "noise_scale_w",
             ],
-            output_names=["output"],
+            output_names=output_names,
             dynamic_axes=jp_extra_dynamic_axes,
         )
         print(f"ONNX exported ({time.time() - export_start:.1f}s)")
@@ -247,12 +331,12 @@ def export_onnx(
             x, x_lengths, sid, tone, language, bert, ja_bert, en_bert, style_vec,
             length_scale=1.0, sdp_ratio=0.0, noise_scale=0.667, noise_scale_w=0.8,
         ):
-            o, _, _, _ = cast(SynthesizerTrn, net_g).infer(
+            o, _, y_mask, _ = cast(SynthesizerTrn, net_g).infer(
                 x, x_lengths, sid, tone, language, bert, ja_bert, en_bert, style_vec,
                 length_scale=length_scale, sdp_ratio=sdp_ratio,
                 noise_scale=noise_scale, noise_scale_w=noise_scale_w,
             )
-            return o
+            return outputs(o, y_mask)
 
         net_g.forward = forward_non_jp_extra  # type: ignore
 
@@ -269,6 +353,7 @@ def export_onnx(
                 "ja_bert": {0: "batch_size", 2: "x_tst_max_length"},
                 "en_bert": {0: "batch_size", 2: "x_tst_max_length"},
                 "style_vec": {0: "batch_size"},
+                **({AUDIO_LENGTHS_OUTPUT: {0: "batch_size"}} if with_lengths else {}),
             }
         )
         print(f"Exporting ONNX (Non-JP-Extra, dynamic={not no_dynamic})...")
@@ -289,23 +374,21 @@ def export_onnx(
                 "bert", "ja_bert", "en_bert", "style_vec",
                 "length_scale", "sdp_ratio", "noise_scale", "noise_scale_w",
             ],
-            output_names=["output"],
+            output_names=output_names,
             dynamic_axes=non_jp_dynamic_axes,
         )
         print(f"ONNX exported ({time.time() - export_start:.1f}s)")
 
-    # 後処理
-    print("Loading exported ONNX...")
-    model = onnx.load(temp_path)
 
-    if not no_simplify:
-        print("Simplifying with onnxsim...")
-        model, check = simplify(model)
-        if not check:
-            print("Warning: onnxsim simplification check failed")
-    else:
-        print("Skipping onnxsim simplification.")
+def _simplify_stage(model: onnx.ModelProto) -> onnx.ModelProto:
+    print("Simplifying with onnxsim...")
+    model, check = simplify(model)
+    if not check:
+        print("Warning: onnxsim simplification check failed")
+    return model
 
+
+def _int32_stage(model: onnx.ModelProto) -> onnx.ModelProto:
     print("Converting int64 -> int32...")
     model = convert_int64_to_int32(model)
 
@@ -315,24 +398,704 @@ def export_onnx(
             new_dim = inp.type.tensor_type.shape.dim.add()
             new_dim.dim_value = 1
             print(f"  Fixed scalar input: {inp.name} [] -> [1]")
+    return model
 
-    if not no_fp16:
-        print("Converting to FP16...")
-        try:
-            model = float16.convert_float_to_float16(model, keep_io_types=True)
-        except ValueError:
-            # onnxsim may partially convert to fp16, retry with check disabled
-            model = float16.convert_float_to_float16(
-                model, keep_io_types=True, check_fp16_ready=False
+
+def _fp16_stage(model: onnx.ModelProto) -> onnx.ModelProto:
+    print("Converting to FP16...")
+    try:
+        return convert_to_fp16(model)
+    except ValueError as e:
+        raise SystemExit(str(e))
+
+
+def _mixed_fp16_stage(
+    model: onnx.ModelProto, max_error: float, calibration_dir: Path | None = None
+) -> onnx.ModelProto:
+    print("Converting to mixed FP16/FP32...")
+    try:
+        feeds_list = calibration_feeds_for(model, calibration_dir)
+        model, _ = search_mixed_precision(model, feeds_list, max_error)
+    except ValueError as e:
+        raise SystemExit(f"{e}; relax --mp-max-error or use --no-fp16")
+    return model
+
+
+def conversion_base_key(model_path: Path, config_path: Path) -> str:
+    """チェックポイント・config.json・SBV2 ソース・変換スクリプトの内容とツールのバージョンから基底キーを求める"""
+    script_dir = Path(__file__).parent
+    sources = {
+        "checkpoint": file_sha256(model_path),
+        "config": file_sha256(config_path),
+        "sbv2_src": tree_sha256(SBV2_SRC / "style_bert_vits2"),
+        "scripts": {
+            name: file_sha256(script_dir / name)
+            for name in CACHE_KEY_SCRIPTS
+        },
+        "tools": tool_versions(),
+    }
+    return chain_key("", "sources", sources)
+
+
+def run_conversion(
+    export_fn: Callable[[str], None],
+    output_path: Path,
+    no_fp16: bool = False,
+    no_simplify: bool = False,
+    external_data: bool = False,
+    cache: ConversionCache | None = None,
+    export_key: str | None = None,
+    mixed_precision_error: float | None = None,
+    calibration_dir: Path | None = None,
+):
+    """export_fn(temp_path) でエクスポートし、Sentis 向け後処理を適用して保存する
+
+    onnxsim 簡略化 → int64→int32 → scalar 入力の [1] 化 → FP16 変換。
+    mixed_precision_error を指定すると、FP16 変換の代わりに出力誤差がその値以下になる
+    混合精度を探索する (mixed_precision.py)。探索は ORT で実行するため int64→int32 の前に行い、
+    入力は calibration_dir の *.npz (なければ合成入力) を、固定長グラフでは固定次元に合わせて使う。
+    external_data=True の場合、エクスポート直後から重みを外部ファイルに置いたまま処理する
+    (onnxsim はモデル全体をメモリに載せるため行わない)。
+
+    cache を渡すと各ステージの出力を export_key から連鎖したキーで保存し、
+    最後に有効なステージから再開する (エクスポート自体もスキップされうる)。
+    """
+    stages = [("export", None)]
+    if no_simplify:
+        print("Skipping onnxsim simplification.")
+    elif external_data:
+        # onnxsim は入力と出力の両方のモデル全体 (+ 定数畳み込み用の ORT セッション) を保持する
+        print("Skipping onnxsim simplification (--external-data).")
+    else:
+        stages.append(("simplify", _simplify_stage))
+    stage_params = {}
+    if not no_fp16 and mixed_precision_error is not None:
+        # 探索は ORT で実行するため int64→int32 の前に行う
+        # (int32 化したグラフは Reshape の shape 入力などが ORT で不正になる)
+        stages.append((
+            "fp16_mixed",
+            lambda model: _mixed_fp16_stage(model, mixed_precision_error, calibration_dir),
+        ))
+        stage_params["fp16_mixed"] = {
+            "max_error": mixed_precision_error,
+            "calibration": tree_sha256(calibration_dir, "*.npz") if calibration_dir else None,
+        }
+        stages.append(("int32", _int32_stage))
+    else:
+        stages.append(("int32", _int32_stage))
+        if not no_fp16:
+            stages.append(("fp16", _fp16_stage))
+
+    keys = []
+    model = None
+    base_dir = None
+    start = 0
+    if cache is not None:
+        key = export_key
+        for name, _ in stages:
+            if name != "export":
+                key = chain_key(key, name, stage_params.get(name))
+            keys.append(key)
+
+        # 最後に有効なステージから再開
+        for i in reversed(range(len(stages))):
+            if cache.has(keys[i]):
+                print(f"Cache hit: {stages[i][0]} ({keys[i][:12]})")
+                model, base_dir = cache.load(keys[i], external_data=external_data)
+                start = i + 1
+                break
+
+    temp_path = output_path.with_suffix(".temp.onnx")
+    for i in range(start, len(stages)):
+        name, stage_fn = stages[i]
+        if name == "export":
+            export_fn(str(temp_path))
+            print("Loading exported ONNX...")
+            model = onnx.load(str(temp_path))
+            base_dir = temp_path.parent
+        else:
+            if external_data and name == "int32":
+                load_external_tensors(model, base_dir, onnx.TensorProto.INT64)
+            model = stage_fn(model)
+
+        if cache is not None:
+            # external_data=True では保存後の model は外部参照 (グラフのみ) になる
+            base_dir = cache.save(
+                keys[i], name, model, base_dir=base_dir, external_data=external_data
             )
+        elif external_data and name == "export":
+            print("Externalizing weights...")
+            model = externalize(model, temp_path)
+            base_dir = temp_path.parent
 
-    output_path.parent.mkdir(parents=True, exist_ok=True)
     print(f"Saving to: {output_path}")
-    onnx.save(model, str(output_path))
-    print(f"Done! Model size: {output_path.stat().st_size / 1024 / 1024:.1f} MB")
+    save_model(model, output_path, base_dir=base_dir, external_data=external_data)
+    print(f"Done! Model size: {model_size_mb(output_path):.1f} MB")
 
     # 一時ファイル削除
-    Path(temp_path).unlink(missing_ok=True)
+    remove_model_files(temp_path)
+
+
+def export_onnx(
+    net_g: torch.nn.Module,
+    hps: HyperParameters,
+    output_path: Path,
+    no_fp16: bool = False,
+    no_dynamic: bool = False,
+    no_simplify: bool = False,
+    opset_version: int = 15,
+    seq_len: int = 128,
+    external_data: bool = False,
+    cache: ConversionCache | None = None,
+    base_key: str | None = None,
+    mixed_precision_error: float | None = None,
+    calibration_dir: Path | None = None,
+):
+    """モデルを Sentis 互換 ONNX にエクスポート"""
+    export_key = None
+    if cache is not None:
+        export_key = chain_key(base_key, "export", {
+            "graph": "full", "opset": opset_version,
+            "seq_len": seq_len, "dynamic": not no_dynamic,
+        })
+
+    def export_fn(temp_path: str):
+        _export_synthesizer(
+            net_g, hps, temp_path,
+            no_dynamic=no_dynamic, opset_version=opset_version, seq_len=seq_len,
+            with_lengths=True,
+        )
+
+    run_conversion(
+        export_fn, output_path,
+        no_fp16=no_fp16, no_simplify=no_simplify, external_data=external_data,
+        cache=cache, export_key=export_key,
+        mixed_precision_error=mixed_precision_error,
+        calibration_dir=calibration_dir,
+    )
+
+
+class _PassthroughDecoder(torch.nn.Module):
+    """infer() 内の dec を置き換え、デコーダ入力 (z * y_mask) をそのまま返す"""
+
+    def forward(self, z, g=None):
+        return z
+
+
+class DecoderWrapper(torch.nn.Module):
+    """HiFi-GAN デコーダ単体のラッパー。sid から話者埋め込み g を求めて dec に渡す"""
+
+    def __init__(self, net_g: torch.nn.Module):
+        super().__init__()
+        self.emb_g = net_g.emb_g
+        self.dec = net_g.dec
+
+    def forward(self, z, sid):
+        g = self.emb_g(sid).unsqueeze(-1)  # [batch, gin_channels, 1]
+        return self.dec(z, g=g)
+
+
+def _export_flow(
+    net_g: torch.nn.Module,
+    hps: HyperParameters,
+    temp_path: str,
+    no_dynamic: bool = False,
+    opset_version: int = 15,
+    seq_len: int = 128,
+):
+    """enc_p + dp/sdp + flow: dec を素通しに差し替えて infer をそのままエクスポート"""
+    original_dec = net_g.dec
+    net_g.dec = _PassthroughDecoder()
+    try:
+        _export_synthesizer(
+            net_g, hps, temp_path,
+            no_dynamic=no_dynamic, opset_version=opset_version, seq_len=seq_len,
+            output_name="z",
+        )
+    finally:
+        net_g.dec = original_dec
+
+
+def _export_decoder(
+    net_g: torch.nn.Module,
+    hps: HyperParameters,
+    temp_path: str,
+    no_dynamic: bool = False,
+    opset_version: int = 15,
+    seq_len: int = 128,
+):
+    """DecoderWrapper を torch.onnx.export する (後処理なし)"""
+    decoder = DecoderWrapper(net_g)
+    decoder.eval()
+    z = torch.randn(1, hps.model.inter_channels, seq_len * 2)
+    sid = torch.tensor([0], dtype=torch.long)
+    decoder_dynamic_axes = (
+        None
+        if no_dynamic
+        else {
+            "z": {0: "batch_size", 2: "frames"},
+            "sid": {0: "batch_size"},
+            "output": {0: "batch_size", 2: "audio_len"},
+        }
+    )
+    print(f"Exporting ONNX (decoder, dynamic={not no_dynamic})...")
+    export_start = time.time()
+    torch.onnx.export(
+        decoder,
+        (z, sid),
+        temp_path,
+        opset_version=opset_version,
+        dynamo=False,
+        input_names=["z", "sid"],
+        output_names=["output"],
+        dynamic_axes=decoder_dynamic_axes,
+    )
+    print(f"ONNX exported ({time.time() - export_start:.1f}s)")
+
+
+def export_split_onnx(
+    net_g: torch.nn.Module,
+    hps: HyperParameters,
+    output_path: Path,
+    no_fp16: bool = False,
+    no_dynamic: bool = False,
+    no_simplify: bool = False,
+    opset_version: int = 15,
+    seq_len: int = 128,
+    external_data: bool = False,
+    cache: ConversionCache | None = None,
+    base_key: str | None = None,
+    mixed_precision_error: float | None = None,
+    calibration_dir: Path | None = None,
+) -> tuple[Path, Path]:
+    """ストリーミング合成用に 2 つのグラフへ分割してエクスポート
+
+    - <stem>_flow.onnx: テキストエンコーダ + duration predictor + flow
+      (入力は monolithic と同じ、出力 z [batch, inter_channels, frames])
+    - <stem>_decoder.onnx: デコーダ (入力 z, sid → 出力 output [batch, 1, frames * hop])
+    """
+    if not hasattr(net_g, "emb_g"):
+        raise ValueError("Split export requires a multi-speaker model (emb_g)")
+
+    flow_path = output_path.with_name(f"{output_path.stem}_flow.onnx")
+    decoder_path = output_path.with_name(f"{output_path.stem}_decoder.onnx")
+
+    for graph, path, export_graph in (
+        ("flow", flow_path, _export_flow),
+        ("decoder", decoder_path, _export_decoder),
+    ):
+        export_key = None
+        if cache is not None:
+            export_key = chain_key(base_key, "export", {
+                "graph": graph, "opset": opset_version,
+                "seq_len": seq_len, "dynamic": not no_dynamic,
+            })
+
+        def export_fn(temp_path: str, export_graph=export_graph):
+            export_graph(
+                net_g, hps, temp_path,
+                no_dynamic=no_dynamic, opset_version=opset_version, seq_len=seq_len,
+            )
+
+        run_conversion(
+            export_fn, path,
+            no_fp16=no_fp16, no_simplify=no_simplify, external_data=external_data,
+            cache=cache, export_key=export_key,
+            mixed_precision_error=mixed_precision_error,
+            calibration_dir=calibration_dir,
+        )
+
+    return flow_path, decoder_path
+
+
+class _EncoderCaptured(Exception):
+    """enc_p の出力を infer() の外に持ち出すための例外"""
+
+    def __init__(self, outputs):
+        super().__init__()
+        self.outputs = outputs
+
+
+class _CapturingEncoder(torch.nn.Module):
+    """infer() 内の enc_p を包み、出力が得られた時点で infer を打ち切る"""
+
+    def __init__(self, enc_p: torch.nn.Module):
+        super().__init__()
+        self.enc_p = enc_p
+
+    def forward(self, *args, **kwargs):
+        raise _EncoderCaptured(self.enc_p(*args, **kwargs))
+
+
+class _CachedEncoder(torch.nn.Module):
+    """infer() 内の enc_p を置き換え、グラフ入力のエンコーダ出力をそのまま返す"""
+
+    def __init__(self):
+        super().__init__()
+        self.outputs = None
+
+    def forward(self, *args, **kwargs):
+        return self.outputs
+
+
+class EncoderWrapper(torch.nn.Module):
+    """infer() の決定的な部分 (emb_g + enc_p) だけを取り出すラッパー
+
+    enc_p を _CapturingEncoder に差し替えた net_g で infer を呼ぶため、
+    enc_p の引数 (BERT・style_vec・g の渡し方) は SBV2 のバージョンに従う。
+    出力は (hidden, m_p, logs_p, x_mask)。
+    """
+
+    def __init__(self, net_g: torch.nn.Module):
+        super().__init__()
+        self.net_g = net_g
+
+    def forward(self, x, x_lengths, sid, tone, language, *bert_and_style):
+        try:
+            self.net_g.infer(x, x_lengths, sid, tone, language, *bert_and_style)
+        except _EncoderCaptured as captured:
+            return tuple(captured.outputs)
+        raise RuntimeError("enc_p was not called by infer()")
+
+
+class RetakeWrapper(torch.nn.Module):
+    """キャッシュ済みのエンコーダ出力から dp/sdp + flow + dec を実行するラッパー
+
+    enc_p を _CachedEncoder に差し替えた net_g で infer を呼ぶ。
+    音素系列・BERT・style_vec は enc_p でしか使われないため、ダミーを渡す
+    (エクスポート時に未使用として除去される)。
+    """
+
+    def __init__(self, net_g: torch.nn.Module, hps: HyperParameters, cached: _CachedEncoder):
+        super().__init__()
+        self.net_g = net_g
+        self.cached = cached
+        self.is_jp_extra = hps.version.endswith("JP-Extra")
+
+    def forward(
+        self, hidden, m_p, logs_p, x_mask, sid,
+        length_scale, sdp_ratio, noise_scale, noise_scale_w,
+    ):
+        self.cached.outputs = (hidden, m_p, logs_p, x_mask)
+        tokens = torch.zeros(1, 1, dtype=torch.long)
+        bert = torch.zeros(1, 1024, 1)
+        bert_args = (bert,) if self.is_jp_extra else (bert, bert, bert)
+        o, _, _, _ = self.net_g.infer(
+            tokens, tokens[:, 0], sid, tokens, tokens, *bert_args, torch.zeros(1, 256),
+            length_scale=length_scale, sdp_ratio=sdp_ratio,
+            noise_scale=noise_scale, noise_scale_w=noise_scale_w,
+        )
+        return o
+
+
+def _export_encoder(
+    net_g: torch.nn.Module,
+    hps: HyperParameters,
+    temp_path: str,
+    no_dynamic: bool = False,
+    opset_version: int = 15,
+    seq_len: int = 128,
+):
+    """EncoderWrapper を torch.onnx.export する (後処理なし)"""
+    is_jp_extra = hps.version.endswith("JP-Extra")
+    bert_names = ["bert"] if is_jp_extra else ["bert", "ja_bert", "en_bert"]
+    x_tst = torch.randint(0, 100, (1, seq_len), dtype=torch.long)
+    x_tst_lengths = torch.tensor([seq_len], dtype=torch.long)
+    sid = torch.tensor([0], dtype=torch.long)
+    tones = torch.zeros(1, seq_len, dtype=torch.long)
+    lang_ids = torch.ones(1, seq_len, dtype=torch.long)
+    berts = [torch.randn(1, 1024, seq_len) for _ in bert_names]
+    style_vec = torch.randn(1, 256)
+
+    input_names = ["x_tst", "x_tst_lengths", "sid", "tones", "language", *bert_names, "style_vec"]
+    encoder_dynamic_axes = None
+    if not no_dynamic:
+        encoder_dynamic_axes = {
+            "x_tst": {0: "batch_size", 1: "x_tst_max_length"},
+            "x_tst_lengths": {0: "batch_size"},
+            "sid": {0: "batch_size"},
+            "tones": {0: "batch_size", 1: "x_tst_max_length"},
+            "language": {0: "batch_size", 1: "x_tst_max_length"},
+            **{name: {0: "batch_size", 2: "x_tst_max_length"} for name in bert_names},
+            "style_vec": {0: "batch_size"},
+            **{name: {0: "batch_size", 2: "x_tst_max_length"} for name in ENCODER_OUTPUT_NAMES},
+        }
+
+    original_enc_p = net_g.enc_p
+    net_g.enc_p = _CapturingEncoder(original_enc_p)
+    try:
+        encoder = EncoderWrapper(net_g)
+        encoder.eval()
+        print(f"Exporting ONNX (text encoder, dynamic={not no_dynamic})...")
+        export_start = time.time()
+        torch.onnx.export(
+            encoder,
+            (x_tst, x_tst_lengths, sid, tones, lang_ids, *berts, style_vec),
+            temp_path,
+            opset_version=opset_version,
+            dynamo=False,
+            input_names=input_names,
+            output_names=list(ENCODER_OUTPUT_NAMES),
+            dynamic_axes=encoder_dynamic_axes,
+        )
+        print(f"ONNX exported ({time.time() - export_start:.1f}s)")
+    finally:
+        net_g.enc_p = original_enc_p
+
+
+def _export_retake(
+    net_g: torch.nn.Module,
+    hps: HyperParameters,
+    temp_path: str,
+    no_dynamic: bool = False,
+    opset_version: int = 15,
+    seq_len: int = 128,
+):
+    """RetakeWrapper を torch.onnx.export する (後処理なし)"""
+    hidden = torch.randn(1, hps.model.hidden_channels, seq_len)
+    m_p = torch.randn(1, hps.model.inter_channels, seq_len)
+    logs_p = torch.randn(1, hps.model.inter_channels, seq_len) * 0.1
+    x_mask = torch.ones(1, 1, seq_len)
+    sid = torch.tensor([0], dtype=torch.long)
+    retake_dynamic_axes = None
+    if not no_dynamic:
+        retake_dynamic_axes = {
+            **{name: {0: "batch_size", 2: "x_tst_max_length"} for name in ENCODER_OUTPUT_NAMES},
+            "sid": {0: "batch_size"},
+            "output": {0: "batch_size", 2: "audio_len"},
+        }
+
+    original_enc_p = net_g.enc_p
+    cached = _CachedEncoder()
+    net_g.enc_p = cached
+    try:
+        retake = RetakeWrapper(net_g, hps, cached)
+        retake.eval()
+        print(f"Exporting ONNX (retake: duration + flow + decoder, dynamic={not no_dynamic})...")
+        export_start = time.time()
+        torch.onnx.export(
+            retake,
+            (
+                hidden, m_p, logs_p, x_mask, sid,
+                torch.tensor(1.0), torch.tensor(0.0), torch.tensor(0.667), torch.tensor(0.8),
+            ),
+            temp_path,
+            opset_version=opset_version,
+            dynamo=False,
+            input_names=[
+                *ENCODER_OUTPUT_NAMES, "sid",
+                "length_scale", "sdp_ratio", "noise_scale", "noise_scale_w",
+            ],
+            output_names=["output"],
+            dynamic_axes=retake_dynamic_axes,
+        )
+        print(f"ONNX exported ({time.time() - export_start:.1f}s)")
+    finally:
+        net_g.enc_p = original_enc_p
+
+
+def export_retake_onnx(
+    net_g: torch.nn.Module,
+    hps: HyperParameters,
+    output_path: Path,
+    no_fp16: bool = False,
+    no_dynamic: bool = False,
+    no_simplify: bool = False,
+    opset_version: int = 15,
+    seq_len: int = 128,
+    external_data: bool = False,
+    cache: ConversionCache | None = None,
+    base_key: str | None = None,
+    mixed_precision_error: float | None = None,
+    calibration_dir: Path | None = None,
+) -> tuple[Path, Path]:
+    """リテイク用に決定的な部分と確率的な部分の 2 つのグラフへ分割してエクスポート
+
+    - <stem>_encoder.onnx: emb_g + テキストエンコーダ
+      (入力は monolithic から制御パラメータを除いたもの、出力 hidden / m_p / logs_p / x_mask)
+    - <stem>_retake.onnx: duration predictor + flow + デコーダ
+      (入力はエンコーダ出力・sid・制御パラメータ、出力 output [batch, 1, audio_len])
+
+    エンコーダ出力は (テキスト, スタイル, 話者) ごとにキャッシュでき (retake_cache.py)、
+    noise_scale / noise_scale_w / sdp_ratio / length_scale だけを変えるリテイクでは
+    BERT とエンコーダを再実行しない。
+    """
+    if not hasattr(net_g, "emb_g"):
+        raise ValueError("Retake export requires a multi-speaker model (emb_g)")
+
+    encoder_path = output_path.with_name(f"{output_path.stem}_encoder.onnx")
+    retake_path = output_path.with_name(f"{output_path.stem}_retake.onnx")
+
+    for graph, path, export_graph in (
+        ("encoder", encoder_path, _export_encoder),
+        ("retake", retake_path, _export_retake),
+    ):
+        export_key = None
+        if cache is not None:
+            export_key = chain_key(base_key, "export", {
+                "graph": graph, "opset": opset_version,
+                "seq_len": seq_len, "dynamic": not no_dynamic,
+            })
+
+        def export_fn(temp_path: str, export_graph=export_graph):
+            export_graph(
+                net_g, hps, temp_path,
+                no_dynamic=no_dynamic, opset_version=opset_version, seq_len=seq_len,
+            )
+
+        run_conversion(
+            export_fn, path,
+            no_fp16=no_fp16, no_simplify=no_simplify, external_data=external_data,
+            cache=cache, export_key=export_key,
+            mixed_precision_error=mixed_precision_error,
+            calibration_dir=calibration_dir,
+        )
+
+    return encoder_path, retake_path
+
+
+class CombinedWrapper(torch.nn.Module):
+    """DeBERTa (word2ph 展開込み) と SynthesizerTrn.infer を 1 つにまとめたラッパー
+
+    BERT 出力 [1, 1024, phone_len] をグラフ内で SBV2 に渡すため、
+    ホスト側で BERT テンソルをセッション間で受け渡す必要がない。
+    非 JP-Extra モデルでは DeBERTa 出力を ja_bert とし、bert / en_bert は 0 とする。
+    """
+
+    def __init__(self, net_g: torch.nn.Module, hps: HyperParameters, bert_model: torch.nn.Module):
+        super().__init__()
+        self.net_g = net_g
+        self.bert = DeBERTaWrapper(bert_model, fuse_alignment=True)
+        self.is_jp_extra = hps.version.endswith("JP-Extra")
+
+    def forward(
+        self, input_ids, token_type_ids, attention_mask, phone_to_token,
+        x, x_lengths, sid, tone, language, style_vec,
+        length_scale, sdp_ratio, noise_scale, noise_scale_w,
+    ):
+        ja_bert = self.bert(input_ids, token_type_ids, attention_mask, phone_to_token)
+        if self.is_jp_extra:
+            bert_args = (ja_bert,)
+        else:
+            zeros = torch.zeros_like(ja_bert)
+            bert_args = (zeros, ja_bert, zeros)
+        o, _, _, _ = self.net_g.infer(
+            x, x_lengths, sid, tone, language, *bert_args, style_vec,
+            length_scale=length_scale, sdp_ratio=sdp_ratio,
+            noise_scale=noise_scale, noise_scale_w=noise_scale_w,
+        )
+        return o
+
+
+def _export_combined(
+    net_g: torch.nn.Module,
+    hps: HyperParameters,
+    bert_model: torch.nn.Module,
+    temp_path: str,
+    no_dynamic: bool = False,
+    opset_version: int = 15,
+    seq_len: int = 128,
+):
+    """CombinedWrapper を torch.onnx.export する (後処理なし、batch=1 固定)"""
+    combined = CombinedWrapper(net_g, hps, bert_model)
+    combined.eval()
+    # ダミー入力: 1 トークン = 2 音素
+    token_len = seq_len // 2
+    # 隠れ層 -3 より後の DeBERTa エンコーダ層は使わないので削除する
+    truncate_with_check(combined.bert, token_len)
+    input_ids = torch.ones(1, token_len, dtype=torch.long)
+    token_type_ids = torch.zeros(1, token_len, dtype=torch.long)
+    attention_mask = torch.ones(1, token_len, dtype=torch.long)
+    phone_to_token = torch.arange(token_len, dtype=torch.long).repeat_interleave(2)
+    x_tst = torch.randint(0, 100, (1, seq_len), dtype=torch.long)
+    x_tst_lengths = torch.tensor([seq_len], dtype=torch.long)
+    sid = torch.tensor([0], dtype=torch.long)
+    tones = torch.zeros(1, seq_len, dtype=torch.long)
+    lang_ids = torch.ones(1, seq_len, dtype=torch.long)
+    style_vec = torch.randn(1, 256)
+
+    combined_dynamic_axes = (
+        None
+        if no_dynamic
+        else {
+            "input_ids": {1: "token_len"},
+            "token_type_ids": {1: "token_len"},
+            "attention_mask": {1: "token_len"},
+            "phone_to_token": {0: "x_tst_max_length"},
+            "x_tst": {1: "x_tst_max_length"},
+            "tones": {1: "x_tst_max_length"},
+            "language": {1: "x_tst_max_length"},
+            "output": {2: "audio_len"},
+        }
+    )
+    print(f"Exporting ONNX (DeBERTa + SynthesizerTrn, dynamic={not no_dynamic})...")
+    export_start = time.time()
+    torch.onnx.export(
+        combined,
+        (
+            input_ids, token_type_ids, attention_mask, phone_to_token,
+            x_tst, x_tst_lengths, sid, tones, lang_ids, style_vec,
+            torch.tensor(1.0), torch.tensor(0.0), torch.tensor(0.667), torch.tensor(0.8),
+        ),
+        temp_path,
+        opset_version=opset_version,
+        dynamo=False,
+        input_names=[
+            "input_ids", "token_type_ids", "attention_mask", "phone_to_token",
+            "x_tst", "x_tst_lengths", "sid", "tones", "language", "style_vec",
+            "length_scale", "sdp_ratio", "noise_scale", "noise_scale_w",
+        ],
+        output_names=["output"],
+        dynamic_axes=combined_dynamic_axes,
+    )
+    print(f"ONNX exported ({time.time() - export_start:.1f}s)")
+
+
+def export_combined_onnx(
+    net_g: torch.nn.Module,
+    hps: HyperParameters,
+    output_path: Path,
+    bert_model_name: str,
+    no_fp16: bool = False,
+    no_dynamic: bool = False,
+    no_simplify: bool = False,
+    opset_version: int = 15,
+    seq_len: int = 128,
+    external_data: bool = False,
+    cache: ConversionCache | None = None,
+    base_key: str | None = None,
+    mixed_precision_error: float | None = None,
+    calibration_dir: Path | None = None,
+):
+    """DeBERTa と SynthesizerTrn を 1 つの Sentis 互換 ONNX にエクスポート
+
+    入力はトークン (input_ids / token_type_ids / attention_mask)・phone_to_token・
+    音素系列・style_vec・scalar 制御パラメータ、出力は音声 [1, 1, audio_len]。
+    後処理 (onnxsim / int32 / scalar の [1] 化 / FP16) は monolithic と同じ。
+    """
+    export_key = None
+    if cache is not None:
+        export_key = chain_key(base_key, "export", {
+            "graph": "combined", "bert": bert_model_name, "opset": opset_version,
+            "seq_len": seq_len, "dynamic": not no_dynamic,
+        })
+
+    def export_fn(temp_path: str):
+        print(f"Loading BERT model: {bert_model_name}")
+        bert_model = AutoModel.from_pretrained(bert_model_name)
+        bert_model.eval()
+        _export_combined(
+            net_g, hps, bert_model, temp_path,
+            no_dynamic=no_dynamic, opset_version=opset_version, seq_len=seq_len,
+        )
+
+    run_conversion(
+        export_fn, output_path,
+        no_fp16=no_fp16, no_simplify=no_simplify, external_data=external_data,
+        cache=cache, export_key=export_key,
+        mixed_precision_error=mixed_precision_error,
+        calibration_dir=calibration_dir,
+    )
 
 
 def main():
@@ -370,6 +1133,67 @@ def main():
         action="store_true",
         help="Skip onnxsim simplification",
     )
+    parser.add_argument(
+        "--split",
+        action="store_true",
+        help="Export encoder/flow and decoder as separate graphs (for streaming)",
+    )
+    parser.add_argument(
+        "--retake-split",
+        action="store_true",
+        help="Export the text encoder and duration/flow/decoder as separate graphs (for retakes)",
+    )
+    parser.add_argument(
+        "--buckets",
+        type=int,
+        nargs="+",
+        default=None,
+        help="Export one fixed-length graph per phoneme length plus a bucket manifest",
+    )
+    parser.add_argument(
+        "--combined-bert",
+        type=str,
+        default=None,
+        metavar="MODEL_NAME",
+        help="Merge this HuggingFace DeBERTa model into the graph (tokens + phonemes -> audio)",
+    )
+    parser.add_argument(
+        "--mixed-precision",
+        action="store_true",
+        help="Keep FP16-unstable nodes in FP32 (searched with --calibration-dir or synthetic inputs)",
+    )
+    parser.add_argument(
+        "--calibration-dir",
+        type=str,
+        default=None,
+        help="Directory of *.npz preprocessed feeds for the --mixed-precision search",
+    )
+    parser.add_argument(
+        "--mp-max-error",
+        type=float,
+        default=0.01,
+        help="Max relative output error vs FP32 for --mixed-precision (default: 0.01)",
+    )
+    parser.add_argument(
+        "--emit-ort",
+        type=str,
+        choices=OPTIMIZED_FORMATS,
+        default=None,
+        help="Also save an offline-optimized ONNX Runtime model next to each output graph",
+    )
+    parser.add_argument(
+        "--ort-opt-level",
+        type=str,
+        choices=list(OPTIMIZATION_LEVELS),
+        default="extended",
+        help="Optimization level for --emit-ort ('all' is tied to the current CPU)",
+    )
+    parser.add_argument(
+        "--external-data",
+        action="store_true",
+        help="Keep weights in an external .data file and stream the int32/FP16 stages "
+        "(skips onnxsim, which holds the whole model in memory)",
+    )
     parser.add_argument(
         "--seq-len",
         type=int,
@@ -382,7 +1206,36 @@ def main():
         default=".cache/sbv2",
         help="Cache directory for downloaded files",
     )
+    parser.add_argument(
+        "--stage-cache-dir",
+        type=str,
+        default=".cache/sbv2_stages",
+        help="Cache directory for intermediate conversion stages",
+    )
+    parser.add_argument(
+        "--no-stage-cache",
+        action="store_true",
+        help="Always re-run every conversion stage",
+    )
+    parser.add_argument(
+        "--stage-cache-max-gb",
+        type=float,
+        default=20.0,
+        help="Prune least recently used stage cache entries above this size (0 = no limit)",
+    )
     args = parser.parse_args()
+    if args.buckets and args.split:
+        parser.error("--buckets cannot be combined with --split (decoder length is data-dependent)")
+    if args.combined_bert and (args.split or args.buckets):
+        parser.error("--combined-bert cannot be combined with --split or --buckets")
+    if args.retake_split and (args.split or args.buckets or args.combined_bert):
+        parser.error("--retake-split cannot be combined with --split, --buckets or --combined-bert")
+    if args.mixed_precision and (args.no_fp16 or args.external_data):
+        parser.error("--mixed-precision cannot be combined with --no-fp16 or --external-data")
+    if args.calibration_dir and not args.mixed_precision:
+        parser.error("--calibration-dir requires --mixed-precision")
+    mixed_precision_error = args.mp_max_error if args.mixed_precision else None
+    calibration_dir = Path(args.calibration_dir) if args.calibration_dir else None
 
     # 1. モデルダウンロード
     print(f"Downloading model from: {args.repo}")
@@ -400,13 +1253,76 @@ def main():
     # 3. モデル構築
     net_g, hps = build_model(config_path, model_path)
 
-    # 4. ONNX エクスポート + 後処理
-    export_onnx(
-        net_g, hps, Path(args.output),
-        no_fp16=args.no_fp16, no_dynamic=args.no_dynamic,
-        no_simplify=args.no_simplify,
-        seq_len=args.seq_len,
-    )
+    # 4. ONNX エクスポート + 後処理 (変更のないステージはキャッシュから再開)
+    cache = None
+    base_key = None
+    if not args.no_stage_cache:
+        cache = ConversionCache(Path(args.stage_cache_dir))
+        base_key = conversion_base_key(model_path, config_path)
+        print(f"Stage cache: {cache.root} (key {base_key[:12]})")
+
+    outputs: list[Path] = []
+    if args.buckets:
+        # バケット長ごとに静的シェイプのグラフを出力
+        output_path = Path(args.output)
+        for length in sorted(args.buckets):
+            print(f"\n=== Bucket: seq_len={length} ===")
+            outputs.append(bucket_path(output_path, length))
+            export_onnx(
+                net_g, hps, outputs[-1],
+                no_fp16=args.no_fp16, no_dynamic=True,
+                no_simplify=args.no_simplify,
+                seq_len=length,
+                external_data=args.external_data,
+                cache=cache, base_key=base_key,
+                mixed_precision_error=mixed_precision_error,
+                calibration_dir=calibration_dir,
+            )
+        write_bucket_manifest(output_path, "tts", args.buckets)
+    elif args.combined_bert:
+        try:
+            export_combined_onnx(
+                net_g, hps, Path(args.output), args.combined_bert,
+                no_fp16=args.no_fp16, no_dynamic=args.no_dynamic,
+                no_simplify=args.no_simplify,
+                seq_len=args.seq_len,
+                external_data=args.external_data,
+                cache=cache, base_key=base_key,
+                mixed_precision_error=mixed_precision_error,
+                calibration_dir=calibration_dir,
+            )
+        except TruncationMismatchError as e:
+            raise SystemExit(str(e))
+        outputs.append(Path(args.output))
+    else:
+        if args.retake_split:
+            export = export_retake_onnx
+        elif args.split:
+            export = export_split_onnx
+        else:
+            export = export_onnx
+        # 分割エクスポートは出力した各グラフのパスを返す
+        outputs.extend(export(
+            net_g, hps, Path(args.output),
+            no_fp16=args.no_fp16, no_dynamic=args.no_dynamic,
+            no_simplify=args.no_simplify,
+            seq_len=args.seq_len,
+            external_data=args.external_data,
+            cache=cache, base_key=base_key,
+            mixed_precision_error=mixed_precision_error,
+            calibration_dir=calibration_dir,
+        ) or [Path(args.output)])
+
+    # 5. ORT 用のオフライン最適化済みモデル
+    if args.emit_ort:
+        for path in outputs:
+            emit_ort_model(path, args.emit_ort, args.ort_opt_level)
+
+    # 6. ステージキャッシュを上限まで削除 (最終使用が古いエントリから)
+    if cache is not None and args.stage_cache_max_gb > 0:
+        removed = cache.prune(int(args.stage_cache_max_gb * 1024**3))
+        if removed:
+            print(f"Pruned {removed} stage cache entries (limit {args.stage_cache_max_gb} GB)")
 
 
 if __name__ == "__main__":
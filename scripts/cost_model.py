@@ -0,0 +1,427 @@
+"""
+変換済み ONNX の静的コストモデル (FLOPs・重みサイズ・ピーク活性メモリ)
+
+推論を実行せずに、系列長・バッチサイズに対するコストを見積もる。
+コンテナのメモリ上限やサービスの最大長・最大バッチを決めるための目安。
+
+処理フロー:
+1. ONNX Runtime の SymbolicShapeInference で動的軸
+   (token_len / phone_len / x_tst_max_length / batch_size / frames) を記号のまま形状推論
+   - 入力から決まらない次元 (SBV2 の duration から決まるフレーム数など) は frames とみなし、
+     frames = ceil(--frames-per-token × 系列長) で見積もる
+2. ノードごとの FLOPs を記号式で求める (MatMul / Gemm / Conv / ConvTranspose は積和 2 FLOPs、
+   要素ごとの演算は出力要素数、形状操作は 0)
+3. 指定した (系列長, バッチ) ごとに、ノード順に活性テンソルの生存区間をたどってピークメモリを計算
+   (initializer / Constant は重みとして別集計。ORT のメモリ再利用・アリーナは考慮しない)
+4. 系列長を 2 倍にしたときに出力サイズが 4 倍になるノード (attention など) を二乗増加として表示
+
+系列長 L は token_len / phone_len / x_tst_max_length に共通に与える
+(結合モデルでは 1 トークン = 1 音素とみなす。validate_onnx の make_tts_feeds と同じ)。
+音声長は frames × prod(upsample_rates) / sampling_rate で予測する (--config で config.json を指定)。
+
+使用方法:
+    uv run python cost_model.py --model sbv2_model.onnx --lengths 64 128 256 512 --batch-sizes 1 4 \
+        --config config.json
+    uv run python cost_model.py --model deberta_fp16.onnx --lengths 128 512 --output cost.json
+"""
+
+import argparse
+import json
+import math
+import re
+from pathlib import Path
+
+import onnx
+import sympy
+from onnxruntime.tools.symbolic_shape_infer import (
+    SymbolicShapeInference,
+    get_attribute,
+    get_opset,
+    get_shape_from_sympy_shape,
+)
+
+# 系列長として扱う動的軸
+LENGTH_DIMS = ("token_len", "phone_len", "x_tst_max_length")
+BATCH_DIM = "batch_size"
+FRAMES_DIM = "frames"
+
+# SBV2 の既定値 (config.json の model.upsample_rates / data.sampling_rate)
+DEFAULT_UPSAMPLE_RATES = [8, 8, 2, 2, 2]
+DEFAULT_SAMPLING_RATE = 44100
+
+# 1 トークン (音素、intersperse の blank を含む) あたりの潜在フレーム数の目安
+DEFAULT_FRAMES_PER_TOKEN = 4.0
+
+# 出力要素あたりの FLOPs (それ以外の op は形状操作・データ移動として 0)
+ELEMENTWISE_FLOPS = {
+    "Add": 1, "Sub": 1, "Mul": 1, "Div": 1, "Pow": 1, "Sqrt": 1, "Exp": 1, "Log": 1,
+    "Neg": 1, "Abs": 1, "Relu": 1, "LeakyRelu": 1, "Sigmoid": 4, "Tanh": 4, "Erf": 4,
+    "Sin": 1, "Cos": 1, "Softplus": 4, "Where": 1, "Max": 1, "Min": 1, "Clip": 1,
+    "ReduceMean": 1, "ReduceSum": 1, "ReduceMax": 1, "CumSum": 1,
+    "Softmax": 5, "LayerNormalization": 8, "SkipLayerNormalization": 9,
+    "Gelu": 8, "BiasGelu": 9, "InstanceNormalization": 8,
+}
+
+L, B, F = sympy.symbols("L B frames", positive=True, integer=True)
+_IDENT = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+class _ShapeInference(SymbolicShapeInference):
+    """ConvTranspose の記号形状推論を追加した SymbolicShapeInference。
+
+    標準では ConvTranspose の出力が記号次元のとき推論されず、HiFi-GAN デコーダ以降の
+    形状がすべて不明になる。
+    """
+
+    def __init__(self):
+        super().__init__(2**31 - 1, auto_merge=True, guess_output_rank=True, verbose=0)
+        self.dispatcher_["ConvTranspose"] = self._infer_ConvTranspose
+
+    def _infer_ConvTranspose(self, node):  # noqa: N802
+        x_shape = self._get_sympy_shape(node, 0)
+        w_shape = self._get_sympy_shape(node, 1)
+        rank = len(w_shape) - 2
+        strides = get_attribute(node, "strides", [1] * rank)
+        dilations = get_attribute(node, "dilations", [1] * rank)
+        pads = get_attribute(node, "pads", [0] * (2 * rank))
+        output_padding = get_attribute(node, "output_padding", [0] * rank)
+        group = get_attribute(node, "group", 1)
+        spatial = [
+            s * (d_in - 1) + op + (k - 1) * d + 1 - pads[i] - pads[i + rank]
+            for i, (d_in, s, k, d, op) in enumerate(
+                zip(x_shape[2:], strides, w_shape[2:], dilations, output_padding, strict=True)
+            )
+        ]
+        sympy_shape = [x_shape[0], w_shape[1] * group, *spatial]
+        self._update_computed_dims(sympy_shape)
+        vi = self.known_vi_[node.output[0]]
+        vi.CopyFrom(
+            onnx.helper.make_tensor_value_info(
+                node.output[0],
+                self.known_vi_[node.input[0]].type.tensor_type.elem_type,
+                get_shape_from_sympy_shape(sympy_shape),
+            )
+        )
+
+    @classmethod
+    def infer(cls, model: onnx.ModelProto) -> onnx.ModelProto:
+        """SymbolicShapeInference.infer_shapes と同じ手順 (推論できない形状があっても続行)。"""
+        if get_opset(model) < 7:
+            raise ValueError("Symbolic shape inference requires opset 7 or later")
+        inference = cls()
+        inference._preprocess(model)
+        while inference.run_:
+            inference._infer_impl()
+        inference._update_output_from_vi()
+        return inference.out_mp_
+
+
+def parse_dim(dim: onnx.TensorShapeProto.Dimension) -> sympy.Expr | None:
+    """次元を記号式にする。系列長 → L、batch_size → B、それ以外の記号 → frames。"""
+    if dim.HasField("dim_value"):
+        return sympy.Integer(dim.dim_value)
+    if not dim.HasField("dim_param"):
+        return None
+    text = dim.dim_param
+    symbols = {}
+    for name in set(_IDENT.findall(text)):
+        if name in LENGTH_DIMS:
+            symbols[name] = L
+        elif name == BATCH_DIM:
+            symbols[name] = B
+        else:
+            symbols[name] = F
+    try:
+        return sympy.parse_expr(text, local_dict=symbols)
+    except Exception:
+        return F
+
+
+def tensor_shapes(model: onnx.ModelProto) -> dict[str, list[sympy.Expr] | None]:
+    """形状推論済みモデルのテンソル名 → 記号形状 (不明な次元がある場合は None)。"""
+    shapes = {}
+    graph = model.graph
+    for info in [*graph.input, *graph.value_info, *graph.output]:
+        tensor_type = info.type.tensor_type
+        if not tensor_type.HasField("shape"):
+            shapes[info.name] = None
+            continue
+        dims = [parse_dim(d) for d in tensor_type.shape.dim]
+        # 推論できずランクだけ推測された出力 (全次元が個別の記号) は不明として扱う
+        opaque = [
+            d.dim_param for d in tensor_type.shape.dim
+            if d.HasField("dim_param") and _IDENT.fullmatch(d.dim_param)
+            and d.dim_param not in (*LENGTH_DIMS, BATCH_DIM, FRAMES_DIM)
+        ]
+        unknown = any(d is None for d in dims) or len(set(opaque)) > 1
+        shapes[info.name] = None if unknown else dims
+    for init in graph.initializer:
+        shapes[init.name] = [sympy.Integer(d) for d in init.dims]
+    return shapes
+
+
+def tensor_itemsize(model: onnx.ModelProto) -> dict[str, int]:
+    """テンソル名 → 要素のバイト数。"""
+    sizes = {}
+    graph = model.graph
+    for info in [*graph.input, *graph.value_info, *graph.output]:
+        elem_type = info.type.tensor_type.elem_type
+        if elem_type:
+            sizes[info.name] = onnx.helper.tensor_dtype_to_np_dtype(elem_type).itemsize
+    return sizes
+
+
+def _numel(shape: list[sympy.Expr]) -> sympy.Expr:
+    return sympy.Mul(*shape) if shape else sympy.Integer(1)
+
+
+def node_flops(node: onnx.NodeProto, shapes: dict) -> sympy.Expr:
+    """ノードの FLOPs (記号式)。形状が不明な場合は 0。"""
+    outputs = [shapes.get(name) for name in node.output if name]
+    if not outputs or outputs[0] is None:
+        return sympy.Integer(0)
+    out = outputs[0]
+    op = node.op_type
+    if op in ("MatMul", "Gemm", "MatMulInteger", "QLinearMatMul"):
+        a = shapes.get(node.input[0])
+        if a is None or not a:
+            return sympy.Integer(0)
+        transposed = op == "Gemm" and any(
+            attr.name == "transA" and attr.i for attr in node.attribute
+        )
+        k = a[-2] if transposed else a[-1]
+        return 2 * _numel(out) * k
+    if op in ("Conv", "ConvInteger"):
+        weight = shapes.get(node.input[1])
+        if weight is None:
+            return sympy.Integer(0)
+        return 2 * _numel(out) * _numel(weight[1:])
+    if op == "ConvTranspose":
+        x, weight = shapes.get(node.input[0]), shapes.get(node.input[1])
+        if x is None or weight is None:
+            return sympy.Integer(0)
+        return 2 * _numel(x) * _numel(weight[1:])
+    return ELEMENTWISE_FLOPS.get(op, 0) * _numel(out)
+
+
+def weight_bytes(model: onnx.ModelProto) -> int:
+    """initializer と Constant ノードの合計バイト数 (外部データは読み込まずに dims から計算)。"""
+    total = 0
+    tensors = list(model.graph.initializer)
+    for node in model.graph.node:
+        if node.op_type == "Constant":
+            tensors += [attr.t for attr in node.attribute if attr.type == onnx.AttributeProto.TENSOR]
+    for tensor in tensors:
+        itemsize = onnx.helper.tensor_dtype_to_np_dtype(tensor.data_type).itemsize
+        total += math.prod(tensor.dims) * itemsize
+    return total
+
+
+class CostModel:
+    """形状推論済みグラフから FLOPs とメモリを見積もる。"""
+
+    def __init__(self, model: onnx.ModelProto, frames_per_token: float = DEFAULT_FRAMES_PER_TOKEN):
+        inferred = _ShapeInference.infer(model)
+        self.model = inferred
+        self.frames_per_token = frames_per_token
+        self.weight_bytes = weight_bytes(model)
+        shapes = tensor_shapes(inferred)
+        itemsize = tensor_itemsize(inferred)
+        graph = inferred.graph
+
+        weights = {init.name for init in graph.initializer}
+        weights |= {out for node in graph.node if node.op_type == "Constant" for out in node.output}
+
+        # 活性テンソル: グラフ入力とノード出力 (重みを除く)
+        self.tensor_bytes: dict[str, sympy.Expr] = {}
+        self.unknown: list[str] = []
+        for name in [inp.name for inp in graph.input] + [
+            out for node in graph.node for out in node.output
+        ]:
+            if not name or name in weights or name in self.tensor_bytes:
+                continue
+            shape = shapes.get(name)
+            if shape is None or name not in itemsize:
+                self.unknown.append(name)
+                continue
+            self.tensor_bytes[name] = _numel(shape) * itemsize[name]
+
+        self.node_flops = [(node, node_flops(node, shapes)) for node in graph.node]
+        self.total_flops = sympy.expand(sum(flops for _, flops in self.node_flops))
+        self.graph_outputs = [(out.name, shapes.get(out.name)) for out in graph.output]
+
+        # テンソルの最後の使用ノード (グラフ出力は最後まで保持)
+        self.last_use: dict[str, int] = {}
+        for index, node in enumerate(graph.node):
+            for name in node.input:
+                self.last_use[name] = index
+        for out in graph.output:
+            self.last_use[out.name] = len(graph.node)
+
+        self._funcs: dict[sympy.Expr, callable] = {}
+
+    def evaluate(self, expr: sympy.Expr, length: int, batch: int) -> float:
+        """記号式を (系列長, バッチ) で評価する。"""
+        if expr not in self._funcs:
+            self._funcs[expr] = sympy.lambdify((L, B, F), expr, modules="math")
+        frames = math.ceil(self.frames_per_token * length)
+        return float(self._funcs[expr](length, batch, frames))
+
+    def peak_activation_bytes(self, length: int, batch: int) -> tuple[float, str]:
+        """ノード順に実行したときの活性メモリのピークと、そのときのノード名。"""
+        graph = self.model.graph
+        live = {
+            inp.name: self.evaluate(self.tensor_bytes[inp.name], length, batch)
+            for inp in graph.input
+            if inp.name in self.tensor_bytes and inp.name in self.last_use
+        }
+        current = sum(live.values())
+        peak, peak_node = current, "<inputs>"
+        for index, node in enumerate(graph.node):
+            for name in node.output:
+                if name in self.tensor_bytes and name not in live:
+                    live[name] = self.evaluate(self.tensor_bytes[name], length, batch)
+                    current += live[name]
+            if current > peak:
+                peak, peak_node = current, node.name or node.op_type
+            for name in set(node.input) | set(node.output):
+                if name in live and self.last_use.get(name, index) <= index:
+                    current -= live.pop(name)
+        return peak, peak_node
+
+    def flops(self, length: int, batch: int) -> float:
+        return self.evaluate(self.total_flops, length, batch)
+
+    def output_samples(self, length: int, batch: int) -> dict[str, float]:
+        """グラフ出力の要素数 (1 バッチあたり)。"""
+        return {
+            name: self.evaluate(_numel(shape), length, batch) / batch
+            for name, shape in self.graph_outputs
+            if shape is not None
+        }
+
+    def quadratic_nodes(self, probe: int = 512) -> list[dict]:
+        """系列長を 2 倍にすると出力が 4 倍程度に増えるノード。"""
+        rows = []
+        for node in self.model.graph.node:
+            for name in node.output:
+                if name not in self.tensor_bytes:
+                    continue
+                expr = self.tensor_bytes[name]
+                small = self.evaluate(expr, probe, 1)
+                large = self.evaluate(expr, probe * 2, 1)
+                if small > 0 and large / small > 3.0:
+                    rows.append({
+                        "node": node.name or name,
+                        "op_type": node.op_type,
+                        "bytes": str(expr),
+                        "growth": round(math.log2(large / small), 2),
+                    })
+        return rows
+
+
+def predict_audio_seconds(
+    length: int, frames_per_token: float, upsample_rates: list[int], sampling_rate: int
+) -> float:
+    """系列長から予測する音声長 (秒)。"""
+    frames = math.ceil(frames_per_token * length)
+    return frames * math.prod(upsample_rates) / sampling_rate
+
+
+def load_audio_config(config_path: str | None) -> tuple[list[int], int]:
+    if config_path is None:
+        return DEFAULT_UPSAMPLE_RATES, DEFAULT_SAMPLING_RATE
+    config = json.loads(Path(config_path).read_text())
+    return config["model"]["upsample_rates"], config["data"]["sampling_rate"]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Static FLOPs / memory cost model for exported ONNX graphs"
+    )
+    parser.add_argument("--model", type=str, required=True, help="ONNX model path")
+    parser.add_argument(
+        "--lengths", type=int, nargs="+", default=[32, 64, 128, 256, 512],
+        help="Sequence lengths (token_len / x_tst_max_length)",
+    )
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1], help="Batch sizes")
+    parser.add_argument(
+        "--frames-per-token", type=float, default=DEFAULT_FRAMES_PER_TOKEN,
+        help="Latent frames per input token for data-dependent dims (SBV2 duration)",
+    )
+    parser.add_argument(
+        "--config", type=str, default=None,
+        help="SBV2 config.json for upsample_rates / sampling_rate (default: SBV2 44.1kHz)",
+    )
+    parser.add_argument("--output", type=str, default=None, help="Write the report as JSON")
+    args = parser.parse_args()
+
+    print(f"Loading model (without external data): {args.model}")
+    model = onnx.load(args.model, load_external_data=False)
+    print("Running symbolic shape inference...")
+    cost = CostModel(model, args.frames_per_token)
+    upsample_rates, sampling_rate = load_audio_config(args.config)
+
+    print(f"\nWeights: {cost.weight_bytes / 1024 / 1024:.1f}MB")
+    print(f"FLOPs(L, B, frames) = {sympy.N(cost.total_flops, 4)}")
+    if cost.unknown:
+        print(f"Warning: {len(cost.unknown)} tensor(s) without inferred shape (not counted)")
+
+    rows = []
+    # 音声長の予測は SBV2 (x_tst 入力を持つモデル) のみ
+    is_tts = any(inp.name == "x_tst" for inp in model.graph.input)
+    print(
+        f"\n{'length':>7} {'batch':>6} {'GFLOPs':>10} {'peak act MB':>12} {'peak at':<40}"
+        + (f" {'audio s':>8}" if is_tts else "")
+    )
+    for batch in args.batch_sizes:
+        for length in args.lengths:
+            peak, peak_node = cost.peak_activation_bytes(length, batch)
+            row = {
+                "length": length,
+                "batch_size": batch,
+                "gflops": round(cost.flops(length, batch) / 1e9, 3),
+                "peak_activation_mb": round(peak / 1024 / 1024, 2),
+                "peak_node": peak_node,
+                "output_elements": cost.output_samples(length, batch),
+            }
+            if is_tts:
+                row["predicted_audio_s"] = round(
+                    predict_audio_seconds(
+                        length, args.frames_per_token, upsample_rates, sampling_rate
+                    ), 3
+                )
+            rows.append(row)
+            node = peak_node if len(peak_node) <= 40 else "..." + peak_node[-37:]
+            print(
+                f"{length:>7} {batch:>6} {row['gflops']:>10.3f} "
+                f"{row['peak_activation_mb']:>12.2f} {node:<40}"
+                + (f" {row['predicted_audio_s']:>8.2f}" if is_tts else "")
+            )
+
+    quadratic = cost.quadratic_nodes()
+    if quadratic:
+        print(f"\nQuadratic-growth tensors ({len(quadratic)}):")
+        for item in quadratic[:20]:
+            print(f"  {item['node']} [{item['op_type']}] bytes={item['bytes']}")
+        if len(quadratic) > 20:
+            print(f"  ... and {len(quadratic) - 20} more")
+
+    if args.output:
+        report = {
+            "model": args.model,
+            "weight_bytes": cost.weight_bytes,
+            "flops_expr": str(cost.total_flops),
+            "frames_per_token": args.frames_per_token,
+            "upsample_rates": upsample_rates,
+            "sampling_rate": sampling_rate,
+            "rows": rows,
+            "quadratic": quadratic,
+            "unknown_shapes": len(cost.unknown),
+        }
+        Path(args.output).write_text(json.dumps(report, indent=2))
+        print(f"\nReport written to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
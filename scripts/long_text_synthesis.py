@@ -0,0 +1,383 @@
+"""
+文分割 + ステージパイプラインによる長文合成
+
+C# の TTSPipeline.Synthesize はテキスト全体に対して G2P → トークナイズ → BERT → アライメント →
+SBV2 を順に実行するため、ナレーション長の入力では最初の音が出るまでが長く、
+BERT / SBV2 の中間テンソルもテキスト全体の長さになる。
+
+処理フロー:
+1. 前処理済みの長文リクエスト (add_blank 適用後の値 + text) を文末の句読点で分割
+   (split_request: blank を外して文ごとに先頭/末尾 PAD を付け直し、再び blank を挿入する。
+    G2P の出力 [PAD] + 文字ごとの音素 + [PAD] と同じ形になる)
+2. BERT ワーカーが文 n+1 を処理している間に SBV2 ワーカーが文 n を合成する
+   (各 1 スレッドの ThreadPoolExecutor、先読みは --lookahead 文まで)
+3. 文ごとに末尾無音をトリムし、ポーズ (--pause-ms) とクロスフェード (--crossfade-ms) で連結
+4. 連結済みの PCM を文ごとに yield する (クロスフェード分だけ次の文まで保留)
+
+使用方法:
+    synth = LongTextSynthesizer("deberta_fp16.onnx", "sbv2_model.onnx")
+    joiner = SentenceJoiner(pause_ms=200, crossfade_ms=10)
+    for chunk in synth.synthesize_iter(request, joiner):
+        play(chunk)
+
+    uv run python long_text_synthesis.py --bert deberta_fp16.onnx --tts sbv2_model.onnx \
+        --requests narration.jsonl --compare --output narration.wav
+
+前提:
+    - requests.jsonl の形式は synthesis_server.py と同じ。text が必須
+      (token_ids は [CLS] + text の UTF-16 コード単位ごとのトークン + [SEP])
+"""
+
+import argparse
+import re
+import time
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import replace
+from pathlib import Path
+
+import numpy as np
+
+from audio_postprocess import trimmed_lengths, write_audio
+from bert_cache import BertFeatureStore, model_digest
+from synthesis_server import (
+    SAMPLE_RATE,
+    STYLE_DIM,
+    BertRunner,
+    SynthesisRequest,
+    load_requests,
+    request_feeds,
+)
+from text_tensors import CLS_ID, EMBEDDING_DIM, SEP_ID, adjust_word2ph_for_blanks, intersperse
+from validate_onnx import cast_feeds, create_session
+
+# 文末記号 (連続する記号と閉じ括弧は直前の文に含める)
+_SENTENCE = re.compile(r"[^。．！!？?…\n]*(?:[。．！!？?…\n]+[」』）)】]*|$)")
+
+
+def split_sentences(text: str) -> list[tuple[int, int]]:
+    """文末の句読点で分割し、空白のみの文を除いた (開始, 終了) の文字 index を返す。"""
+    spans = []
+    for match in _SENTENCE.finditer(text):
+        if match.group().strip():
+            spans.append(match.span())
+    return spans
+
+
+def _utf16_offsets(text: str) -> np.ndarray:
+    """文字 index → UTF-16 コード単位の位置 (長さ len(text) + 1)。"""
+    widths = np.fromiter(
+        (2 if ord(c) > 0xFFFF else 1 for c in text), dtype=np.int64, count=len(text)
+    )
+    offsets = np.zeros(len(text) + 1, dtype=np.int64)
+    np.cumsum(widths, out=offsets[1:])
+    return offsets
+
+
+def split_request(request: SynthesisRequest) -> list[SynthesisRequest]:
+    """長文リクエストを文ごとのリクエストに分割する。
+
+    トークン i (text の i-1 コード単位目) の音素は word2ph から求めるため、
+    文の境界は音素列でもトークン境界に一致する。
+    """
+    if request.text is None:
+        raise ValueError("Sentence splitting requires request.text")
+    offsets = _utf16_offsets(request.text)
+    if len(request.token_ids) != offsets[-1] + 2:
+        raise ValueError(
+            f"token length ({len(request.token_ids)}) does not match "
+            f"[CLS] + text + [SEP] ({offsets[-1] + 2})"
+        )
+
+    # AdjustWord2PhForBlanks / Intersperse を戻す
+    raw_word2ph = request.word2ph.astype(np.int64)
+    raw_word2ph[0] -= 1
+    raw_word2ph //= 2
+    raw_phonemes = request.phoneme_ids[1::2]
+    raw_tones = request.tones[1::2]
+    raw_language = request.language[1::2]
+    if int(raw_word2ph.sum()) != len(raw_phonemes):
+        raise ValueError(
+            f"word2ph sum ({int(raw_word2ph.sum())}) does not match "
+            f"phone length ({len(raw_phonemes)}) after removing blanks"
+        )
+    phone_start = np.zeros(len(raw_word2ph) + 1, dtype=np.int64)
+    np.cumsum(raw_word2ph, out=phone_start[1:])
+
+    def with_pads(values: np.ndarray, pad: int) -> np.ndarray:
+        return intersperse(np.concatenate([[pad], values, [pad]]).astype(np.int32))
+
+    sentences = []
+    for start, end in split_sentences(request.text):
+        first, last = int(offsets[start]) + 1, int(offsets[end]) + 1  # [CLS] 分ずらす
+        p0, p1 = phone_start[first], phone_start[last]
+        if p1 == p0:
+            continue
+        sentences.append(replace(
+            request,
+            token_ids=np.concatenate([
+                request.token_ids[:1], request.token_ids[first:last], request.token_ids[-1:],
+            ]),
+            phoneme_ids=with_pads(raw_phonemes[p0:p1], raw_phonemes[0]),
+            tones=with_pads(raw_tones[p0:p1], raw_tones[0]),
+            language=with_pads(raw_language[p0:p1], raw_language[0]),
+            word2ph=adjust_word2ph_for_blanks(
+                np.concatenate([[1], raw_word2ph[first:last], [1]]).astype(np.int32)
+            ),
+            text=request.text[start:end],
+        ))
+    return sentences
+
+
+class SentenceJoiner:
+    """文ごとの PCM をポーズ / クロスフェードで連結し、出力できる部分から返す。
+
+    pause_ms > 0 では文末をフェードアウト、無音を挟んで次の文頭をフェードイン。
+    pause_ms = 0 では文末と次の文頭を crossfade_ms だけ重ねて加算する。
+    """
+
+    def __init__(
+        self, sample_rate: int = SAMPLE_RATE, pause_ms: float = 200.0, crossfade_ms: float = 10.0
+    ):
+        self.pause = np.zeros(int(sample_rate * pause_ms / 1000), dtype=np.float32)
+        self.fade = int(sample_rate * crossfade_ms / 1000)
+        self._tail: np.ndarray | None = None
+
+    def push(self, audio: np.ndarray) -> np.ndarray:
+        """文の PCM を追加し、確定したサンプルを返す (末尾 fade サンプルは次の文まで保留)。"""
+        fade = min(self.fade, len(audio) // 2)
+        head, body = audio[:fade], audio[fade:]
+        if self._tail is None:
+            parts = [head]
+        elif len(self.pause):
+            parts = [
+                self._tail * np.linspace(1.0, 0.0, len(self._tail), dtype=np.float32),
+                self.pause,
+                head * np.linspace(0.0, 1.0, len(head), dtype=np.float32),
+            ]
+        else:
+            parts = [_crossfade(self._tail, head)]
+        hold = len(body) - min(self.fade, len(body))
+        parts.append(body[:hold])
+        self._tail = body[hold:]
+        return np.concatenate(parts).astype(np.float32, copy=False)
+
+    def flush(self) -> np.ndarray:
+        tail = self._tail if self._tail is not None else np.zeros(0, dtype=np.float32)
+        self._tail = None
+        return tail
+
+
+def _crossfade(tail: np.ndarray, head: np.ndarray) -> np.ndarray:
+    """tail の末尾と head の先頭を重ねて線形クロスフェードする。"""
+    n = min(len(tail), len(head))
+    ramp = np.linspace(0.0, 1.0, n, dtype=np.float32)
+    overlap = tail[len(tail) - n :] * (1.0 - ramp) + head[:n] * ramp
+    return np.concatenate([tail[: len(tail) - n], overlap, head[n:]])
+
+
+class LongTextSynthesizer:
+    """BERT と SBV2 を別ワーカーで実行し、文単位でパイプライン合成する。"""
+
+    def __init__(
+        self,
+        bert_path: str,
+        tts_path: str,
+        intra_op_num_threads: int = 0,
+        bert_cache: BertFeatureStore | None = None,
+        lookahead: int = 1,
+    ):
+        self.bert = BertRunner(bert_path, intra_op_num_threads, bert_cache)
+        print(f"Loading TTS model: {tts_path}")
+        self.tts_session = create_session(tts_path, intra_op_num_threads)
+        self.tts_input_names = {inp.name for inp in self.tts_session.get_inputs()}
+        self.lookahead = lookahead
+
+    def _run_bert(self, request: SynthesisRequest) -> np.ndarray:
+        return self.bert.run(request.token_ids, request.word2ph, request.text)
+
+    def _render(self, request: SynthesisRequest, bert: np.ndarray | Future) -> np.ndarray:
+        """SBV2 推論 + 末尾無音トリム。bert が Future の場合は BERT ワーカーの完了を待つ。"""
+        if isinstance(bert, Future):
+            bert = bert.result()
+        feeds = request_feeds(request, bert, self.tts_input_names)
+        output = self.tts_session.run(None, cast_feeds(self.tts_session, feeds))[0]
+        samples = output[0, 0].astype(np.float32, copy=False)
+        return samples[: trimmed_lengths(samples)[0]]
+
+    def synthesize_sentences(self, sentences: list[SynthesisRequest]) -> Iterator[np.ndarray]:
+        """文ごとの PCM を順に返す。BERT (文 n+1) と SBV2 (文 n) は並行に実行される。"""
+        with (
+            ThreadPoolExecutor(1, thread_name_prefix="bert") as bert_pool,
+            ThreadPoolExecutor(1, thread_name_prefix="sbv2") as tts_pool,
+        ):
+
+            def submit(i: int) -> Future:
+                bert_future = bert_pool.submit(self._run_bert, sentences[i])
+                return tts_pool.submit(self._render, sentences[i], bert_future)
+
+            # 保持する中間結果は先読み分 (lookahead + 1 文) まで
+            pending = deque(submit(i) for i in range(min(self.lookahead + 1, len(sentences))))
+            next_index = len(pending)
+            while pending:
+                audio = pending.popleft().result()
+                if next_index < len(sentences):
+                    pending.append(submit(next_index))
+                    next_index += 1
+                yield audio
+
+    def synthesize_iter(
+        self, request: SynthesisRequest, joiner: SentenceJoiner | None = None
+    ) -> Iterator[np.ndarray]:
+        """長文リクエストを文に分割して合成し、連結済みの PCM を文ごとに返す。"""
+        joiner = joiner or SentenceJoiner()
+        for audio in self.synthesize_sentences(split_request(request)):
+            chunk = joiner.push(audio)
+            if len(chunk):
+                yield chunk
+        tail = joiner.flush()
+        if len(tail):
+            yield tail
+
+    def synthesize_whole(self, request: SynthesisRequest) -> np.ndarray:
+        """比較用: テキスト全体を 1 回の BERT + SBV2 で合成する (C# TTSPipeline.Synthesize 相当)。"""
+        return self._render(request, self._run_bert(request))
+
+
+def make_dummy_long_request(num_sentences: int, seed: int = 0) -> SynthesisRequest:
+    """仮名と句点からなるダミーの長文リクエスト (G2P 済みの形式)。"""
+    rng = np.random.default_rng(seed)
+    kana = {"あ": 1, "い": 1, "う": 1, "か": 2, "き": 2, "さ": 2, "た": 2, "な": 2}
+    chars = list(kana)
+    text = "".join(
+        "".join(rng.choice(chars, size=int(rng.integers(12, 40)))) + "。"
+        for _ in range(num_sentences)
+    )
+    counts = [kana.get(c, 1) for c in text]  # 句点は句読点シンボル 1 音素
+    raw_word2ph = np.array([1, *counts, 1], dtype=np.int32)
+    phone_len = int(raw_word2ph.sum())
+    raw_phonemes = rng.integers(1, 100, size=phone_len).astype(np.int32)
+    raw_phonemes[[0, -1]] = 0
+    raw_tones = np.full(phone_len, 6, dtype=np.int32)
+    raw_language = np.ones(phone_len, dtype=np.int32)
+    return SynthesisRequest(
+        token_ids=np.concatenate([
+            [CLS_ID], rng.integers(5, 1000, size=len(text)), [SEP_ID],
+        ]).astype(np.int32),
+        phoneme_ids=intersperse(raw_phonemes),
+        tones=intersperse(raw_tones),
+        language=intersperse(raw_language),
+        word2ph=adjust_word2ph_for_blanks(raw_word2ph),
+        style_vec=np.zeros(STYLE_DIM, dtype=np.float32),
+        text=text,
+    )
+
+
+def _bert_mb(phone_len: int) -> float:
+    """BERT 特徴量 [1024, phone_len] (FP32) のサイズ (MB)。"""
+    return phone_len * EMBEDDING_DIM * 4 / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Sentence-split, stage-pipelined long-text synthesis for SBV2 models"
+    )
+    parser.add_argument("--bert", type=str, required=True, help="DeBERTa ONNX path")
+    parser.add_argument("--tts", type=str, required=True, help="SBV2 ONNX path")
+    parser.add_argument(
+        "--requests", type=str, default=None,
+        help="Pre-tokenized long-text requests with text (JSONL, the first line is used)",
+    )
+    parser.add_argument(
+        "--style-vectors", type=str, default=None, help="style_vectors.npy path"
+    )
+    parser.add_argument(
+        "--num-sentences", type=int, default=16,
+        help="Sentences in the dummy request when --requests is not given",
+    )
+    parser.add_argument("--pause-ms", type=float, default=200.0, help="Silence between sentences")
+    parser.add_argument(
+        "--crossfade-ms", type=float, default=10.0,
+        help="Fade length at sentence joins (overlap when --pause-ms is 0)",
+    )
+    parser.add_argument(
+        "--lookahead", type=int, default=1, help="Sentences processed ahead of playback"
+    )
+    parser.add_argument(
+        "--threads", type=int, default=0,
+        help="ORT intra-op threads per session (BERT and SBV2 run concurrently)",
+    )
+    parser.add_argument(
+        "--bert-cache", type=str, default=None,
+        help="Persistent BERT feature cache directory (see bert_cache.py)",
+    )
+    parser.add_argument(
+        "--compare", action="store_true",
+        help="Also synthesize the whole text in one pass and compare latency",
+    )
+    parser.add_argument("--output", type=str, default=None, help="Write the joined WAV")
+    args = parser.parse_args()
+
+    if args.requests:
+        style_vectors = np.load(args.style_vectors) if args.style_vectors else None
+        request = load_requests(Path(args.requests), style_vectors)[0]
+    else:
+        request = make_dummy_long_request(args.num_sentences)
+
+    bert_cache = None
+    if args.bert_cache:
+        bert_cache = BertFeatureStore(Path(args.bert_cache), model_digest(Path(args.bert)))
+    synth = LongTextSynthesizer(
+        args.bert, args.tts,
+        intra_op_num_threads=args.threads, bert_cache=bert_cache, lookahead=args.lookahead,
+    )
+
+    sentences = split_request(request)
+    phone_lens = [len(s.phoneme_ids) for s in sentences]
+    print(
+        f"Text: {len(request.text)} chars, {len(request.phoneme_ids)} phonemes -> "
+        f"{len(sentences)} sentences (max {max(phone_lens)} phonemes)"
+    )
+    # ウォームアップ
+    synth.synthesize_whole(sentences[0])
+
+    joiner = SentenceJoiner(SAMPLE_RATE, args.pause_ms, args.crossfade_ms)
+    chunks = []
+    start = time.perf_counter()
+    first_ms = None
+    for i, chunk in enumerate(synth.synthesize_iter(request, joiner)):
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if first_ms is None:
+            first_ms = elapsed_ms
+        print(f"  chunk {i}: {len(chunk) / SAMPLE_RATE:.2f}s audio at {elapsed_ms:.0f}ms")
+        chunks.append(chunk)
+    total_ms = (time.perf_counter() - start) * 1000
+    audio = np.concatenate(chunks)
+    print(
+        f"Pipelined: first sound {first_ms:.0f}ms, total {total_ms:.0f}ms, "
+        f"audio {len(audio) / SAMPLE_RATE:.2f}s"
+    )
+    # BERT 出力 (word2ph 展開後, FP32) の最大サイズ
+    print(f"  largest BERT tensor: {_bert_mb(max(phone_lens)):.1f}MB")
+
+    if args.compare:
+        start = time.perf_counter()
+        whole = synth.synthesize_whole(request)
+        whole_ms = (time.perf_counter() - start) * 1000
+        print(
+            f"Single pass: first sound {whole_ms:.0f}ms (= total), "
+            f"audio {len(whole) / SAMPLE_RATE:.2f}s"
+        )
+        print(f"  largest BERT tensor: {_bert_mb(len(request.phoneme_ids)):.1f}MB")
+        print(f"First-sound speedup: x{whole_ms / first_ms:.1f}")
+
+    if bert_cache is not None:
+        bert_cache.close()
+    if args.output:
+        write_audio(Path(args.output), audio, SAMPLE_RATE)
+        print(f"Wrote: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,573 @@
+"""
+FP16 混合精度の自動探索
+
+float16.convert_float_to_float16 は全ノードを FP16 にするため、数値的に不安定な
+ノード (flow / decoder の一部など) で音声にアーティファクトが出ることがある。
+キャリブレーション入力で FP32 と FP16 の中間出力を比較し、誤差を持ち込んだノードだけを
+node_block_list で FP32 に残す。
+
+処理フロー:
+1. FP32 モデルの全中間出力をキャリブレーション入力で取得
+2. ブロックリストを適用して FP16 変換し、同じく全中間出力を取得
+3. 最終出力の相対誤差が --max-error 以下なら終了
+4. ノードごとに「出力の誤差 - 入力の誤差の最大値」(そのノードで増えた誤差) を求め、
+   閾値を超えたノードをブロックリストに追加 (閾値は毎回半分にする) して 2 に戻る。
+   FP32 にしても誤差が残るノード (FP16 で丸められた入力を増幅する) は入力元も追加する
+5. 前後がすべて FP32 のノードも FP32 に寄せ、FP32/FP16 境界の Cast を減らす
+
+使用方法:
+    uv run python mixed_precision.py --model sbv2_model_fp32.onnx \
+        --output sbv2_model_mixed.onnx --max-error 0.01
+
+    # 変換スクリプトから (FP16 ステージを置き換え)
+    uv run python convert_sbv2_for_sentis.py --repo <hf-repo-id> --mixed-precision
+"""
+
+import argparse
+import json
+from pathlib import Path
+
+import numpy as np
+import onnx
+import onnxruntime as ort
+from onnxconverter_common import float16
+
+from onnx_io import model_size_mb, save_model
+from quantize_onnx import (
+    deterministic_feeds,
+    load_calibration_feeds,
+    make_tts_gate_feeds,
+    relative_error,
+)
+from validate_onnx import cast_feeds
+
+FLOAT_TYPES = (onnx.TensorProto.FLOAT, onnx.TensorProto.FLOAT16)
+
+
+def remove_cast_roundtrips(model: onnx.ModelProto) -> int:
+    """Cast(FP16) → Cast(FP32) の往復を取り除き、削除した Cast の数を返す。
+
+    convert_float_to_float16 は FP32 ノード同士の間にも FP16 への Cast を挟むことがあり、
+    往復で値が FP16 に丸められる (FP32 に残した意味がなくなる)。
+    """
+    graph = model.graph
+    graph_outputs = {out.name for out in graph.output}
+    types = {
+        info.name: info.type.tensor_type.elem_type
+        for info in list(graph.input) + list(graph.value_info)
+    }
+    types.update((tensor.name, tensor.data_type) for tensor in graph.initializer)
+    consumers: dict[str, list[onnx.NodeProto]] = {}
+    for node in graph.node:
+        for name in node.input:
+            consumers.setdefault(name, []).append(node)
+
+    def cast_to(node: onnx.NodeProto) -> int | None:
+        if node.op_type != "Cast":
+            return None
+        return next(attr.i for attr in node.attribute if attr.name == "to")
+
+    removed = set()
+    for node in graph.node:
+        if cast_to(node) != onnx.TensorProto.FLOAT16:
+            continue
+        source = node.input[0]
+        if types.get(source) != onnx.TensorProto.FLOAT:
+            # int→FP16 の Cast は往復しても元の型に戻らない
+            continue
+        users = consumers.get(node.output[0], [])
+        for user in users:
+            if cast_to(user) != onnx.TensorProto.FLOAT or user.output[0] in graph_outputs:
+                continue
+            # Cast(FP32) の出力を使うノードを元の FP32 テンソルに付け替える
+            for target in consumers.get(user.output[0], []):
+                for i, name in enumerate(target.input):
+                    if name == user.output[0]:
+                        target.input[i] = source
+                consumers.setdefault(source, []).append(target)
+            removed.add(id(user))
+        remaining = [user for user in users if id(user) not in removed]
+        if not remaining and node.output[0] not in graph_outputs:
+            removed.add(id(node))
+
+    kept = [node for node in graph.node if id(node) not in removed]
+    count = len(graph.node) - len(kept)
+    del graph.node[:]
+    graph.node.extend(kept)
+    return count
+
+
+def restore_output_types(source: onnx.ModelProto, converted: onnx.ModelProto) -> None:
+    """出力を作るノードが FP32 のとき keep_io_types でも出力が FP16 になるため元の型に戻す。"""
+    types = {out.name: out.type.tensor_type.elem_type for out in source.graph.output}
+    for out in converted.graph.output:
+        elem_type = types.get(out.name)
+        if elem_type is None or out.type.tensor_type.elem_type == elem_type:
+            continue
+        producer = next(node for node in converted.graph.node if out.name in node.output)
+        if producer.op_type == "Cast":
+            for attr in producer.attribute:
+                if attr.name == "to":
+                    attr.i = elem_type
+        else:
+            intermediate = out.name + "_fp16"
+            producer.output[list(producer.output).index(out.name)] = intermediate
+            converted.graph.node.append(
+                onnx.helper.make_node("Cast", [intermediate], [out.name], to=elem_type)
+            )
+        out.type.tensor_type.elem_type = elem_type
+
+
+def fix_cast_targets(converted: onnx.ModelProto) -> int:
+    """出力が FP16 に変換されたのに to=FLOAT のまま残った Cast (int→float など) を FP16 に直す。
+
+    convert_float_to_float16 は value_info だけを FP16 にするため、ORT では型エラーになる。
+    """
+    types = {
+        info.name: info.type.tensor_type.elem_type
+        for info in list(converted.graph.value_info) + list(converted.graph.output)
+    }
+    count = 0
+    for node in converted.graph.node:
+        if node.op_type != "Cast" or types.get(node.output[0]) != onnx.TensorProto.FLOAT16:
+            continue
+        for attr in node.attribute:
+            if attr.name == "to" and attr.i == onnx.TensorProto.FLOAT:
+                attr.i = onnx.TensorProto.FLOAT16
+                count += 1
+    return count
+
+
+def convert_to_fp16(
+    model: onnx.ModelProto,
+    node_block_list: list[str] | None = None,
+    check_fp16_ready: bool = True,
+) -> onnx.ModelProto:
+    """node_block_list のノードを FP32 に残して FP16 に変換する (入出力は FP32 のまま)。
+
+    Raises:
+        ValueError: モデルが既に FP16 のテンソルを含む場合 (onnxsim が一部を FP16 化した場合など)。
+            check_fp16_ready=False は出力誤差を FP32 と比較する search_mixed_precision だけが使う
+    """
+    converted = _convert_float_to_float16(model, node_block_list, check_fp16_ready)
+    fix_cast_targets(converted)
+    if node_block_list:
+        restore_output_types(model, converted)
+        remove_cast_roundtrips(converted)
+    return converted
+
+
+def _convert_float_to_float16(
+    model: onnx.ModelProto, node_block_list: list[str] | None, check_fp16_ready: bool
+) -> onnx.ModelProto:
+    try:
+        return float16.convert_float_to_float16(
+            model, keep_io_types=True, node_block_list=node_block_list,
+            check_fp16_ready=check_fp16_ready,
+        )
+    except ValueError as e:
+        raise ValueError(
+            "Model is already partially FP16; converting it again without checking "
+            "the output may break it. Use --mixed-precision (verifies the output error "
+            "vs FP32) or --no-fp16"
+        ) from e
+
+
+def name_nodes(model: onnx.ModelProto) -> None:
+    """node_block_list はノード名で指定するため、名前のないノードに名前を付ける。"""
+    for i, node in enumerate(model.graph.node):
+        if not node.name:
+            node.name = f"{node.op_type}_{i}"
+
+
+def _float_tensors(model: onnx.ModelProto) -> set[str]:
+    """FP32/FP16 と推論できる中間テンソル名。"""
+    inferred = onnx.shape_inference.infer_shapes(model)
+    return {
+        info.name
+        for info in list(inferred.graph.value_info) + list(inferred.graph.output)
+        if info.type.tensor_type.elem_type in FLOAT_TYPES
+    }
+
+
+def run_intermediates(
+    model: onnx.ModelProto,
+    names: list[str],
+    feeds_list: list[dict[str, np.ndarray]],
+    source: onnx.ModelProto | None = None,
+) -> list[dict[str, np.ndarray]]:
+    """names の中間テンソルをグラフ出力に追加して実行し、feeds ごとに値を返す。
+
+    model が source を FP16 変換したものの場合、ブロック境界の Cast 挿入でリネームされた
+    ノード出力はノード名と出力位置で source のテンソル名に対応付ける。
+    """
+    renamed = {}
+    if source is not None:
+        source_nodes = {node.name: node for node in source.graph.node}
+        for node in model.graph.node:
+            original = source_nodes.get(node.name)
+            if original is not None:
+                renamed.update(zip(node.output, original.output))
+    wanted = set(names)
+    exposed_names = {
+        name for node in model.graph.node for name in node.output
+        if renamed.get(name, name) in wanted
+    }
+
+    exposed = onnx.ModelProto()
+    exposed.CopyFrom(model)
+    outputs = {out.name for out in exposed.graph.output}
+    for name in sorted(exposed_names - outputs):
+        exposed.graph.output.append(onnx.ValueInfoProto(name=name))
+
+    options = ort.SessionOptions()
+    # グラフ最適化で中間テンソルが融合・削除されないようにする
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+    session = ort.InferenceSession(
+        exposed.SerializeToString(), sess_options=options, providers=["CPUExecutionProvider"]
+    )
+    output_names = [renamed.get(out.name, out.name) for out in session.get_outputs()]
+    results = []
+    for feeds in feeds_list:
+        values = session.run(None, cast_feeds(session, feeds))
+        results.append(dict(zip(output_names, values)))
+    return results
+
+
+def _tensor_error(reference: np.ndarray, output: np.ndarray) -> float:
+    if reference.ndim != output.ndim or reference.shape[:-1] != output.shape[:-1]:
+        # 系列長の変化などで比較できない場合は最大の誤差とみなす
+        return float("inf")
+    return relative_error(reference, output)
+
+
+def tensor_errors(
+    reference: list[dict[str, np.ndarray]], converted: list[dict[str, np.ndarray]]
+) -> dict[str, float]:
+    """中間テンソルごとの相対誤差 (feeds 間の最大値)。"""
+    errors: dict[str, float] = {}
+    for ref, out in zip(reference, converted):
+        for name, value in ref.items():
+            if name in out:
+                errors[name] = max(errors.get(name, 0.0), _tensor_error(value, out[name]))
+    return errors
+
+
+def _max_error(errors: dict[str, float], names) -> float:
+    return max((errors.get(name, 0.0) for name in names), default=0.0)
+
+
+def node_error_increase(
+    model: onnx.ModelProto, errors: dict[str, float], candidates: set[str]
+) -> dict[str, float]:
+    """ノードごとに FP16 化で増えた誤差 (出力の誤差 - 入力の誤差の最大値) を求める。"""
+    increase = {}
+    for node in model.graph.node:
+        if node.name not in candidates:
+            continue
+        out_error = _max_error(errors, node.output)
+        in_error = _max_error(errors, node.input)
+        if np.isinf(out_error) and np.isinf(in_error):
+            continue
+        increase[node.name] = out_error - in_error
+    return increase
+
+
+def amplifying_producers(
+    model: onnx.ModelProto, errors: dict[str, float], blocked: set[str], max_error: float
+) -> set[str]:
+    """FP32 にしても出力誤差が max_error を超えるノード (入力の誤差を増幅する) の入力元。
+
+    入力が FP16 で丸められている限り誤差は残るため、FP32 の領域をたどって
+    その上流にある最初の FP16 ノードを返す (FP32 の領域を 1 段上流に広げる)。
+    """
+    nodes = {node.name: node for node in model.graph.node}
+    producer = {name: node.name for node in model.graph.node for name in node.output}
+    stack = [
+        name for name in blocked
+        if name in nodes and _max_error(errors, nodes[name].output) > max_error
+    ]
+    visited = set(stack)
+    result = set()
+    while stack:
+        node = nodes[stack.pop()]
+        for name in node.input:
+            source = producer.get(name)
+            if source is None or source in visited:
+                continue
+            visited.add(source)
+            if source in blocked:
+                stack.append(source)
+            else:
+                result.add(source)
+    return result
+
+
+def fill_block_gaps(model: onnx.ModelProto, blocked: set[str]) -> set[str]:
+    """入力元と出力先がすべて FP32 のノードも FP32 にし、境界の Cast を減らす。"""
+    producer = {name: node.name for node in model.graph.node for name in node.output}
+    consumers: dict[str, list[str]] = {}
+    for node in model.graph.node:
+        for name in node.input:
+            consumers.setdefault(name, []).append(node.name)
+    graph_outputs = {out.name for out in model.graph.output}
+
+    blocked = set(blocked)
+    changed = True
+    while changed:
+        changed = False
+        for node in model.graph.node:
+            if node.name in blocked:
+                continue
+            sources = [producer[name] for name in node.input if name in producer]
+            sinks = [c for name in node.output for c in consumers.get(name, [])]
+            if any(name in graph_outputs for name in node.output):
+                continue
+            if sources and sinks and all(s in blocked for s in sources + sinks):
+                blocked.add(node.name)
+                changed = True
+    return blocked
+
+
+def count_casts(model: onnx.ModelProto) -> int:
+    return sum(1 for node in model.graph.node if node.op_type == "Cast")
+
+
+def search_mixed_precision(
+    model: onnx.ModelProto,
+    feeds_list: list[dict[str, np.ndarray]],
+    max_error: float = 0.01,
+    node_threshold: float = 0.01,
+    max_rounds: int = 16,
+) -> tuple[onnx.ModelProto, dict]:
+    """最終出力の誤差が max_error 以下になるまで誤差を持ち込むノードを FP32 に残す。
+
+    戻り値は (混合精度モデル, レポート)。max_rounds 内に収まらない場合は
+    ValueError を送出する (呼び出し元で FP32 のままにするなどの判断をする)。
+    """
+    model_copy = onnx.ModelProto()
+    model_copy.CopyFrom(model)
+    model = model_copy
+    name_nodes(model)
+    output_name = model.graph.output[0].name
+
+    # FP16 化の対象になりうるノード (既定で FP32 に残る op は除外)
+    float_tensors = _float_tensors(model)
+    candidates = {
+        node.name for node in model.graph.node
+        if node.op_type not in float16.DEFAULT_OP_BLOCK_LIST
+        and any(name in float_tensors for name in node.output)
+    }
+    names = sorted(float_tensors)
+    print(
+        f"Mixed precision search: {len(candidates)} convertible nodes, "
+        f"{len(feeds_list)} calibration inputs"
+    )
+    reference = run_intermediates(model, names, feeds_list)
+    # 一部が FP16 のモデルでも、出力誤差を検証するため check_fp16_ready を無効にして変換する
+    full_casts = count_casts(convert_to_fp16(model, check_fp16_ready=False))
+
+    blocked: set[str] = set()
+    threshold = node_threshold
+    for round_index in range(1, max_rounds + 1):
+        converted_model = convert_to_fp16(model, sorted(blocked), check_fp16_ready=False)
+        converted = run_intermediates(converted_model, names, feeds_list, source=model)
+        error = max(
+            _tensor_error(ref[output_name], out[output_name])
+            for ref, out in zip(reference, converted)
+        )
+        print(
+            f"  Round {round_index}: {len(blocked)} node(s) in FP32, "
+            f"output error {error:.5f} (budget {max_error:.5f})"
+        )
+        if error <= max_error:
+            break
+        errors = tensor_errors(reference, converted)
+        increase = node_error_increase(model, errors, candidates - blocked)
+        new = {name for name, value in increase.items() if value > threshold}
+        new |= amplifying_producers(model, errors, blocked, max_error) & candidates
+        if not new:
+            # 閾値を超えるノードがなければ最も誤差を増やしたノードを追加
+            new = {max(increase, key=increase.get)} if increase else set()
+        if not new:
+            break
+        blocked |= new
+        threshold /= 2
+    else:
+        raise ValueError(
+            f"Mixed precision search did not reach error {max_error} in {max_rounds} rounds"
+        )
+    if error > max_error:
+        raise ValueError(f"Mixed precision search stalled at error {error:.5f}")
+
+    # Cast 削減 (ブロックを増やすだけなので誤差は悪化しない)
+    filled = fill_block_gaps(model, blocked)
+    result = convert_to_fp16(model, sorted(filled), check_fp16_ready=False)
+    casts = count_casts(result)
+    print(
+        f"  Block list: {len(blocked)} node(s) + {len(filled) - len(blocked)} gap node(s), "
+        f"Cast nodes {casts} (full FP16: {full_casts})"
+    )
+    report = {
+        "max_error": max_error,
+        "output_error": error,
+        "rounds": round_index,
+        "node_block_list": sorted(filled),
+        "cast_nodes": casts,
+        "cast_nodes_full_fp16": full_casts,
+    }
+    return result, report
+
+
+def default_calibration_feeds(model: onnx.ModelProto) -> list[dict[str, np.ndarray]]:
+    """キャリブレーションデータがない場合の feeds (ノイズ 0 の SBV2 入力 / デコーダ用の z / リテイク用のエンコーダ出力)。"""
+    input_names = {inp.name for inp in model.graph.input}
+    if "z" in input_names and "x_tst" not in input_names:
+        # 分割エクスポートのデコーダ
+        z = next(inp for inp in model.graph.input if inp.name == "z")
+        channels = z.type.tensor_type.shape.dim[1].dim_value
+        rng = np.random.default_rng(0)
+        return [
+            {
+                "z": rng.standard_normal((1, channels, frames)).astype(np.float32),
+                "sid": np.zeros((1,), dtype=np.int64),
+            }
+            for frames in (32, 128)
+        ]
+    if "m_p" in input_names:
+        # リテイク用エクスポートの duration + flow + デコーダ (入力はエンコーダ出力)
+        channels = {
+            inp.name: inp.type.tensor_type.shape.dim[1].dim_value for inp in model.graph.input
+        }
+        rng = np.random.default_rng(0)
+        feeds_list = []
+        for length in (16, 64):
+            x_mask = np.ones((1, 1, length), dtype=np.float32)
+            feeds_list.append(deterministic_feeds({
+                "hidden": rng.standard_normal((1, channels["hidden"], length)).astype(np.float32),
+                "m_p": rng.standard_normal((1, channels["m_p"], length)).astype(np.float32),
+                "logs_p": np.full((1, channels["logs_p"], length), -1.0, dtype=np.float32),
+                "x_mask": x_mask,
+                "sid": np.zeros((1,), dtype=np.int64),
+                "sdp_ratio": np.array([0.2], dtype=np.float32),
+                "noise_scale": np.array([0.6], dtype=np.float32),
+                "noise_scale_w": np.array([0.8], dtype=np.float32),
+                "length_scale": np.array([1.0], dtype=np.float32),
+            }))
+        return feeds_list
+    return [deterministic_feeds(feeds) for feeds in make_tts_gate_feeds()]
+
+
+def fit_fixed_shape_feeds(
+    model: onnx.ModelProto, feeds_list: list[dict[str, np.ndarray]]
+) -> list[dict[str, np.ndarray]]:
+    """固定長グラフ (--no-dynamic / --buckets) 用に、入力の固定次元に合わせて feeds を切り詰め / 0 埋めする。
+
+    動的次元はそのまま。x_tst_lengths は x_tst の長さ以下に、
+    phone_to_token はトークン数未満に収める (結合モデルはトークン数が音素数と異なる)。
+    """
+    shapes = {
+        inp.name: [
+            dim.dim_value if dim.HasField("dim_value") else 0
+            for dim in inp.type.tensor_type.shape.dim
+        ]
+        for inp in model.graph.input
+    }
+    result = []
+    for feeds in feeds_list:
+        fitted = dict(feeds)
+        for name, dims in shapes.items():
+            value = fitted.get(name)
+            if value is None or value.ndim != len(dims):
+                continue
+            for axis, size in enumerate(dims):
+                if size <= 0 or value.shape[axis] == size:
+                    continue
+                if value.shape[axis] > size:
+                    value = value[(slice(None),) * axis + (slice(0, size),)]
+                else:
+                    widths = [(0, 0)] * value.ndim
+                    widths[axis] = (0, size - value.shape[axis])
+                    value = np.pad(value, widths)
+            fitted[name] = value
+        if "x_tst" in fitted and "x_tst_lengths" in fitted:
+            fitted["x_tst_lengths"] = np.minimum(
+                fitted["x_tst_lengths"], fitted["x_tst"].shape[1]
+            )
+        if "input_ids" in fitted and "phone_to_token" in fitted:
+            fitted["phone_to_token"] = np.minimum(
+                fitted["phone_to_token"], fitted["input_ids"].shape[1] - 1
+            )
+        result.append(fitted)
+    return result
+
+
+def calibration_feeds_for(
+    model: onnx.ModelProto, calibration_dir: Path | None = None
+) -> list[dict[str, np.ndarray]]:
+    """探索に使う feeds (calibration_dir の *.npz、なければ合成入力) をモデルの固定次元に合わせて返す。
+
+    *.npz は前処理済みの SBV2 入力 (x_tst ...) なので、テキストを入力とするグラフにだけ使い、
+    分割デコーダ / リテイク用グラフには合成入力を使う。
+    """
+    input_names = {inp.name for inp in model.graph.input}
+    if calibration_dir is not None and "x_tst" in input_names:
+        feeds_list = [
+            deterministic_feeds(feeds) for feeds in load_calibration_feeds(calibration_dir)
+        ]
+        if not feeds_list:
+            raise ValueError(f"No *.npz calibration feeds in {calibration_dir}")
+    else:
+        if calibration_dir is not None:
+            print("  Calibration feeds do not match this graph; using synthetic inputs")
+        feeds_list = default_calibration_feeds(model)
+    return fit_fixed_shape_feeds(model, feeds_list)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert an ONNX model to FP16 while keeping unstable nodes in FP32"
+    )
+    parser.add_argument("--model", type=str, required=True, help="FP32 ONNX model")
+    parser.add_argument("--output", type=str, required=True, help="Mixed-precision model path")
+    parser.add_argument(
+        "--calibration-dir", type=str, default=None,
+        help="Directory of *.npz preprocessed feeds (default: synthetic SBV2 inputs)",
+    )
+    parser.add_argument(
+        "--max-error", type=float, default=0.01,
+        help="Max relative L2 error of the model output vs FP32",
+    )
+    parser.add_argument(
+        "--node-threshold", type=float, default=0.01,
+        help="Initial per-node error increase that puts a node in FP32 (halved each round)",
+    )
+    parser.add_argument("--max-rounds", type=int, default=16, help="Max search rounds")
+    args = parser.parse_args()
+
+    model = onnx.load(args.model)
+    if args.calibration_dir:
+        feeds_list = [
+            deterministic_feeds(feeds)
+            for feeds in load_calibration_feeds(Path(args.calibration_dir))
+        ]
+    else:
+        feeds_list = default_calibration_feeds(model)
+    feeds_list = fit_fixed_shape_feeds(model, feeds_list)
+
+    try:
+        result, report = search_mixed_precision(
+            model, feeds_list, args.max_error, args.node_threshold, args.max_rounds
+        )
+    except ValueError as e:
+        raise SystemExit(str(e))
+
+    output_path = Path(args.output)
+    save_model(result, output_path)
+    report_path = output_path.with_suffix(".mixed.json")
+    report_path.write_text(json.dumps(report, indent=2))
+    print(f"Saved: {output_path} ({model_size_mb(output_path):.1f} MB), report: {report_path}")
+
+
+if __name__ == "__main__":
+    main()
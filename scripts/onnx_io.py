@@ -0,0 +1,180 @@
+"""
+ONNX 外部データ (external data) 入出力ユーティリティ
+
+DeBERTa-large FP32 (~1.4GB) は protobuf の 2GB 制限に近く、
+onnx.load / onnx.save でモデル全体をメモリに載せると変換ジョブのピーク RSS が大きくなる。
+
+--external-data 指定時の変換フロー:
+1. エクスポート直後のモデルを externalize() で <model>.onnx + <model>.onnx.data に書き出し、
+   重みを外部参照のまま (グラフのみ) 読み直す
+   (onnxsim は入力と出力の両方のモデル全体を保持するため、--external-data では行わない)
+2. int64→int32 / FP16 変換はグラフのみに対して行う
+   (FP16 変換された外部 FLOAT initializer は data_type だけが FLOAT16 になり、データは FP32 のまま)
+3. save_model() で initializer を 1 つずつ np.memmap で読み、
+   FP16 化が保留されているものは変換しながら出力 .data にストリーム書き込みする
+
+ジョブのピーク RSS はエクスポート直後の「torch の重み + FP32 の ONNX 1 つ」になる
+(torch.onnx.export の TorchScript 経路は 2GB 未満のモデルを単一ファイルで書き出すため、
+externalize() までの一度の onnx.load は避けられない)。
+"""
+
+import os
+from pathlib import Path
+
+import numpy as np
+import onnx
+from onnxconverter_common import float16
+
+# これ未満のサイズの initializer は .onnx 内にインラインで保持する
+EXTERNAL_DATA_THRESHOLD = 1024
+
+
+def _iter_initializers(graph: onnx.GraphProto):
+    """グラフ (およびサブグラフ) の initializer を列挙する。"""
+    yield from graph.initializer
+    for node in graph.node:
+        for attr in node.attribute:
+            if attr.type == onnx.AttributeProto.GRAPH:
+                yield from _iter_initializers(attr.g)
+            elif attr.type == onnx.AttributeProto.GRAPHS:
+                for subgraph in attr.graphs:
+                    yield from _iter_initializers(subgraph)
+
+
+def _is_external(tensor: onnx.TensorProto) -> bool:
+    return tensor.data_location == onnx.TensorProto.EXTERNAL
+
+
+def _numel(tensor: onnx.TensorProto) -> int:
+    return int(np.prod(tensor.dims, dtype=np.int64))
+
+
+def external_data_path(model_path: Path) -> Path:
+    """モデルに対応する外部データファイルのパス (<model>.onnx.data)。"""
+    return model_path.with_name(model_path.name + ".data")
+
+
+def model_size_mb(model_path: Path) -> float:
+    """モデルファイルと外部データファイルの合計サイズ (MB)。"""
+    data_path = external_data_path(model_path)
+    size = model_path.stat().st_size
+    if data_path.exists():
+        size += data_path.stat().st_size
+    return size / 1024 / 1024
+
+
+def remove_model_files(model_path: Path) -> None:
+    """モデルファイルと外部データファイルを削除する。"""
+    model_path.unlink(missing_ok=True)
+    external_data_path(model_path).unlink(missing_ok=True)
+
+
+def tensor_memmap(tensor: onnx.TensorProto, base_dir: Path) -> np.memmap:
+    """外部データの initializer を uint8 の読み取り専用 memmap として開く。"""
+    info = {entry.key: entry.value for entry in tensor.external_data}
+    path = base_dir / info["location"]
+    offset = int(info.get("offset", 0))
+    length = (
+        int(info["length"]) if "length" in info else path.stat().st_size - offset
+    )
+    return np.memmap(path, dtype=np.uint8, mode="r", offset=offset, shape=(length,))
+
+
+def _external_tensor_bytes(tensor: onnx.TensorProto, base_dir: Path) -> np.ndarray:
+    """外部データの initializer の最終的なバイト列を返す。
+
+    グラフのみの FP16 変換で data_type が FLOAT16 になったがデータが FP32 のままの
+    initializer は、ここで convert_np_to_float16 (float16 変換と同じクリップ) を適用する。
+    """
+    data = tensor_memmap(tensor, base_dir)
+    if (
+        tensor.data_type == onnx.TensorProto.FLOAT16
+        and data.shape[0] == _numel(tensor) * 4
+    ):
+        fp16 = float16.convert_np_to_float16(data.view("<f4"))
+        return fp16.astype("<f2").view(np.uint8)
+    return data
+
+
+def load_external_tensors(
+    model: onnx.ModelProto, base_dir: Path, data_type: int
+) -> int:
+    """指定 data_type の外部 initializer をインライン (raw_data) に読み込む。
+
+    int64→int32 変換のように、データの書き換えが必要な (小さい) テンソル用。
+    """
+    count = 0
+    for tensor in _iter_initializers(model.graph):
+        if _is_external(tensor) and tensor.data_type == data_type:
+            tensor.raw_data = tensor_memmap(tensor, base_dir).tobytes()
+            del tensor.external_data[:]
+            tensor.data_location = onnx.TensorProto.DEFAULT
+            count += 1
+    return count
+
+
+def save_model(
+    model: onnx.ModelProto,
+    output_path: Path,
+    base_dir: Path | None = None,
+    external_data: bool = False,
+) -> None:
+    """モデルを保存する。
+
+    external_data=True: initializer を 1 つずつ <output>.onnx.data に書き出す
+    (外部参照中のテンソルは memmap から直接コピーし、全体をメモリに載せない)。
+    external_data=False: 外部参照中のテンソルを読み込んで単一ファイルで保存する。
+
+    base_dir は model 内の外部参照 (location) の基準ディレクトリ。
+    """
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    if not external_data:
+        for tensor in _iter_initializers(model.graph):
+            if _is_external(tensor):
+                tensor.raw_data = _external_tensor_bytes(tensor, base_dir).tobytes()
+                del tensor.external_data[:]
+                tensor.data_location = onnx.TensorProto.DEFAULT
+        onnx.save(model, str(output_path))
+        return
+
+    data_path = external_data_path(output_path)
+    # 入力と出力の .data が同じファイルの場合に備え、一時ファイルに書いてから置き換える
+    temp_data_path = data_path.with_name(data_path.name + ".tmp")
+    with open(temp_data_path, "wb") as f:
+        for tensor in _iter_initializers(model.graph):
+            if _is_external(tensor):
+                data = _external_tensor_bytes(tensor, base_dir)
+            elif len(tensor.raw_data) >= EXTERNAL_DATA_THRESHOLD:
+                data = np.frombuffer(tensor.raw_data, dtype=np.uint8)
+            else:
+                continue
+
+            offset = f.tell()
+            f.write(data)
+            length = data.shape[0]
+            del data
+
+            tensor.ClearField("raw_data")
+            del tensor.external_data[:]
+            for key, value in (
+                ("location", data_path.name),
+                ("offset", str(offset)),
+                ("length", str(length)),
+            ):
+                entry = tensor.external_data.add()
+                entry.key = key
+                entry.value = value
+            tensor.data_location = onnx.TensorProto.EXTERNAL
+
+    onnx.save(model, str(output_path))
+    os.replace(temp_data_path, data_path)
+
+
+def externalize(model: onnx.ModelProto, path: Path) -> onnx.ModelProto:
+    """モデルを外部データ付きで path に保存し、グラフのみ (重みは外部参照) を読み直す。
+
+    戻り値を受け取った時点で呼び出し元の巨大な ModelProto は解放できる。
+    """
+    save_model(model, path, base_dir=path.parent, external_data=True)
+    return onnx.load(str(path), load_external_data=False)
@@ -0,0 +1,178 @@
+"""
+ONNX Runtime 向けのオフライン最適化モデル出力・ロード
+
+InferenceSession の作成時には毎回グラフ最適化 (定数畳み込み・演算子融合など) が走る。
+変換時に最適化済みのモデルを保存しておけば、ロード時は最適化を無効にして
+セッション作成 (= ワーカーのコールドスタート) を短縮できる。
+
+出力形式:
+- onnx: 最適化済み ONNX (optimized_model_filepath)。ORT の contrib op を含むため Sentis 非対応
+- ort: ORT 形式 (.ort, flatbuffer)。パースが速く、ロード時のメモリコピーも少ない
+
+最適化レベル:
+- extended (既定): ハードウェア非依存の融合まで。別の CPU でも使える
+- all: レイアウト最適化 (NCHWc など) を含む。出力したマシンと同じ CPU でのみ使う
+
+最適化済みモデルは出力した ORT のバージョンに依存するため、<model>.json に
+バージョンと元モデルを記録し、load 時に不一致なら元モデルにフォールバックする。
+
+使用方法:
+    uv run python ort_optimize.py --model deberta.onnx --output deberta.ort --format ort --check
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+import onnxruntime as ort
+
+from quantize_onnx import deterministic_feeds
+from validate_onnx import cast_feeds, create_session, make_bert_feeds, make_tts_feeds
+
+OPTIMIZED_FORMATS = ("onnx", "ort")
+
+OPTIMIZATION_LEVELS = {
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+
+def metadata_path(model_path: Path) -> Path:
+    """最適化済みモデルのメタデータ (<model>.json)。"""
+    return model_path.with_name(model_path.name + ".json")
+
+
+def optimized_output_path(model_path: Path, fmt: str) -> Path:
+    """変換スクリプトの出力に対応する最適化済みモデルのパス。"""
+    return model_path.with_name(f"{model_path.stem}.optimized.{fmt}")
+
+
+def emit_optimized_model(
+    model_path: Path,
+    output_path: Path,
+    fmt: str = "ort",
+    level: str = "extended",
+) -> Path:
+    """model_path を ORT で最適化し、output_path に保存する。"""
+    if fmt not in OPTIMIZED_FORMATS:
+        raise ValueError(f"Unknown optimized model format: {fmt}")
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = OPTIMIZATION_LEVELS[level]
+    options.optimized_model_filepath = str(output_path)
+    if fmt == "ort":
+        options.add_session_config_entry("session.save_model_format", "ORT")
+
+    print(f"Optimizing for ONNX Runtime ({fmt}, level={level})...")
+    start = time.perf_counter()
+    ort.InferenceSession(
+        str(model_path), sess_options=options, providers=["CPUExecutionProvider"]
+    )
+    print(f"Saved optimized model: {output_path} ({time.perf_counter() - start:.1f}s)")
+
+    metadata = {
+        "source": str(model_path.resolve()),
+        "format": fmt,
+        "level": level,
+        "onnxruntime": ort.__version__,
+    }
+    metadata_path(output_path).write_text(json.dumps(metadata, indent=2))
+    return output_path
+
+
+def create_optimized_session(
+    model_path: str,
+    intra_op_num_threads: int = 0,
+    inter_op_num_threads: int = 0,
+) -> ort.InferenceSession:
+    """最適化済みモデルをグラフ最適化なしでロードする。
+
+    メタデータの ORT バージョンが実行中の ORT と異なる場合は、
+    元モデルを通常どおり (最適化ありで) ロードする。
+    """
+    path = Path(model_path)
+    meta_path = metadata_path(path)
+    if meta_path.exists():
+        metadata = json.loads(meta_path.read_text())
+        if metadata["onnxruntime"] != ort.__version__:
+            print(
+                f"Warning: {path.name} was optimized with onnxruntime "
+                f"{metadata['onnxruntime']} (running {ort.__version__}); "
+                f"loading source model {metadata['source']}"
+            )
+            return create_session(
+                metadata["source"], intra_op_num_threads, inter_op_num_threads
+            )
+
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = intra_op_num_threads
+    options.inter_op_num_threads = inter_op_num_threads
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+    if path.suffix == ".ort":
+        options.add_session_config_entry("session.load_model_format", "ORT")
+    return ort.InferenceSession(
+        str(path), sess_options=options, providers=["CPUExecutionProvider"]
+    )
+
+
+def _timed(fn, *args) -> tuple[ort.InferenceSession, float]:
+    start = time.perf_counter()
+    session = fn(*args)
+    return session, (time.perf_counter() - start) * 1000
+
+
+def check_optimized(source_path: str, optimized_path: str, model_type: str):
+    """元モデルと最適化済みモデルのセッション作成時間と出力を比較する。"""
+    source, source_ms = _timed(create_session, source_path)
+    optimized, optimized_ms = _timed(create_optimized_session, optimized_path)
+    print(f"Session creation: source {source_ms:.1f}ms, optimized {optimized_ms:.1f}ms")
+
+    if model_type == "bert":
+        feeds = make_bert_feeds(16)
+    else:
+        feeds = deterministic_feeds(make_tts_feeds(16))
+    ref = source.run(None, cast_feeds(source, feeds))[0]
+    out = optimized.run(None, cast_feeds(optimized, feeds))[0]
+    if ref.shape != out.shape:
+        raise SystemExit(f"Output shape mismatch: {ref.shape} vs {out.shape}")
+    print(f"Max abs diff: {np.abs(ref.astype(np.float32) - out.astype(np.float32)).max():.6f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Emit an offline-optimized ONNX Runtime model"
+    )
+    parser.add_argument("--model", type=str, required=True, help="Source ONNX model")
+    parser.add_argument(
+        "--output", type=str, default=None,
+        help="Output path (default: <model>.optimized.<format>)",
+    )
+    parser.add_argument(
+        "--format", type=str, choices=OPTIMIZED_FORMATS, default="ort",
+        help="Optimized model format",
+    )
+    parser.add_argument(
+        "--level", type=str, choices=list(OPTIMIZATION_LEVELS), default="extended",
+        help="Graph optimization level ('all' is tied to the current CPU)",
+    )
+    parser.add_argument(
+        "--check", type=str, choices=["bert", "tts"], default=None,
+        help="Compare session creation time and outputs with the source model",
+    )
+    args = parser.parse_args()
+
+    model_path = Path(args.model)
+    output_path = (
+        Path(args.output) if args.output else optimized_output_path(model_path, args.format)
+    )
+    emit_optimized_model(model_path, output_path, fmt=args.format, level=args.level)
+
+    if args.check:
+        check_optimized(str(model_path), str(output_path), args.check)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+ONNX Runtime のプロファイラによる演算子単位のホットスポット分析
+
+validate_onnx.py と同じダミー入力でモデルを実行し、ORT のプロファイルトレース
+(Chrome trace 形式の JSON) を演算子種別・ノード・モデル領域ごとに集計する。
+
+モデル領域はエクスポート時のノード名 (モジュールのスコープ) から判定する:
+- SBV2: text_encoder (enc_p) / duration_predictor (dp, sdp) / flow / decoder (dec) / speaker (emb_g)
+- DeBERTa: embeddings / layer.N (エンコーダ層ごと)
+ORT のグラフ最適化で融合・生成されたノードは名前から判定できないことがある (other)。
+
+出力:
+- 演算子種別・領域・ノードの上位 (1 回あたりの平均時間と割合) を表示
+- <output-dir>/<model>_len<N>.folded: flamegraph.pl / speedscope で読める collapsed stack
+  (ノード名のスコープを階層とし、値はマイクロ秒)
+- <output-dir>/<model>_len<N>.json: 集計結果
+
+使用方法:
+    uv run python profile_onnx.py --model sbv2_model.onnx --type tts --lengths 64 256
+    uv run python profile_onnx.py --model deberta_fp16.onnx --type bert --lengths 128 \
+        --output-dir profile/
+    flamegraph.pl profile/deberta_fp16_len128.folded > deberta.svg
+"""
+
+import argparse
+import json
+import tempfile
+from collections import defaultdict
+from pathlib import Path
+
+import onnxruntime as ort
+
+from benchmark_onnx import OPT_LEVELS
+from validate_onnx import cast_feeds, make_bert_feeds, make_tts_feeds
+
+# SynthesizerTrn の属性名 → 領域名
+SBV2_REGIONS = {
+    "enc_p": "text_encoder",
+    "dp": "duration_predictor",
+    "sdp": "duration_predictor",
+    "flow": "flow",
+    "dec": "decoder",
+    "emb_g": "speaker",
+}
+
+KERNEL_SUFFIX = "_kernel_time"
+
+
+def node_region(node_name: str) -> str:
+    """ノード名 (/enc_p/encoder/attn_layers.0/MatMul など) からモデル領域を求める。"""
+    scopes = [part for part in node_name.split("/") if part][:-1]
+    for scope in scopes:
+        if scope in SBV2_REGIONS:
+            return SBV2_REGIONS[scope]
+    for scope in scopes:
+        if scope.startswith("layer."):
+            return scope
+    if "embeddings" in scopes:
+        return "embeddings"
+    return "other"
+
+
+def node_stack(node_name: str, op_type: str) -> list[str]:
+    """flame graph 用のスタック (スコープ + 演算子種別)。"""
+    scopes = [part for part in node_name.split("/") if part][:-1]
+    return [node_region(node_name), *scopes, op_type]
+
+
+def profile_session(
+    model_path: str,
+    feeds: dict,
+    runs: int,
+    warmup: int,
+    opt_level: str,
+    intra_op_num_threads: int = 0,
+) -> list[dict]:
+    """プロファイリングを有効にして warmup + runs 回実行し、計測対象のノード実行イベントを返す。
+
+    warmup も同じセッションで実行し (計測対象のセッションを温めるため)、
+    トレースから最初の warmup 回の model_run のイベントを除く。
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        options = ort.SessionOptions()
+        options.graph_optimization_level = OPT_LEVELS[opt_level]
+        options.intra_op_num_threads = intra_op_num_threads
+        options.enable_profiling = True
+        options.profile_file_prefix = str(Path(tmp_dir) / "ort_profile")
+        session = ort.InferenceSession(
+            model_path, sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        feeds = cast_feeds(session, feeds)
+        for _ in range(warmup + runs):
+            session.run(None, feeds)
+        trace_path = session.end_profiling()
+        trace = json.loads(Path(trace_path).read_text())
+
+    run_starts = sorted(
+        event["ts"] for event in trace
+        if event.get("cat") == "Session" and event["name"] == "model_run"
+    )
+    if len(run_starts) != warmup + runs:
+        raise RuntimeError(
+            f"Expected {warmup + runs} model_run events in the trace, got {len(run_starts)}"
+        )
+    timed_start = run_starts[warmup]
+
+    events = []
+    for event in trace:
+        if event.get("cat") != "Node" or not event["name"].endswith(KERNEL_SUFFIX):
+            continue
+        if event["ts"] < timed_start:
+            continue
+        events.append({
+            "node": event["name"][: -len(KERNEL_SUFFIX)],
+            "op_type": event["args"].get("op_name", "?"),
+            "dur_us": event["dur"],
+        })
+    return events
+
+
+def aggregate(events: list[dict], runs: int) -> dict:
+    """演算子種別・領域・ノードごとの 1 回あたりの時間 (マイクロ秒) を集計する。"""
+    by_op: dict[str, float] = defaultdict(float)
+    by_region: dict[str, float] = defaultdict(float)
+    by_node: dict[str, float] = defaultdict(float)
+    node_op = {}
+    stacks: dict[str, float] = defaultdict(float)
+    for event in events:
+        dur = event["dur_us"] / runs
+        by_op[event["op_type"]] += dur
+        by_region[node_region(event["node"])] += dur
+        by_node[event["node"]] += dur
+        node_op[event["node"]] = event["op_type"]
+        stacks[";".join(node_stack(event["node"], event["op_type"]))] += dur
+
+    total = sum(by_op.values())
+
+    def ranked(values: dict[str, float]) -> list[dict]:
+        return [
+            {"name": name, "us": round(us, 1), "share": round(us / total, 4) if total else 0.0}
+            for name, us in sorted(values.items(), key=lambda item: -item[1])
+        ]
+
+    nodes = ranked(by_node)
+    for row in nodes:
+        row["op_type"] = node_op[row["name"]]
+    return {
+        "total_us": round(total, 1),
+        "by_op_type": ranked(by_op),
+        "by_region": ranked(by_region),
+        "by_node": nodes,
+        "stacks": stacks,
+    }
+
+
+def print_table(title: str, rows: list[dict], top: int) -> None:
+    print(f"\n{title}")
+    for row in rows[:top]:
+        name = row["name"]
+        if len(name) > 60:
+            name = "..." + name[-57:]
+        suffix = f"  [{row['op_type']}]" if "op_type" in row else ""
+        print(f"  {name:<60} {row['us'] / 1000:>9.3f}ms {row['share']:>7.1%}{suffix}")
+
+
+def write_folded(path: Path, stacks: dict[str, float]) -> None:
+    """collapsed stack 形式 ("a;b;c <値>") で書き出す。値は整数のマイクロ秒。"""
+    lines = [f"{stack} {round(us)}" for stack, us in sorted(stacks.items()) if round(us) > 0]
+    path.write_text("\n".join(lines) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-operator ONNX Runtime profiling report")
+    parser.add_argument("--model", type=str, required=True, help="ONNX model path")
+    parser.add_argument(
+        "--type", type=str, required=True, choices=["bert", "tts"], help="Model type"
+    )
+    parser.add_argument(
+        "--lengths", type=int, nargs="+", default=[64],
+        help="Token (bert) or phoneme (tts) lengths to profile",
+    )
+    parser.add_argument("--runs", type=int, default=10, help="Profiled runs per length")
+    parser.add_argument("--warmup", type=int, default=3, help="Warmup runs per length")
+    parser.add_argument(
+        "--opt-level", type=str, choices=list(OPT_LEVELS), default="all",
+        help="Graph optimization level ('disable' keeps export node names for region mapping)",
+    )
+    parser.add_argument(
+        "--intra-threads", type=int, default=0, help="intra_op_num_threads (0 = ORT default)"
+    )
+    parser.add_argument("--top", type=int, default=15, help="Rows per hot-spot table")
+    parser.add_argument(
+        "--output-dir", type=str, default="profile", help="Directory for .folded / .json"
+    )
+    args = parser.parse_args()
+
+    model_path = Path(args.model)
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    for length in args.lengths:
+        feeds = make_bert_feeds(length) if args.type == "bert" else make_tts_feeds(length)
+        events = profile_session(
+            str(model_path), feeds, args.runs, args.warmup, args.opt_level, args.intra_threads
+        )
+        summary = aggregate(events, args.runs)
+
+        print(f"\n=== {model_path.name} length={length} ({args.opt_level}) ===")
+        print(f"Total kernel time per run: {summary['total_us'] / 1000:.3f}ms")
+        print_table("By region:", summary["by_region"], args.top)
+        print_table("By op type:", summary["by_op_type"], args.top)
+        print_table("Hot nodes:", summary["by_node"], args.top)
+
+        stem = f"{model_path.stem}_len{length}"
+        write_folded(output_dir / f"{stem}.folded", summary.pop("stacks"))
+        summary.update({"model": str(model_path), "length": length, "runs": args.runs,
+                        "opt_level": args.opt_level})
+        (output_dir / f"{stem}.json").write_text(json.dumps(summary, indent=2))
+        print(f"\nWritten: {output_dir / stem}.folded / .json")
+
+
+if __name__ == "__main__":
+    main()
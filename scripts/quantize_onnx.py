@@ -0,0 +1,212 @@
+"""
+ONNX モデルの INT8 量子化ユーティリティ (ONNX Runtime 向け)
+
+量子化モード:
+- dynamic: 重みのみ INT8 化し、活性は実行時に量子化 (キャリブレーション不要)
+- static: キャリブレーション入力で活性のレンジを求め、QDQ 形式で量子化
+
+精度ゲート:
+    量子化前の FP32 モデルと出力を比較し、相対誤差 (L2) が予算を超えた場合は
+    出力ファイルを削除して失敗とする (AccuracyGateError)。static モードでは
+    キャリブレーションデータの一部 (split_holdout) をレンジ推定に使わずゲート専用にする。
+
+INT8 モデルは ORT 専用 (Sentis は DynamicQuantizeLinear / QLinear 系を扱えない) のため、
+int64→int32 変換と FP16 変換は行わない。
+
+キャリブレーションデータ (--calibration-dir):
+    *.txt: 1 行 1 文のサンプル文 (DeBERTa 用。HF トークナイザでトークナイズする)
+    *.npz: 入力名をキーとする前処理済み feeds (SBV2 用。G2P/BERT 済みの入力を保存したもの)
+"""
+
+from pathlib import Path
+
+import numpy as np
+import onnx
+from onnxruntime.quantization import (
+    CalibrationDataReader,
+    QuantFormat,
+    QuantType,
+    quantize_dynamic,
+    quantize_static,
+)
+
+from validate_onnx import cast_feeds, create_session, make_tts_feeds
+
+QUANTIZE_MODES = ("dynamic", "static")
+# static モードで精度ゲート用に取り分ける間隔 (4 件に 1 件)
+GATE_HOLDOUT_EVERY = 4
+
+
+class AccuracyGateError(ValueError):
+    """量子化モデルの誤差が予算を超えた (出力ファイルは削除済み)。"""
+
+
+class FeedListReader(CalibrationDataReader):
+    """feeds のリストを順に返すキャリブレーションリーダー。
+
+    feeds はモデルの入力型にキャストする (*.npz の int32 入力を int64 入力のモデルに渡すため)。
+    """
+
+    def __init__(self, feeds_list: list[dict[str, np.ndarray]], model_path: str):
+        self._session = create_session(model_path)
+        self._iter = iter(feeds_list)
+
+    def get_next(self) -> dict[str, np.ndarray] | None:
+        feeds = next(self._iter, None)
+        return None if feeds is None else cast_feeds(self._session, feeds)
+
+
+def load_calibration_sentences(calibration_dir: Path) -> list[str]:
+    """ディレクトリ内の *.txt からサンプル文を読み込む (空行は無視)。"""
+    sentences = []
+    for path in sorted(calibration_dir.glob("*.txt")):
+        for line in path.read_text(encoding="utf-8").splitlines():
+            if line.strip():
+                sentences.append(line.strip())
+    return sentences
+
+
+def load_calibration_feeds(calibration_dir: Path) -> list[dict[str, np.ndarray]]:
+    """ディレクトリ内の *.npz から前処理済み feeds を読み込む。"""
+    feeds_list = []
+    for path in sorted(calibration_dir.glob("*.npz")):
+        with np.load(path) as data:
+            feeds_list.append({name: data[name] for name in data.files})
+    return feeds_list
+
+
+def make_tts_gate_feeds(
+    lengths: tuple[int, ...] = (16, 64, 128), seed: int = 0
+) -> list[dict[str, np.ndarray]]:
+    """SBV2 精度ゲート用のランダム feeds (キャリブレーションデータがない場合)。"""
+    rng = np.random.default_rng(seed)
+    feeds_list = []
+    for seq_len in lengths:
+        feeds = make_tts_feeds(seq_len)
+        feeds["x_tst"] = rng.integers(1, 100, size=(1, seq_len)).astype(np.int32)
+        bert = rng.standard_normal((1, 1024, seq_len)).astype(np.float32)
+        feeds["bert"] = feeds["ja_bert"] = bert
+        feeds["style_vec"] = rng.standard_normal((1, 256)).astype(np.float32) * 0.1
+        feeds_list.append(feeds)
+    return feeds_list
+
+
+def deterministic_feeds(feeds: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    """SBV2 のノイズ入力を 0 にした feeds を返す (FP32 と INT8 の出力を比較するため)。"""
+    result = dict(feeds)
+    for name in ("noise_scale", "noise_scale_w"):
+        if name in result:
+            result[name] = np.zeros_like(result[name])
+    return result
+
+
+def relative_error(reference: np.ndarray, output: np.ndarray) -> float:
+    """相対 L2 誤差。最終軸の長さが異なる場合 (音声長の変化) はゼロ埋めして比較する。"""
+    reference = reference.astype(np.float32)
+    output = output.astype(np.float32)
+    length = max(reference.shape[-1], output.shape[-1])
+
+    def pad(a: np.ndarray) -> np.ndarray:
+        return np.pad(a, [(0, 0)] * (a.ndim - 1) + [(0, length - a.shape[-1])])
+
+    reference, output = pad(reference), pad(output)
+    denom = max(float(np.linalg.norm(reference)), 1e-8)
+    return float(np.linalg.norm(reference - output)) / denom
+
+
+def split_holdout(
+    feeds_list: list[dict[str, np.ndarray]], every: int = GATE_HOLDOUT_EVERY
+) -> tuple[list[dict[str, np.ndarray]], list[dict[str, np.ndarray]]]:
+    """feeds を (キャリブレーション用, 精度ゲート用) に分ける (every 件に 1 件、最低 1 件をゲート用)。
+
+    static 量子化はキャリブレーション入力に合わせて活性のレンジを決めるため、
+    同じ入力でゲートすると誤差を過小評価する。
+    """
+    if len(feeds_list) < 2:
+        raise ValueError(
+            "Static quantization needs at least 2 calibration inputs "
+            "(some are held out for the accuracy gate)"
+        )
+    held_out = set(range(every - 1, len(feeds_list), every)) or {len(feeds_list) - 1}
+    calibration = [f for i, f in enumerate(feeds_list) if i not in held_out]
+    gate = [f for i, f in enumerate(feeds_list) if i in held_out]
+    return calibration, gate
+
+
+def accuracy_gate(
+    reference_path: str,
+    quantized_path: str,
+    feeds_list: list[dict[str, np.ndarray]],
+) -> list[float]:
+    """FP32 モデルと量子化モデルの出力誤差を feeds ごとに返す。"""
+    reference = create_session(reference_path)
+    quantized = create_session(quantized_path)
+    errors = []
+    for feeds in feeds_list:
+        ref_out = reference.run(None, cast_feeds(reference, feeds))[0]
+        q_out = quantized.run(None, cast_feeds(quantized, feeds))[0]
+        errors.append(relative_error(ref_out, q_out))
+    return errors
+
+
+def quantize_with_gate(
+    model: onnx.ModelProto,
+    output_path: Path,
+    mode: str,
+    gate_feeds: list[dict[str, np.ndarray]],
+    max_error: float,
+    calibration_feeds: list[dict[str, np.ndarray]] | None = None,
+) -> None:
+    """FP32 モデルを INT8 量子化し、精度ゲートを通った場合のみ output_path に残す。
+
+    量子化・精度ゲートのどこで失敗しても output_path は削除してから例外を送出する。
+
+    Raises:
+        ValueError: static モードでキャリブレーションデータがない場合
+        AccuracyGateError: 誤差が max_error を超えた場合
+    """
+    if mode not in QUANTIZE_MODES:
+        raise ValueError(f"Unknown quantize mode: {mode}")
+    if mode == "static" and not calibration_feeds:
+        raise ValueError("Static quantization requires calibration data (--calibration-dir)")
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    reference_path = output_path.with_suffix(".fp32.temp.onnx")
+    onnx.save(model, str(reference_path))
+
+    try:
+        if mode == "dynamic":
+            print("Quantizing to INT8 (dynamic)...")
+            quantize_dynamic(
+                str(reference_path), str(output_path), weight_type=QuantType.QInt8
+            )
+        else:
+            print(f"Quantizing to INT8 (static, {len(calibration_feeds)} calibration inputs)...")
+            quantize_static(
+                str(reference_path),
+                str(output_path),
+                FeedListReader(calibration_feeds, str(reference_path)),
+                quant_format=QuantFormat.QDQ,
+                activation_type=QuantType.QUInt8,
+                weight_type=QuantType.QInt8,
+                per_channel=True,
+            )
+
+        print(f"Running accuracy gate ({len(gate_feeds)} inputs)...")
+        errors = accuracy_gate(str(reference_path), str(output_path), gate_feeds)
+        worst = max(errors)
+        print(
+            f"  Relative error vs FP32: mean {np.mean(errors):.4f}, "
+            f"worst {worst:.4f} (budget {max_error:.4f})"
+        )
+        if worst > max_error:
+            raise AccuracyGateError(
+                f"INT8 model rejected: relative error {worst:.4f} exceeds budget {max_error:.4f}"
+            )
+    except BaseException:
+        # 量子化やゲートの途中で失敗した場合も、検証されていない出力を残さない
+        output_path.unlink(missing_ok=True)
+        raise
+    finally:
+        reference_path.unlink(missing_ok=True)
+    print(f"Done! Model size: {output_path.stat().st_size / 1024 / 1024:.1f} MB")
@@ -0,0 +1,288 @@
+"""
+リテイク用のエンコーダ出力キャッシュ
+
+サウンドデザイナーは同じセリフを noise_scale / noise_scale_w / sdp_ratio / length_scale
+だけ変えて何度も再合成する。monolithic モデルではリテイクごとに BERT と infer 全体を
+再実行するが、テキストエンコーダの出力はこれらのパラメータに依存しない。
+
+処理フロー:
+1. convert_sbv2_for_sentis.py --retake-split で出力した 2 つのグラフをロード
+   - <stem>_encoder.onnx: emb_g + テキストエンコーダ (→ hidden, m_p, logs_p, x_mask)
+   - <stem>_retake.onnx: duration predictor + flow + デコーダ (→ output)
+2. (テキスト, スタイル, 話者) をキーに BERT + エンコーダを 1 回だけ実行し、出力を LRU で保持
+   (キーは前処理済みテンソル・style_vec・speaker_id の sha256 で、制御パラメータは含まない)
+3. リテイクでは retake グラフのみを実行する
+4. スクリプト実行時は BERT + infer 全体 (monolithic / キャッシュなし) とリテイク 1 回あたりの時間を比較
+
+使用方法:
+    synth = RetakeSynthesizer("deberta_fp16.onnx", "sbv2_model_encoder.onnx",
+                              "sbv2_model_retake.onnx")
+    for noise_scale in (0.4, 0.6, 0.8):
+        audio = synth.synthesize(replace(request, noise_scale=noise_scale))
+
+    uv run python retake_cache.py --bert deberta_fp16.onnx \
+        --encoder sbv2_model_encoder.onnx --retake sbv2_model_retake.onnx \
+        --model sbv2_model.onnx --retakes 16
+"""
+
+import argparse
+import hashlib
+import time
+from collections import OrderedDict
+from dataclasses import replace
+from pathlib import Path
+
+import numpy as np
+
+from audio_postprocess import write_audio
+from bert_cache import BertFeatureStore, model_digest
+from quantize_onnx import relative_error
+from synthesis_server import (
+    BertRunner,
+    SynthesisRequest,
+    control_feeds,
+    load_requests,
+    make_dummy_requests,
+    request_feeds,
+)
+from validate_onnx import cast_feeds, create_session
+
+# テキストエンコーダ出力 (キャッシュの単位) の名前。convert_sbv2_for_sentis.py の
+# --retake-split エクスポートもこの定義を使う
+ENCODER_OUTPUT_NAMES = ("hidden", "m_p", "logs_p", "x_mask")
+DEFAULT_CAPACITY = 64
+
+
+def encoder_cache_key(request: SynthesisRequest) -> str:
+    """エンコーダ出力のキャッシュキー (制御パラメータを除いた入力の sha256)。"""
+    digest = hashlib.sha256()
+    for array in (
+        request.token_ids, request.phoneme_ids, request.tones, request.language, request.word2ph,
+    ):
+        digest.update(np.ascontiguousarray(array, dtype=np.int32).tobytes())
+        digest.update(b"\0")
+    digest.update(np.ascontiguousarray(request.style_vec, dtype=np.float32).tobytes())
+    digest.update(str(request.speaker_id).encode())
+    return digest.hexdigest()
+
+
+class RetakeSynthesizer:
+    """エンコーダ出力を (テキスト, スタイル, 話者) ごとにキャッシュし、リテイクを高速化する。"""
+
+    def __init__(
+        self,
+        bert_path: str,
+        encoder_path: str,
+        retake_path: str,
+        intra_op_num_threads: int = 0,
+        capacity: int = DEFAULT_CAPACITY,
+        bert_cache: BertFeatureStore | None = None,
+    ):
+        self.bert = BertRunner(bert_path, intra_op_num_threads, bert_cache)
+        print(f"Loading encoder model: {encoder_path}")
+        self.encoder_session = create_session(encoder_path, intra_op_num_threads)
+        self.encoder_input_names = {inp.name for inp in self.encoder_session.get_inputs()}
+        output_names = [out.name for out in self.encoder_session.get_outputs()]
+        if output_names != list(ENCODER_OUTPUT_NAMES):
+            raise ValueError(
+                f"{encoder_path} is not a --retake-split encoder (outputs {output_names})"
+            )
+        print(f"Loading retake model: {retake_path}")
+        self.retake_session = create_session(retake_path, intra_op_num_threads)
+        self.capacity = capacity
+        self._cache: OrderedDict[str, dict[str, np.ndarray]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def encode(self, request: SynthesisRequest) -> dict[str, np.ndarray]:
+        """BERT + エンコーダの出力 (hidden, m_p, logs_p, x_mask)。キャッシュにあれば再利用する。"""
+        key = encoder_cache_key(request)
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return cached
+
+        self.misses += 1
+        bert = self.bert.run(request.token_ids, request.word2ph, request.text)
+        feeds = request_feeds(request, bert, self.encoder_input_names)
+        outputs = self.encoder_session.run(None, cast_feeds(self.encoder_session, feeds))
+        encoded = dict(zip(ENCODER_OUTPUT_NAMES, outputs))
+        self._cache[key] = encoded
+        while len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+        return encoded
+
+    def synthesize(self, request: SynthesisRequest) -> np.ndarray:
+        """リクエストの制御パラメータで retake グラフを実行し、PCM (float32 [N]) を返す。"""
+        feeds = {
+            **self.encode(request),
+            "sid": np.array([request.speaker_id], dtype=np.int32),
+            **control_feeds(request),
+        }
+        output = self.retake_session.run(None, cast_feeds(self.retake_session, feeds))[0]
+        return output[0, 0].astype(np.float32, copy=False)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._cache),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def make_retakes(request: SynthesisRequest, count: int, seed: int = 0) -> list[SynthesisRequest]:
+    """制御パラメータだけを変えたリテイクを作成する。"""
+    rng = np.random.default_rng(seed)
+    return [
+        replace(
+            request,
+            noise_scale=float(rng.uniform(0.3, 0.9)),
+            noise_scale_w=float(rng.uniform(0.5, 1.0)),
+            sdp_ratio=float(rng.uniform(0.0, 0.6)),
+            length_scale=float(rng.uniform(0.8, 1.2)),
+        )
+        for _ in range(count)
+    ]
+
+
+def check_equivalence(
+    synth: RetakeSynthesizer, model_path: str, request: SynthesisRequest
+) -> float:
+    """ノイズ 0 で encoder + retake と monolithic の出力を比較し、相対誤差を返す。"""
+    session = create_session(model_path)
+    input_names = {inp.name for inp in session.get_inputs()}
+    deterministic = replace(request, noise_scale=0.0, noise_scale_w=0.0)
+    bert = synth.bert.run(request.token_ids, request.word2ph, request.text)
+    reference = session.run(
+        None, cast_feeds(session, request_feeds(deterministic, bert, input_names))
+    )[0]
+    return relative_error(reference[0, 0], synth.synthesize(deterministic))
+
+
+def benchmark(
+    synth: RetakeSynthesizer,
+    request: SynthesisRequest,
+    retakes: int,
+    model_path: str | None = None,
+) -> list[np.ndarray]:
+    """リテイク 1 回あたりの時間をキャッシュあり / なし (/ monolithic) で比較する。"""
+    takes = make_retakes(request, retakes)
+    phone_len = len(request.phoneme_ids)
+    print(f"\nBenchmark: phone_len={phone_len}, {retakes} retakes")
+
+    # ウォームアップ
+    synth.clear()
+    synth.synthesize(takes[0])
+
+    # キャッシュなし: 毎回 BERT + エンコーダ + retake
+    start = time.perf_counter()
+    for take in takes:
+        synth.clear()
+        synth.synthesize(take)
+    uncached_ms = (time.perf_counter() - start) * 1000 / retakes
+
+    # キャッシュあり: 最初の 1 回だけ BERT + エンコーダ
+    synth.clear()
+    start = time.perf_counter()
+    audios = [synth.synthesize(takes[0])]
+    first_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    audios += [synth.synthesize(take) for take in takes[1:]]
+    cached_ms = (time.perf_counter() - start) * 1000 / max(retakes - 1, 1)
+
+    print(f"  first take (BERT + encoder + retake): {first_ms:.1f}ms")
+    print(f"  uncached retake:                      {uncached_ms:.1f}ms")
+    print(f"  cached retake (retake graph only):    {cached_ms:.1f}ms")
+    print(
+        f"  saving per retake: {uncached_ms - cached_ms:.1f}ms "
+        f"({(1 - cached_ms / uncached_ms) * 100:.0f}%)"
+    )
+
+    if model_path:
+        session = create_session(model_path)
+        input_names = {inp.name for inp in session.get_inputs()}
+
+        def full_take(take: SynthesisRequest) -> None:
+            bert = synth.bert.run(take.token_ids, take.word2ph, take.text)
+            session.run(None, cast_feeds(session, request_feeds(take, bert, input_names)))
+
+        full_take(takes[0])
+        start = time.perf_counter()
+        for take in takes:
+            full_take(take)
+        full_ms = (time.perf_counter() - start) * 1000 / retakes
+        print(f"  monolithic (BERT + infer):            {full_ms:.1f}ms")
+        print(
+            f"  saving per retake vs monolithic: {full_ms - cached_ms:.1f}ms "
+            f"({(1 - cached_ms / full_ms) * 100:.0f}%)"
+        )
+        error = check_equivalence(synth, model_path, request)
+        print(f"  relative error vs monolithic (noise 0): {error:.2e}")
+    return audios
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Cache SBV2 text encoder outputs and re-render only duration/flow/decoder"
+    )
+    parser.add_argument("--bert", type=str, required=True, help="DeBERTa ONNX path")
+    parser.add_argument("--encoder", type=str, required=True, help="<stem>_encoder.onnx")
+    parser.add_argument("--retake", type=str, required=True, help="<stem>_retake.onnx")
+    parser.add_argument(
+        "--model", type=str, default=None,
+        help="Monolithic SBV2 ONNX to compare against (optional)",
+    )
+    parser.add_argument(
+        "--requests", type=str, default=None,
+        help="Pre-tokenized requests (JSONL, the first line is used)",
+    )
+    parser.add_argument(
+        "--style-vectors", type=str, default=None, help="style_vectors.npy path"
+    )
+    parser.add_argument("--retakes", type=int, default=16, help="Retakes per line")
+    parser.add_argument(
+        "--threads", type=int, default=0, help="ORT intra-op threads (0 = default)"
+    )
+    parser.add_argument(
+        "--bert-cache", type=str, default=None,
+        help="Persistent BERT feature cache directory (see bert_cache.py)",
+    )
+    parser.add_argument(
+        "--output-dir", type=str, default=None, help="Write each retake as WAV"
+    )
+    args = parser.parse_args()
+
+    if args.requests:
+        style_vectors = np.load(args.style_vectors) if args.style_vectors else None
+        request = load_requests(Path(args.requests), style_vectors)[0]
+    else:
+        request = make_dummy_requests(1)[0]
+
+    bert_cache = None
+    if args.bert_cache:
+        bert_cache = BertFeatureStore(Path(args.bert_cache), model_digest(Path(args.bert)))
+
+    synth = RetakeSynthesizer(
+        args.bert, args.encoder, args.retake,
+        intra_op_num_threads=args.threads, bert_cache=bert_cache,
+    )
+    audios = benchmark(synth, request, args.retakes, args.model)
+    print(f"Encoder cache: {synth.stats()}")
+    if bert_cache is not None:
+        bert_cache.close()
+
+    if args.output_dir:
+        output_dir = Path(args.output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        for i, audio in enumerate(audios):
+            write_audio(output_dir / f"retake_{i:03d}.wav", audio)
+        print(f"Wrote {len(audios)} files to: {output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+複数話者の SBV2 ONNX モデルを「共有重み + 話者ごとの差分」に分解するツール
+
+同じベースモデルからファインチューンした話者モデルは、グラフ構造が同一で
+initializer の多く (凍結した層・ファインチューンでほぼ動かなかった層) が一致する。
+
+処理フロー:
+1. 基準モデル (--models の先頭) をそのまま shared.onnx として保存
+2. 各話者モデルのグラフ構造 (initializer を除く) が基準と一致することを確認
+3. initializer を基準と比較し、差が --atol を超えるものだけを
+   <name>.override.safetensors に保存
+4. ロード時は shared.onnx に差分を SessionOptions.add_initializer で上書きして
+   InferenceSession を作成 (話者切り替えで共有部分を再読み込みしない)
+
+Sentis 向けには build_speaker_model() で話者ごとの完全な ONNX を復元できる。
+
+使用方法:
+    uv run python shared_weights.py \
+        --models voices/a/sbv2_model.onnx voices/b/sbv2_model.onnx voices/c/sbv2_model.onnx \
+        --output-dir shared/ --check
+"""
+
+import argparse
+import hashlib
+import json
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import onnx
+import onnxruntime as ort
+from onnx import numpy_helper
+from safetensors.numpy import load_file, save_file
+
+from onnx_io import model_size_mb, save_model
+from quantize_onnx import deterministic_feeds, relative_error
+from validate_onnx import cast_feeds, create_session, make_tts_feeds
+
+SHARED_MODEL_NAME = "shared.onnx"
+OVERRIDE_SUFFIX = ".override.safetensors"
+
+
+def graph_signature(model: onnx.ModelProto) -> str:
+    """initializer の値を除いたグラフ構造のハッシュ (名前・shape・dtype は含める)。"""
+    graph = onnx.GraphProto()
+    graph.CopyFrom(model.graph)
+    for tensor in graph.initializer:
+        tensor.ClearField("raw_data")
+        for field in ("float_data", "int32_data", "int64_data", "double_data", "external_data"):
+            tensor.ClearField(field)
+        tensor.data_location = onnx.TensorProto.DEFAULT
+    return hashlib.sha256(graph.SerializeToString(deterministic=True)).hexdigest()
+
+
+def _initializer_arrays(model: onnx.ModelProto) -> dict[str, np.ndarray]:
+    return {tensor.name: numpy_helper.to_array(tensor) for tensor in model.graph.initializer}
+
+
+def find_overrides(
+    base: dict[str, np.ndarray], speaker: dict[str, np.ndarray], atol: float = 0.0
+) -> dict[str, np.ndarray]:
+    """基準と差が atol を超える initializer を返す (atol=0 は完全一致のみ共有)。"""
+    overrides = {}
+    for name, value in speaker.items():
+        ref = base[name]
+        if value.dtype.kind == "f":
+            diff = np.abs(value.astype(np.float32) - ref.astype(np.float32))
+            if diff.size and float(diff.max()) > atol:
+                overrides[name] = value
+        elif not np.array_equal(value, ref):
+            overrides[name] = value
+    return overrides
+
+
+def speaker_names(model_paths: list[Path]) -> list[str]:
+    """モデルのファイル名 (重複する場合は親ディレクトリ名) を話者名とする。"""
+    stems = [path.stem for path in model_paths]
+    if len(set(stems)) == len(stems):
+        return stems
+    return [path.parent.name for path in model_paths]
+
+
+def build_shared_weights(
+    model_paths: list[Path],
+    output_dir: Path,
+    names: list[str] | None = None,
+    atol: float = 0.0,
+) -> dict:
+    """先頭のモデルを基準に共有モデルと話者ごとの差分ファイルを書き出し、マニフェストを返す。"""
+    names = names or speaker_names(model_paths)
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate speaker names: {names}")
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    print(f"Loading base model: {model_paths[0]}")
+    base_model = onnx.load(str(model_paths[0]))
+    signature = graph_signature(base_model)
+    base = _initializer_arrays(base_model)
+    base_bytes = sum(value.nbytes for value in base.values())
+
+    shared_path = output_dir / SHARED_MODEL_NAME
+    save_model(base_model, shared_path)
+    del base_model
+
+    manifest = {"shared": SHARED_MODEL_NAME, "atol": atol, "speakers": {}}
+    original_mb = 0.0
+    for name, path in zip(names, model_paths):
+        original_mb += model_size_mb(path)
+        model = onnx.load(str(path))
+        if graph_signature(model) != signature:
+            raise ValueError(f"Graph structure of {path} differs from {model_paths[0]}")
+        overrides = find_overrides(base, _initializer_arrays(model), atol)
+        del model
+
+        override_path = output_dir / f"{name}{OVERRIDE_SUFFIX}"
+        save_file(overrides, str(override_path))
+        override_bytes = sum(value.nbytes for value in overrides.values())
+        print(
+            f"  {name}: {len(overrides)}/{len(base)} initializers overridden "
+            f"({override_bytes / 1024 / 1024:.1f} MB of {base_bytes / 1024 / 1024:.1f} MB)"
+        )
+        manifest["speakers"][name] = {
+            "override": override_path.name,
+            "source": str(path),
+            "overridden": len(overrides),
+        }
+
+    (output_dir / "manifest.json").write_text(json.dumps(manifest, indent=2))
+    shared_mb = model_size_mb(shared_path) + sum(
+        (output_dir / entry["override"]).stat().st_size / 1024 / 1024
+        for entry in manifest["speakers"].values()
+    )
+    print(f"\nTotal size: {original_mb:.1f} MB -> {shared_mb:.1f} MB")
+    return manifest
+
+
+@dataclass
+class SpeakerSession:
+    """話者のセッションと、add_initializer で渡した差分のバッファ。
+
+    add_initializer はバッファをコピーしないため、override_values (OrtValue と元の配列) を
+    セッションと同じ寿命で保持する。
+    """
+
+    session: ort.InferenceSession
+    override_values: list[ort.OrtValue]
+
+
+class SharedWeightLoader:
+    """共有モデルと話者ごとの差分から InferenceSession を作成する。"""
+
+    def __init__(self, shared_dir: Path, intra_op_num_threads: int = 0):
+        self.shared_dir = shared_dir
+        self.manifest = json.loads((shared_dir / "manifest.json").read_text())
+        self.shared_path = shared_dir / self.manifest["shared"]
+        self.intra_op_num_threads = intra_op_num_threads
+
+    @property
+    def speakers(self) -> list[str]:
+        return list(self.manifest["speakers"])
+
+    def load_overrides(self, speaker: str) -> dict[str, np.ndarray]:
+        entry = self.manifest["speakers"][speaker]
+        return load_file(str(self.shared_dir / entry["override"]))
+
+    def create_session(self, speaker: str) -> SpeakerSession:
+        """話者の差分を add_initializer で上書きしたセッションを作成する。"""
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.intra_op_num_threads
+        values = []
+        for name, value in self.load_overrides(speaker).items():
+            ort_value = ort.OrtValue.ortvalue_from_numpy(np.ascontiguousarray(value))
+            options.add_initializer(name, ort_value)
+            values.append(ort_value)
+        session = ort.InferenceSession(
+            str(self.shared_path), sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        return SpeakerSession(session, values)
+
+    def build_speaker_model(self, speaker: str) -> onnx.ModelProto:
+        """差分を適用した話者の完全な ModelProto を返す (Sentis へのインポート用)。"""
+        model = onnx.load(str(self.shared_path))
+        overrides = self.load_overrides(speaker)
+        for tensor in model.graph.initializer:
+            if tensor.name in overrides:
+                tensor.CopyFrom(numpy_helper.from_array(overrides[tensor.name], tensor.name))
+        return model
+
+
+def check_parity(loader: SharedWeightLoader, seq_len: int = 16) -> list[float]:
+    """差分から作ったセッションと元モデルの出力を比較し、話者ごとの相対誤差を返す。"""
+    feeds = deterministic_feeds(make_tts_feeds(seq_len))
+    errors = []
+    for speaker in loader.speakers:
+        original = create_session(loader.manifest["speakers"][speaker]["source"])
+        speaker_session = loader.create_session(speaker)
+        rebuilt = speaker_session.session
+        ref = original.run(None, cast_feeds(original, feeds))[0]
+        out = rebuilt.run(None, cast_feeds(rebuilt, feeds))[0]
+        error = relative_error(ref, out)
+        print(f"  {speaker}: relative error {error:.6f}")
+        errors.append(error)
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Split speaker ONNX models into shared weights and per-speaker overrides"
+    )
+    parser.add_argument(
+        "--models", type=str, nargs="+", required=True,
+        help="Speaker ONNX models (the first one is used as the shared base)",
+    )
+    parser.add_argument(
+        "--names", type=str, nargs="+", default=None,
+        help="Speaker names (default: file stem or parent directory name)",
+    )
+    parser.add_argument("--output-dir", type=str, required=True, help="Output directory")
+    parser.add_argument(
+        "--atol",
+        type=float,
+        default=0.0,
+        help="Share initializers whose max abs difference is <= atol (lossy if > 0)",
+    )
+    parser.add_argument(
+        "--check", action="store_true",
+        help="Compare rebuilt sessions with the original models using ONNX Runtime",
+    )
+    args = parser.parse_args()
+
+    model_paths = [Path(p) for p in args.models]
+    if args.names and len(args.names) != len(model_paths):
+        parser.error("--names must have the same length as --models")
+
+    output_dir = Path(args.output_dir)
+    build_shared_weights(model_paths, output_dir, names=args.names, atol=args.atol)
+
+    if args.check:
+        print("\nChecking rebuilt sessions...")
+        check_parity(SharedWeightLoader(output_dir))
+
+
+if __name__ == "__main__":
+    main()
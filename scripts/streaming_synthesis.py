@@ -0,0 +1,176 @@
+"""
+分割エクスポートした SBV2 (flow + decoder) によるストリーミング合成ドライバ
+
+処理フロー:
+1. <stem>_flow.onnx で潜在表現 z [1, inter_channels, frames] を一括計算
+2. z をフレーム方向のウィンドウに分割し、前後に context フレームを付けて decoder を実行
+3. context 部分のサンプルを捨て、中央部分の PCM を完成した順に yield
+   (最初のチャンクは --first-chunk-frames で小さくして first-chunk latency を下げる)
+
+HiFi-GAN 系デコーダは畳み込みのみで受容野が有限なため、
+context を十分に取れば連結結果は一括デコードとほぼ一致する (--check で確認し、
+最大誤差が --max-diff を超えるか長さが異なれば終了コード 1)。
+
+使用方法:
+    uv run python convert_sbv2_for_sentis.py --repo <hf-repo-id> --split
+    uv run python streaming_synthesis.py \
+        --flow sbv2_model_flow.onnx --decoder sbv2_model_decoder.onnx --check
+"""
+
+import argparse
+import time
+from collections.abc import Iterator
+
+import numpy as np
+
+from validate_onnx import cast_feeds, create_session, make_tts_feeds
+
+
+class StreamingSynthesizer:
+    """flow グラフと decoder グラフを保持し、PCM をチャンク単位で生成する。"""
+
+    def __init__(
+        self,
+        flow_path: str,
+        decoder_path: str,
+        chunk_frames: int = 32,
+        context_frames: int = 8,
+        first_chunk_frames: int | None = None,
+        intra_op_num_threads: int = 0,
+    ):
+        if chunk_frames <= 0 or context_frames < 0:
+            raise ValueError("chunk_frames must be > 0 and context_frames >= 0")
+        print(f"Loading flow model: {flow_path}")
+        self.flow_session = create_session(flow_path, intra_op_num_threads)
+        print(f"Loading decoder model: {decoder_path}")
+        self.decoder_session = create_session(decoder_path, intra_op_num_threads)
+        self.chunk_frames = chunk_frames
+        self.context_frames = context_frames
+        self.first_chunk_frames = first_chunk_frames or chunk_frames
+
+    def run_flow(self, feeds: dict[str, np.ndarray]) -> np.ndarray:
+        """enc_p + duration predictor + flow。戻り値 z [1, inter_channels, frames]。"""
+        return self.flow_session.run(None, cast_feeds(self.flow_session, feeds))[0]
+
+    def decode(self, z: np.ndarray, sid: np.ndarray) -> np.ndarray:
+        """z [1, C, frames] をデコードし PCM [samples] を返す。"""
+        feeds = {"z": z.astype(np.float32, copy=False), "sid": sid}
+        output = self.decoder_session.run(None, cast_feeds(self.decoder_session, feeds))[0]
+        return output[0, 0]
+
+    def windows(self, frames: int) -> Iterator[tuple[int, int]]:
+        """デコード対象の [start, end) フレーム区間を順に返す。"""
+        start = 0
+        size = self.first_chunk_frames
+        while start < frames:
+            end = min(start + size, frames)
+            yield start, end
+            start = end
+            size = self.chunk_frames
+
+    def stream_latent(self, z: np.ndarray, sid: np.ndarray) -> Iterator[np.ndarray]:
+        """z をウィンドウごとにデコードし、完成した PCM チャンクを yield する。"""
+        frames = z.shape[2]
+        hop = None
+        for start, end in self.windows(frames):
+            ctx_start = max(0, start - self.context_frames)
+            ctx_end = min(frames, end + self.context_frames)
+            audio = self.decode(z[:, :, ctx_start:ctx_end], sid)
+            if hop is None:
+                # 1 フレームあたりのサンプル数 (= prod(upsample_rates))
+                hop = audio.shape[0] // (ctx_end - ctx_start)
+            left = (start - ctx_start) * hop
+            yield audio[left : left + (end - start) * hop]
+
+    def stream(self, feeds: dict[str, np.ndarray]) -> Iterator[np.ndarray]:
+        """monolithic モデルと同じ feeds から PCM チャンクを順に生成する。"""
+        z = self.run_flow(feeds)
+        yield from self.stream_latent(z, feeds["sid"])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Streaming SBV2 synthesis with split flow/decoder ONNX graphs"
+    )
+    parser.add_argument("--flow", type=str, required=True, help="Flow ONNX path")
+    parser.add_argument("--decoder", type=str, required=True, help="Decoder ONNX path")
+    parser.add_argument(
+        "--seq-len", type=int, default=64, help="Dummy phoneme sequence length"
+    )
+    parser.add_argument(
+        "--chunk-frames", type=int, default=32, help="Latent frames per chunk"
+    )
+    parser.add_argument(
+        "--context-frames",
+        type=int,
+        default=8,
+        help="Overlap frames decoded on each side of a chunk and discarded",
+    )
+    parser.add_argument(
+        "--first-chunk-frames",
+        type=int,
+        default=None,
+        help="Frames in the first chunk (default: --chunk-frames)",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Compare concatenated chunks with a single full decode (exit 1 on mismatch)",
+    )
+    parser.add_argument(
+        "--max-diff",
+        type=float,
+        default=1e-2,
+        help="Max abs sample difference allowed by --check (default: 0.01)",
+    )
+    args = parser.parse_args()
+
+    synth = StreamingSynthesizer(
+        args.flow,
+        args.decoder,
+        chunk_frames=args.chunk_frames,
+        context_frames=args.context_frames,
+        first_chunk_frames=args.first_chunk_frames,
+    )
+    feeds = make_tts_feeds(args.seq_len)
+
+    start = time.perf_counter()
+    z = synth.run_flow(feeds)
+    flow_elapsed = time.perf_counter() - start
+    print(f"\nLatent frames: {z.shape[2]} (flow {flow_elapsed * 1000:.1f}ms)")
+
+    chunks = []
+    first_chunk_latency = None
+    for chunk in synth.stream_latent(z, feeds["sid"]):
+        if first_chunk_latency is None:
+            first_chunk_latency = time.perf_counter() - start
+        chunks.append(chunk)
+    total = time.perf_counter() - start
+    audio = np.concatenate(chunks)
+
+    print(f"Chunks: {len(chunks)}, samples: {audio.shape[0]}")
+    print(f"First chunk latency: {first_chunk_latency * 1000:.1f}ms")
+    print(f"Total latency: {total * 1000:.1f}ms")
+
+    if args.check:
+        start = time.perf_counter()
+        full = synth.decode(z, feeds["sid"])
+        full_elapsed = time.perf_counter() - start
+        n = min(full.shape[0], audio.shape[0])
+        diff = np.abs(full[:n] - audio[:n])
+        print(f"Full decode: {full_elapsed * 1000:.1f}ms, samples: {full.shape[0]}")
+        print(f"Max abs diff: {diff.max():.6f}, mean abs diff: {diff.mean():.6f}")
+        if full.shape[0] != audio.shape[0]:
+            raise SystemExit(
+                f"Streamed length {audio.shape[0]} differs from full decode {full.shape[0]}"
+            )
+        if not diff.max() <= args.max_diff:
+            raise SystemExit(
+                f"Streamed audio differs from full decode: max abs diff {diff.max():.6f} "
+                f"> {args.max_diff} (increase --context-frames)"
+            )
+        print("Check passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,555 @@
+"""
+ONNX Runtime によるバッチ合成サービス (ヘッドレス / オフライン音声生成向け)
+
+処理フロー:
+1. DeBERTa / SynthesizerTrn の ONNX を一度だけロード
+2. submit() で受け付けたリクエストをキューに積む
+3. バッチウィンドウ内に到着したリクエストをまとめる
+   (SBV2 の scalar 入力はバッチ共通のため、制御パラメータが同じものだけを束ねる)
+4. BERT 推論 (batch=1 固定のためリクエスト単位) → word2ph アライメント
+   (--fuse-alignment で変換した BERT はグラフ内で展開。
+    --bert-cache 指定時は text をキーに永続キャッシュから引く。
+    --bert-window 指定時はそれより長いトークン列を重なり付きウィンドウで推論)
+5. x_tst_max_length までパディングし、SBV2 の batch_size 動的軸で一括推論
+6. 各行を audio_lengths 出力 (durations から求めた有効サンプル数) で切り、
+   末尾無音をトリムしてリクエストごとの PCM を返す (全行の無音判定を一括で行う)
+7. スループット (音声秒 / 経過秒) を集計
+
+使用方法:
+    uv run python synthesis_server.py \
+        --bert deberta_fp16.onnx --tts sbv2_model.onnx \
+        --requests requests.jsonl --style-vectors style_vectors.npy
+
+    # ダミー入力でのスループット計測
+    uv run python synthesis_server.py \
+        --bert deberta_fp16.onnx --tts sbv2_model.onnx --num-dummy 64
+
+前提:
+    - SBV2 は動的軸付き (--no-dynamic なし) でエクスポートされていること
+    - audio_lengths 出力のない古いエクスポートはバッチサイズ 1 で実行する
+      (パディング行の末尾が無音になる保証がないため)
+    - requests.jsonl の各行は G2P/トークナイズ済みの入力
+      (token_ids, phoneme_ids, tones, language, word2ph は add_blank 適用後の値)
+"""
+
+import argparse
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+
+from audio_postprocess import FORMATS, trimmed_lengths, write_audio
+from bert_cache import BertFeatureStore, model_digest
+from chunked_bert import ChunkedBert
+from text_tensors import (
+    adjust_word2ph_for_blanks,
+    align_bert_to_phonemes,
+    intersperse,
+    phone_to_token_indices,
+)
+from validate_onnx import cast_feeds, create_session
+
+SAMPLE_RATE = 44100
+BERT_DIM = 1024
+STYLE_DIM = 256
+AUDIO_LENGTHS_OUTPUT = "audio_lengths"
+
+
+@dataclass
+class SynthesisRequest:
+    """合成リクエスト (C# TTSRequest + 前処理済みテンソル)。"""
+
+    token_ids: np.ndarray  # [token_len] ([CLS] ... [SEP])
+    phoneme_ids: np.ndarray  # [phone_len] (intersperse 済み)
+    tones: np.ndarray  # [phone_len]
+    language: np.ndarray  # [phone_len]
+    word2ph: np.ndarray  # [token_len] (AdjustWord2PhForBlanks 済み)
+    style_vec: np.ndarray  # [256]
+    speaker_id: int = 0
+    sdp_ratio: float = 0.2
+    noise_scale: float = 0.6
+    noise_scale_w: float = 0.8
+    length_scale: float = 1.0
+    text: str | None = None  # BERT キャッシュのキー (--bert-cache)
+    style_id: int = 0  # style_vec の元のスタイル番号 (voice_archive.py のキー)
+
+    def control_key(self) -> tuple[float, float, float, float]:
+        """バッチ内で共有される scalar 入力のキー。"""
+        return (self.sdp_ratio, self.noise_scale, self.noise_scale_w, self.length_scale)
+
+
+@dataclass
+class ThroughputStats:
+    """スループット集計。"""
+
+    requests: int = 0
+    batches: int = 0
+    audio_seconds: float = 0.0
+    bert_seconds: float = 0.0
+    tts_seconds: float = 0.0
+    batch_sizes: list[int] = field(default_factory=list)
+    started_at: float | None = None
+    finished_at: float | None = None
+
+    @property
+    def wall_seconds(self) -> float:
+        if self.started_at is None or self.finished_at is None:
+            return 0.0
+        return self.finished_at - self.started_at
+
+    @property
+    def throughput(self) -> float:
+        """音声秒 / 経過秒 (1.0 で実時間)。"""
+        wall = self.wall_seconds
+        return self.audio_seconds / wall if wall > 0 else 0.0
+
+    def report(self) -> str:
+        mean_batch = float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.0
+        return (
+            f"Requests: {self.requests}, batches: {self.batches} "
+            f"(mean batch size {mean_batch:.2f})\n"
+            f"Audio: {self.audio_seconds:.2f}s, wall: {self.wall_seconds:.2f}s "
+            f"(BERT {self.bert_seconds:.2f}s, TTS {self.tts_seconds:.2f}s)\n"
+            f"Throughput: {self.throughput:.2f}x realtime"
+        )
+
+
+def load_style_vector(
+    style_vectors: np.ndarray, style_id: int, weight: float = 1.0
+) -> np.ndarray:
+    """sbv2-api 方式の補間 (mean + (style - mean) * weight)。StyleVectorProvider と同じ。"""
+    mean = style_vectors[0]
+    return (mean + (style_vectors[style_id] - mean) * weight).astype(np.float32)
+
+
+def bert_feeds(bert: np.ndarray, input_names: set[str]) -> dict[str, np.ndarray]:
+    """BERT 特徴量 [batch, 1024, phone_len] を SBV2 の入力に割り当てる。
+
+    非 JP-Extra モデル (ja_bert 入力あり) では日本語 BERT を ja_bert に入れ、bert/en_bert はゼロ。
+    """
+    if "ja_bert" in input_names:
+        zeros = np.zeros_like(bert)
+        return {"bert": zeros, "ja_bert": bert, "en_bert": zeros}
+    return {"bert": bert}
+
+
+def request_feeds(
+    request: SynthesisRequest, bert: np.ndarray, input_names: set[str]
+) -> dict[str, np.ndarray]:
+    """batch=1 の SBV2 入力 (cast_feeds で不要分は除外されるため、分割グラフにも渡せる)。"""
+    phone_len = len(request.phoneme_ids)
+    return {
+        "x_tst": request.phoneme_ids.reshape(1, phone_len),
+        "x_tst_lengths": np.array([phone_len], dtype=np.int32),
+        "sid": np.array([request.speaker_id], dtype=np.int32),
+        "tones": request.tones.reshape(1, phone_len),
+        "language": request.language.reshape(1, phone_len),
+        "style_vec": request.style_vec.reshape(1, -1).astype(np.float32),
+        **control_feeds(request),
+        **bert_feeds(bert.reshape(1, *bert.shape), input_names),
+    }
+
+
+def control_feeds(request: SynthesisRequest) -> dict[str, np.ndarray]:
+    """制御パラメータの scalar 入力 ([1])。"""
+    return {
+        "sdp_ratio": np.array([request.sdp_ratio], dtype=np.float32),
+        "noise_scale": np.array([request.noise_scale], dtype=np.float32),
+        "noise_scale_w": np.array([request.noise_scale_w], dtype=np.float32),
+        "length_scale": np.array([request.length_scale], dtype=np.float32),
+    }
+
+
+class BertRunner:
+    """DeBERTa セッション + word2ph 展開 (+ 永続 BERT キャッシュ)。"""
+
+    def __init__(
+        self,
+        bert_path: str,
+        intra_op_num_threads: int = 0,
+        bert_cache: BertFeatureStore | None = None,
+        window: int | None = None,
+    ):
+        """window を指定すると、それより長いトークン列は重なり付きウィンドウで推論する。"""
+        print(f"Loading BERT model: {bert_path}")
+        self.bert_session = create_session(bert_path, intra_op_num_threads)
+        self.fused_alignment = any(
+            inp.name == "phone_to_token" for inp in self.bert_session.get_inputs()
+        )
+        self.bert_cache = bert_cache
+        self.chunked = ChunkedBert(self.bert_session, window) if window else None
+
+    def forward(self, token_ids: np.ndarray, word2ph: np.ndarray) -> np.ndarray:
+        if self.chunked is not None and len(token_ids) > self.chunked.window:
+            features = self.chunked.run(token_ids)
+            # 出力の形はモデルに合わせる (融合モデルは音素単位)
+            return align_bert_to_phonemes(features, word2ph) if self.fused_alignment else features
+        token_len = len(token_ids)
+        feeds = {
+            "input_ids": token_ids.reshape(1, token_len),
+            "token_type_ids": np.zeros((1, token_len), dtype=np.int32),
+            "attention_mask": np.ones((1, token_len), dtype=np.int32),
+            "phone_to_token": phone_to_token_indices(word2ph),
+        }
+        output = self.bert_session.run(None, cast_feeds(self.bert_session, feeds))[0]
+        return output[0].astype(np.float32, copy=False)
+
+    def run(
+        self, token_ids: np.ndarray, word2ph: np.ndarray, text: str | None = None
+    ) -> np.ndarray:
+        """DeBERTa 推論 + word2ph 展開。戻り値 [1024, phone_len]。
+
+        phone_to_token 入力を持つモデル (--fuse-alignment) はグラフ内で展開し、
+        それ以外は text_tensors.align_bert_to_phonemes (C# の BertAligner と同じ) で展開する。
+        BERT キャッシュと text がある場合はトークン単位の特徴量をキャッシュから引く
+        (融合モデルも 1 トークン 1 音素で実行してトークン単位の出力をキャッシュする)。
+        """
+        if self.bert_cache is not None and text is not None:
+            identity = np.ones(len(token_ids), dtype=np.int64)
+            features = self.bert_cache.get_or_compute(
+                text, lambda _: self.forward(token_ids, identity), len(token_ids)
+            )
+            return align_bert_to_phonemes(features.astype(np.float32, copy=False), word2ph)
+        output = self.forward(token_ids, word2ph)
+        if not self.fused_alignment:
+            output = align_bert_to_phonemes(output, word2ph)
+        return output
+
+
+class SynthesisServer:
+    """BERT + SBV2 セッションを保持し、リクエストをバッチ化して合成するサービス。"""
+
+    def __init__(
+        self,
+        bert_path: str,
+        tts_path: str,
+        max_batch_size: int = 8,
+        batch_window_ms: float = 20.0,
+        intra_op_num_threads: int = 0,
+        sample_rate: int = SAMPLE_RATE,
+        bert_cache: BertFeatureStore | None = None,
+        bert_window: int | None = None,
+    ):
+        self.bert = BertRunner(bert_path, intra_op_num_threads, bert_cache, bert_window)
+        print(f"Loading TTS model: {tts_path}")
+        self.tts_session = create_session(tts_path, intra_op_num_threads)
+        self.tts_input_names = {inp.name for inp in self.tts_session.get_inputs()}
+        output_names = [out.name for out in self.tts_session.get_outputs()]
+        self.audio_lengths_index = (
+            output_names.index(AUDIO_LENGTHS_OUTPUT)
+            if AUDIO_LENGTHS_OUTPUT in output_names else None
+        )
+        if self.audio_lengths_index is None and max_batch_size > 1:
+            print(
+                f"Warning: {tts_path} has no {AUDIO_LENGTHS_OUTPUT} output "
+                "(re-export with convert_sbv2_for_sentis.py); using batch size 1"
+            )
+            max_batch_size = 1
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window_ms / 1000.0
+        self.sample_rate = sample_rate
+        self.stats = ThroughputStats()
+        self._queue: queue.Queue[tuple[SynthesisRequest, Future] | None] = queue.Queue()
+        self._worker: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "SynthesisServer":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        if self._worker is not None:
+            return
+        self._worker = threading.Thread(target=self._serve, daemon=True)
+        self._worker.start()
+
+    def stop(self) -> None:
+        """キュー内のリクエストを処理し終えてからワーカーを停止する。"""
+        if self._worker is None:
+            return
+        self._queue.put(None)
+        self._worker.join()
+        self._worker = None
+
+    def submit(self, request: SynthesisRequest) -> Future:
+        """リクエストを投入し、PCM (float32 [N]) を返す Future を得る。"""
+        if len(request.word2ph) != len(request.token_ids):
+            raise ValueError(
+                f"word2ph length ({len(request.word2ph)}) does not match "
+                f"token length ({len(request.token_ids)})"
+            )
+        if int(np.sum(request.word2ph)) != len(request.phoneme_ids):
+            raise ValueError(
+                f"word2ph sum ({int(np.sum(request.word2ph))}) does not match "
+                f"phone length ({len(request.phoneme_ids)})"
+            )
+        future: Future = Future()
+        with self._lock:
+            if self.stats.started_at is None:
+                self.stats.started_at = time.perf_counter()
+        self._queue.put((request, future))
+        return future
+
+    def synthesize(self, requests: list[SynthesisRequest]) -> list[np.ndarray]:
+        """全リクエストを投入して結果を待つ同期 API。"""
+        futures = [self.submit(r) for r in requests]
+        return [f.result() for f in futures]
+
+    # ------------------------------------------------------------------
+
+    def _serve(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.perf_counter() + self.batch_window
+            stop = False
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            # scalar 入力が異なるリクエストは同じバッチに入れられない
+            groups: dict[tuple, list[tuple[SynthesisRequest, Future]]] = {}
+            for request, future in batch:
+                groups.setdefault(request.control_key(), []).append((request, future))
+            for group in groups.values():
+                self._process(group)
+
+            if stop:
+                return
+
+    def _process(self, group: list[tuple[SynthesisRequest, Future]]) -> None:
+        try:
+            audios = self._run_batch([request for request, _ in group])
+        except Exception as e:
+            for _, future in group:
+                future.set_exception(e)
+            return
+        with self._lock:
+            self.stats.requests += len(group)
+            self.stats.batches += 1
+            self.stats.batch_sizes.append(len(group))
+            self.stats.audio_seconds += sum(len(a) for a in audios) / self.sample_rate
+            self.stats.finished_at = time.perf_counter()
+        for (_, future), audio in zip(group, audios):
+            future.set_result(audio)
+
+    def _run_batch(self, requests: list[SynthesisRequest]) -> list[np.ndarray]:
+        batch_size = len(requests)
+        lengths = np.array([len(r.phoneme_ids) for r in requests], dtype=np.int32)
+        max_len = int(lengths.max())
+
+        x_tst = np.zeros((batch_size, max_len), dtype=np.int32)
+        tones = np.zeros((batch_size, max_len), dtype=np.int32)
+        language = np.zeros((batch_size, max_len), dtype=np.int32)
+        bert = np.zeros((batch_size, BERT_DIM, max_len), dtype=np.float32)
+
+        bert_start = time.perf_counter()
+        for i, r in enumerate(requests):
+            n = lengths[i]
+            x_tst[i, :n] = r.phoneme_ids
+            tones[i, :n] = r.tones
+            language[i, :n] = r.language
+            bert[i, :, :n] = self.bert.run(r.token_ids, r.word2ph, r.text)
+        bert_elapsed = time.perf_counter() - bert_start
+
+        # 制御パラメータはバッチ内で共通 (control_key でグループ化済み)
+        feeds = {
+            "x_tst": x_tst,
+            "x_tst_lengths": lengths,
+            "sid": np.array([r.speaker_id for r in requests], dtype=np.int32),
+            "tones": tones,
+            "language": language,
+            "style_vec": np.stack([r.style_vec for r in requests]).astype(np.float32),
+            **control_feeds(requests[0]),
+            **bert_feeds(bert, self.tts_input_names),
+        }
+
+        tts_start = time.perf_counter()
+        outputs = self.tts_session.run(None, cast_feeds(self.tts_session, feeds))
+        tts_elapsed = time.perf_counter() - tts_start
+
+        with self._lock:
+            self.stats.bert_seconds += bert_elapsed
+            self.stats.tts_seconds += tts_elapsed
+
+        output = outputs[0][:, 0].astype(np.float32, copy=False)
+        # パディング行の末尾は無音とは限らないため、batch=1 と同じ長さで切ってからトリムする
+        valid = None
+        if self.audio_lengths_index is not None:
+            valid = np.minimum(outputs[self.audio_lengths_index], output.shape[1])
+        ends = trimmed_lengths(output, valid)
+        return [output[i, : ends[i]].copy() for i in range(batch_size)]
+
+
+def load_requests(path: Path, style_vectors: np.ndarray | None) -> list[SynthesisRequest]:
+    """JSONL からリクエストを読み込む。
+
+    各行: {"token_ids": [...], "phoneme_ids": [...], "tones": [...], "language": [...],
+           "word2ph": [...], "style_id": 0, "style_weight": 1.0, "speaker_id": 0,
+           "text": "...", ...}  (text は --bert-cache のキー。省略時はキャッシュしない)
+    """
+    requests = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            d = json.loads(line)
+            if style_vectors is not None:
+                style_vec = load_style_vector(
+                    style_vectors, d.get("style_id", 0), d.get("style_weight", 1.0)
+                )
+            else:
+                style_vec = np.zeros(STYLE_DIM, dtype=np.float32)
+            requests.append(
+                SynthesisRequest(
+                    token_ids=np.asarray(d["token_ids"], dtype=np.int32),
+                    phoneme_ids=np.asarray(d["phoneme_ids"], dtype=np.int32),
+                    tones=np.asarray(d["tones"], dtype=np.int32),
+                    language=np.asarray(d["language"], dtype=np.int32),
+                    word2ph=np.asarray(d["word2ph"], dtype=np.int32),
+                    style_vec=style_vec,
+                    speaker_id=d.get("speaker_id", 0),
+                    sdp_ratio=d.get("sdp_ratio", 0.2),
+                    noise_scale=d.get("noise_scale", 0.6),
+                    noise_scale_w=d.get("noise_scale_w", 0.8),
+                    length_scale=d.get("length_scale", 1.0),
+                    text=d.get("text"),
+                    style_id=d.get("style_id", 0),
+                )
+            )
+    return requests
+
+
+def make_dummy_requests(count: int, seed: int = 0) -> list[SynthesisRequest]:
+    """長さの異なるダミーリクエストを作成する (スループット計測用)。"""
+    rng = np.random.default_rng(seed)
+    requests = []
+    for _ in range(count):
+        num_chars = int(rng.integers(4, 40))
+        # [CLS] / [SEP] は 0 音素、各文字 1-3 音素 (blank 挿入前)
+        raw_word2ph = np.concatenate(
+            [[0], rng.integers(1, 4, size=num_chars), [0]]
+        ).astype(np.int32)
+        word2ph = adjust_word2ph_for_blanks(raw_word2ph)
+        phonemes = intersperse(rng.integers(1, 100, size=int(raw_word2ph.sum())))
+        phone_len = len(phonemes)
+        requests.append(
+            SynthesisRequest(
+                token_ids=rng.integers(5, 1000, size=num_chars + 2).astype(np.int32),
+                phoneme_ids=phonemes,
+                tones=np.zeros(phone_len, dtype=np.int32),
+                language=np.ones(phone_len, dtype=np.int32),
+                word2ph=word2ph,
+                style_vec=np.zeros(STYLE_DIM, dtype=np.float32),
+            )
+        )
+    return requests
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Batched ONNX Runtime synthesis service for SBV2 models"
+    )
+    parser.add_argument("--bert", type=str, required=True, help="DeBERTa ONNX path")
+    parser.add_argument("--tts", type=str, required=True, help="SBV2 ONNX path")
+    parser.add_argument(
+        "--requests", type=str, default=None, help="Pre-tokenized requests (JSONL)"
+    )
+    parser.add_argument(
+        "--style-vectors", type=str, default=None, help="style_vectors.npy path"
+    )
+    parser.add_argument(
+        "--num-dummy",
+        type=int,
+        default=32,
+        help="Number of dummy requests when --requests is not given",
+    )
+    parser.add_argument("--max-batch-size", type=int, default=8, help="Max batch size")
+    parser.add_argument(
+        "--batch-window-ms",
+        type=float,
+        default=20.0,
+        help="Time window for grouping requests into a batch",
+    )
+    parser.add_argument(
+        "--threads", type=int, default=0, help="ORT intra-op threads (0 = default)"
+    )
+    parser.add_argument(
+        "--output-dir", type=str, default=None, help="Write each result as WAV/FLAC"
+    )
+    parser.add_argument(
+        "--output-format", choices=FORMATS, default="wav", help="Audio format for --output-dir"
+    )
+    parser.add_argument(
+        "--bert-cache", type=str, default=None,
+        help="Persistent BERT feature cache directory (shared between workers)",
+    )
+    parser.add_argument(
+        "--bert-window", type=int, default=None,
+        help="Run longer token sequences as overlapping windows of this size (chunked_bert.py)",
+    )
+    parser.add_argument(
+        "--bert-cache-mb", type=int, default=None,
+        help="Arena size when creating a new BERT cache (MB)",
+    )
+    args = parser.parse_args()
+
+    if args.requests:
+        style_vectors = np.load(args.style_vectors) if args.style_vectors else None
+        requests = load_requests(Path(args.requests), style_vectors)
+    else:
+        requests = make_dummy_requests(args.num_dummy)
+    print(f"Requests: {len(requests)}")
+
+    bert_cache = None
+    if args.bert_cache:
+        capacity = args.bert_cache_mb << 20 if args.bert_cache_mb else None
+        bert_cache = BertFeatureStore(
+            Path(args.bert_cache), model_digest(Path(args.bert)), capacity
+        )
+
+    with SynthesisServer(
+        args.bert,
+        args.tts,
+        max_batch_size=args.max_batch_size,
+        batch_window_ms=args.batch_window_ms,
+        intra_op_num_threads=args.threads,
+        bert_cache=bert_cache,
+        bert_window=args.bert_window,
+    ) as server:
+        audios = server.synthesize(requests)
+
+    print(server.stats.report())
+    if bert_cache is not None:
+        print(f"BERT cache: {bert_cache.stats()}")
+        bert_cache.close()
+
+    if args.output_dir:
+        output_dir = Path(args.output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        for i, audio in enumerate(audios):
+            write_audio(output_dir / f"{i:05d}.{args.output_format}", audio, fmt=args.output_format)
+        print(f"Wrote {len(audios)} files to: {output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""audio_postprocess.py のテスト (C# の TTSAudioUtility / TTSPipeline との一致、リサンプリング、エンコード)"""
+
+import numpy as np
+import pytest
+
+from audio_postprocess import (
+    FORMATS,
+    SAMPLE_RATE,
+    TARGET_PEAK,
+    TARGET_RATES,
+    TRIM_BLOCK_SIZE,
+    TRIM_THRESHOLD,
+    _random_batch,
+    _reference_normalize,
+    block_stats,
+    design_resampler,
+    flac_available,
+    open_writer,
+    peak_scales,
+    postprocess_batch,
+    read_audio,
+    resample_batch,
+    to_int16,
+    trim_bounds,
+    trimmed_lengths,
+)
+
+
+def reference_resample(samples: np.ndarray, src_rate: int, dst_rate: int) -> np.ndarray:
+    """y[n] = sum_m x[m] * h[n * down + half_len - m * up] を密行列で直接計算する。"""
+    up, down, half_len, taps = design_resampler(src_rate, dst_rate)
+    h = taps.T.reshape(-1).astype(np.float64)
+    count = -(-len(samples) * up // down)
+    index = (np.arange(count) * down + half_len)[:, None] - np.arange(len(samples))[None, :] * up
+    valid = (index >= 0) & (index < len(h))
+    return np.where(valid, h[np.clip(index, 0, len(h) - 1)], 0.0) @ samples.astype(np.float64)
+
+
+@pytest.fixture(scope="module")
+def batch():
+    rng = np.random.default_rng(0)
+    return _random_batch(rng, 48, 20000)
+
+
+# AudioTests (GetTrimmedLength)
+# (サンプル数, 信号位置, 値, 期待値): 閾値ちょうどは無音、末尾の端数ブロックは判定しない
+@pytest.mark.parametrize("size, index, value, expected", [
+    (256, None, 0.5, 256), (1024, 800, 0.5, 1024), (2048, 600, 0.5, 1024),
+    (2048, None, 0.5, 512), (2048, 700, TRIM_THRESHOLD, 512),
+    (1536, 1100, 0.0021, 1536), (1600, 1550, 0.5, 512),
+])
+def test_trimmed_length_matches_audio_tests(size, index, value, expected):
+    samples = np.zeros(size, dtype=np.float32)
+    if index is not None:
+        samples[index] = value
+    assert int(trimmed_lengths(samples)[0]) == expected
+
+
+def test_peak_scales_match_normalize_samples_burst(batch):
+    samples, lengths = batch
+    peaks, _ = block_stats(samples, lengths)
+    scales = peak_scales(peaks)
+    for i, n in enumerate(lengths):
+        np.testing.assert_array_equal(
+            samples[i, :n] * scales[i], _reference_normalize(samples[i, :n])
+        )
+
+
+def test_trim_bounds_match_trimmed_length_after_normalization(batch):
+    samples, lengths = batch
+    peaks, _ = block_stats(samples, lengths)
+    starts, ends = trim_bounds(peaks, lengths, peak_scales(peaks), leading=True)
+    for i, n in enumerate(lengths):
+        normalized = _reference_normalize(samples[i, :n])
+        assert ends[i] == trimmed_lengths(normalized)[0]
+        # 先頭は無音ブロックだけを除く
+        assert starts[i] % TRIM_BLOCK_SIZE == 0
+        assert np.abs(normalized[: starts[i]]).max(initial=0) <= TRIM_THRESHOLD
+
+
+def test_block_stats_sum_of_squares(batch):
+    samples, lengths = batch
+    _, sumsq = block_stats(samples, lengths)
+    expected = [np.sum(samples[i, :n].astype(np.float64) ** 2) for i, n in enumerate(lengths)]
+    np.testing.assert_allclose(sumsq, expected)
+
+
+def test_rms_normalization_reaches_target_or_peak_limit(batch):
+    samples, lengths = batch
+    # 先頭行は全無音なので除く
+    outputs = postprocess_batch(samples[1:], lengths[1:], normalize="rms", target_dbfs=-30.0)
+    for row, n, out in zip(samples[1:], lengths[1:], outputs):
+        source = row[: len(out)]
+        scale = np.dot(out, source) / np.dot(source, source)
+        np.testing.assert_allclose(out, source * scale, rtol=1e-5, atol=1e-7)
+        # RMS が -30 dBFS になるスケール (ピークが TARGET_PEAK を超える場合はピークで制限)
+        rms = np.sqrt(np.mean(row[:n].astype(np.float64) ** 2))
+        expected = min(10 ** (-30.0 / 20) / rms, TARGET_PEAK / np.abs(row[:n]).max())
+        assert scale == pytest.approx(expected, rel=1e-5)
+
+
+def test_postprocess_batch_matches_per_row_pipeline(batch):
+    samples, lengths = batch
+    outputs = postprocess_batch(samples, lengths)
+    for i, n in enumerate(lengths):
+        normalized = _reference_normalize(samples[i, :n])
+        np.testing.assert_array_equal(outputs[i], normalized[: trimmed_lengths(normalized)[0]])
+
+
+@pytest.mark.parametrize("rate", TARGET_RATES)
+def test_resample_matches_direct_convolution(rate):
+    samples, lengths = _random_batch(np.random.default_rng(1), 8, 3000)
+    outputs = postprocess_batch(samples, lengths, normalize="none", target_rate=rate)
+    for i, n in enumerate(lengths):
+        trimmed = samples[i, : trimmed_lengths(samples[i, :n])[0]]
+        expected = reference_resample(trimmed, SAMPLE_RATE, rate)
+        assert len(outputs[i]) == len(expected)
+        np.testing.assert_allclose(outputs[i], expected, atol=1e-5)
+
+
+@pytest.mark.parametrize("rate", TARGET_RATES)
+def test_resample_tone(rate):
+    t = np.arange(SAMPLE_RATE) / SAMPLE_RATE
+    tone = (0.5 * np.sin(2 * np.pi * 1000 * t)).astype(np.float32)
+    out = resample_batch(
+        tone[None], np.array([0]), np.array([len(tone)]), np.ones(1), SAMPLE_RATE, rate
+    )[0][0]
+    expected = 0.5 * np.sin(2 * np.pi * 1000 * np.arange(len(out)) / rate)
+    middle = slice(rate // 10, -rate // 10)
+    assert len(out) == rate
+    assert np.abs(out[middle] - expected[middle]).max() < 1e-3
+
+
+@pytest.mark.parametrize("fmt", FORMATS)
+def test_streaming_round_trip_is_lossless(fmt, tmp_path):
+    if fmt == "flac" and not flac_available():
+        pytest.skip("soundfile is not installed")
+    rng = np.random.default_rng(2)
+    samples = np.concatenate([
+        np.zeros(5000, dtype=np.float32),
+        (0.3 * np.sin(np.arange(30000) / 20)).astype(np.float32),
+        rng.uniform(-1.2, 1.2, 9000).astype(np.float32),  # クリップ
+    ])
+    path = tmp_path / f"check.{fmt}"
+    with open_writer(path, 24000) as writer:
+        for chunk in np.array_split(samples, 7):
+            writer.write(chunk)
+    decoded, rate = read_audio(path)
+    assert rate == 24000
+    np.testing.assert_array_equal((decoded * 32767).round().astype(np.int16), to_int16(samples))
@@ -0,0 +1,111 @@
+"""bert_cache.py のテスト (保存と読み出し、LRU 削除、プロセス間の共有)"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+
+from bert_cache import BertFeatureStore, _benchmark_worker, model_digest
+from onnx_io import external_data_path
+from text_tensors import EMBEDDING_DIM
+
+# 1 エントリ = 1024 * 8 * 2 バイト (FP16)
+TOKEN_LEN = 8
+ENTRY_BYTES = EMBEDDING_DIM * TOKEN_LEN * 2
+
+
+def features(seed: int, token_len: int = TOKEN_LEN) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((EMBEDDING_DIM, token_len)).astype(np.float32)
+
+
+def test_round_trip_across_instances(tmp_path):
+    expected = features(0)
+    with BertFeatureStore(tmp_path, "model") as store:
+        assert store.get("こんにちは") is None
+        # batch=1 の軸付きでも保存できる
+        assert store.put("こんにちは", expected[None])
+        got = store.get("こんにちは")
+        assert got.dtype == np.float16
+        np.testing.assert_array_equal(got, expected.astype(np.float16))
+        assert store.stats()["hits"] == 1 and store.stats()["misses"] == 1
+    # 再オープンしても残っている
+    with BertFeatureStore(tmp_path, "model") as store:
+        np.testing.assert_array_equal(store.get("こんにちは"), expected.astype(np.float16))
+        assert store.stats()["entries"] == 1
+
+
+def test_key_uses_normalized_text_and_model(tmp_path):
+    with BertFeatureStore(tmp_path, "model") as store:
+        store.put("ＡＢＣ　１２３", features(0))
+        # TextNormalizer.Normalize と同じ正規化 (全角英数・空白)
+        assert store.get("ABC 123") is not None
+        # token_len が異なるエントリはミス扱い
+        assert store.get("ABC 123", token_len=TOKEN_LEN + 1) is None
+    with BertFeatureStore(tmp_path, "other-model") as store:
+        assert store.get("ABC 123") is None
+
+
+def test_get_or_compute_computes_once(tmp_path):
+    calls = []
+
+    def compute(text):
+        calls.append(text)
+        return features(1)
+
+    with BertFeatureStore(tmp_path, "model") as store:
+        first = store.get_or_compute("　テスト　", compute, TOKEN_LEN)
+        second = store.get_or_compute("テスト", compute, TOKEN_LEN)
+    # compute には正規化後のテキストを渡す
+    assert calls == ["テスト"]
+    np.testing.assert_array_equal(first, second)
+
+
+def test_lru_eviction(tmp_path):
+    with BertFeatureStore(tmp_path, "model", capacity_bytes=3 * ENTRY_BYTES) as store:
+        for i in range(3):
+            store.put(f"text{i}", features(i))
+        store.get("text0")  # text1 が最も古くなる
+        store.put("text3", features(3))
+        assert store.get("text1") is None
+        for i in (0, 2, 3):
+            np.testing.assert_array_equal(store.get(f"text{i}"), features(i).astype(np.float16))
+        # 上書きは同じスロットを使う
+        store.put("text0", features(10))
+        np.testing.assert_array_equal(store.get("text0"), features(10).astype(np.float16))
+        assert store.stats()["entries"] == 3
+        # アリーナより大きいものは保存しない
+        assert not store.put("large", features(4, token_len=4 * TOKEN_LEN))
+
+
+def test_slot_table_full_evicts_oldest(tmp_path):
+    with BertFeatureStore(tmp_path, "model", capacity_bytes=8 * ENTRY_BYTES, slots=2) as store:
+        for i in range(3):
+            store.put(f"text{i}", features(i))
+        assert store.get("text0") is None
+        assert store.get("text1") is not None and store.get("text2") is not None
+
+
+def test_shared_between_processes(tmp_path):
+    texts = [f"text{i}" for i in range(4)]
+    with BertFeatureStore(tmp_path, "model") as store:
+        for i, text in enumerate(texts):
+            store.put(text, features(i))
+    # ORT / Numba のスレッドを持つテストプロセスから fork しない
+    with ProcessPoolExecutor(2, mp_context=multiprocessing.get_context("spawn")) as pool:
+        results = list(pool.map(_benchmark_worker, [str(tmp_path)] * 2, ["model"] * 2, [texts] * 2))
+    assert [hits for hits, _ in results] == [len(texts)] * 2
+
+
+def test_rejects_foreign_index(tmp_path):
+    (tmp_path / "index.bin").write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError, match="not a BERT cache index"):
+        BertFeatureStore(tmp_path, "model")
+
+
+def test_model_digest_includes_external_data(tmp_path):
+    model_path = tmp_path / "bert.onnx"
+    model_path.write_bytes(b"graph")
+    digest = model_digest(model_path)
+    external_data_path(model_path).write_bytes(b"weights")
+    assert model_digest(model_path) != digest
@@ -0,0 +1,101 @@
+"""chunked_bert.py のテスト (ウィンドウ分割とスティッチングの重み)"""
+
+import numpy as np
+import onnx
+import pytest
+from onnx import TensorProto, helper, numpy_helper
+
+from chunked_bert import ChunkedBert, plan_windows, stitch_weights
+from validate_onnx import create_session
+
+DIM = 8
+
+
+@pytest.mark.parametrize("content_len, window, context", [
+    (10, 256, 32), (254, 256, 32), (255, 256, 32), (1000, 256, 32), (1000, 100, 10), (37, 12, 2),
+])
+def test_plan_windows_cover_content(content_len, window, context):
+    starts, length = plan_windows(content_len, window, context)
+    assert length == min(window - 2, content_len)
+    assert starts[0] == 0
+    # 最後のウィンドウは末尾に揃え、全ウィンドウが同じ長さ
+    assert starts[-1] + length == content_len
+    if len(starts) > 1:
+        # 隣り合うウィンドウは少なくとも 2 * context 重なる
+        assert np.all(np.diff(starts) <= length - 2 * context)
+        assert np.all(np.diff(starts) > 0)
+
+
+@pytest.mark.parametrize("mode", ["blend", "core"])
+@pytest.mark.parametrize("content_len, window, context", [(1000, 256, 32), (37, 12, 2)])
+def test_stitch_weights_sum_to_one(mode, content_len, window, context):
+    starts, length = plan_windows(content_len, window, context)
+    weights = stitch_weights(starts, length, content_len, mode)
+    assert weights.shape == (len(starts), length)
+    assert np.all(weights >= 0)
+    full = np.zeros((len(starts), content_len))
+    for i, start in enumerate(starts):
+        full[i, start : start + length] = weights[i]
+    np.testing.assert_allclose(full.sum(axis=0), 1.0)
+    if mode == "core":
+        # 端から最も遠いウィンドウだけを使う (同じ距離なら等分)
+        for column in full.T:
+            used = column[column > 0]
+            np.testing.assert_allclose(used, 1.0 / len(used))
+
+
+def test_stitch_weights_keep_sequence_ends():
+    starts, length = plan_windows(100, 42, 5)
+    weights = stitch_weights(starts, length, 100)
+    # 系列の先頭・末尾は 1 つのウィンドウしか覆わないため重み 1
+    assert weights[0, 0] == 1.0 and weights[-1, -1] == 1.0
+    # 重なりの中ではウィンドウ端に近いほど重みが小さい
+    overlap = starts[0] + length - starts[1]
+    assert np.all(np.diff(weights[0, length - overlap :]) < 0)
+    assert np.all(np.diff(weights[1, :overlap]) > 0)
+
+
+def test_stitch_weights_rejects_unknown_mode():
+    with pytest.raises(ValueError, match="stitch mode"):
+        stitch_weights(np.zeros(1, dtype=np.int64), 10, 10, mode="mean")
+
+
+def make_bert(path, batch_dim="batch_size", token_dim="token_len") -> str:
+    """トークンごとに独立な (文脈を使わない) BERT の代わり。分割しても出力が変わらない。"""
+    embedding = np.random.default_rng(0).standard_normal((100, DIM)).astype(np.float32)
+    graph = helper.make_graph(
+        [
+            helper.make_node("Gather", ["embedding", "input_ids"], ["hidden"]),
+            helper.make_node("Transpose", ["hidden"], ["output"], perm=[0, 2, 1]),
+        ],
+        "bert",
+        [helper.make_tensor_value_info("input_ids", TensorProto.INT64, [batch_dim, token_dim])],
+        [helper.make_tensor_value_info("output", TensorProto.FLOAT, [batch_dim, DIM, token_dim])],
+        [numpy_helper.from_array(embedding, "embedding")],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 17)], ir_version=8)
+    onnx.save(model, path)
+    return str(path)
+
+
+@pytest.mark.parametrize("batch_dim", ["batch_size", 1])
+@pytest.mark.parametrize("mode", ["blend", "core"])
+def test_chunked_run_matches_single_pass(tmp_path, batch_dim, mode):
+    session = create_session(make_bert(tmp_path / "bert.onnx", batch_dim))
+    chunked = ChunkedBert(session, window=16, context=3, mode=mode)
+    assert chunked.batched == (batch_dim != 1)
+    token_ids = np.random.default_rng(1).integers(5, 100, size=61)
+    token_ids[[0, -1]] = [1, 2]
+    expected = session.run(None, {"input_ids": token_ids[None]})[0][0]
+    np.testing.assert_allclose(chunked.run(token_ids), expected, rtol=1e-6, atol=1e-6)
+    # ウィンドウ以下の長さは分割しない
+    np.testing.assert_array_equal(chunked.run(token_ids[:16]), expected[:, :16])
+
+
+def test_chunked_rejects_invalid_settings(tmp_path):
+    session = create_session(make_bert(tmp_path / "bert.onnx"))
+    with pytest.raises(ValueError, match="window"):
+        ChunkedBert(session, window=8, context=3)
+    static = create_session(make_bert(tmp_path / "bert_static.onnx", 1, 32))
+    with pytest.raises(ValueError, match="dynamic token_len"):
+        ChunkedBert(static)
@@ -0,0 +1,89 @@
+"""conversion_cache.py のテスト (ステージ出力の保存と読み込み、並行実行時のリネーム)"""
+
+import os
+
+import numpy as np
+import onnx
+import pytest
+from onnx import TensorProto, helper, numpy_helper
+from onnx.external_data_helper import load_external_data_for_model
+
+import conversion_cache
+from conversion_cache import ConversionCache, chain_key
+
+
+def make_model() -> onnx.ModelProto:
+    weight = np.arange(64 * 32, dtype=np.float32).reshape(64, 32)
+    graph = helper.make_graph(
+        [helper.make_node("MatMul", ["x", "weight"], ["y"])],
+        "toy",
+        [helper.make_tensor_value_info("x", TensorProto.FLOAT, [1, 64])],
+        [helper.make_tensor_value_info("y", TensorProto.FLOAT, [1, 32])],
+        [numpy_helper.from_array(weight, "weight")],
+    )
+    return helper.make_model(graph, opset_imports=[helper.make_opsetid("", 17)], ir_version=8)
+
+
+def weight_of(model: onnx.ModelProto, base_dir) -> np.ndarray:
+    load_external_data_for_model(model, str(base_dir))
+    return numpy_helper.to_array(model.graph.initializer[0])
+
+
+def test_chain_key_depends_on_parent_and_params():
+    key = chain_key("base", "int32")
+    assert key == chain_key("base", "int32", {})
+    assert key != chain_key("other", "int32")
+    assert chain_key(key, "fp16", {"a": 1}) != chain_key(key, "fp16", {"a": 2})
+
+
+@pytest.mark.parametrize("external_data", [False, True])
+def test_save_load_round_trip(tmp_path, external_data):
+    cache = ConversionCache(tmp_path / "cache")
+    model = make_model()
+    expected = numpy_helper.to_array(model.graph.initializer[0])
+    assert not cache.has("k")
+    base_dir = cache.save("k", "export", model, external_data=external_data)
+    assert cache.has("k")
+    loaded, loaded_dir = cache.load("k", external_data=external_data)
+    assert loaded_dir == base_dir
+    np.testing.assert_array_equal(weight_of(loaded, loaded_dir), expected)
+
+
+def test_concurrent_writer_wins_rename(tmp_path, monkeypatch):
+    cache = ConversionCache(tmp_path / "cache")
+    real_replace = os.replace
+
+    def replace_after_other_writer(src, dst):
+        # 存在確認の後、リネームの前に他のプロセスがエントリを書き終えた状況
+        monkeypatch.setattr(conversion_cache.os, "replace", real_replace)
+        cache.save("k", "export", make_model())
+        return real_replace(src, dst)
+
+    monkeypatch.setattr(conversion_cache.os, "replace", replace_after_other_writer)
+    entry_dir = cache.save("k", "export", make_model())
+    assert cache.has("k")
+    # 自分の一時ディレクトリは破棄される
+    assert [p.name for p in cache.root.iterdir()] == [entry_dir.name]
+
+
+def test_rename_failure_without_entry_is_raised(tmp_path, monkeypatch):
+    cache = ConversionCache(tmp_path / "cache")
+
+    def fail(src, dst):
+        raise PermissionError(dst)
+
+    monkeypatch.setattr(conversion_cache.os, "replace", fail)
+    with pytest.raises(PermissionError):
+        cache.save("k", "export", make_model())
+    assert not cache.has("k")
+    assert not any(cache.root.iterdir())
+
+
+def test_prune_removes_least_recently_used(tmp_path):
+    cache = ConversionCache(tmp_path / "cache")
+    for i, key in enumerate(["old", "new"]):
+        entry_dir = cache.save(key, "export", make_model())
+        os.utime(entry_dir / ConversionCache.MARKER_NAME, (i, i))
+    size = sum(f.stat().st_size for f in cache.entry_dir("new").rglob("*"))
+    assert cache.prune(max_bytes=size) == 1
+    assert cache.has("new") and not cache.has("old")
@@ -0,0 +1,127 @@
+"""convert_for_sentis.py のテスト (int64→int32 変換)"""
+
+import numpy as np
+import onnx
+import pytest
+from onnx import TensorProto, helper, numpy_helper
+
+from convert_for_sentis import INT32_MAX, INT32_MIN, Int32ConversionReport, convert_int64_to_int32
+
+INT64_MAX = np.iinfo(np.int64).max
+
+
+def make_model(shape_values=(1, -1), with_subgraph: bool = True) -> onnx.ModelProto:
+    """int64 の入出力・initializer・Constant・Cast・Slice の番兵値・If のサブグラフを含むモデル。"""
+    then_graph = helper.make_graph(
+        [helper.make_node("Constant", [], ["then_out"], value=helper.make_tensor(
+            "then_value", TensorProto.INT64, [1], [7]))],
+        "then", [], [helper.make_tensor_value_info("then_out", TensorProto.INT64, [1])],
+    )
+    else_graph = helper.make_graph(
+        [helper.make_node("Constant", [], ["else_out"], value=helper.make_tensor(
+            "else_value", TensorProto.INT64, [1], [8]))],
+        "else", [], [helper.make_tensor_value_info("else_out", TensorProto.INT64, [1])],
+    )
+    nodes = [
+        helper.make_node("Reshape", ["x", "shape"], ["reshaped"], name="reshape"),
+        helper.make_node("Slice", ["reshaped", "starts", "ends"], ["sliced"], name="slice"),
+        helper.make_node("Constant", [], ["offset"], name="offset",
+                         value=helper.make_tensor("offset", TensorProto.INT64, [], [3])),
+        helper.make_node("Add", ["sliced", "offset"], ["added"], name="add"),
+        helper.make_node("Cast", ["scale"], ["scale_int"], name="cast", to=TensorProto.INT64),
+        helper.make_node("Mul", ["added", "scale_int"], ["y"], name="mul"),
+    ]
+    outputs = [helper.make_tensor_value_info("y", TensorProto.INT64, [1, None])]
+    if with_subgraph:
+        nodes.append(helper.make_node(
+            "If", ["cond"], ["branch"], name="if", then_branch=then_graph, else_branch=else_graph
+        ))
+        outputs.append(helper.make_tensor_value_info("branch", TensorProto.INT64, [1]))
+    graph = helper.make_graph(
+        nodes,
+        "toy",
+        [
+            helper.make_tensor_value_info("x", TensorProto.INT64, [2, 3]),
+            helper.make_tensor_value_info("scale", TensorProto.FLOAT, [1]),
+            helper.make_tensor_value_info("cond", TensorProto.BOOL, []),
+        ],
+        outputs,
+        [
+            # raw_data と int64_data の両方の格納形式
+            numpy_helper.from_array(np.array(shape_values, dtype=np.int64), "shape"),
+            helper.make_tensor("starts", TensorProto.INT64, [1], [1]),
+            numpy_helper.from_array(np.array([INT64_MAX], dtype=np.int64), "ends"),
+        ],
+        value_info=[helper.make_tensor_value_info("reshaped", TensorProto.INT64, [1, 6])],
+    )
+    return helper.make_model(graph, opset_imports=[helper.make_opsetid("", 17)], ir_version=8)
+
+
+def int64_types(model: onnx.ModelProto) -> list[str]:
+    """変換後に残った int64 の型宣言・データ・Cast を列挙する。"""
+    found = []
+
+    def visit(graph):
+        for vi in [*graph.input, *graph.output, *graph.value_info]:
+            if vi.type.tensor_type.elem_type == TensorProto.INT64:
+                found.append(vi.name)
+        for tensor in graph.initializer:
+            if tensor.data_type == TensorProto.INT64:
+                found.append(tensor.name)
+        for node in graph.node:
+            for attr in node.attribute:
+                if attr.type == onnx.AttributeProto.TENSOR and attr.t.data_type == TensorProto.INT64:
+                    found.append(node.name or node.output[0])
+                elif attr.type == onnx.AttributeProto.GRAPH:
+                    visit(attr.g)
+                elif node.op_type == "Cast" and attr.name == "to" and attr.i == TensorProto.INT64:
+                    found.append(node.name)
+
+    visit(model.graph)
+    return found
+
+
+def test_converts_every_int64_tensor():
+    report = Int32ConversionReport()
+    model = convert_int64_to_int32(make_model(), report)
+    assert int64_types(model) == []
+    onnx.checker.check_model(model)
+
+    initializers = {t.name: numpy_helper.to_array(t) for t in model.graph.initializer}
+    assert initializers["shape"].dtype == np.int32
+    assert initializers["shape"].tolist() == [1, -1]
+    assert initializers["starts"].tolist() == [1]
+    # Slice の終端の番兵値は INT32_MAX に丸める
+    assert initializers["ends"].tolist() == [INT32_MAX]
+
+    assert report.inputs == ["x"]
+    assert sorted(report.outputs) == ["branch", "else_out", "then_out", "y"]
+    assert sorted(report.initializers) == ["ends", "shape", "starts"]
+    assert report.casts == ["cast"]
+    assert report.clamped == ["ends"]
+    assert report.subgraphs == 2
+    # Constant は本体の 1 つとサブグラフの 2 つ
+    assert len(report.tensor_attributes) == 3
+    assert report.value_infos == 1
+
+
+def test_int64_min_sentinel_is_clamped():
+    model = convert_int64_to_int32(make_model(shape_values=(np.iinfo(np.int64).min, 6)))
+    shape = next(t for t in model.graph.initializer if t.name == "shape")
+    assert numpy_helper.to_array(shape).tolist() == [INT32_MIN, 6]
+
+
+def test_out_of_range_value_is_rejected():
+    with pytest.raises(OverflowError, match="shape"):
+        convert_int64_to_int32(make_model(shape_values=(1, INT32_MAX + 1)))
+
+
+def test_external_int64_tensor_is_rejected():
+    model = make_model(with_subgraph=False)
+    shape = next(t for t in model.graph.initializer if t.name == "shape")
+    shape.ClearField("raw_data")
+    shape.data_location = TensorProto.EXTERNAL
+    entry = shape.external_data.add()
+    entry.key, entry.value = "location", "model.onnx.data"
+    with pytest.raises(ValueError, match="load_external_tensors"):
+        convert_int64_to_int32(model)
@@ -0,0 +1,112 @@
+"""long_text_synthesis.py のテスト (文分割とリクエストの分割、文の連結)"""
+
+from dataclasses import replace
+
+import numpy as np
+import pytest
+
+from long_text_synthesis import (
+    SentenceJoiner,
+    make_dummy_long_request,
+    split_request,
+    split_sentences,
+)
+from synthesis_server import SynthesisRequest
+from text_tensors import adjust_word2ph_for_blanks, intersperse
+
+
+def make_request(text: str, counts: list[int]) -> SynthesisRequest:
+    """UTF-16 コード単位ごとの音素数 counts から G2P 済みの形式のリクエストを作る。"""
+    raw_word2ph = np.array([1, *counts, 1], dtype=np.int32)
+    phone_len = int(raw_word2ph.sum())
+    raw_phonemes = np.arange(phone_len, dtype=np.int32) + 10
+    raw_phonemes[[0, -1]] = 0
+    return SynthesisRequest(
+        token_ids=np.arange(len(counts) + 2, dtype=np.int32) + 100,
+        phoneme_ids=intersperse(raw_phonemes),
+        tones=intersperse(np.arange(phone_len, dtype=np.int32) % 5),
+        language=intersperse(np.ones(phone_len, dtype=np.int32)),
+        word2ph=adjust_word2ph_for_blanks(raw_word2ph),
+        style_vec=np.zeros(256, dtype=np.float32),
+        text=text,
+    )
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("こんにちは。元気？", ["こんにちは。", "元気？"]),
+    ("「はい！」と言った。", ["「はい！」", "と言った。"]),
+    ("待って……本当に?!", ["待って……", "本当に?!"]),
+    ("一行目\n\n二行目", ["一行目\n\n", "二行目"]),
+    ("句点なし", ["句点なし"]),
+    # 空白のみの文は除く
+    ("。 \n", ["。"]),
+    ("", []),
+])
+def test_split_sentences(text, expected):
+    assert [text[start:end] for start, end in split_sentences(text)] == expected
+
+
+def test_split_request_sentences_are_consistent():
+    request = make_dummy_long_request(5)
+    sentences = split_request(request)
+    assert len(sentences) == 5
+    assert "".join(s.text for s in sentences) == request.text
+    raw_phonemes = []
+    for sentence in sentences:
+        phone_len = len(sentence.phoneme_ids)
+        assert len(sentence.token_ids) == len(sentence.text) + 2
+        assert len(sentence.word2ph) == len(sentence.token_ids)
+        assert int(sentence.word2ph.sum()) == phone_len
+        assert len(sentence.tones) == len(sentence.language) == phone_len
+        # 先頭と末尾は [CLS] / [SEP] と pad 音素
+        assert sentence.token_ids[0] == request.token_ids[0]
+        assert sentence.token_ids[-1] == request.token_ids[-1]
+        assert sentence.phoneme_ids[:2].tolist() == [0, 0]
+        raw_phonemes.extend(sentence.phoneme_ids[1::2][1:-1])
+    # pad を除いた音素列は元のリクエストと同じ
+    assert raw_phonemes == request.phoneme_ids[1::2][1:-1].tolist()
+
+
+def test_split_request_counts_surrogate_pairs_as_two_tokens():
+    # "𠮷" は UTF-16 で 2 コード単位 (2 トークン)
+    text = "𠮷野家。あ。"
+    request = make_request(text, [2, 0, 1, 1, 1, 1, 1])
+    first, second = split_request(request)
+    assert (first.text, second.text) == ("𠮷野家。", "あ。")
+    assert len(first.token_ids) == 5 + 2 and len(second.token_ids) == 2 + 2
+    assert first.phoneme_ids[1::2][1:-1].tolist() == request.phoneme_ids[1::2][1:6].tolist()
+    assert second.phoneme_ids[1::2][1:-1].tolist() == request.phoneme_ids[1::2][6:8].tolist()
+
+
+def test_split_request_skips_sentences_without_phonemes():
+    # 「」。 は音素を持たない
+    request = make_request("あ。「」。", [1, 1, 0, 0, 0])
+    assert [s.text for s in split_request(request)] == ["あ。"]
+
+
+def test_split_request_rejects_mismatched_inputs():
+    request = make_dummy_long_request(2)
+    with pytest.raises(ValueError, match="text"):
+        split_request(replace(request, text=None))
+    with pytest.raises(ValueError, match="token length"):
+        split_request(replace(request, token_ids=request.token_ids[:-1]))
+    with pytest.raises(ValueError, match="word2ph sum"):
+        split_request(replace(request, phoneme_ids=request.phoneme_ids[:-2]))
+
+
+@pytest.mark.parametrize("pause_ms", [0.0, 200.0])
+def test_sentence_joiner_length(pause_ms):
+    sample_rate, fade = 1000, 10
+    joiner = SentenceJoiner(sample_rate, pause_ms=pause_ms, crossfade_ms=fade)
+    audios = [np.ones(n, dtype=np.float32) for n in (100, 50, 5, 80)]
+    output = np.concatenate([joiner.push(a) for a in audios] + [joiner.flush()])
+    pauses = int(sample_rate * pause_ms / 1000) * (len(audios) - 1)
+    if pause_ms:
+        assert len(output) == sum(map(len, audios)) + pauses
+    else:
+        # 文の境界ごとに重ねた分だけ短くなる
+        overlaps = [min(fade, len(b) // 2, len(a) - min(fade, len(a) // 2)) for a, b in
+                    zip(audios, audios[1:])]
+        assert len(output) == sum(map(len, audios)) - sum(overlaps)
+        # 定数信号のクロスフェードは定数のまま
+        np.testing.assert_allclose(output, 1.0, atol=1e-6)
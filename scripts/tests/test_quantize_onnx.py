@@ -0,0 +1,75 @@
+"""quantize_onnx.py のテスト (キャリブレーション入力のキャスト、精度ゲートで落ちたモデルの削除)"""
+
+import numpy as np
+import onnx
+import pytest
+from onnx import TensorProto, helper, numpy_helper
+
+from quantize_onnx import AccuracyGateError, quantize_with_gate, split_holdout
+
+
+def make_model() -> onnx.ModelProto:
+    """int64 のトークン列を埋め込んで MatMul する FP32 モデル (SBV2 の x_tst 入力と同じ型)。"""
+    rng = np.random.default_rng(0)
+    embedding = rng.standard_normal((100, 64)).astype(np.float32)
+    weight = rng.standard_normal((64, 32)).astype(np.float32)
+    graph = helper.make_graph(
+        [
+            helper.make_node("Gather", ["embedding", "x_tst"], ["hidden"]),
+            helper.make_node("MatMul", ["hidden", "weight"], ["output"]),
+        ],
+        "toy",
+        [helper.make_tensor_value_info("x_tst", TensorProto.INT64, [1, "length"])],
+        [helper.make_tensor_value_info("output", TensorProto.FLOAT, [1, "length", 32])],
+        [numpy_helper.from_array(embedding, "embedding"), numpy_helper.from_array(weight, "weight")],
+    )
+    return helper.make_model(graph, opset_imports=[helper.make_opsetid("", 17)], ir_version=8)
+
+
+def int32_feeds(count: int) -> list[dict[str, np.ndarray]]:
+    """ツールが *.npz に書き出す int32 の feeds。"""
+    rng = np.random.default_rng(1)
+    return [
+        {"x_tst": rng.integers(0, 100, size=(1, int(n))).astype(np.int32)}
+        for n in rng.integers(4, 16, count)
+    ]
+
+
+def test_static_calibration_casts_int32_feeds(tmp_path):
+    calibration, gate = split_holdout(int32_feeds(8))
+    output_path = tmp_path / "model_int8.onnx"
+    quantize_with_gate(
+        make_model(), output_path, "static",
+        gate_feeds=gate, max_error=1.0, calibration_feeds=calibration,
+    )
+    assert output_path.exists()
+    assert not output_path.with_suffix(".fp32.temp.onnx").exists()
+
+
+def test_rejected_model_is_removed(tmp_path):
+    output_path = tmp_path / "model_int8.onnx"
+    with pytest.raises(AccuracyGateError):
+        quantize_with_gate(
+            make_model(), output_path, "dynamic", gate_feeds=int32_feeds(2), max_error=0.0
+        )
+    assert not output_path.exists()
+
+
+def test_failed_gate_removes_unvalidated_output(tmp_path):
+    output_path = tmp_path / "model_int8.onnx"
+    # 量子化後のゲートで入力が足りずに失敗する
+    with pytest.raises(KeyError):
+        quantize_with_gate(
+            make_model(), output_path, "dynamic", gate_feeds=[{}], max_error=1.0
+        )
+    assert not output_path.exists()
+    assert not output_path.with_suffix(".fp32.temp.onnx").exists()
+
+
+def test_split_holdout_keeps_gate_inputs_out_of_calibration():
+    feeds_list = int32_feeds(9)
+    calibration, gate = split_holdout(feeds_list, every=4)
+    assert len(calibration) == 7 and len(gate) == 2
+    assert not any(any(g is c for c in calibration) for g in gate)
+    with pytest.raises(ValueError):
+        split_holdout(feeds_list[:1])
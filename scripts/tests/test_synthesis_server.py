@@ -0,0 +1,154 @@
+"""synthesis_server.py のテスト (バッチ推論の結果が batch=1 と一致すること)"""
+
+import numpy as np
+import onnx
+import pytest
+from onnx import TensorProto, helper, numpy_helper
+
+from audio_postprocess import TRIM_BLOCK_SIZE
+from bert_cache import BertFeatureStore
+from synthesis_server import (
+    AUDIO_LENGTHS_OUTPUT,
+    BERT_DIM,
+    BertRunner,
+    SynthesisServer,
+    make_dummy_requests,
+)
+from text_tensors import align_bert_to_phonemes
+
+HOP_LENGTH = 300
+
+
+def expected_length(request) -> int:
+    """無音のない音声は末尾の端数ブロックだけがトリムされる。"""
+    return len(request.phoneme_ids) * HOP_LENGTH // TRIM_BLOCK_SIZE * TRIM_BLOCK_SIZE
+
+
+def save(graph: onnx.GraphProto, path) -> str:
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 17)], ir_version=8)
+    onnx.save(model, path)
+    return str(path)
+
+
+def make_bert(path, fuse_alignment: bool = False) -> str:
+    """input_ids を埋め込んで [1, 1024, token_len] を返す DeBERTa の代わり。
+
+    fuse_alignment=True では phone_to_token で展開した [1, 1024, phone_len] を返す。
+    """
+    embedding = np.random.default_rng(0).standard_normal((1000, BERT_DIM)).astype(np.float32)
+    nodes = [
+        helper.make_node("Gather", ["embedding", "input_ids"], ["hidden"]),
+        helper.make_node("Transpose", ["hidden"], ["output"], perm=[0, 2, 1]),
+    ]
+    inputs = [helper.make_tensor_value_info("input_ids", TensorProto.INT64, [1, "token_len"])]
+    if fuse_alignment:
+        nodes[-1].output[0] = "tokens"
+        nodes.append(helper.make_node("Gather", ["tokens", "phone_to_token"], ["output"], axis=2))
+        inputs.append(helper.make_tensor_value_info("phone_to_token", TensorProto.INT64, ["phone_len"]))
+    graph = helper.make_graph(
+        nodes,
+        "bert",
+        inputs,
+        [helper.make_tensor_value_info("output", TensorProto.FLOAT, [1, BERT_DIM, None])],
+        [numpy_helper.from_array(embedding, "embedding")],
+    )
+    return save(graph, path)
+
+
+def make_tts(path, with_lengths: bool = True) -> str:
+    """音素ごとに HOP_LENGTH サンプルを出す SBV2 の代わり。
+
+    パディング位置も 0.3 のバイアスで無音にならない (実モデルと同じく末尾無音は保証されない)。
+    """
+    nodes = [
+        helper.make_node("Cast", ["x_tst"], ["x_float"], to=TensorProto.FLOAT),
+        helper.make_node("Mul", ["x_float", "scale"], ["x_scaled"]),
+        helper.make_node("ReduceMean", ["bert"], ["bert_mean"], axes=[1], keepdims=0),
+        helper.make_node("Mul", ["bert_mean", "scale"], ["bert_scaled"]),
+        helper.make_node("Add", ["x_scaled", "bert_scaled"], ["frame"]),
+        helper.make_node("Add", ["frame", "bias"], ["frame_biased"]),
+        helper.make_node("Unsqueeze", ["frame_biased", "last_axis"], ["frame_3d"]),
+        helper.make_node("Expand", ["frame_3d", "hop_shape"], ["samples"]),
+        helper.make_node("Reshape", ["samples", "output_shape"], ["output"]),
+        helper.make_node("Cast", ["x_tst_lengths"], ["lengths_64"], to=TensorProto.INT64),
+        helper.make_node("Mul", ["lengths_64", "hop_length"], [AUDIO_LENGTHS_OUTPUT]),
+    ]
+    outputs = [helper.make_tensor_value_info("output", TensorProto.FLOAT, ["batch", 1, "samples"])]
+    initializers = [
+        numpy_helper.from_array(np.float32(0.01), "scale"),
+        numpy_helper.from_array(np.float32(0.3), "bias"),
+        numpy_helper.from_array(np.array([2], dtype=np.int64), "last_axis"),
+        numpy_helper.from_array(np.array([1, 1, HOP_LENGTH], dtype=np.int64), "hop_shape"),
+        numpy_helper.from_array(np.array([0, 1, -1], dtype=np.int64), "output_shape"),
+    ]
+    if with_lengths:
+        outputs.append(helper.make_tensor_value_info(AUDIO_LENGTHS_OUTPUT, TensorProto.INT64, ["batch"]))
+        initializers.append(numpy_helper.from_array(np.int64(HOP_LENGTH), "hop_length"))
+    else:
+        nodes = nodes[:-2]
+    graph = helper.make_graph(
+        nodes,
+        "tts",
+        [
+            helper.make_tensor_value_info("x_tst", TensorProto.INT64, ["batch", "length"]),
+            helper.make_tensor_value_info("x_tst_lengths", TensorProto.INT64, ["batch"]),
+            helper.make_tensor_value_info("bert", TensorProto.FLOAT, ["batch", BERT_DIM, "length"]),
+        ],
+        outputs,
+        initializers,
+    )
+    return save(graph, path)
+
+
+@pytest.fixture(scope="module")
+def models(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("models")
+    return make_bert(directory / "bert.onnx"), make_tts(directory / "tts.onnx")
+
+
+def synthesize(bert_path: str, tts_path: str, max_batch_size: int):
+    requests = make_dummy_requests(12)
+    server = SynthesisServer(bert_path, tts_path, max_batch_size, batch_window_ms=500.0)
+    with server:
+        audios = server.synthesize(requests)
+    return requests, audios, server.stats
+
+
+def test_batched_output_matches_batch_of_one(models):
+    requests, batched, stats = synthesize(*models, max_batch_size=8)
+    assert max(stats.batch_sizes) > 1
+    _, single, _ = synthesize(*models, max_batch_size=1)
+    for request, got, expected in zip(requests, batched, single):
+        # パディング分を含まず、リクエスト自身の長さで切られている
+        assert len(expected) == expected_length(request)
+        assert len(got) == len(expected)
+        # バッチ形状による ReduceMean の丸め誤差のみ
+        np.testing.assert_allclose(got, expected, rtol=1e-6)
+
+
+def test_export_without_audio_lengths_runs_batch_of_one(models, tmp_path):
+    tts_path = make_tts(tmp_path / "tts_old.onnx", with_lengths=False)
+    requests, audios, stats = synthesize(models[0], tts_path, max_batch_size=8)
+    assert stats.batch_sizes == [1] * len(requests)
+    for request, audio in zip(requests, audios):
+        assert len(audio) == expected_length(request)
+
+
+def test_bert_runner_alignment_matches_text_tensors(models, tmp_path):
+    request = make_dummy_requests(1)[0]
+    identity = np.ones(len(request.token_ids), dtype=np.int32)
+    features = BertRunner(models[0]).forward(request.token_ids, identity)
+    expected = align_bert_to_phonemes(features, request.word2ph)
+    assert expected.shape == (BERT_DIM, len(request.phoneme_ids))
+
+    unfused_path = models[0]
+    fused_path = make_bert(tmp_path / "bert_fused.onnx", fuse_alignment=True)
+    for i, path in enumerate((unfused_path, fused_path)):
+        got = BertRunner(path).run(request.token_ids, request.word2ph)
+        np.testing.assert_array_equal(got, expected)
+        # キャッシュは FP16 で保存する (1 回目はミス、2 回目はヒット)
+        with BertFeatureStore(tmp_path / f"cache{i}", "toy") as store:
+            runner = BertRunner(path, bert_cache=store)
+            for _ in range(2):
+                got = runner.run(request.token_ids, request.word2ph, text="こんにちは")
+                np.testing.assert_allclose(got, expected, rtol=1e-3, atol=1e-3)
@@ -0,0 +1,140 @@
+"""text_tensors.py のテスト (C# の PhonemeUtils / TextNormalizer / SBV2Tokenizer / BertAligner との一致)"""
+
+import numpy as np
+import pytest
+
+from text_tensors import (
+    EMBEDDING_DIM,
+    SBV2Tokenizer,
+    _reference_adjust,
+    _reference_encode,
+    _reference_intersperse,
+    adjust_word2ph_for_blanks,
+    adjust_word2ph_for_blanks_batch,
+    align_bert_to_phonemes,
+    align_bert_to_phonemes_batch,
+    from_ragged,
+    intersperse,
+    intersperse_batch,
+    normalize_text,
+    phone_to_token_indices,
+    to_ragged,
+)
+
+# TokenizerTests と同じ語彙
+VOCAB = {
+    "[PAD]": 0, "[CLS]": 1, "[SEP]": 2, "[UNK]": 3,
+    "こ": 100, "ん": 101, "に": 102, "ち": 103, "は": 104, "テ": 105,
+}
+
+
+def reference_align(bert_flat, token_len, word2ph, phone_len):
+    """BertAligner.AlignBertToPhonemes のループの書き写し。"""
+    aligned = [0.0] * (EMBEDDING_DIM * phone_len)
+    phone_idx = 0
+    for token_idx, count in enumerate(word2ph):
+        for _ in range(count):
+            for d in range(EMBEDDING_DIM):
+                aligned[d * phone_len + phone_idx] = bert_flat[d * token_len + token_idx]
+            phone_idx += 1
+    return aligned
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+
+def test_intersperse():
+    assert intersperse(np.array([5, 6, 7])).tolist() == [0, 5, 0, 6, 0, 7, 0]
+    assert intersperse(np.array([], dtype=np.int32)).tolist() == [0]
+
+
+def test_adjust_word2ph_for_blanks():
+    assert adjust_word2ph_for_blanks(np.array([0, 2, 1, 0])).tolist() == [1, 4, 2, 0]
+
+
+def test_intersperse_batch_matches_per_sequence(rng):
+    sequences = [rng.integers(1, 100, size=n).astype(np.int32) for n in rng.integers(0, 30, 64)]
+    batch, offsets = intersperse_batch(*to_ragged(sequences))
+    for got, src in zip(from_ragged(batch, offsets), sequences):
+        assert got.tolist() == _reference_intersperse(src.tolist(), 0)
+
+
+def test_adjust_word2ph_for_blanks_batch_matches_per_sequence(rng):
+    word2phs = [rng.integers(0, 4, size=n).astype(np.int32) for n in rng.integers(1, 30, 64)]
+    values, offsets = to_ragged(word2phs)
+    adjusted = adjust_word2ph_for_blanks_batch(values, offsets)
+    for got, src in zip(from_ragged(adjusted, offsets), word2phs):
+        assert got.tolist() == _reference_adjust(src.tolist())
+
+
+@pytest.mark.parametrize("src, expected", [
+    ("ＡＢＣ１２３", "ABC123"), ("　こんにちは　　世界　", "こんにちは 世界"),
+    ("a  b", "a b"), ("", ""), (None, ""),
+])
+def test_normalize_text(src, expected):
+    assert normalize_text(src) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("こんにちは", [1, 100, 101, 102, 103, 104, 2]),
+    ("X", [1, 3, 2]),
+    ("", [1, 2]),
+    # サロゲートペアは C# と同じく 2 トークン (どちらも [UNK])
+    ("𠮷", [1, 3, 3, 2]),
+])
+def test_encode(text, expected):
+    token_ids, mask = SBV2Tokenizer(VOCAB).encode(text)
+    assert token_ids.tolist() == expected
+    assert mask.tolist() == [1] * len(expected)
+
+
+def test_encode_long_text():
+    assert len(SBV2Tokenizer(VOCAB).encode("こ" * 100)[0]) == 102
+
+
+def test_encode_batch_matches_per_text(rng):
+    alphabet = list("こんにちはテX𠮷") + [""]
+    texts = ["".join(rng.choice(alphabet, size=n)) for n in rng.integers(0, 20, 64)]
+    batch_ids, offsets = SBV2Tokenizer(VOCAB).encode_batch(texts)
+    for got, text in zip(from_ragged(batch_ids, offsets), texts):
+        assert got.tolist() == _reference_encode(VOCAB, text)
+
+
+def test_align_bert_to_phonemes(rng):
+    token_len = 6
+    word2ph = np.array([1, 2, 0, 3, 1, 1], dtype=np.int32)
+    bert = rng.standard_normal((1, EMBEDDING_DIM, token_len)).astype(np.float32)
+    aligned = align_bert_to_phonemes(bert, word2ph, phone_len=8)
+    reference = reference_align(bert.reshape(-1).tolist(), token_len, word2ph.tolist(), 8)
+    np.testing.assert_array_equal(aligned.reshape(-1), np.float32(reference))
+
+
+def test_phone_to_token_indices():
+    # --fuse-alignment の BERT 入力 phone_to_token
+    assert phone_to_token_indices(np.array([1, 2, 0, 3])).tolist() == [0, 1, 1, 3, 3, 3]
+
+
+def test_align_bert_to_phonemes_rejects_word2ph_sum_mismatch(rng):
+    word2ph = np.array([1, 2, 0, 3, 1, 1], dtype=np.int32)
+    bert = rng.standard_normal((1, EMBEDDING_DIM, 6)).astype(np.float32)
+    with pytest.raises(ValueError):
+        align_bert_to_phonemes(bert, word2ph, phone_len=9)
+
+
+def test_align_bert_to_phonemes_batch_matches_per_sequence(rng):
+    token_lens = rng.integers(2, 24, 32)
+    features = [rng.standard_normal((EMBEDDING_DIM, n)).astype(np.float32) for n in token_lens]
+    word2phs = [rng.integers(0, 4, size=n).astype(np.int32) for n in token_lens]
+    padded = np.zeros((len(features), EMBEDDING_DIM, token_lens.max()), dtype=np.float32)
+    for i, feat in enumerate(features):
+        padded[i, :, : feat.shape[1]] = feat
+    aligned, phone_offsets = align_bert_to_phonemes_batch(padded, *to_ragged(word2phs))
+    for i, (feat, word2ph) in enumerate(zip(features, word2phs)):
+        phone_len = phone_offsets[i + 1] - phone_offsets[i]
+        np.testing.assert_array_equal(
+            aligned[i, :, :phone_len], align_bert_to_phonemes(feat, word2ph)
+        )
+        # パディングは 0
+        assert not aligned[i, :, phone_len:].any()
@@ -0,0 +1,107 @@
+"""voice_archive.py のテスト (書き込みと読み出し、キーの正規化、書きかけの破棄)"""
+
+import numpy as np
+import pytest
+
+from audio_postprocess import flac_available, to_int16
+from synthesis_server import SynthesisRequest
+from voice_archive import FORMATS, VoiceArchive, VoiceArchiveWriter
+
+
+def lines(count: int = 20) -> dict[tuple[str, int, int], np.ndarray]:
+    """(テキスト, style_id, speaker_id) → float PCM。長さはラインごとに変える。"""
+    rng = np.random.default_rng(0)
+    return {
+        (f"セリフ{i}", i % 3, i % 2): rng.uniform(-1, 1, 100 + 37 * i).astype(np.float32)
+        for i in range(count)
+    }
+
+
+@pytest.mark.parametrize("fmt", FORMATS)
+def test_round_trip(tmp_path, fmt):
+    if fmt == "flac" and not flac_available():
+        pytest.skip("soundfile is not installed")
+    path = tmp_path / "voice.pack"
+    expected = lines()
+    with VoiceArchiveWriter(path, sample_rate=22050, fmt=fmt) as writer:
+        for (text, style_id, speaker_id), samples in expected.items():
+            assert writer.add(text, samples, style_id, speaker_id)
+        # 同じキーは追加しない
+        assert not writer.add("セリフ0", np.zeros(10, dtype=np.float32))
+
+    with VoiceArchive(path) as archive:
+        assert len(archive) == len(expected)
+        assert archive.sample_rate == 22050
+        for (text, style_id, speaker_id), samples in expected.items():
+            assert (text, style_id, speaker_id) in archive
+            pcm = archive.get(text, style_id, speaker_id)
+            assert pcm.dtype == np.int16
+            np.testing.assert_array_equal(pcm, to_int16(samples))
+            np.testing.assert_allclose(
+                archive.get_float(text, style_id, speaker_id), samples, atol=1 / 32767
+            )
+        stats = archive.stats()
+        assert stats["entries"] == len(expected)
+        assert stats["formats"] == {fmt: len(expected)}
+
+
+def test_pcm16_lines_are_views_of_the_map(tmp_path):
+    path = tmp_path / "voice.pack"
+    with VoiceArchiveWriter(path) as writer:
+        writer.add("こんにちは", np.full(64, 0.5, dtype=np.float32))
+    with VoiceArchive(path) as archive:
+        pcm = archive.get("こんにちは")
+        # コピーせず読み取り専用のビューを返す
+        assert not pcm.flags.writeable
+        assert not pcm.flags.owndata
+
+
+def test_lookup_uses_normalized_text_and_ids(tmp_path):
+    path = tmp_path / "voice.pack"
+    request = SynthesisRequest(
+        token_ids=np.zeros(1, dtype=np.int32),
+        phoneme_ids=np.zeros(1, dtype=np.int32),
+        tones=np.zeros(1, dtype=np.int32),
+        language=np.zeros(1, dtype=np.int32),
+        word2ph=np.ones(1, dtype=np.int32),
+        style_vec=np.zeros(256, dtype=np.float32),
+        text="ＡＢＣ　１２３",
+        style_id=2,
+        speaker_id=1,
+    )
+    with VoiceArchiveWriter(path) as writer:
+        assert writer.add_request(request, np.zeros(10, dtype=np.int16))
+    with VoiceArchive(path) as archive:
+        # TextNormalizer.Normalize と同じ正規化 (全角英数・空白)
+        assert archive.get("ABC 123", 2, 1) is not None
+        assert archive.get("ABC 123", 0, 1) is None
+        assert archive.get("ABC 123", 2, 0) is None
+        assert ("ABC 124", 2, 1) not in archive
+        assert archive.get_float("ABC 124", 2, 1) is None
+
+
+def test_abort_keeps_existing_archive(tmp_path):
+    path = tmp_path / "voice.pack"
+    with VoiceArchiveWriter(path) as writer:
+        writer.add("古いセリフ", np.zeros(10, dtype=np.float32))
+    with pytest.raises(RuntimeError):
+        with VoiceArchiveWriter(path) as writer:
+            writer.add("新しいセリフ", np.zeros(10, dtype=np.float32))
+            raise RuntimeError("render failed")
+    # 一時ファイルは残らず、既存のアーカイブは置き換わらない
+    assert [p.name for p in tmp_path.iterdir()] == ["voice.pack"]
+    with VoiceArchive(path) as archive:
+        assert len(archive) == 1
+        assert ("古いセリフ", 0, 0) in archive
+
+
+def test_rejects_foreign_file(tmp_path):
+    path = tmp_path / "voice.pack"
+    path.write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError, match="not a voice archive"):
+        VoiceArchive(path)
+
+
+def test_rejects_unknown_format(tmp_path):
+    with pytest.raises(ValueError, match="Unknown archive format"):
+        VoiceArchiveWriter(tmp_path / "voice.pack", fmt="mp3")
@@ -0,0 +1,373 @@
+"""
+テキスト → テンソル前処理 (C# ランタイムの Python 版)
+
+Unity 側の前処理と同じ結果を返す numpy / Numba 実装。
+バッチ処理用の関数は可変長の系列を「連結した値 + offsets」で受け取り、ループなしで一括処理する
+(offsets は長さ N+1、系列 i は values[offsets[i]:offsets[i + 1]])。
+
+対応する C# 実装:
+- PhonemeUtils.Intersperse            → intersperse / intersperse_batch
+- PhonemeUtils.AdjustWord2PhForBlanks → adjust_word2ph_for_blanks / adjust_word2ph_for_blanks_batch
+- TextNormalizer.Normalize            → normalize_text
+- SBV2Tokenizer.Encode                → SBV2Tokenizer.encode / encode_batch
+  (C# の string と同じく UTF-16 コード単位ごとに 1 トークン)
+- BertAligner.AlignBertToPhonemes     → align_bert_to_phonemes / align_bert_to_phonemes_batch
+  (Burst ジョブ相当の列コピーは Numba の並列カーネル。
+   参照トークン index は phone_to_token_indices で、--fuse-alignment の BERT 入力と同じ)
+
+C# のループ実装を書き写した参照実装・C# テスト (TokenizerTests / BertAlignerTests) と同じ期待値、
+およびランダムな可変長バッチとの一致は tests/test_text_tensors.py で確認する。
+
+使用方法:
+    uv run python text_tensors.py --benchmark --batch-size 256
+"""
+
+import argparse
+import json
+import re
+import time
+from pathlib import Path
+
+import numba
+import numpy as np
+
+EMBEDDING_DIM = 1024
+
+PAD_ID = 0
+CLS_ID = 1
+SEP_ID = 2
+UNK_ID = 3
+
+
+# ---------------------------------------------------------------------------
+# 可変長バッチ (values + offsets)
+# ---------------------------------------------------------------------------
+
+
+def to_ragged(sequences: list[np.ndarray], dtype=np.int32) -> tuple[np.ndarray, np.ndarray]:
+    """系列のリストを (連結した値, offsets[N+1]) にする。"""
+    lengths = np.fromiter((len(s) for s in sequences), dtype=np.int64, count=len(sequences))
+    offsets = np.zeros(len(sequences) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    values = (
+        np.concatenate(sequences).astype(dtype, copy=False)
+        if sequences else np.zeros(0, dtype=dtype)
+    )
+    return values, offsets
+
+
+def from_ragged(values: np.ndarray, offsets: np.ndarray) -> list[np.ndarray]:
+    """(値, offsets) を系列のリスト (values のビュー) に戻す。"""
+    return [values[offsets[i] : offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+
+def segment_ids(offsets: np.ndarray) -> np.ndarray:
+    """要素ごとの系列番号。"""
+    return np.repeat(np.arange(len(offsets) - 1, dtype=np.int64), np.diff(offsets))
+
+
+# ---------------------------------------------------------------------------
+# PhonemeUtils
+# ---------------------------------------------------------------------------
+
+
+def intersperse(src: np.ndarray, filler: int = 0) -> np.ndarray:
+    """[a, b, c] → [filler, a, filler, b, filler, c, filler] (長さ 2N+1)。"""
+    result = np.full(len(src) * 2 + 1, filler, dtype=np.int32)
+    result[1::2] = src
+    return result
+
+
+def intersperse_batch(
+    values: np.ndarray, offsets: np.ndarray, filler: int = 0
+) -> tuple[np.ndarray, np.ndarray]:
+    """全系列に intersperse を適用する。
+
+    系列 i の j 番目 (連結後の位置 k) は出力の 2k + i + 1 に移る。
+    """
+    out_offsets = offsets * 2 + np.arange(len(offsets), dtype=np.int64)
+    result = np.full(out_offsets[-1], filler, dtype=np.int32)
+    positions = np.arange(len(values), dtype=np.int64) * 2 + segment_ids(offsets) + 1
+    result[positions] = values
+    return result, out_offsets
+
+
+def adjust_word2ph_for_blanks(word2ph: np.ndarray) -> np.ndarray:
+    """各値を ×2 し、先頭に +1 する (先頭 blank トークン分)。"""
+    if len(word2ph) == 0:
+        raise ValueError("word2ph must not be empty")
+    result = np.asarray(word2ph, dtype=np.int32) * 2
+    result[0] += 1
+    return result
+
+
+def adjust_word2ph_for_blanks_batch(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """全系列に adjust_word2ph_for_blanks を適用する (offsets は変わらない)。"""
+    if np.any(np.diff(offsets) == 0):
+        raise ValueError("word2ph must not be empty")
+    result = np.asarray(values, dtype=np.int32) * 2
+    result[offsets[:-1]] += 1
+    return result
+
+
+# ---------------------------------------------------------------------------
+# TextNormalizer
+# ---------------------------------------------------------------------------
+
+# 全角英数字・記号 (U+FF01-FF5E) → 半角
+_FULLWIDTH_TABLE = {code: code - 0xFEE0 for code in range(0xFF01, 0xFF5F)}
+_SPACES = re.compile(" +")
+
+
+def normalize_text(text: str | None) -> str:
+    """全角英数字→半角、全角スペース→半角、連続スペース圧縮、前後のスペース除去。"""
+    if not text:
+        return ""
+    text = text.translate(_FULLWIDTH_TABLE).replace("\u3000", " ")
+    return _SPACES.sub(" ", text).strip(" ")
+
+
+# ---------------------------------------------------------------------------
+# SBV2Tokenizer
+# ---------------------------------------------------------------------------
+
+
+def _utf16_units(text: str) -> np.ndarray:
+    """C# の string と同じ UTF-16 コード単位の列。"""
+    return np.frombuffer(text.encode("utf-16-le"), dtype="<u2")
+
+
+class SBV2Tokenizer:
+    """DeBERTa (ku-nlp/deberta-v2-large-japanese-char-wwm) 用の文字レベルトークナイザ。
+
+    語彙のうち 1 文字 (UTF-16 で 1 コード単位) のトークンだけを 65536 要素の表にし、
+    テキストのコード単位を表引きする。
+    """
+
+    def __init__(self, vocab: dict[str, int]):
+        self.table = np.full(65536, vocab.get("[UNK]", UNK_ID), dtype=np.int32)
+        self.vocab_size = 0
+        for token, token_id in vocab.items():
+            units = _utf16_units(token)
+            if len(units) == 1:
+                self.table[units[0]] = token_id
+                self.vocab_size += 1
+        self.cls_id = vocab.get("[CLS]", CLS_ID)
+        self.sep_id = vocab.get("[SEP]", SEP_ID)
+        self.unk_id = vocab.get("[UNK]", UNK_ID)
+
+    @classmethod
+    def from_vocab_json(cls, path: str | Path) -> "SBV2Tokenizer":
+        return cls(json.loads(Path(path).read_text(encoding="utf-8")))
+
+    def encode(self, text: str | None) -> tuple[np.ndarray, np.ndarray]:
+        """[CLS] + 文字ごとの ID + [SEP] と attention_mask (全 1) を返す。"""
+        units = _utf16_units(text or "")
+        token_ids = np.empty(len(units) + 2, dtype=np.int32)
+        token_ids[0] = self.cls_id
+        token_ids[1:-1] = self.table[units]
+        token_ids[-1] = self.sep_id
+        return token_ids, np.ones_like(token_ids)
+
+    def encode_batch(self, texts: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        """全テキストをまとめて表引きし、(連結した token_ids, offsets) を返す。
+
+        attention_mask は全 1、token_type_ids は全 0 のため返さない。
+        """
+        encoded = [(text or "").encode("utf-16-le") for text in texts]
+        units = np.frombuffer(b"".join(encoded), dtype="<u2")
+        lengths = np.fromiter((len(e) // 2 for e in encoded), dtype=np.int64, count=len(texts))
+        offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+        np.cumsum(lengths + 2, out=offsets[1:])
+
+        token_ids = np.empty(offsets[-1], dtype=np.int32)
+        token_ids[offsets[:-1]] = self.cls_id
+        token_ids[offsets[1:] - 1] = self.sep_id
+        # テキスト i の j 文字目 (連結後の位置 k) は出力の k + 2i + 1
+        text_segments = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)
+        positions = np.arange(len(units), dtype=np.int64) + 2 * text_segments + 1
+        token_ids[positions] = self.table[units]
+        return token_ids, offsets
+
+
+# ---------------------------------------------------------------------------
+# BertAligner
+# ---------------------------------------------------------------------------
+
+
+@numba.njit(parallel=True, cache=True)
+def _gather_columns(features: np.ndarray, columns: np.ndarray, out: np.ndarray) -> None:
+    """out[d, p] = features[d, columns[p]] (AlignBertToPhonemesBurst のジョブ相当)。"""
+    for d in numba.prange(features.shape[0]):
+        row = features[d]
+        out_row = out[d]
+        for p in range(columns.shape[0]):
+            out_row[p] = row[columns[p]]
+
+
+@numba.njit(parallel=True, cache=True)
+def _gather_padded(
+    bert: np.ndarray, columns: np.ndarray, phone_offsets: np.ndarray, out: np.ndarray
+) -> None:
+    """out[i, d, p] = bert[i, d, columns[phone_offsets[i] + p]] (系列ごとに並列)。"""
+    for i in numba.prange(bert.shape[0]):
+        start = phone_offsets[i]
+        count = phone_offsets[i + 1] - start
+        for d in range(bert.shape[1]):
+            row = bert[i, d]
+            out_row = out[i, d]
+            for p in range(count):
+                out_row[p] = row[columns[start + p]]
+
+
+def _check_word2ph(word2ph: np.ndarray, token_len: int, phone_len: int | None) -> int:
+    total = int(np.sum(word2ph))
+    if phone_len is not None and total != phone_len:
+        raise ValueError(f"word2ph sum ({total}) does not match phoneSeqLen ({phone_len}).")
+    if len(word2ph) > token_len:
+        raise ValueError(f"word2ph length ({len(word2ph)}) exceeds token_len ({token_len}).")
+    return total
+
+
+def phone_to_token_indices(word2ph: np.ndarray) -> np.ndarray:
+    """word2ph から音素ごとの参照トークン index [phone_len] を求める (phone_to_token 入力)。"""
+    return np.repeat(np.arange(len(word2ph), dtype=np.int64), word2ph)
+
+
+def align_bert_to_phonemes(
+    bert: np.ndarray,
+    word2ph: np.ndarray,
+    phone_len: int | None = None,
+    out: np.ndarray | None = None,
+) -> np.ndarray:
+    """[1024, token_len] (先頭に batch=1 の軸があってもよい) を [1024, phone_len] に展開する。
+
+    out を渡すと事前確保済みバッファに書き込む (C# の ArrayPool 版と同様)。
+    """
+    features = bert.reshape(bert.shape[-2], bert.shape[-1])
+    total = _check_word2ph(word2ph, features.shape[1], phone_len)
+    columns = phone_to_token_indices(word2ph)
+    if out is None:
+        out = np.empty((features.shape[0], total), dtype=features.dtype)
+    _gather_columns(np.ascontiguousarray(features), columns, out)
+    return out
+
+
+def align_bert_to_phonemes_batch(
+    bert: np.ndarray, word2ph: np.ndarray, word_offsets: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """パディングされた BERT 出力のバッチを一括で展開する。
+
+    bert: [N, 1024, token_len_max] (系列 i の有効長は word2ph の系列長以上)
+    戻り値: ([N, 1024, phone_len_max] (パディングは 0), 音素の offsets[N+1])
+    SBV2 のバッチ入力 bert [N, 1024, x_tst_max_length] にそのまま使える。
+    """
+    if bert.shape[0] != len(word_offsets) - 1:
+        raise ValueError(f"bert batch ({bert.shape[0]}) does not match word2ph batch")
+    if np.any(np.diff(word_offsets) > bert.shape[2]):
+        raise ValueError(f"word2ph length exceeds token_len ({bert.shape[2]})")
+    word2ph = np.asarray(word2ph, dtype=np.int64)
+    phone_offsets = np.concatenate([[0], np.cumsum(word2ph)])[word_offsets]
+
+    # 系列内のトークン位置を word2ph の回数だけ繰り返す
+    local_tokens = np.arange(len(word2ph), dtype=np.int64) - np.repeat(
+        word_offsets[:-1], np.diff(word_offsets)
+    )
+    columns = np.repeat(local_tokens, word2ph)
+    out = np.zeros((bert.shape[0], bert.shape[1], int(np.diff(phone_offsets).max(initial=0))),
+                   dtype=bert.dtype)
+    _gather_padded(np.ascontiguousarray(bert), columns, phone_offsets, out)
+    return out, phone_offsets
+
+
+# ---------------------------------------------------------------------------
+# 参照実装 (C# のループ実装をそのまま書き写したもの。ベンチマークとテストで使う)
+# ---------------------------------------------------------------------------
+
+
+def _reference_intersperse(src, filler):
+    result = [filler] * (len(src) * 2 + 1)
+    for i in range(len(src)):
+        result[i * 2 + 1] = src[i]
+    return result
+
+
+def _reference_adjust(word2ph):
+    result = [w * 2 for w in word2ph]
+    result[0] += 1
+    return result
+
+
+def _reference_encode(vocab, text):
+    char_to_id = {}
+    for key, value in vocab.items():
+        units = key.encode("utf-16-le")
+        if len(units) == 2:
+            char_to_id[units] = value
+    units = (text or "").encode("utf-16-le")
+    ids = [vocab.get("[CLS]", CLS_ID)]
+    for i in range(0, len(units), 2):
+        ids.append(char_to_id.get(units[i : i + 2], vocab.get("[UNK]", UNK_ID)))
+    ids.append(vocab.get("[SEP]", SEP_ID))
+    return ids
+
+
+def benchmark(batch_size: int, seed: int = 0) -> None:
+    """Python ループ (C# の書き写し) とバッチ実装の処理時間を比較する。"""
+    rng = np.random.default_rng(seed)
+    vocab = {chr(0x3041 + i): 100 + i for i in range(80)}
+    tokenizer = SBV2Tokenizer(vocab)
+    texts = [
+        "".join(chr(0x3041 + c) for c in rng.integers(0, 90, size=n))
+        for n in rng.integers(10, 60, batch_size)
+    ]
+    word2phs = [np.concatenate([[0], rng.integers(1, 4, size=len(t)), [0]]) for t in texts]
+    phonemes = [rng.integers(1, 100, size=int(w.sum())).astype(np.int32) for w in word2phs]
+    # BERT をバッチ実行したときの出力 [N, 1024, token_len_max]
+    bert = rng.standard_normal(
+        (batch_size, EMBEDDING_DIM, max(len(w) for w in word2phs))
+    ).astype(np.float32)
+
+    # JIT コンパイルを計測から除く
+    align_bert_to_phonemes_batch(bert[:1], *to_ragged(word2phs[:1]))
+
+    start = time.perf_counter()
+    aligned = []
+    for i, (text, phones, w2p) in enumerate(zip(texts, phonemes, word2phs)):
+        _reference_encode(vocab, text)
+        _reference_intersperse(phones.tolist(), 0)
+        adjusted = _reference_adjust(w2p.tolist())
+        phone_to_token = [t for t, n in enumerate(adjusted) for _ in range(n)]
+        aligned.append(bert[i][:, phone_to_token])
+    padded = np.zeros((batch_size, EMBEDDING_DIM, max(a.shape[1] for a in aligned)), np.float32)
+    for i, a in enumerate(aligned):
+        padded[i, :, : a.shape[1]] = a
+    loop_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    tokenizer.encode_batch(texts)
+    intersperse_batch(*to_ragged(phonemes))
+    w_values, w_offsets = to_ragged(word2phs)
+    adjusted = adjust_word2ph_for_blanks_batch(w_values, w_offsets)
+    align_bert_to_phonemes_batch(bert, adjusted, w_offsets)
+    batch_ms = (time.perf_counter() - start) * 1000
+
+    print(f"Batch of {batch_size}: per-item loop {loop_ms:.1f}ms, batched {batch_ms:.1f}ms "
+          f"(x{loop_ms / batch_ms:.1f})")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Vectorized SBV2 text-to-tensor preprocessing (C# runtime parity)"
+    )
+    parser.add_argument("--benchmark", action="store_true", help="Compare with per-item loops")
+    parser.add_argument("--batch-size", type=int, default=128, help="Batch size for --benchmark")
+    args = parser.parse_args()
+
+    if not args.benchmark:
+        parser.error("specify --benchmark")
+    benchmark(args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+ONNX Runtime 向けの DeBERTa 演算子融合
+
+torch.onnx.export (opset 15) の DeBERTa グラフは LayerNorm / Gelu / バイアス加算が
+プリミティブ演算 (ReduceMean, Sub, Pow, Erf, Add ...) に分解されており、onnxsim は
+定数畳み込みしか行わない。onnxruntime.transformers の融合パスでこれらを ORT の
+contrib op にまとめる。
+
+融合対象:
+- LayerNorm → LayerNormalization、残差加算 + LayerNorm → SkipLayerNormalization
+- MatMul のバイアス加算 + Gelu → BiasGelu
+- 注意機構 → Attention (BERT 型のパターンのみ。DeBERTa の disentangled attention は
+  パターンが異なるため多くは融合されない)
+
+融合後のグラフは com.microsoft の contrib op を含むため ORT 専用 (Sentis 非対応)。
+FP16 変換は contrib op の型を扱える ORT の OnnxModel.convert_float_to_float16 を使う。
+
+使用方法:
+    # 変換時に融合 (ORT 用 --no-int32 のみ)
+    uv run python convert_bert_for_sentis.py \
+        --output deberta_fp32.onnx --no-fp16 --no-int32 --fuse-transformer --fusion-benchmark
+
+    # 変換済みモデルを融合し、融合前後のレイテンシを比較
+    uv run python transformer_fusion.py --model deberta_fp32.onnx \
+        --output deberta_fused.onnx --benchmark
+"""
+
+import argparse
+import json
+from pathlib import Path
+
+import onnx
+from onnxruntime.transformers import optimizer
+from onnxruntime.transformers.fusion_options import FusionOptions
+from onnxruntime.transformers.onnx_model import OnnxModel
+
+from benchmark_onnx import run_isolated
+from onnx_io import save_model
+
+# DeBERTa-v2-large
+DEFAULT_NUM_HEADS = 16
+DEFAULT_HIDDEN_SIZE = 1024
+
+
+def fuse_transformer(
+    model: onnx.ModelProto,
+    num_heads: int = DEFAULT_NUM_HEADS,
+    hidden_size: int = DEFAULT_HIDDEN_SIZE,
+) -> tuple[onnx.ModelProto, dict[str, int]]:
+    """Attention / LayerNorm / Gelu / バイアス加算を ORT の融合 op に置き換える。
+
+    戻り値は (融合後のモデル, 融合された op 種別ごとの個数)。
+    ORT 側のグラフ最適化 (opt_level) はロード時に任せ、ここではパターン融合のみ行う。
+    """
+    nodes_before = len(model.graph.node)
+    inputs_before = list(model.graph.input)
+
+    options = FusionOptions("bert")
+    fused = optimizer.optimize_model(
+        model,
+        model_type="bert",
+        num_heads=num_heads,
+        hidden_size=hidden_size,
+        optimization_options=options,
+        opt_level=0,
+    )
+    stats = {op: count for op, count in fused.get_fused_operator_statistics().items() if count}
+    result = fused.model
+
+    # 未使用入力 (token_type_ids など) も削除されるため、入力インターフェースを元に戻す
+    names = {inp.name for inp in result.graph.input}
+    for inp in inputs_before:
+        if inp.name not in names:
+            result.graph.input.append(inp)
+
+    nodes_after = len(result.graph.node)
+    print(
+        f"Transformer fusion: {nodes_before} -> {nodes_after} nodes "
+        f"({nodes_before - nodes_after} removed)"
+    )
+    for op, count in stats.items():
+        print(f"  {op}: {count}")
+    return result, stats
+
+
+def convert_fused_to_fp16(model: onnx.ModelProto) -> onnx.ModelProto:
+    """contrib op を含むモデルを FP16 に変換する (入出力は FP32 のまま)。"""
+    onnx_model = OnnxModel(model)
+    onnx_model.convert_float_to_float16(keep_io_types=True)
+    return onnx_model.model
+
+
+def compare_latency(
+    source_path: Path,
+    fused_path: Path,
+    lengths: list[int],
+    warmup: int = 3,
+    iterations: int = 20,
+    intra: int = 0,
+) -> list[dict]:
+    """融合前後のモデルを benchmark_onnx と同じ条件 (設定ごとに子プロセス) で計測する。"""
+    print(f"\n=== Fusion benchmark ({warmup} warmup, {iterations} runs) ===")
+    rows = []
+    for length in lengths:
+        row = {"length": length}
+        for variant, path in (("unfused", source_path), ("fused", fused_path)):
+            config = {
+                "kind": "bert", "variant": variant, "path": str(path), "length": length,
+                "intra": intra, "inter": 0,
+                "opt_level": "all", "execution_mode": "sequential",
+            }
+            result = run_isolated(config, warmup, iterations)
+            if "error" in result:
+                raise RuntimeError(f"Benchmark failed for {variant}: {result['error']}")
+            row[f"{variant}_p50_ms"] = result["p50_ms"]
+            row[f"{variant}_p95_ms"] = result["p95_ms"]
+        row["speedup"] = round(row["unfused_p50_ms"] / row["fused_p50_ms"], 3)
+        print(
+            f"  token_len={length:>4}: {row['unfused_p50_ms']:>9.2f}ms -> "
+            f"{row['fused_p50_ms']:>9.2f}ms (x{row['speedup']:.2f})"
+        )
+        rows.append(row)
+    return rows
+
+
+def write_fusion_report(
+    path: Path, stats: dict[str, int], nodes: tuple[int, int], rows: list[dict]
+) -> None:
+    report = {
+        "fused_ops": stats,
+        "nodes_before": nodes[0],
+        "nodes_after": nodes[1],
+        "latency": rows,
+    }
+    path.write_text(json.dumps(report, indent=2))
+    print(f"Fusion report written to: {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fuse transformer patterns in a DeBERTa ONNX model for ONNX Runtime"
+    )
+    parser.add_argument("--model", type=str, required=True, help="Unfused FP32 ONNX model")
+    parser.add_argument("--output", type=str, required=True, help="Fused ONNX model path")
+    parser.add_argument("--num-heads", type=int, default=DEFAULT_NUM_HEADS)
+    parser.add_argument("--hidden-size", type=int, default=DEFAULT_HIDDEN_SIZE)
+    parser.add_argument("--fp16", action="store_true", help="Convert the fused model to FP16")
+    parser.add_argument(
+        "--benchmark", action="store_true", help="Compare unfused vs fused CPU latency"
+    )
+    parser.add_argument(
+        "--lengths", type=int, nargs="+", default=[32, 128], help="Token lengths to benchmark"
+    )
+    parser.add_argument("--warmup", type=int, default=3, help="Warmup runs per config")
+    parser.add_argument("--iterations", type=int, default=20, help="Timed runs per config")
+    args = parser.parse_args()
+
+    model_path = Path(args.model)
+    output_path = Path(args.output)
+    model = onnx.load(str(model_path))
+    nodes_before = len(model.graph.node)
+    fused, stats = fuse_transformer(model, args.num_heads, args.hidden_size)
+    if args.fp16:
+        print("Converting to FP16...")
+        fused = convert_fused_to_fp16(fused)
+    nodes_after = len(fused.graph.node)
+    save_model(fused, output_path)
+    print(f"Saved fused model: {output_path}")
+
+    if args.benchmark:
+        rows = compare_latency(
+            model_path, output_path, args.lengths, args.warmup, args.iterations
+        )
+        write_fusion_report(
+            output_path.with_suffix(".fusion.json"), stats, (nodes_before, nodes_after), rows
+        )
+
+
+if __name__ == "__main__":
+    main()
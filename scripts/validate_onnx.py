@@ -12,13 +12,97 @@ import argparse
 import numpy as np
 import onnxruntime as ort
 
+from audio_postprocess import trimmed_lengths
+from text_tensors import align_bert_to_phonemes, phone_to_token_indices
+
+# onnxruntime の型文字列 → numpy dtype
+ORT_TYPE_TO_NUMPY = {
+    "tensor(int32)": np.int32,
+    "tensor(int64)": np.int64,
+    "tensor(float)": np.float32,
+    "tensor(float16)": np.float16,
+}
+
+
+def create_session(
+    model_path: str,
+    intra_op_num_threads: int = 0,
+    inter_op_num_threads: int = 0,
+    graph_optimization_level: ort.GraphOptimizationLevel = (
+        ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    ),
+    execution_mode: ort.ExecutionMode = ort.ExecutionMode.ORT_SEQUENTIAL,
+) -> ort.InferenceSession:
+    """CPU 向けの InferenceSession を作成する (スレッド数 0 = ORT 既定)。"""
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = intra_op_num_threads
+    options.inter_op_num_threads = inter_op_num_threads
+    options.graph_optimization_level = graph_optimization_level
+    options.execution_mode = execution_mode
+    return ort.InferenceSession(
+        model_path, sess_options=options, providers=["CPUExecutionProvider"]
+    )
 
-def validate_bert(model_path: str):
-    """DeBERTa ONNX の検証。"""
-    print(f"Loading BERT model: {model_path}")
-    session = ort.InferenceSession(model_path)
 
-    # 入力情報表示
+def cast_feeds(
+    session: ort.InferenceSession, feeds: dict[str, np.ndarray]
+) -> dict[str, np.ndarray]:
+    """feeds をセッションの入力型にキャストする。
+
+    Sentis 向け (int32) と ORT 向け (int64) のどちらのモデルにも同じ feeds を渡せる。
+    セッションに存在しない入力 (例: JP-Extra モデルに対する ja_bert/en_bert) は除外する。
+    """
+    result = {}
+    for inp in session.get_inputs():
+        if inp.name not in feeds:
+            raise KeyError(f"Missing feed for model input: {inp.name}")
+        dtype = ORT_TYPE_TO_NUMPY.get(inp.type)
+        value = feeds[inp.name]
+        result[inp.name] = value if dtype is None else value.astype(dtype, copy=False)
+    return result
+
+
+def make_bert_feeds(token_len: int) -> dict[str, np.ndarray]:
+    """DeBERTa 用のダミー入力を作成する。
+
+    phone_to_token は恒等写像 (--fuse-alignment のモデルでも出力は [1, 1024, token_len])。
+    """
+    return {
+        "input_ids": np.ones((1, token_len), dtype=np.int32),
+        "token_type_ids": np.zeros((1, token_len), dtype=np.int32),
+        "attention_mask": np.ones((1, token_len), dtype=np.int32),
+        "phone_to_token": np.arange(token_len, dtype=np.int32),
+    }
+
+
+def make_tts_feeds(seq_len: int, batch_size: int = 1) -> dict[str, np.ndarray]:
+    """SynthesizerTrn 用のダミー入力を作成する。
+
+    非 JP-Extra モデル用の ja_bert/en_bert と、DeBERTa 結合モデル (--combined-bert) 用の
+    トークン入力 (1 トークン = 1 音素) も含む (cast_feeds で不要分は除外される)。
+    """
+    x_tst = np.tile(np.arange(seq_len, dtype=np.int32) % 100, (batch_size, 1))
+    bert = np.zeros((batch_size, 1024, seq_len), dtype=np.float32)
+    return {
+        "x_tst": x_tst,
+        "x_tst_lengths": np.full((batch_size,), seq_len, dtype=np.int32),
+        "tones": np.zeros((batch_size, seq_len), dtype=np.int32),
+        "language": np.ones((batch_size, seq_len), dtype=np.int32),
+        "bert": bert,
+        "ja_bert": bert,
+        "en_bert": bert,
+        "style_vec": np.zeros((batch_size, 256), dtype=np.float32),
+        "sid": np.zeros((batch_size,), dtype=np.int32),
+        "sdp_ratio": np.array([0.2], dtype=np.float32),
+        "noise_scale": np.array([0.6], dtype=np.float32),
+        "noise_scale_w": np.array([0.8], dtype=np.float32),
+        "length_scale": np.array([1.0], dtype=np.float32),
+        **make_bert_feeds(seq_len),
+    }
+
+
+def print_io(session: ort.InferenceSession):
+    """セッションの入出力情報を表示する。"""
     print("\nInputs:")
     for inp in session.get_inputs():
         print(f"  {inp.name}: {inp.type} {inp.shape}")
@@ -27,21 +111,19 @@ def validate_bert(model_path: str):
     for out in session.get_outputs():
         print(f"  {out.name}: {out.type} {out.shape}")
 
+
+def validate_bert(model_path: str):
+    """DeBERTa ONNX の検証。"""
+    print(f"Loading BERT model: {model_path}")
+    session = create_session(model_path)
+
+    # 入力情報表示
+    print_io(session)
+
     # ダミー推論
     token_len = 10
-    input_ids = np.ones((1, token_len), dtype=np.int32)
-    token_type_ids = np.zeros((1, token_len), dtype=np.int32)
-    attention_mask = np.ones((1, token_len), dtype=np.int32)
-
     print(f"\nRunning dummy inference (token_len={token_len})...")
-    outputs = session.run(
-        None,
-        {
-            "input_ids": input_ids,
-            "token_type_ids": token_type_ids,
-            "attention_mask": attention_mask,
-        },
-    )
+    outputs = session.run(None, cast_feeds(session, make_bert_feeds(token_len)))
 
     output = outputs[0]
     print(f"Output shape: {output.shape}")
@@ -53,47 +135,42 @@ def validate_bert(model_path: str):
     assert output.shape == expected_shape, (
         f"Expected shape {expected_shape}, got {output.shape}"
     )
+
+    if any(inp.name == "phone_to_token" for inp in session.get_inputs()):
+        # グラフ内の展開と numpy 版 (text_tensors.align_bert_to_phonemes) を比較
+        word2ph = np.random.default_rng(0).integers(1, 4, size=token_len)
+        feeds = make_bert_feeds(token_len)
+        feeds["phone_to_token"] = phone_to_token_indices(word2ph)
+        aligned = session.run(None, cast_feeds(session, feeds))[0]
+        reference = align_bert_to_phonemes(output.astype(np.float32), word2ph)[None]
+        diff = np.abs(aligned.astype(np.float32) - reference.astype(np.float32)).max()
+        print(f"Fused alignment: output {aligned.shape}, max abs diff vs numpy {diff:.6f}")
+        assert aligned.shape == reference.shape, (
+            f"Expected shape {reference.shape}, got {aligned.shape}"
+        )
+        assert diff < 1e-3, f"Fused alignment differs from numpy reference ({diff})"
     print("\n✓ BERT model validation passed!")
 
 
 def validate_tts(model_path: str):
     """SynthesizerTrn ONNX の検証。"""
     print(f"Loading TTS model: {model_path}")
-    session = ort.InferenceSession(model_path)
+    session = create_session(model_path)
 
     # 入力情報表示
-    print("\nInputs:")
-    for inp in session.get_inputs():
-        print(f"  {inp.name}: {inp.type} {inp.shape}")
-
-    print("\nOutputs:")
-    for out in session.get_outputs():
-        print(f"  {out.name}: {out.type} {out.shape}")
+    print_io(session)
 
     # ダミー推論
     seq_len = 10
-    feeds = {
-        "x_tst": np.array([[0, 1, 2, 3, 4, 5, 6, 7, 8, 9]], dtype=np.int32),
-        "x_tst_lengths": np.array([seq_len], dtype=np.int32),
-        "tones": np.zeros((1, seq_len), dtype=np.int32),
-        "language": np.ones((1, seq_len), dtype=np.int32),
-        "bert": np.zeros((1, 1024, seq_len), dtype=np.float32),
-        "style_vec": np.zeros((1, 256), dtype=np.float32),
-        "sid": np.array([0], dtype=np.int32),
-        "sdp_ratio": np.array([0.2], dtype=np.float32),
-        "noise_scale": np.array([0.6], dtype=np.float32),
-        "noise_scale_w": np.array([0.8], dtype=np.float32),
-        "length_scale": np.array([1.0], dtype=np.float32),
-    }
-
     print(f"\nRunning dummy inference (seq_len={seq_len})...")
-    outputs = session.run(None, feeds)
+    outputs = session.run(None, cast_feeds(session, make_tts_feeds(seq_len)))
 
     output = outputs[0]
     print(f"Output shape: {output.shape}")
     print(f"Output dtype: {output.dtype}")
     print(f"Output range: [{output.min():.4f}, {output.max():.4f}]")
     print(f"Audio samples: {output.shape[-1]}")
+    print(f"Audio samples after trim (GetTrimmedLength): {trimmed_lengths(output)[0]}")
     print(f"Audio duration: {output.shape[-1] / 44100:.2f}s")
 
     assert output.ndim == 3, f"Expected 3D output, got {output.ndim}D"
@@ -0,0 +1,381 @@
+"""
+合成済みボイスラインのパックアーカイブ (memory-map で読み出し)
+
+バッチレンダーの出力を数千個の WAV として置くと、ランタイムでの読み込みがファイルの open の連続になる。
+ここでは PCM を 1 つのファイルに詰め、(テキスト, スタイル, 話者) から引く索引を付ける。
+既知のセリフ (固定の会話など) は TTS を実行せずにこのアーカイブから再生できる。
+
+キー: (sha256(normalize_text(テキスト)), style_id, speaker_id)
+    (正規化は C# の TextNormalizer.Normalize と同じ。bert_cache.py と同じくテキストの表記揺れを吸収する)
+
+ファイル構成 (リトルエンディアン):
+    ヘッダ (32 バイト)  magic "SBV2VOIC" / version / sample_rate / 件数 / 索引のオフセット
+    ペイロード          ラインごとの int16 PCM または FLAC (先頭は 64 バイト境界)
+    索引                ENTRY_DTYPE の配列 (lookup の昇順)
+                        lookup = sha256(テキストハッシュ, style_id, speaker_id) の先頭 8 バイト
+
+- 書き込みはラインを受け取るたびにペイロードを追記し、close で索引とヘッダを書く
+  (一時ファイルに書いてから置き換えるため、読み手が書きかけのファイルを開くことはない)
+- 読み出しはファイル全体を memory-map し、索引を二分探索する。pcm16 のラインは
+  マップ上の int16 ビュー (読み取り専用、コピーなし)、flac はマップ上のバイト列を soundfile で復号する
+
+使用方法:
+    with VoiceArchiveWriter("voice_lines.pack", fmt="pcm16") as writer:
+        writer.add("こんにちは", samples, style_id=0, speaker_id=0)
+
+    archive = VoiceArchive("voice_lines.pack")
+    pcm = archive.get("こんにちは", style_id=0, speaker_id=0)  # int16 ビュー or None
+
+    # synthesis_server.py --output-dir の出力 (00000.wav, ...) を requests.jsonl の順にパック
+    uv run python voice_archive.py --output voice_lines.pack \\
+        --requests requests.jsonl --audio-dir renders
+    # その場で合成してパック
+    uv run python voice_archive.py --output voice_lines.pack --requests requests.jsonl \\
+        --bert deberta_fp16.onnx --tts sbv2_model.onnx --style-vectors style_vectors.npy
+    uv run python voice_archive.py --info voice_lines.pack
+    uv run python voice_archive.py --benchmark --count 2000
+"""
+
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from audio_postprocess import (
+    SAMPLE_RATE,
+    decode_flac,
+    encode_flac,
+    int16_chunks,
+    read_audio,
+    write_audio,
+)
+from synthesis_server import SynthesisRequest, SynthesisServer, load_requests
+from text_tensors import normalize_text
+
+MAGIC = b"SBV2VOIC"
+ARCHIVE_VERSION = 1
+PAYLOAD_ALIGN = 64
+FORMATS = {"pcm16": 0, "flac": 1}
+
+HEADER_DTYPE = np.dtype([
+    ("magic", "S8"), ("version", "<u4"), ("sample_rate", "<u4"),
+    ("count", "<i8"), ("index_offset", "<i8"),
+])
+ENTRY_DTYPE = np.dtype([
+    ("lookup", "<u8"),
+    ("text_hash", "V32"),
+    ("style_id", "<i4"),
+    ("speaker_id", "<i4"),
+    ("offset", "<i8"),  # ファイル先頭からのバイト位置
+    ("nbytes", "<i8"),
+    ("num_samples", "<i8"),
+    ("format", "<u4"),  # FORMATS の値
+    ("pad", "<u4"),
+])
+
+
+def text_hash(text: str) -> bytes:
+    """正規化済みテキストの sha256 (32 バイト)。"""
+    return hashlib.sha256(normalize_text(text).encode()).digest()
+
+
+def lookup_key(hashed_text: bytes, style_id: int, speaker_id: int) -> int:
+    """索引の並び順に使う 64bit キー。"""
+    digest = hashlib.sha256(
+        hashed_text + style_id.to_bytes(4, "little", signed=True)
+        + speaker_id.to_bytes(4, "little", signed=True)
+    ).digest()
+    return int.from_bytes(digest[:8], "little")
+
+
+class VoiceArchiveWriter:
+    """ボイスラインを 1 ファイルに追記し、close で索引を書く。"""
+
+    def __init__(self, path, sample_rate: int = SAMPLE_RATE, fmt: str = "pcm16"):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown archive format: {fmt} (expected one of {list(FORMATS)})")
+        self.path = Path(path)
+        self.sample_rate = sample_rate
+        self.fmt = fmt
+        self._tmp_path = self.path.with_name(self.path.name + ".tmp")
+        self._file = open(self._tmp_path, "wb")
+        self._file.write(bytes(HEADER_DTYPE.itemsize))
+        self._entries: list[tuple] = []
+        self._keys: set[tuple[bytes, int, int]] = set()
+
+    def _align(self, alignment: int) -> int:
+        position = self._file.tell()
+        padding = -position % alignment
+        self._file.write(bytes(padding))
+        return position + padding
+
+    def add(self, text: str, samples: np.ndarray, style_id: int = 0, speaker_id: int = 0) -> bool:
+        """float PCM (または int16) を 1 ライン追加する。同じキーが既にあれば追加せず False。"""
+        hashed = text_hash(text)
+        key = (hashed, style_id, speaker_id)
+        if key in self._keys:
+            return False
+        self._keys.add(key)
+
+        samples = np.asarray(samples)
+        offset = self._align(PAYLOAD_ALIGN)
+        if self.fmt == "flac":
+            self._file.write(encode_flac(samples, self.sample_rate))
+        else:
+            for pcm in int16_chunks(samples):
+                self._file.write(pcm.astype("<i2", copy=False).tobytes())
+        nbytes = self._file.tell() - offset
+        self._entries.append((
+            lookup_key(hashed, style_id, speaker_id), hashed, style_id, speaker_id,
+            offset, nbytes, len(samples), FORMATS[self.fmt], 0,
+        ))
+        return True
+
+    def add_request(self, request: SynthesisRequest, samples: np.ndarray) -> bool:
+        """SynthesisRequest の text / style_id / speaker_id をキーに追加する。"""
+        if request.text is None:
+            raise ValueError("Voice archive entries require request.text")
+        return self.add(request.text, samples, request.style_id, request.speaker_id)
+
+    def close(self) -> None:
+        if self._file.closed:
+            return
+        index = np.array(self._entries, dtype=ENTRY_DTYPE)
+        index.sort(order="lookup", kind="stable")
+        index_offset = self._align(8)
+        self._file.write(index.tobytes())
+        header = np.array(
+            [(MAGIC, ARCHIVE_VERSION, self.sample_rate, len(index), index_offset)],
+            dtype=HEADER_DTYPE,
+        )
+        self._file.seek(0)
+        self._file.write(header.tobytes())
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self) -> None:
+        """書きかけの一時ファイルを削除する (既存のアーカイブはそのまま)。"""
+        if not self._file.closed:
+            self._file.close()
+            self._tmp_path.unlink(missing_ok=True)
+
+    def __enter__(self) -> "VoiceArchiveWriter":
+        return self
+
+    def __exit__(self, exc_type, *exc) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class VoiceArchive:
+    """VoiceArchiveWriter が書いたファイルを memory-map して引く。"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._data = np.memmap(self.path, dtype=np.uint8, mode="r")
+        header = self._data[: HEADER_DTYPE.itemsize].view(HEADER_DTYPE)[0]
+        if header["magic"] != MAGIC or header["version"] != ARCHIVE_VERSION:
+            raise ValueError(f"{path} is not a voice archive (version {ARCHIVE_VERSION})")
+        self.sample_rate = int(header["sample_rate"])
+        start = int(header["index_offset"])
+        self.index = self._data[start : start + int(header["count"]) * ENTRY_DTYPE.itemsize].view(
+            ENTRY_DTYPE
+        )
+        # 二分探索用に lookup だけ連続配列にする (8 バイト / ライン)
+        self._lookups = np.ascontiguousarray(self.index["lookup"])
+
+    def close(self) -> None:
+        """マップへの参照を外す (返したビューが残っている間はマップも残る)。"""
+        self.index = self._data = self._lookups = None
+
+    def __enter__(self) -> "VoiceArchive":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def find(self, text: str, style_id: int = 0, speaker_id: int = 0) -> int | None:
+        """索引の位置を返す。ない場合は None。"""
+        hashed = text_hash(text)
+        lookup = np.uint64(lookup_key(hashed, style_id, speaker_id))
+        i = int(np.searchsorted(self._lookups, lookup))
+        while i < len(self._lookups) and self._lookups[i] == lookup:
+            entry = self.index[i]
+            if (
+                entry["text_hash"].tobytes() == hashed
+                and entry["style_id"] == style_id
+                and entry["speaker_id"] == speaker_id
+            ):
+                return i
+            i += 1
+        return None
+
+    def __contains__(self, key: tuple[str, int, int]) -> bool:
+        return self.find(*key) is not None
+
+    def entry_pcm(self, i: int) -> np.ndarray:
+        """索引 i のラインの int16 PCM (pcm16 はマップ上の読み取り専用ビュー)。"""
+        entry = self.index[i]
+        start = int(entry["offset"])
+        payload = self._data[start : start + int(entry["nbytes"])]
+        if entry["format"] == FORMATS["pcm16"]:
+            return payload.view("<i2")
+        pcm, _ = decode_flac(payload)
+        return pcm
+
+    def get(self, text: str, style_id: int = 0, speaker_id: int = 0) -> np.ndarray | None:
+        """int16 PCM を返す。アーカイブにない場合は None (TTS で合成する)。"""
+        i = self.find(text, style_id, speaker_id)
+        return None if i is None else self.entry_pcm(i)
+
+    def get_float(
+        self, text: str, style_id: int = 0, speaker_id: int = 0
+    ) -> np.ndarray | None:
+        """float32 PCM ([-1, 1]) を返す (コピー)。"""
+        pcm = self.get(text, style_id, speaker_id)
+        return None if pcm is None else pcm.astype(np.float32) / 32767
+
+    def stats(self) -> dict:
+        names = {v: k for k, v in FORMATS.items()}
+        formats, counts = np.unique(self.index["format"], return_counts=True)
+        return {
+            "entries": len(self.index),
+            "sample_rate": self.sample_rate,
+            "formats": {names[int(f)]: int(c) for f, c in zip(formats, counts)},
+            "audio_seconds": round(float(self.index["num_samples"].sum()) / self.sample_rate, 1),
+            "payload_mb": round(float(self.index["nbytes"].sum()) / 1024 / 1024, 2),
+            "file_mb": round(self.path.stat().st_size / 1024 / 1024, 2),
+        }
+
+
+def pack_requests(
+    output: Path,
+    requests: list[SynthesisRequest],
+    audios,
+    sample_rate: int = SAMPLE_RATE,
+    fmt: str = "pcm16",
+) -> None:
+    """リクエストと PCM (同じ順序のイテラブル) をアーカイブに書く。"""
+    with VoiceArchiveWriter(output, sample_rate, fmt) as writer:
+        added = sum(
+            writer.add_request(request, audio)
+            for request, audio in zip(requests, audios, strict=True)
+        )
+    skipped = f" ({len(requests) - added} duplicates skipped)" if added < len(requests) else ""
+    print(f"Wrote {added} lines to: {output}{skipped}")
+
+
+def _read_rendered(audio_dir: Path, count: int):
+    """synthesis_server.py --output-dir の出力 (00000.wav / .flac ...) を順に読む。"""
+    for i in range(count):
+        path = audio_dir / f"{i:05d}.wav"
+        if not path.exists():
+            path = path.with_suffix(".flac")
+        samples, _ = read_audio(path)
+        yield samples
+
+
+def benchmark(count: int, fmt: str, seed: int = 0) -> None:
+    """個別の WAV ファイルの読み込みとアーカイブからの読み出しを比較する。"""
+    rng = np.random.default_rng(seed)
+    texts = [f"ダミーのセリフ{i}" for i in range(count)]
+    lengths = rng.integers(SAMPLE_RATE // 2, SAMPLE_RATE * 3, count)
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        archive_path = tmp / "voice_lines.pack"
+        with VoiceArchiveWriter(archive_path, fmt=fmt) as writer:
+            for i, (text, n) in enumerate(zip(texts, lengths)):
+                t = np.arange(n) / SAMPLE_RATE
+                samples = (0.3 * np.sin(2 * np.pi * (200 + i % 300) * t)).astype(np.float32)
+                writer.add(text, samples, style_id=i % 4, speaker_id=i % 2)
+                write_audio(tmp / f"{i:05d}.wav", samples)
+
+        start = time.perf_counter()
+        for i in range(count):
+            read_audio(tmp / f"{i:05d}.wav")
+        files_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        archive = VoiceArchive(archive_path)
+        open_ms = (time.perf_counter() - start) * 1000
+        archive.get(texts[0], 0, 0)  # 初回アクセス (ページイン・soundfile の読み込み) を計測から除く
+        start = time.perf_counter()
+        hits = sum(
+            archive.get(text, i % 4, i % 2) is not None for i, text in enumerate(texts)
+        )
+        get_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        for i, text in enumerate(texts):
+            archive.get_float(text, i % 4, i % 2)
+        float_ms = (time.perf_counter() - start) * 1000
+        missing = archive.get("アーカイブにないセリフ")
+
+        print(f"{count} lines ({fmt}, {lengths.sum() / SAMPLE_RATE:.0f}s of audio)")
+        print(f"  separate WAV files: {files_ms:.1f}ms ({files_ms * 1000 / count:.0f}us/line)")
+        print(f"  archive open:       {open_ms:.2f}ms")
+        print(f"  archive get:        {get_ms:.1f}ms ({get_ms * 1000 / count:.0f}us/line, "
+              f"{hits}/{count} hits, miss -> {missing})")
+        print(f"  archive get_float:  {float_ms:.1f}ms ({float_ms * 1000 / count:.0f}us/line)")
+        print(f"  {archive.stats()}")
+        archive.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Pack rendered voice lines into a memory-mapped archive"
+    )
+    parser.add_argument("--output", type=str, default=None, help="Archive to write")
+    parser.add_argument("--requests", type=str, default=None, help="Requests JSONL (with text)")
+    parser.add_argument(
+        "--audio-dir", type=str, default=None,
+        help="Rendered files from synthesis_server.py --output-dir (in request order)",
+    )
+    parser.add_argument("--bert", type=str, default=None, help="DeBERTa ONNX (render mode)")
+    parser.add_argument("--tts", type=str, default=None, help="SBV2 ONNX (render mode)")
+    parser.add_argument("--style-vectors", type=str, default=None, help="style_vectors.npy path")
+    parser.add_argument(
+        "--threads", type=int, default=0, help="ORT intra-op threads (0 = default)"
+    )
+    parser.add_argument("--format", choices=list(FORMATS), default="pcm16", help="Payload format")
+    parser.add_argument("--info", type=str, default=None, help="Print archive statistics")
+    parser.add_argument("--benchmark", action="store_true", help="Compare with separate WAV files")
+    parser.add_argument("--count", type=int, default=1000, help="Lines for --benchmark")
+    args = parser.parse_args()
+
+    if not (args.output or args.info or args.benchmark):
+        parser.error("specify --output, --info and/or --benchmark")
+    if args.output:
+        if not args.requests:
+            parser.error("--output requires --requests")
+        style_vectors = np.load(args.style_vectors) if args.style_vectors else None
+        requests = load_requests(Path(args.requests), style_vectors)
+        if args.audio_dir:
+            audio_dir = Path(args.audio_dir)
+            sample_rate = read_audio(sorted(audio_dir.glob("00000.*"))[0])[1]
+            audios = _read_rendered(audio_dir, len(requests))
+        elif args.bert and args.tts:
+            with SynthesisServer(args.bert, args.tts, intra_op_num_threads=args.threads) as server:
+                audios = server.synthesize(requests)
+            print(server.stats.report())
+            sample_rate = server.sample_rate
+        else:
+            parser.error("--output requires --audio-dir or --bert/--tts")
+        pack_requests(Path(args.output), requests, audios, sample_rate, args.format)
+    if args.info:
+        with VoiceArchive(args.info) as archive:
+            print(archive.stats())
+    if args.benchmark:
+        benchmark(args.count, args.format)
+
+
+if __name__ == "__main__":
+    main()